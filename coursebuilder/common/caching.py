@@ -22,11 +22,14 @@ import datetime
 import logging
 import sys
 import threading
+import time
 import unittest
 
 import appengine_config
 from models.counters import PerfCounter
 
+from google.appengine.api import memcache
+
 
 def iter_all(query, batch_size=100):
     """Yields query results iterator. Proven method for large datasets."""
@@ -181,6 +184,7 @@ class LRUCache(object):
 
     def put(self, key, value):
         assert key
+        self.delete(key)
         if self._allocate_space(key, value):
             self.items[key] = value
             return True
@@ -197,11 +201,64 @@ class LRUCache(object):
     def delete(self, key):
         assert key
         if key in self.items:
-            del self.items[key]
+            value = self.items.pop(key)
+            if self.max_size_bytes:
+                self.total_size -= self.get_entry_size(key, value)
+                assert self.total_size >= 0
             return True
         return False
 
 
+class MemcacheGeneration(object):
+    """A per namespace stamp in memcache that moves on with every change.
+
+    Data cached under one stamp is stale once the stamp has moved on. The
+    stamp read from memcache is remembered for check_interval_secs, so
+    changes made by other processes are noticed within that delay.
+    """
+
+    def __init__(self, key, check_interval_secs=0):
+        self.key = key
+        self.check_interval_secs = check_interval_secs
+        self._stamps = {}
+
+    @classmethod
+    def _new_stamp(cls):
+        # Derive the initial stamp from the clock, so a stamp lost to memcache
+        # eviction is never re-created with a value seen before.
+        return int(time.time() * 1000)
+
+    def get(self, namespace):
+        """Returns the current stamp, or None if memcache is unavailable."""
+        now = time.time()
+        stamp, checked_on = self._stamps.get(namespace, (None, 0))
+        if now - checked_on < self.check_interval_secs:
+            return stamp
+        stamp = memcache.get(self.key, namespace=namespace)
+        if stamp is None:
+            memcache.add(self.key, self._new_stamp(), namespace=namespace)
+            stamp = memcache.get(self.key, namespace=namespace)
+        self._stamps[namespace] = (stamp, now)
+        return stamp
+
+    def incr(self, namespace):
+        """Moves the stamp on; returns the new one, or None on failure."""
+        stamp = memcache.incr(
+            self.key, initial_value=self._new_stamp(), namespace=namespace)
+        if stamp is None:
+            self._stamps.pop(namespace, None)
+        else:
+            self._stamps[namespace] = (stamp, time.time())
+        return stamp
+
+    def forget(self, namespace=None):
+        """Has the next get() read the stamp from memcache again."""
+        if namespace is None:
+            self._stamps.clear()
+        else:
+            self._stamps.pop(namespace, None)
+
+
 class NoopCacheConnection(object):
     """Connection to no-op cache that provides no caching."""
 
@@ -479,6 +536,18 @@ class LRUCacheTests(unittest.TestCase):
         found, _ = cache.get('a')
         self.assertTrue(found)
 
+    def test_delete_and_replace_release_size(self):
+        cache = LRUCache(max_size_bytes=5000)
+        self.assertTrue(cache.put('a', bytearray(3000)))
+        self.assertTrue(cache.put('a', bytearray(3000)))
+        self.assertTrue(cache.put('b', bytearray(1000)))
+        self.assertTrue(cache.contains('a'))
+        cache.delete('a')
+        self.assertEquals(cache.total_size, cache.get_entry_size(
+            'b', bytearray(1000)))
+        self.assertTrue(cache.put('c', bytearray(3000)))
+        self.assertTrue(cache.contains('b'))
+
 
 class SingletonTests(unittest.TestCase):
 
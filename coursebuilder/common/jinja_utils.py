@@ -17,6 +17,7 @@
 __author__ = 'John Orr (jorr@google.com)'
 
 import sys
+import threading
 import traceback
 import jinja2
 import safe_dom
@@ -40,6 +41,22 @@ CAN_USE_JINJA2_TEMPLATE_CACHE = config.ConfigProperty(
         'Whether jinja2 can cache bytecode of compiled templates in-process.'),
     default_value=True)
 
+CAN_POOL_JINJA2_ENVIRONMENTS = config.ConfigProperty(
+    'gcb_can_pool_jinja2_environments', bool, safe_dom.Text(
+        'Whether configured jinja2 environments, and the templates they '
+        'loaded, are kept in-process and shared by requests.'),
+    default_value=True)
+
+# max number of configured jinja environments kept in-process
+MAX_POOLED_ENVIRONMENTS = 100
+
+JINJA_ENVIRONMENT_POOL_HIT = PerfCounter(
+    'gcb-jinja-environment-pool-hit',
+    'A number of times a configured jinja environment was reused.')
+JINJA_ENVIRONMENT_POOL_MISS = PerfCounter(
+    'gcb-jinja-environment-pool-miss',
+    'A number of times a jinja environment had to be configured.')
+
 
 def finalize(x):
     """A finalize method which will correctly handle safe_dom elements."""
@@ -81,6 +98,88 @@ def get_gcb_tags_filter(handler):
     return gcb_tags
 
 
+# The handlers of the templates being rendered by this thread, innermost last.
+_RENDER_BINDINGS = threading.local()
+
+
+def _get_render_handler():
+    handlers = getattr(_RENDER_BINDINGS, 'handlers', None)
+    return handlers[-1] if handlers else None
+
+
+def pooled_gcb_tags(data):
+    """The gcb_tags filter, for the handler of the template being rendered."""
+    return get_gcb_tags_filter(_get_render_handler())(data)
+
+
+class BoundTemplate(object):
+    """A template of a pooled environment, bound to one handler.
+
+    Pooled environments are shared by all requests, so nothing that depends
+    on the handler is set on them. The handler is made current for the
+    duration of render() instead, and the gcb_tags filter picks it up from
+    there; this includes the macros of templates imported without context.
+    """
+
+    def __init__(self, template, handler):
+        self._template = template
+        self._handler = handler
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, *args, **kwargs):
+        handlers = getattr(_RENDER_BINDINGS, 'handlers', None)
+        if handlers is None:
+            handlers = []
+            _RENDER_BINDINGS.handlers = handlers
+        handlers.append(self._handler)
+        try:
+            return self._template.render(*args, **kwargs)
+        finally:
+            handlers.pop()
+
+
+class ProcessScopedJinjaEnvironmentPool(caching.ProcessScopedSingleton):
+    """Configured jinja environments, shared by all requests.
+
+    An environment keeps the templates it compiled and, before reusing one,
+    asks the loader whether its source changed; see
+    vfs.VirtualFileSystemTemplateLoader for files stored in the datastore.
+    """
+
+    def __init__(self):
+        self._environments = caching.LRUCache(
+            max_item_count=MAX_POOLED_ENVIRONMENTS)
+
+    @classmethod
+    def get(cls, key, factory):
+        """Returns the environment for key, calling factory() to create it.
+
+        Args:
+          key: a hashable value; everything the configuration of the
+              environment depends on, besides the current namespace.
+          factory: a function without arguments that creates a new,
+              fully configured environment.
+        Returns:
+          A jinja2.Environment. It must not be modified.
+        """
+        if not CAN_POOL_JINJA2_ENVIRONMENTS.value:
+            return factory()
+        key = (
+            models.MemcacheManager.get_namespace(),
+            CAN_USE_JINJA2_TEMPLATE_CACHE.value) + tuple(key)
+        environments = cls.instance()._environments
+        found, environment = environments.get(key)
+        if found:
+            JINJA_ENVIRONMENT_POOL_HIT.inc()
+            return environment
+        JINJA_ENVIRONMENT_POOL_MISS.inc()
+        environment = factory()
+        environments.put(key, environment)
+        return environment
+
+
 class ProcessScopedJinjaCache(caching.ProcessScopedSingleton):
     """This class holds in-process cache of Jinja compiled templates."""
 
@@ -177,9 +276,15 @@ def get_template(
     if not locale:
         locale = 'en_US'
 
-    jinja_environment = create_jinja_environment(
-        jinja2.FileSystemLoader(dirs), locale=locale, autoescape=autoescape)
-
-    jinja_environment.filters['gcb_tags'] = get_gcb_tags_filter(handler)
-
-    return jinja_environment.get_template(template_name)
+    def create_environment():
+        jinja_environment = create_jinja_environment(
+            jinja2.FileSystemLoader(dirs), locale=locale,
+            autoescape=autoescape)
+        jinja_environment.filters['gcb_tags'] = pooled_gcb_tags
+        return jinja_environment
+
+    jinja_environment = ProcessScopedJinjaEnvironmentPool.get(
+        ('fs', tuple(dirs), locale, autoescape), create_environment)
+    i18n.get_i18n().set_locale(locale)
+    return BoundTemplate(
+        jinja_environment.get_template(template_name), handler)
@@ -98,6 +98,17 @@ class BaseTag(object):
         """
         return cElementTree.XML('<div>[Unimplemented custom tag]</div>')
 
+    def prefetch(self, nodes):
+        """Receive all nodes for this tag on a page before any is rendered.
+
+        Tags which load an object for each node can queue the loads here, so
+        that the objects are fetched together when the first node is rendered.
+
+        Args:
+            nodes: list of cElementTree.Element. The DOM nodes for the tag.
+        """
+        pass
+
     def get_icon_url(self):
         """Return the URL for the icon to be displayed in the rich text editor.
 
@@ -325,6 +336,19 @@ def html_string_to_element_tree(html_string):
     return parser.parseFragment('<div>%s</div>' % html_string)[0]
 
 
+def _prefetch_custom_tags(root, tag_bindings):
+    """Let each custom tag type see all of its nodes before rendering."""
+    tag_nodes = {}
+    for elt in root.iter():
+        if elt.tag in tag_bindings:
+            tag_nodes.setdefault(elt.tag, []).append(elt)
+    for tag_name, nodes in tag_nodes.items():
+        try:
+            tag_bindings[tag_name]().prefetch(nodes)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Error prefetching tag: %s', tag_name)
+
+
 def html_to_safe_dom(html_string, handler, render_custom_tags=True):
     """Render HTML text as a tree of safe_dom elements."""
 
@@ -416,6 +440,8 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True):
                 original_elt, '%s: %s' % (INVALID_HTML_TAG_MESSAGE, e))
 
     root = html_string_to_element_tree(html_string)
+    if render_custom_tags:
+        _prefetch_custom_tags(root, tag_bindings)
     if root.text:
         node_list.append(safe_dom.Text(root.text))
 
@@ -18,6 +18,8 @@ __author__ = 'Saifu Angto (saifu@google.com)'
 
 import copy
 import datetime
+import logging
+import time
 import urllib
 import urlparse
 
@@ -32,8 +34,10 @@ from utils import XsrfTokenManager
 
 from common import jinja_utils
 from common import safe_dom
+from common import utils as common_utils
 from models import course_list
 from models import courses
+from models import entities
 from models import models
 from models import student_work
 from models import transforms
@@ -50,8 +54,13 @@ from modules import courses as courses_module
 from modules.review import domain
 from tools import verify
 
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 
+# max number of events accepted in one request; the rest are dropped
+MAX_EVENTS_PER_BATCH = 100
+
 COURSE_EVENTS_RECEIVED = PerfCounter(
     'gcb-course-events-received',
     'A number of activity/assessment events received by the server.')
@@ -60,6 +69,45 @@ COURSE_EVENTS_RECORDED = PerfCounter(
     'gcb-course-events-recorded',
     'A number of activity/assessment events recorded in a datastore.')
 
+COURSE_EVENTS_BATCHES_RECEIVED = PerfCounter(
+    'gcb-course-events-batches-received',
+    'A number of requests that posted a batch of events.')
+
+COURSE_EVENTS_DROPPED = PerfCounter(
+    'gcb-course-events-dropped',
+    'A number of events dropped because they could not be parsed, or '
+    'because their batch had more than %s events.' % MAX_EVENTS_PER_BATCH)
+
+COURSE_EVENTS_BUFFERED = PerfCounter(
+    'gcb-course-events-buffered',
+    'A number of events queued to be recorded in a datastore later.')
+
+COURSE_EVENTS_BUFFER_FALLBACK = PerfCounter(
+    'gcb-course-events-buffer-fallback',
+    'A number of events recorded right away because they could not be '
+    'queued.')
+
+COURSE_EVENTS_FLUSH_FAILURES = PerfCounter(
+    'gcb-course-events-flush-failures',
+    'A number of queued events that could not be recorded in a datastore; '
+    'they are retried when their lease expires.')
+
+COURSE_EVENTS_FLUSH_DEADLINE_EXCEEDED = PerfCounter(
+    'gcb-course-events-flush-deadline-exceeded',
+    'A number of times queued events were left for the next flush because '
+    'the flush ran out of time.')
+
+COURSE_EVENTS_PROGRESS_WRITES = PerfCounter(
+    'gcb-course-events-progress-writes',
+    'A number of student progress writes caused by received events.')
+
+CAN_BUFFER_EVENTS = ConfigProperty(
+    'gcb_can_buffer_events', bool, (
+        'Whether events received by the server are queued and recorded in '
+        'a datastore in batches every minute, instead of on every request. '
+        'Student progress is still updated right away.'),
+    False)
+
 ENABLE_HANGOUTS = ConfigProperty(
     'enable_hangouts_on_unit_pages', bool, (
         'Should we show hangout button on unit pages.'),
@@ -242,12 +290,15 @@ def add_course_outline_to_template(handler, student):
     units = filter_assessments_used_within_units(units)
     progress = _tracker.get_or_create_progress(
           student) if is_progress_recorded(handler, student) else None
+    unit_progress = None
+    if progress:
+        unit_progress, lesson_progress = (
+            _tracker.get_unit_and_lesson_progress(student, progress=progress))
     for _unit in units:
         _lessons = handler.get_lessons(_unit.unit_id)
         _lesson_progress = None
         if progress:
-            _lesson_progress = _tracker.get_lesson_progress(
-                student, _unit.unit_id, progress=progress)
+            _lesson_progress = lesson_progress.get(_unit.unit_id, {})
         pre_assessment = None
         if _unit.pre_assessment:
             pre_assessment = handler.find_unit_by_id(_unit.pre_assessment)
@@ -260,8 +311,9 @@ def add_course_outline_to_template(handler, student):
         _tuples.append(_tuple)
 
     handler.template_value['course_outline'] = _tuples
-    handler.template_value['unit_progress'] = _tracker.get_unit_progress(
-        student, progress=progress)
+    if unit_progress is None:
+        unit_progress = _tracker.get_unit_progress(student, progress=progress)
+    handler.template_value['unit_progress'] = unit_progress
 
 
 class CourseHandler(BaseHandler):
@@ -1290,18 +1342,23 @@ class ReviewHandler(BaseHandler):
 
 
 class EventsRESTHandler(BaseRESTHandler):
-    """Provides REST API for an Event."""
+    """Provides REST API for an Event.
+
+    A request either holds a single event, as 'source' and 'payload', or a
+    batch of up to MAX_EVENTS_PER_BATCH of them, as a list of such dicts
+    under 'events'. All events of a request are recorded with one datastore
+    write, or queued when CAN_BUFFER_EVENTS is set, and the progress they
+    make is saved with one write per request.
+    """
 
     def get(self):
         """Returns a 404 error; this handler should not be GET-accessible."""
         self.error(404)
         return
 
-    def _add_request_facts(self, payload_json):
-        payload_dict = transforms.loads(payload_json)
-        if 'loc' not in payload_dict:
-            payload_dict['loc'] = {}
-        loc = payload_dict['loc']
+    def _get_request_facts(self):
+        """Returns location facts and the user agent of the request."""
+        loc = {}
         loc['locale'] = self.get_locale_for(self.request, self.app_context)
         loc['language'] = self.request.headers.get('Accept-Language')
         loc['country'] = self.request.headers.get('X-AppEngine-Country')
@@ -1312,22 +1369,50 @@ class EventsRESTHandler(BaseRESTHandler):
             latitude, longitude = lat_long.split(',')
             loc['lat'] = float(latitude)
             loc['long'] = float(longitude)
-        user_agent = self.request.headers.get('User-Agent')
+        return loc, self.request.headers.get('User-Agent')
+
+    def _add_request_facts(self, payload_dict, request_facts):
+        loc, user_agent = request_facts
+        if 'loc' not in payload_dict:
+            payload_dict['loc'] = {}
+        payload_dict['loc'].update(loc)
         if user_agent:
             payload_dict['user_agent'] = user_agent
         payload_json = transforms.dumps(payload_dict).lstrip(
             models.transforms.JSON_XSSI_PREFIX)
         return payload_json
 
+    def _parse_events(self, request):
+        """Returns a list of (source, payload dict) of the posted events."""
+        if 'events' in request:
+            COURSE_EVENTS_BATCHES_RECEIVED.inc()
+            posted = request['events']
+            if not isinstance(posted, list):
+                posted = []
+        else:
+            posted = [request]
+        COURSE_EVENTS_RECEIVED.inc(len(posted))
+
+        events = []
+        for item in posted[:MAX_EVENTS_PER_BATCH]:
+            try:
+                payload = transforms.loads(item.get('payload'))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if isinstance(payload, dict):
+                events.append((item.get('source'), payload))
+        COURSE_EVENTS_DROPPED.inc(len(posted) - len(events))
+        return events
+
     def post(self):
-        """Receives event and puts it into datastore."""
+        """Receives events and puts them into datastore."""
 
-        COURSE_EVENTS_RECEIVED.inc()
         can = (
             CAN_PERSIST_ACTIVITY_EVENTS.value or
             CAN_PERSIST_PAGE_EVENTS.value or
             CAN_PERSIST_TAG_EVENTS.value)
         if not can:
+            COURSE_EVENTS_RECEIVED.inc()
             return
 
         request = transforms.loads(self.request.get('request'))
@@ -1338,43 +1423,82 @@ class EventsRESTHandler(BaseRESTHandler):
         if not user:
             return
 
-        source = request.get('source')
-        payload_json = request.get('payload')
-        payload_json = self._add_request_facts(payload_json)
-        models.EventEntity.record(source, user, payload_json)
-        COURSE_EVENTS_RECORDED.inc()
-
-        self.process_event(user, source, payload_json)
+        events = self._parse_events(request)
+        if not events:
+            return
+        request_facts = self._get_request_facts()
+        self.record_events(user, [
+            (source, self._add_request_facts(payload, request_facts))
+            for source, payload in events])
+        self.process_events(user, events)
+
+    def record_events(self, user, events):
+        """Records a list of (source, payload_json) in the event stream."""
+        recorded_on = datetime.datetime.now()
+        if CAN_BUFFER_EVENTS.value:
+            try:
+                EventBuffer.add(user.user_id(), events, recorded_on)
+                return
+            except taskqueue.Error, e:
+                COURSE_EVENTS_BUFFER_FALLBACK.inc(len(events))
+                logging.warning(
+                    'Recording events directly, could not queue them: %s', e)
+        entities.put([
+            models.EventEntity(
+                source=source, user_id=user.user_id(), data=payload_json,
+                recorded_on=recorded_on)
+            for source, payload_json in events])
+        COURSE_EVENTS_RECORDED.inc(len(events))
 
     def process_event(self, user, source, payload_json):
         """Processes an event after it has been recorded in the event stream."""
+        self.process_events(user, [(source, transforms.loads(payload_json))])
+
+    def process_events(self, user, events):
+        """Records the progress made by a list of (source, payload dict)."""
+        student = None
+        progress = None
+        updated = False
+        tracker = self.get_course().get_progress_tracker()
+        progress_tags = (
+            TAGS_THAT_TRIGGER_BLOCK_COMPLETION +
+            TAGS_THAT_TRIGGER_COMPONENT_COMPLETION +
+            TAGS_THAT_TRIGGER_HTML_COMPLETION)
+        for source, payload in events:
+            if 'location' not in payload or source not in progress_tags:
+                continue
+            if student is None:
+                student = models.Student.get_enrolled_student_by_email(
+                    user.email())
+                if not student:
+                    return
+                progress = tracker.get_or_create_progress(student)
+            updated |= bool(self._process_progress_event(
+                tracker, student, progress, source, payload))
 
-        student = models.Student.get_enrolled_student_by_email(user.email())
-        if not student:
-            return
-
-        payload = transforms.loads(payload_json)
-
-        if 'location' not in payload:
-            return
+        if updated:
+            progress.put()
+            COURSE_EVENTS_PROGRESS_WRITES.inc()
 
+    def _process_progress_event(
+        self, tracker, student, progress, source, payload):
         source_url = payload['location']
 
         if source in TAGS_THAT_TRIGGER_BLOCK_COMPLETION:
             unit_id, lesson_id = get_unit_and_lesson_id_from_url(
                 self, source_url)
             if unit_id is not None and lesson_id is not None:
-                self.get_course().get_progress_tracker().put_block_completed(
-                    student, unit_id, lesson_id, payload['index'])
+                return tracker.put_block_completed(
+                    student, unit_id, lesson_id, payload['index'],
+                    progress=progress)
         elif source in TAGS_THAT_TRIGGER_COMPONENT_COMPLETION:
             unit_id, lesson_id = get_unit_and_lesson_id_from_url(
                 self, source_url)
             cpt_id = payload['instanceid']
             if (unit_id is not None and lesson_id is not None and
                 cpt_id is not None):
-                self.get_course().get_progress_tracker(
-                    ).put_component_completed(
-                        student, unit_id, lesson_id, cpt_id)
+                return tracker.put_component_completed(
+                    student, unit_id, lesson_id, cpt_id, progress=progress)
         elif source in TAGS_THAT_TRIGGER_HTML_COMPLETION:
             # Records progress for scored lessons.
             unit_id, lesson_id = get_unit_and_lesson_id_from_url(
@@ -1385,5 +1509,115 @@ class EventsRESTHandler(BaseRESTHandler):
             if (unit_id is not None and
                 lesson_id is not None and
                 not lesson.manual_progress):
-                self.get_course().get_progress_tracker().put_html_completed(
-                    student, unit_id, lesson_id)
+                return tracker.put_html_completed(
+                    student, unit_id, lesson_id, progress=progress)
+        return False
+
+
+class EventBuffer(object):
+    """Buffers events in a pull queue until they are flushed.
+
+    The events of a request cost one task insertion. EventsFlushHandler
+    leases the queued tasks in bulk and records their events in a datastore
+    with a few large writes. Tasks stay in the queue until their events are
+    written, so a failed flush is retried once their lease expires.
+    """
+
+    QUEUE_NAME = 'course-events'
+    LEASE_SECONDS = 120
+    MAX_TASKS_PER_LEASE = 1000
+    MAX_ENTITIES_PER_PUT = 500
+    FLUSH_DEADLINE_SECONDS = 50
+
+    @classmethod
+    def add(cls, user_id, events, recorded_on):
+        payload = transforms.dumps_internal({
+            'namespace': namespace_manager.get_namespace(),
+            'user_id': user_id,
+            'recorded_on': recorded_on.strftime(
+                transforms.ISO_8601_DATETIME_FORMAT),
+            'events': events})
+        taskqueue.Queue(cls.QUEUE_NAME).add(
+            taskqueue.Task(payload=payload, method='PULL'))
+        COURSE_EVENTS_BUFFERED.inc(len(events))
+
+    @classmethod
+    def _group(cls, tasks):
+        """Returns {namespace: [EventEntity]} and {namespace: [task]}."""
+        events = {}
+        tasks_by_namespace = {}
+        for task in tasks:
+            try:
+                batch = transforms.loads(task.payload)
+                namespace = batch['namespace']
+                recorded_on = datetime.datetime.strptime(
+                    batch['recorded_on'], transforms.ISO_8601_DATETIME_FORMAT)
+                # Keys are derived from the task, so that writing the events
+                # of a task again after a failed flush does not copy them.
+                batch_events = [
+                    models.EventEntity(
+                        key_name='%s-%s' % (task.name, index),
+                        source=source, user_id=batch['user_id'],
+                        data=payload_json, recorded_on=recorded_on)
+                    for index, (source, payload_json) in enumerate(
+                        batch['events'])]
+            except (KeyError, TypeError, ValueError), e:
+                logging.error('Dropping bad batch of events: %s', e)
+                tasks_by_namespace.setdefault(None, []).append(task)
+                continue
+            events.setdefault(namespace, []).extend(batch_events)
+            tasks_by_namespace.setdefault(namespace, []).append(task)
+        return events, tasks_by_namespace
+
+    @classmethod
+    def flush(cls):
+        """Records queued events until the queue is empty or time is up.
+
+        Returns:
+          The number of events recorded.
+        """
+        queue = taskqueue.Queue(cls.QUEUE_NAME)
+        start = time.time()
+        num_recorded = 0
+        while True:
+            if time.time() - start >= cls.FLUSH_DEADLINE_SECONDS:
+                COURSE_EVENTS_FLUSH_DEADLINE_EXCEEDED.inc()
+                break
+            tasks = queue.lease_tasks(
+                cls.LEASE_SECONDS, cls.MAX_TASKS_PER_LEASE)
+            if not tasks:
+                break
+            events, tasks_by_namespace = cls._group(tasks)
+            done = tasks_by_namespace.pop(None, [])
+            for namespace, namespace_events in events.iteritems():
+                try:
+                    with common_utils.Namespace(namespace):
+                        for index in xrange(
+                                0, len(namespace_events),
+                                cls.MAX_ENTITIES_PER_PUT):
+                            entities.put(namespace_events[
+                                index:index + cls.MAX_ENTITIES_PER_PUT])
+                except db.Error, e:
+                    COURSE_EVENTS_FLUSH_FAILURES.inc(len(namespace_events))
+                    logging.warning(
+                        'Failed to record events in %s: %s', namespace, e)
+                    continue
+                done += tasks_by_namespace[namespace]
+                num_recorded += len(namespace_events)
+                COURSE_EVENTS_RECORDED.inc(len(namespace_events))
+            if done:
+                queue.delete_tasks(done)
+        return num_recorded
+
+
+class EventsFlushHandler(BaseHandler):
+    """Cron handler that records queued events in a datastore."""
+
+    URL = '/cron/events/flush'
+
+    def get(self):
+        if 'X-AppEngine-Cron' not in self.request.headers:
+            self.error(400)
+            return
+        num_recorded = EventBuffer.flush()
+        logging.info('Recorded %d queued events.', num_recorded)
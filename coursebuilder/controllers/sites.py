@@ -110,6 +110,7 @@ import os
 import posixpath
 import re
 import threading
+import time
 import traceback
 import urlparse
 import zipfile
@@ -120,6 +121,7 @@ from webapp2_extras import i18n
 
 import appengine_config
 from common import caching
+from common import jinja_utils
 from common import safe_dom
 from models import course_list
 from models import models
@@ -212,6 +214,16 @@ HTTP_STATUS_400 = PerfCounter(
 HTTP_STATUS_500 = PerfCounter(
     'gcb-sites-http-50x',
     'A number of times HTTP status code 50x was returned.')
+COURSE_LIST_APP_CONTEXT_CACHE_HIT = PerfCounter(
+    'gcb-sites-course-list-app-context-cache-hit',
+    'A number of app contexts served from the course list context cache.')
+COURSE_LIST_APP_CONTEXT_CACHE_MISS = PerfCounter(
+    'gcb-sites-course-list-app-context-cache-miss',
+    'A number of app contexts built from the course list.')
+COURSE_LIST_APP_CONTEXT_RESOLUTION_MSECS = PerfCounter(
+    'gcb-sites-course-list-app-context-resolution-msecs',
+    'Total milliseconds spent resolving app contexts from the course list.')
+
 COUNTER_BY_HTTP_CODE = {
     200: HTTP_STATUS_200, 300: HTTP_STATUS_300, 400: HTTP_STATUS_400,
     500: HTTP_STATUS_500}
@@ -621,6 +633,11 @@ class ApplicationContext(object):
     # a corresponding CourseIndex.
     _COURSE_INDEX_CACHE = {}
 
+    # Functions called with (app_context, jinja_environment) to configure each
+    # new template environment. Environments are shared by requests; anything
+    # set up here must not depend on the current request.
+    TEMPLATE_ENVIRON_HOOKS = []
+
     @classmethod
     def get_namespace_name_for_request(cls):
         """Gets the name of the namespace to use for this request.
@@ -893,10 +910,20 @@ class ApplicationContext(object):
         dirs = [template_dir]
         if additional_dirs:
             dirs += additional_dirs
-        jinja_environment = self.fs.get_jinja_environ(dirs)
 
+        def create_environment():
+            jinja_environment = self.fs.get_jinja_environ(dirs)
+            jinja_environment.install_gettext_translations(i18n)
+            jinja_environment.filters['gcb_tags'] = jinja_utils.pooled_gcb_tags
+            for hook in self.TEMPLATE_ENVIRON_HOOKS:
+                hook(self, jinja_environment)
+            return jinja_environment
+
+        # The file system is part of the key: a rebuilt context of the same
+        # course gets environments of its own.
+        jinja_environment = jinja_utils.ProcessScopedJinjaEnvironmentPool.get(
+            (id(self.fs), tuple(dirs), locale), create_environment)
         i18n.get_i18n().set_locale(locale)
-        jinja_environment.install_gettext_translations(i18n)
         return jinja_environment
 
     def is_editable_fs(self):
@@ -1028,11 +1055,101 @@ def _build_course_list_from_db(create_vfs=True):
     namespaces = {}
     all_contexts = []
 
+    cache = CourseListAppContextCache.instance()
     for item in courses:
-        all_contexts.append(_build_app_context_from_course_list_item(item))
+        all_contexts.append(cache.get_for_item(item))
     _validate_appcontext_list(all_contexts)
     return all_contexts
 
+class CourseListAppContextCache(caching.ProcessScopedSingleton):
+    """App contexts built from the course list, shared by all requests.
+
+    Building an app context creates a new file system and drops everything
+    the previous instance had cached, so contexts are kept for the life of
+    the process and are thrown away only when the course list changes. Changes
+    made by this process are seen immediately; changes made by other
+    instances are noticed through a version stamp kept in memcache, which is
+    polled at most every VERSION_CHECK_INTERVAL_SECS.
+
+    Slugs that name no course are remembered too, so that requests for
+    unknown paths do not query the course list each time; since any path can
+    be requested, only the last MAX_MISSING_SLUGS of them are kept.
+    """
+
+    VERSION_CHECK_INTERVAL_SECS = 5
+    MAX_MISSING_SLUGS = 1000
+
+    def __init__(self):
+        self._version = None
+        self._local_version = None
+        self._version_checked_on = 0
+        self._reset()
+
+    def _reset(self):
+        self._slug2app_context = {}
+        self._namespace2app_context = {}
+        self._missing_slugs = caching.LRUCache(
+            max_item_count=self.MAX_MISSING_SLUGS)
+
+    def _validate(self):
+        now = time.time()
+        local_version = course_list.CourseListDAO.get_local_version()
+        if (local_version == self._local_version and
+            now - self._version_checked_on < self.VERSION_CHECK_INTERVAL_SECS):
+            return
+        version = course_list.CourseListDAO.get_version()
+        self._version_checked_on = now
+        if version != self._version or local_version != self._local_version:
+            self._version = version
+            self._local_version = local_version
+            self._reset()
+
+    def _get_or_build(self, item):
+        """Returns the cached context for a course list item or builds it."""
+        app_context = self._namespace2app_context.get(item.namespace)
+        if app_context and app_context.get_slug() == item.slug:
+            return app_context
+        COURSE_LIST_APP_CONTEXT_CACHE_MISS.inc()
+        app_context = _build_app_context_from_course_list_item(item)
+        self._namespace2app_context[app_context.get_namespace_name()] = (
+            app_context)
+        return app_context
+
+    def get_for_item(self, item):
+        self._validate()
+        return self._get_or_build(item)
+
+    def get_for_slug(self, slug):
+        self._validate()
+        app_context = self._slug2app_context.get(slug)
+        if app_context or self._missing_slugs.contains(slug):
+            COURSE_LIST_APP_CONTEXT_CACHE_HIT.inc()
+            return app_context
+        clo = course_list.CourseListDAO.get_course_for_path(slug)
+        if not clo:
+            self._missing_slugs.put(slug, True)
+            return None
+        app_context = self._get_or_build(clo)
+        self._slug2app_context[slug] = app_context
+        return app_context
+
+    def get_for_namespace(self, namespace):
+        self._validate()
+        app_context = self._namespace2app_context.get(namespace)
+        if app_context:
+            COURSE_LIST_APP_CONTEXT_CACHE_HIT.inc()
+            return app_context
+        clo = course_list.CourseListDAO.get_course_for_namespace(namespace)
+        if not clo:
+            return None
+        return self._get_or_build(clo)
+
+
+def _inc_resolution_msecs(start):
+    COURSE_LIST_APP_CONTEXT_RESOLUTION_MSECS.inc(
+        int((time.time() - start) * 1000))
+
+
 def get_course_list_from_config(rules_text):
     return _build_course_list_from(rules_text)
 
@@ -1152,11 +1269,15 @@ def get_course_index(rules_text=None):
 def get_app_context_for_namespace(namespace):
     """Chooses the app_context that matches a namespace."""
     if USE_COURSE_LIST.value:
-        clo = course_list.CourseListDAO.get_course_for_namespace(namespace)
-        if not clo:
+        start = time.time()
+        try:
+            app_context = CourseListAppContextCache.instance(
+                ).get_for_namespace(namespace)
+        finally:
+            _inc_resolution_msecs(start)
+        if not app_context:
             debug('No app_context in namespace: %s' % namespace)
-            return None
-        return _build_app_context_from_course_list_item(clo)
+        return app_context
 
     app_context = get_course_index().get_app_context_for_namespace(namespace)
     if not app_context:
@@ -1173,12 +1294,15 @@ def get_course_for_path(path):
         slug = '/%s' % path_parts[1]
     else:
         slug = '/'
-    clo = course_list.CourseListDAO.get_course_for_path(slug)
-    if not clo:
-        clo = course_list.CourseListDAO.get_course_for_path('/')
-    if not clo:
-        return None
-    return _build_app_context_from_course_list_item(clo)
+    start = time.time()
+    try:
+        cache = CourseListAppContextCache.instance()
+        app_context = cache.get_for_slug(slug)
+        if not app_context:
+            app_context = cache.get_for_slug('/')
+        return app_context
+    finally:
+        _inc_resolution_msecs(start)
 
 
 def get_course_for_current_request():
@@ -830,20 +830,25 @@ class CourseHandler(ApplicationHandler):
         self.init_template_values(_p, prefs=prefs)
         template_environ = self.app_context.get_template_environ(
             self.app_context.get_current_locale(), additional_dirs)
-        template_environ.filters[
-            'gcb_tags'] = jinja_utils.get_gcb_tags_filter(self)
-        template_environ.globals.update({
-            'display_unit_title': (
-                lambda unit: resources_display.display_unit_title(
-                    unit, self.app_context)),
-            'display_short_unit_title': (
-                lambda unit: resources_display.display_short_unit_title(
-                    unit, self.app_context)),
-            'display_lesson_title': (
-                lambda unit, lesson: resources_display.display_lesson_title(
-                    unit, lesson, self.app_context))})
-
-        return template_environ.get_template(template_file)
+        return jinja_utils.BoundTemplate(
+            template_environ.get_template(template_file), self)
+
+
+def _add_display_title_globals(app_context, template_environ):
+    template_environ.globals.update({
+        'display_unit_title': (
+            lambda unit: resources_display.display_unit_title(
+                unit, app_context)),
+        'display_short_unit_title': (
+            lambda unit: resources_display.display_short_unit_title(
+                unit, app_context)),
+        'display_lesson_title': (
+            lambda unit, lesson: resources_display.display_lesson_title(
+                unit, lesson, app_context))})
+
+
+sites.ApplicationContext.TEMPLATE_ENVIRON_HOOKS.append(
+    _add_display_title_globals)
 
 
 class BaseHandler(CourseHandler):
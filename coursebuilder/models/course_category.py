@@ -19,6 +19,7 @@ __author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
 
 import appengine_config
 
+from common import caching
 from common.utils import Namespace
 import models
 import entities
@@ -53,12 +54,33 @@ class CourseCategoryDAO(object):
     """All access and mutation methods for CourseCategory."""
 
     TARGET_NAMESPACE = appengine_config.DEFAULT_NAMESPACE_NAME
+    VERSION_MEMCACHE_KEY = 'course-category:version'
+
+    _version = caching.MemcacheGeneration(VERSION_MEMCACHE_KEY)
+
+    # Incremented on every change to the categories made by this process.
+    _local_version = 0
 
     @classmethod
     def _memcache_key(cls, key):
         """Makes a memcache key from primary key."""
         return 'entity:course-category:%s' % key
 
+    @classmethod
+    def get_version(cls):
+        """Returns a stamp that changes whenever a category changes."""
+        return cls._version.get(cls.TARGET_NAMESPACE)
+
+    @classmethod
+    def get_local_version(cls):
+        """Returns a stamp of changes to the categories by this process."""
+        return cls._local_version
+
+    @classmethod
+    def _bump_version(cls):
+        cls._local_version += 1
+        cls._version.incr(cls.TARGET_NAMESPACE)
+
 
     @classmethod
     def get_category_list(cls):
@@ -96,6 +118,7 @@ class CourseCategoryDAO(object):
             cli.put()
             models.MemcacheManager.set(
 	        cls._memcache_key(key), cli, namespace=cls.TARGET_NAMESPACE)
+            cls._bump_version()
 
 
     @classmethod
@@ -113,6 +136,7 @@ class CourseCategoryDAO(object):
             c.put()
             models.MemcacheManager.set(
 	        cls._memcache_key(key), c, namespace=cls.TARGET_NAMESPACE)
+            cls._bump_version()
 
 
     @classmethod
@@ -127,3 +151,4 @@ class CourseCategoryDAO(object):
             c.delete()
             models.MemcacheManager.delete(
 	        cls._memcache_key(key),  namespace=cls.TARGET_NAMESPACE)
+            cls._bump_version()
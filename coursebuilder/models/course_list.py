@@ -20,6 +20,7 @@ __author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
 import appengine_config
 
 import logging
+from common import caching
 from common.utils import Namespace
 import models
 import entities
@@ -113,12 +114,33 @@ class CourseListDAO(object):
     """All access and mutation methods for CourseList."""
 
     TARGET_NAMESPACE = appengine_config.DEFAULT_NAMESPACE_NAME
+    VERSION_MEMCACHE_KEY = 'course-list:version'
+
+    _version = caching.MemcacheGeneration(VERSION_MEMCACHE_KEY)
+
+    # Incremented on every change to the course list made by this process.
+    _local_version = 0
 
     @classmethod
     def _memcache_key(cls, key):
         """Makes a memcache key from primary key."""
         return 'entity:course-list:%s' % key
 
+    @classmethod
+    def get_version(cls):
+        """Returns a stamp that changes whenever the course list changes."""
+        return cls._version.get(cls.TARGET_NAMESPACE)
+
+    @classmethod
+    def get_local_version(cls):
+        """Returns a stamp of changes to the course list by this process."""
+        return cls._local_version
+
+    @classmethod
+    def _bump_version(cls):
+        cls._local_version += 1
+        cls._version.incr(cls.TARGET_NAMESPACE)
+
     @classmethod
     def get_course_list(cls):
         with Namespace(cls.TARGET_NAMESPACE):
@@ -166,6 +188,7 @@ class CourseListDAO(object):
             cli.put()
             memcache_key = cls._memcache_key(path)
 	    memcache.delete(memcache_key, namespace=cls.TARGET_NAMESPACE)
+            cls._bump_version()
 
 
     @classmethod
@@ -214,6 +237,7 @@ class CourseListDAO(object):
             if last_announcement is not None:
                 c.last_announcement=last_announcement
             c.put()
+            cls._bump_version()
 
 
 class CourseListConnector(object):
@@ -19,7 +19,9 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 import collections
 import copy
 from datetime import datetime
+import hashlib
 import logging
+import marshal
 import os
 import pickle
 import re
@@ -38,6 +40,7 @@ import vfs
 import yaml
 
 import appengine_config
+from common import caching
 from common.schema_fields import FieldRegistry
 from common.schema_fields import SchemaField
 from common import locales
@@ -59,6 +62,11 @@ COURSE_MODEL_VERSION_1_3 = '1.3'
 
 DEFAULT_FETCH_LIMIT = 100
 
+# Serialized units and lessons of courses kept in-process, and the most
+# written to memcache with one call.
+COURSE_RECORD_CACHE_MAX_SIZE_BYTES = 16 * 1024 * 1024
+COURSE_RECORD_BATCH_SIZE_BYTES = 8 * 1024 * 1024
+
 # all entities of these types are copies from source to target during course
 # import
 COURSE_CONTENT_ENTITIES = frozenset([
@@ -663,6 +671,9 @@ class CourseModel12(object):
     def get_lessons(self, unit_id):
         return self._unit_id_to_lessons.get(str(unit_id), [])
 
+    def get_units_of_type(self, unit_type):
+        return [unit for unit in self._units if unit_type == unit.type]
+
     def find_unit_by_id(self, unit_id):
         """Finds a unit given its id."""
         for unit in self._units:
@@ -1022,52 +1033,296 @@ class PersistentCourse13(object):
         self._from_dict(adict)
 
 
-class CachedCourse13(AbstractCachedObject):
-    """A representation of a Course13 optimized for storing in memcache."""
+class CourseElementSerializer(object):
+    """A compact serializer for Unit13 and Lesson13 instances.
+
+    Attributes every instance of the class has are stored as a tuple of
+    values in a fixed order, others as a dict, and the result is marshalled.
+    This is smaller and several times faster than pickling the instance.
+    Values marshal does not support fall back to pickle.
+    """
+
+    MARSHAL = 'm'
+    PICKLE = 'p'
+
+    # Computed by CourseModel13 each time units and lessons are indexed.
+    DERIVED_ATTRIBUTES = frozenset(['_index'])
+
+    def __init__(self, element_class):
+        self._element_class = element_class
+        self._fields = tuple(sorted(
+            set(element_class().__dict__) - self.DERIVED_ATTRIBUTES))
+        self._excluded = self.DERIVED_ATTRIBUTES.union(self._fields)
+
+    def dumps(self, element):
+        values = element.__dict__
+        record = (
+            tuple([values.get(name) for name in self._fields]),
+            dict([(name, value) for name, value in values.iteritems()
+                  if name not in self._excluded]))
+        try:
+            return self.MARSHAL + marshal.dumps(record)
+        except ValueError:
+            return self.PICKLE + pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        if data[0] == self.MARSHAL:
+            values, extra_values = marshal.loads(data[1:])
+        else:
+            values, extra_values = pickle.loads(data[1:])
+        element = self._element_class.__new__(self._element_class)
+        element.__dict__.update(zip(self._fields, values))
+        element.__dict__.update(extra_values)
+        element.__dict__['_index'] = None
+        return element
+
+
+class CourseRecordCache(caching.ProcessScopedSingleton):
+    """Serialized units and lessons of CachedCourse13, by content digest.
+
+    A record never changes once written under its digest, so records are
+    kept in-process without any invalidation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = caching.LRUCache(
+            max_size_bytes=COURSE_RECORD_CACHE_MAX_SIZE_BYTES)
+        self._cache.get_entry_size = self._get_entry_size
+
+    @classmethod
+    def _get_entry_size(cls, digest, data):
+        return len(digest) + len(data)
+
+    def get_multi(self, digests):
+        """Returns a dict of digest: record for the digests cached."""
+        records = {}
+        with self._lock:
+            for digest in digests:
+                found, data = self._cache.get(digest)
+                if found:
+                    records[digest] = data
+        return records
+
+    def put_multi(self, records):
+        with self._lock:
+            for digest, data in records.iteritems():
+                self._cache.put(digest, data)
+
+
+class CachedCourse13(object):
+    """A representation of a Course13 optimized for storing in memcache.
+
+    Each unit and lesson is stored as a separate record, keyed by the digest
+    of its content, and a small manifest lists the records of the course in
+    order. Saving a course after an edit only writes the records that
+    changed, and loading it only fetches records not already kept in-process
+    by CourseRecordCache.
+
+    The manifest also carries the indexes of CourseModel13, so that loading
+    a course does not index its units and lessons again.
+    """
 
     VERSION = COURSE_MODEL_VERSION_1_3
 
-    def __init__(
-        self, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None, unit_id_to_child_unit_ids=None):
+    UNIT_SERIALIZER = CourseElementSerializer(Unit13)
+    LESSON_SERIALIZER = CourseElementSerializer(Lesson13)
 
-        self.version = self.VERSION
-        self.next_id = next_id
-        self.units = units
-        self.lessons = lessons
+    @classmethod
+    def _manifest_key(cls):
+        # The course content files may change between deployment. To avoid
+        # reading old cached values by the new version of the application we
+        # add deployment version to the key.
+        return 'course:model:manifest:%s:%s' % (
+            cls.VERSION, os.environ.get('CURRENT_VERSION_ID'))
 
-        # This is almost the same as PersistentCourse13 above, but it also
-        # stores additional indexes used for performance optimizations. There
-        # is no need to persist these indexes in durable storage, but it is
-        # nice to have them in memcache.
-        self.unit_id_to_lesson_ids = unit_id_to_lesson_ids
-        self.unit_id_to_child_unit_ids = unit_id_to_child_unit_ids
+    @classmethod
+    def _record_key(cls, digest):
+        return 'course:model:record:%s:%s:%s' % (
+            cls.VERSION, os.environ.get('CURRENT_VERSION_ID'), digest)
 
     @classmethod
-    def _max_size(cls):
-        # Cap at approximately 4M to avoid 1M single-cache-element limit,
-        # which is too small for larger courses.
-        return models.MEMCACHE_MAX * 4
+    def _make_records(cls, course):
+        """Returns the manifest and a dict of digest: record for a course."""
+        records = {}
+
+        def _add_records(serializer, elements):
+            digests = []
+            for element in elements:
+                data = serializer.dumps(element)
+                digest = hashlib.sha1(data).hexdigest()
+                records[digest] = data
+                digests.append(digest)
+            return digests
+
+        manifest = (
+            cls.VERSION, course.next_id,
+            _add_records(cls.UNIT_SERIALIZER, course.units),
+            _add_records(cls.LESSON_SERIALIZER, course.lessons),
+            cls._make_indexes(course))
+        return manifest, records
 
     @classmethod
-    def new_memento(cls):
-        return CachedCourse13()
+    def _get_positions(cls, elements, id_to_element):
+        position_of = dict(
+            (id(element), position)
+            for position, element in enumerate(elements))
+        return dict(
+            (element_id, position_of[id(element)])
+            for element_id, element in id_to_element.iteritems())
 
     @classmethod
-    def instance_from_memento(cls, app_context, memento):
+    def _make_indexes(cls, course):
+        """Returns the indexes of a course in a form marshal can encode.
+
+        Indexes of units and lessons hold their positions in the course, and
+        the numbers index_units_and_lessons() gave them, which records leave
+        out, are listed in course order.
+        """
+        # pylint: disable=protected-access
+        return (
+            course.unit_id_to_lesson_ids, course.unit_id_to_child_unit_ids,
+            course.assessment_id_to_parent_unit_id,
+            course.unit_type_to_unit_ids,
+            cls._get_positions(course.units, course.unit_id_to_unit),
+            cls._get_positions(course.lessons, course.lesson_id_to_lesson),
+            [unit._index for unit in course.units],
+            [lesson._index for lesson in course.lessons])
+
+    @classmethod
+    def _make_course(cls, app_context, next_id, units, lessons, indexes):
+        (unit_id_to_lesson_ids, unit_id_to_child_unit_ids,
+         assessment_id_to_parent_unit_id, unit_type_to_unit_ids,
+         unit_positions, lesson_positions,
+         unit_numbers, lesson_numbers) = indexes
+        # pylint: disable=protected-access
+        for unit, number in zip(units, unit_numbers):
+            unit._index = number
+        for lesson, number in zip(lessons, lesson_numbers):
+            lesson._index = number
         return CourseModel13(
-            app_context, next_id=memento.next_id,
-            units=memento.units, lessons=memento.lessons,
-            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids,
-            unit_id_to_child_unit_ids=memento.unit_id_to_child_unit_ids)
+            app_context, next_id=next_id, units=units, lessons=lessons,
+            unit_id_to_lesson_ids=unit_id_to_lesson_ids,
+            unit_id_to_child_unit_ids=unit_id_to_child_unit_ids,
+            unit_id_to_unit=dict(
+                (unit_id, units[position])
+                for unit_id, position in unit_positions.iteritems()),
+            lesson_id_to_lesson=dict(
+                (lesson_id, lessons[position])
+                for lesson_id, position in lesson_positions.iteritems()),
+            assessment_id_to_parent_unit_id=assessment_id_to_parent_unit_id,
+            unit_type_to_unit_ids=unit_type_to_unit_ids)
 
     @classmethod
-    def memento_from_instance(cls, course):
-        return CachedCourse13(
-            next_id=course.next_id,
-            units=course.units, lessons=course.lessons,
-            unit_id_to_lesson_ids=course.unit_id_to_lesson_ids,
-            unit_id_to_child_unit_ids=course.unit_id_to_child_unit_ids)
+    def _get_manifest(cls, namespace):
+        data = MemcacheManager.get(cls._manifest_key(), namespace=namespace)
+        if not data:
+            return None
+        manifest = marshal.loads(data)
+        if manifest[0] != cls.VERSION or len(manifest) != 5:
+            return None
+        return manifest
+
+    @classmethod
+    def load(cls, app_context):
+        """Loads instance from memcache; does not fail on errors."""
+        namespace = app_context.get_namespace_name()
+        try:
+            manifest = cls._get_manifest(namespace)
+            if not manifest:
+                return None
+            _, next_id, unit_digests, lesson_digests, indexes = manifest
+
+            digests = unit_digests + lesson_digests
+            records = CourseRecordCache.instance().get_multi(digests)
+            missing_keys = dict(
+                (cls._record_key(digest), digest) for digest in digests
+                if digest not in records)
+            if missing_keys:
+                fetched = MemcacheManager.get_multi(
+                    missing_keys.keys(), namespace=namespace)
+                if len(fetched) != len(missing_keys):
+                    return None
+                fetched = dict(
+                    (missing_keys[key], data)
+                    for key, data in fetched.iteritems())
+                CourseRecordCache.instance().put_multi(fetched)
+                records.update(fetched)
+
+            return cls._make_course(
+                app_context, next_id,
+                [cls.UNIT_SERIALIZER.loads(records[digest])
+                 for digest in unit_digests],
+                [cls.LESSON_SERIALIZER.loads(records[digest])
+                 for digest in lesson_digests],
+                indexes)
+
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(
+                'Failed to load object \'%s\' from memcache. %s',
+                cls._manifest_key(), e)
+        return None
+
+    @classmethod
+    def _put(cls, app_context, course, known_digests):
+        namespace = app_context.get_namespace_name()
+        manifest, records = cls._make_records(course)
+        too_large = [
+            digest for digest, data in records.iteritems()
+            if len(data) > models.MEMCACHE_MAX]
+        if too_large:
+            logging.warning(
+                'Not sending %s for %s to Memcache; %d of its units or '
+                'lessons are more than the maximum limit of %d bytes.',
+                cls._manifest_key(), cls.__name__, len(too_large),
+                models.MEMCACHE_MAX)
+            cls.delete(app_context)
+            return
+
+        # Records are written before the manifest referring to them.
+        mapping = {}
+        mapping_size = 0
+        for digest, data in records.iteritems():
+            if digest in known_digests:
+                continue
+            if mapping_size + len(data) > COURSE_RECORD_BATCH_SIZE_BYTES:
+                MemcacheManager.set_multi(mapping, namespace=namespace)
+                mapping = {}
+                mapping_size = 0
+            mapping[cls._record_key(digest)] = data
+            mapping_size += len(data)
+        MemcacheManager.set_multi(mapping, namespace=namespace)
+        CourseRecordCache.instance().put_multi(records)
+        MemcacheManager.set(
+            cls._manifest_key(), marshal.dumps(manifest), namespace=namespace)
+
+    @classmethod
+    def save(cls, app_context, course):
+        """Saves instance to memcache, with all of its records."""
+        cls._put(app_context, course, ())
+
+    @classmethod
+    def update(cls, app_context, course):
+        """Saves instance to memcache after an edit.
+
+        Only the records not listed in the cached manifest are written, so
+        that other instances only need to fetch those.
+        """
+        known_digests = set()
+        try:
+            manifest = cls._get_manifest(app_context.get_namespace_name())
+        except Exception:  # pylint: disable=broad-except
+            manifest = None
+        if manifest:
+            known_digests.update(manifest[2])
+            known_digests.update(manifest[3])
+        cls._put(app_context, course, known_digests)
+
+    @classmethod
+    def delete(cls, app_context):
+        """Deletes instance from memcache."""
+        MemcacheManager.delete(
+            cls._manifest_key(), namespace=app_context.get_namespace_name())
 
 
 class CourseModel13(object):
@@ -1109,9 +1364,47 @@ class CourseModel13(object):
             unit_id_to_child_unit_ids[key].append(str(unit.unit_id))
         return unit_id_to_child_unit_ids
 
+    @classmethod
+    def _make_unit_id_to_unit_dict(cls, units):
+        """Creates an index of unit.unit_id to unit."""
+        unit_id_to_unit = {}
+        for unit in units:
+            unit_id_to_unit.setdefault(str(unit.unit_id), unit)
+        return unit_id_to_unit
+
+    @classmethod
+    def _make_lesson_id_to_lesson_dict(cls, lessons):
+        """Creates an index of lesson.lesson_id to lesson."""
+        lesson_id_to_lesson = {}
+        for lesson in lessons:
+            lesson_id_to_lesson.setdefault(str(lesson.lesson_id), lesson)
+        return lesson_id_to_lesson
+
+    @classmethod
+    def _make_assessment_id_to_parent_unit_id_dict(cls, units):
+        """Creates an index of pre/post assessment id to its unit's id."""
+        assessment_id_to_parent_unit_id = {}
+        for unit in units:
+            for assessment_id in (unit.pre_assessment, unit.post_assessment):
+                if assessment_id is not None:
+                    assessment_id_to_parent_unit_id.setdefault(
+                        str(assessment_id), str(unit.unit_id))
+        return assessment_id_to_parent_unit_id
+
+    @classmethod
+    def _make_unit_type_to_unit_ids_dict(cls, units):
+        """Creates an index of unit.type to ids of units, in course order."""
+        unit_type_to_unit_ids = {}
+        for unit in units:
+            unit_type_to_unit_ids.setdefault(unit.type, []).append(
+                str(unit.unit_id))
+        return unit_type_to_unit_ids
+
     def __init__(
         self, app_context, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None, unit_id_to_child_unit_ids=None):
+        unit_id_to_lesson_ids=None, unit_id_to_child_unit_ids=None,
+        unit_id_to_unit=None, lesson_id_to_lesson=None,
+        assessment_id_to_parent_unit_id=None, unit_type_to_unit_ids=None):
 
         # Init default values.
         self._app_context = app_context
@@ -1119,6 +1412,11 @@ class CourseModel13(object):
         self._units = []
         self._lessons = []
         self._unit_id_to_lesson_ids = {}
+        self._unit_id_to_child_unit_ids = {}
+        self._unit_id_to_unit = {}
+        self._lesson_id_to_lesson = {}
+        self._assessment_id_to_parent_unit_id = {}
+        self._unit_type_to_unit_ids = {}
 
         # These array keep dirty object in current transaction.
         self._dirty_units = []
@@ -1133,9 +1431,17 @@ class CourseModel13(object):
             self._units = units
         if lessons:
             self._lessons = lessons
-        if unit_id_to_lesson_ids:
+        if (unit_id_to_lesson_ids and unit_id_to_unit is not None and
+            lesson_id_to_lesson is not None and
+            assessment_id_to_parent_unit_id is not None and
+            unit_type_to_unit_ids is not None):
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
             self._unit_id_to_child_unit_ids = unit_id_to_child_unit_ids
+            self._unit_id_to_unit = unit_id_to_unit
+            self._lesson_id_to_lesson = lesson_id_to_lesson
+            self._assessment_id_to_parent_unit_id = (
+                assessment_id_to_parent_unit_id)
+            self._unit_type_to_unit_ids = unit_type_to_unit_ids
         else:
             self._index()
 
@@ -1163,6 +1469,22 @@ class CourseModel13(object):
     def unit_id_to_child_unit_ids(self):
         return self._unit_id_to_child_unit_ids
 
+    @property
+    def unit_id_to_unit(self):
+        return self._unit_id_to_unit
+
+    @property
+    def lesson_id_to_lesson(self):
+        return self._lesson_id_to_lesson
+
+    @property
+    def assessment_id_to_parent_unit_id(self):
+        return self._assessment_id_to_parent_unit_id
+
+    @property
+    def unit_type_to_unit_ids(self):
+        return self._unit_type_to_unit_ids
+
     def _get_next_id(self):
         """Allocates next id in sequence."""
         next_id = self._next_id
@@ -1171,13 +1493,28 @@ class CourseModel13(object):
 
     def _index(self):
         """Indexes units and lessons."""
+        self._unit_id_to_unit = self._make_unit_id_to_unit_dict(self._units)
+        self._lesson_id_to_lesson = self._make_lesson_id_to_lesson_dict(
+            self._lessons)
+        self._assessment_id_to_parent_unit_id = (
+            self._make_assessment_id_to_parent_unit_id_dict(self._units))
+        self._index_order()
+
+    def _index_order(self):
+        """Rebuilds the indexes that depend on the order of units/lessons."""
         self._unit_id_to_lesson_ids = self._make_unit_id_to_lessons_lookup_dict(
             self._lessons)
         self._unit_id_to_child_unit_ids = self._make_unit_id_to_child_unit_ids_dict(
             self._units)
+        self._unit_type_to_unit_ids = self._make_unit_type_to_unit_ids_dict(
+            self._units)
 
         index_units_and_lessons(self)
 
+    def _index_parent_units(self):
+        self._assessment_id_to_parent_unit_id = (
+            self._make_assessment_id_to_parent_unit_id_dict(self._units))
+
     def get_file_content(self, filename):
         fs = self.app_context.fs
         path = fs.impl.physical_to_logical(filename)
@@ -1221,11 +1558,17 @@ class CourseModel13(object):
         lessons = self._lessons
         unit_id_to_lesson_ids = self._unit_id_to_lesson_ids
         unit_id_to_child_unit_ids = self._unit_id_to_child_unit_ids
+        unit_id_to_unit = self._unit_id_to_unit
+        lesson_id_to_lesson = self._lesson_id_to_lesson
         try:
             self._units = self._deleted_units
             self._lessons = self._deleted_lessons
             self._unit_id_to_lesson_ids = None
             self._unit_id_to_child_unit_ids = None
+            self._unit_id_to_unit = self._make_unit_id_to_unit_dict(
+                self._deleted_units)
+            self._lesson_id_to_lesson = self._make_lesson_id_to_lesson_dict(
+                self._deleted_lessons)
 
             # Delete owned assessments.
             for unit in self._deleted_units:
@@ -1246,6 +1589,8 @@ class CourseModel13(object):
             self._lessons = lessons
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
             self._unit_id_to_child_unit_ids = unit_id_to_child_unit_ids
+            self._unit_id_to_unit = unit_id_to_unit
+            self._lesson_id_to_lesson = lesson_id_to_lesson
 
     def invalidate_cached_course_settings(self):
         """Clear settings cached locally in-process and globally in memcache."""
@@ -1301,7 +1646,7 @@ class CourseModel13(object):
 
         self._index()
         PersistentCourse13.save(self._app_context, self)
-        CachedCourse13.delete(self._app_context)
+        CachedCourse13.update(self._app_context, self)
 
     def get_units(self):
         return self._units[:]
@@ -1347,27 +1692,26 @@ class CourseModel13(object):
             return 'assets/js/activity-%s.js' % lesson_id
         return None
 
+    def get_units_of_type(self, unit_type):
+        return [
+            self._unit_id_to_unit[unit_id]
+            for unit_id in self._unit_type_to_unit_ids.get(unit_type, [])]
+
     def find_unit_by_id(self, unit_id):
         """Finds a unit given its id."""
-        for unit in self._units:
-            if str(unit.unit_id) == str(unit_id):
-                return unit
-        return None
+        return self._unit_id_to_unit.get(str(unit_id))
 
     def find_lesson_by_id(self, unused_unit, lesson_id):
         """Finds a lesson given its id."""
-        for lesson in self._lessons:
-            if str(lesson.lesson_id) == str(lesson_id):
-                return lesson
-        return None
+        return self._lesson_id_to_lesson.get(str(lesson_id))
 
     def get_parent_unit(self, unit_id):
         # See if the unit is an assessment being used as a pre/post
         # unit lesson.
-        for unit in self.get_units():
-            if (str(unit.pre_assessment) == str(unit_id) or
-                str(unit.post_assessment) == str(unit_id)):
-                return unit
+        parent_unit_id = self._assessment_id_to_parent_unit_id.get(
+            str(unit_id))
+        if parent_unit_id is not None:
+            return self.find_unit_by_id(parent_unit_id)
 
         # Nope, no other kinds of parentage; no parent.
         return None
@@ -1389,7 +1733,14 @@ class CourseModel13(object):
             unit.custom_unit_type = custom_unit_type
         unit.parent_unit = punit.unit_id if punit else None
         self._units.append(unit)
-        self._index()
+
+        self._unit_id_to_unit[str(unit.unit_id)] = unit
+        self._unit_type_to_unit_ids.setdefault(unit.type, []).append(
+            str(unit.unit_id))
+        if unit.parent_unit is not None:
+            self._unit_id_to_child_unit_ids.setdefault(
+                str(unit.parent_unit), []).append(str(unit.unit_id))
+        index_units_and_lessons(self)
 
         self._dirty_units.append(unit)
         return unit
@@ -1406,7 +1757,11 @@ class CourseModel13(object):
         lesson.now_available = False
 
         self._lessons.append(lesson)
-        self._index()
+
+        self._lesson_id_to_lesson[str(lesson.lesson_id)] = lesson
+        self._unit_id_to_lesson_ids.setdefault(
+            str(lesson.unit_id), []).append(str(lesson.lesson_id))
+        index_units_and_lessons(self)
 
         self._dirty_lessons.append(lesson)
         return lesson
@@ -1465,7 +1820,13 @@ class CourseModel13(object):
         if not lesson:
             return False
         self._lessons.remove(lesson)
-        self._index()
+
+        del self._lesson_id_to_lesson[str(lesson.lesson_id)]
+        lesson_ids = self._unit_id_to_lesson_ids.get(str(lesson.unit_id))
+        if lesson_ids and str(lesson.lesson_id) in lesson_ids:
+            lesson_ids.remove(str(lesson.lesson_id))
+        index_units_and_lessons(self)
+
         self._deleted_lessons.append(lesson)
         self._dirty_lessons.append(lesson)
         return True
@@ -1485,7 +1846,20 @@ class CourseModel13(object):
                 parent.post_assessment = None
             self._dirty_units.append(parent)
         self._units.remove(unit)
-        self._index()
+
+        unit_id = str(unit.unit_id)
+        del self._unit_id_to_unit[unit_id]
+        self._unit_type_to_unit_ids[unit.type].remove(unit_id)
+        self._unit_id_to_lesson_ids.pop(unit_id, None)
+        if unit.parent_unit is not None:
+            sibling_ids = self._unit_id_to_child_unit_ids.get(
+                str(unit.parent_unit))
+            if sibling_ids and unit_id in sibling_ids:
+                sibling_ids.remove(unit_id)
+        if parent or unit.pre_assessment or unit.post_assessment:
+            self._index_parent_units()
+        index_units_and_lessons(self)
+
         self._deleted_units.append(unit)
         self._dirty_units.append(unit)
         return True
@@ -1521,6 +1895,11 @@ class CourseModel13(object):
             existing_unit.workflow_yaml = unit.workflow_yaml
             existing_unit.enable_negative_marking = unit.enable_negative_marking
 
+        # Pre/post assessments and the parent unit may have changed.
+        self._index_parent_units()
+        self._unit_id_to_child_unit_ids = (
+            self._make_unit_id_to_child_unit_ids_dict(self._units))
+
         self._dirty_units.append(existing_unit)
         return existing_unit
 
@@ -1591,7 +1970,9 @@ class CourseModel13(object):
         assert len(lesson_ids) == len(self._lessons)
         self._lessons = reordered_lessons
 
-        self._index()
+        # The same units and lessons are still there; only their order and
+        # the unit owning each lesson have changed.
+        self._index_order()
 
     def _get_file_content_as_dict(self, filename):
         """Gets the content of an assessment file as a Python dict."""
@@ -2264,10 +2645,13 @@ class Course(object):
             ret.add(name)
         return ret
 
+    ENVIRON_MEMCACHE_KEY_PREFIX = 'course:environ:locale:'
+
     @classmethod
     def make_locale_environ_key(cls, locale):
         """Returns key used to store localized settings in memcache."""
-        return 'course:environ:locale:%s:%s' % (
+        return '%s%s:%s' % (
+            cls.ENVIRON_MEMCACHE_KEY_PREFIX,
             os.environ.get('CURRENT_VERSION_ID'), locale)
 
     @classmethod
@@ -2822,8 +3206,7 @@ class Course(object):
             self._reviews_processor = review.ReviewsProcessor(self)
         return self._reviews_processor
 
-    def get_units(self):
-        units = self._model.get_units()
+    def _set_custom_unit_urls(self, units):
         for unit in units:
             if unit.is_custom_unit():
                 cu = custom_units.UnitTypeRegistry.get(unit.custom_unit_type)
@@ -2832,18 +3215,15 @@ class Course(object):
                         cu.visible_url(unit)))
         return units
 
+    def get_units(self):
+        return self._set_custom_unit_urls(self._model.get_units())
+
     def get_subunits(self, unit_id):
-        units = self._model.get_subunits(unit_id)
-        for unit in units:
-            if unit.is_custom_unit():
-                cu = custom_units.UnitTypeRegistry.get(unit.custom_unit_type)
-                if cu:
-                    unit.set_custom_unit_url(self.app_context.canonicalize_url(
-                        cu.visible_url(unit)))
-        return units
+        return self._set_custom_unit_urls(self._model.get_subunits(unit_id))
 
     def get_units_of_type(self, unit_type):
-        return [unit for unit in self.get_units() if unit_type == unit.type]
+        return self._set_custom_unit_urls(
+            self._model.get_units_of_type(unit_type))
 
     def get_track_matching_student(self, student):
         return models.LabelDAO.apply_course_track_labels_to_student_labels(
@@ -2959,8 +3339,7 @@ class Course(object):
         """Gets a student's score for a particular assessment."""
         assert (self.is_valid_assessment_id(unit_id) or
                 self.is_valid_custom_unit(unit_id))
-        scores = transforms.loads(student.scores) if student.scores else {}
-        return scores.get(str(unit_id))
+        return student.get_score(unit_id)
 
     def get_overall_score(self, student):
         """Gets the overall course score for a student."""
@@ -3018,7 +3397,7 @@ class Course(object):
             assessment score.
         """
         unit_list = self.get_units()
-        scores = transforms.loads(student.scores) if student.scores else {}
+        scores = student.get_scores()
 
         progress_tracker = self.get_progress_tracker()
         student_progress = progress_tracker.get_or_create_progress(student)
@@ -3435,3 +3814,7 @@ course:
             student = models.Student(key_name=email, user_id=user_id)
             student.put()
         return student
+
+
+# Course settings are read on every page.
+models.MemcacheL1Cache.register_key_prefix(Course.ENVIRON_MEMCACHE_KEY_PREFIX)
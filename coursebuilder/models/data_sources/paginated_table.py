@@ -99,6 +99,103 @@ class _AbstractDbTableRestDataSource(base_types._AbstractRestDataSource):
                 app_context, source_context, schema, log, page_number, rows
                 ), page_number
 
+    # Scatter samples read per key range when splitting a table.
+    KEY_RANGE_OVERSAMPLING = 32
+
+    @classmethod
+    def build_key_ranges(cls, app_context, num_ranges):
+        """Splits the table into at most num_ranges ranges of similar size.
+
+        App Engine sets the __scatter__ property on a random sample of
+        entities; ordering by it gives keys spread evenly over the table.
+        Tables too small to carry any sample come back as a single range.
+
+        Args:
+          app_context: Standard CB application context object
+          num_ranges: Desired number of key ranges.
+        Returns:
+          A list of key range positions as taken by fetch_key_ranges(),
+          each set up to start reading at the beginning of its range.
+        """
+        with Namespace(app_context.get_namespace_name()):
+            query = cls.get_entity_class().all(keys_only=True)
+            query.order('__scatter__')
+            keys = sorted(query.fetch(
+                num_ranges * cls.KEY_RANGE_OVERSAMPLING))
+        stride = len(keys) / float(num_ranges)
+        split_keys = sorted(set(
+            keys[int(stride * index)] for index in xrange(1, num_ranges)
+            if keys))
+        bounds = [None] + [str(key) for key in split_keys] + [None]
+        return [{'start': start, 'end': end, 'after': None, 'done': False}
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    @classmethod
+    def fetch_key_ranges(cls, app_context, source_context, schema, log,
+                         positions, limit):
+        """Reads the next entities of several key ranges concurrently.
+
+        Unlike fetch_values(), no cursors are needed: each range resumes
+        after the last key read from it, so any page can be re-read from
+        the positions it started from.
+
+        Args:
+          app_context: Standard CB application context object
+          source_context: Context as for fetch_values().  Filters and
+              orderings are not supported.
+          schema: Schema as for fetch_values().
+          log: a catch_and_log object for reporting any exceptions.
+          positions: List of dicts with the 'start' and 'end' keys of a
+              range, the 'after' key last read from it and whether it is
+              'done', as built by build_key_ranges().
+          limit: Maximum number of entities to read from each range.
+        Returns:
+          A 2-tuple of the rows read, postprocessed as for fetch_values(),
+          and the positions to resume reading from.
+        """
+        with Namespace(app_context.get_namespace_name()):
+            runs = []
+            for position in positions:
+                if position['done']:
+                    runs.append(None)
+                    continue
+                query = cls.get_entity_class().all()
+                if position['after']:
+                    query.filter('__key__ >', db.Key(position['after']))
+                elif position['start']:
+                    query.filter('__key__ >=', db.Key(position['start']))
+                if position['end']:
+                    query.filter('__key__ <', db.Key(position['end']))
+                query.order('__key__')
+
+                # run() sends the first batch request without waiting for
+                # it, so all ranges are read in parallel.  The one extra
+                # entity tells whether the range has more to read.
+                runs.append(query.run(
+                    limit=limit + 1, batch_size=limit + 1,
+                    read_policy=db.EVENTUAL_CONSISTENCY))
+
+            rows = []
+            new_positions = []
+            for position, run in zip(positions, runs):
+                position = dict(position)
+                if run is not None:
+                    range_rows = list(run)
+                    if len(range_rows) > limit:
+                        del range_rows[limit:]
+                    else:
+                        position['done'] = True
+                    if range_rows:
+                        position['after'] = str(range_rows[-1].key())
+                    rows.extend(range_rows)
+                new_positions.append(position)
+            log.info('fetched %d rows from %d key ranges' % (
+                len(rows), len([run for run in runs if run is not None])))
+
+            return cls._postprocess_rows(
+                app_context, source_context, schema, log, None, rows
+                ), new_positions
+
     @classmethod
     def _postprocess_rows(cls, unused_app_context, source_context,
                           schema, unused_log, unused_page_number,
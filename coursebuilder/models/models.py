@@ -18,11 +18,12 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 import collections
 import copy
+import cPickle
 import logging
 import os
 import sys
+import threading
 import time
-import pickle
 
 from config import ConfigProperty
 import counters
@@ -54,6 +55,10 @@ DEFAULT_CACHE_TTL_SECS = 60 * 5
 MEMCACHE_MAX = (1000 * 1000 - 96 - 250)
 MEMCACHE_MULTI_MAX = 32 * 1000 * 1000
 
+# Values of hot memcache keys are kept in-process for at most this long.
+L1_CACHE_TTL_SECS = 30
+L1_CACHE_MAX_SIZE_BYTES = 32 * 1024 * 1024
+
 # Global memcache controls.
 CAN_USE_MEMCACHE = ConfigProperty(
     'gcb_can_use_memcache', bool, (
@@ -62,6 +67,14 @@ CAN_USE_MEMCACHE = ConfigProperty(
         'development this value should be off so you can see your changes to '
         'course content instantaneously.'),
     appengine_config.PRODUCTION_MODE)
+CAN_USE_L1_CACHE = ConfigProperty(
+    'gcb_can_use_l1_cache', bool, (
+        'Whether or not to also keep frequently read memcache values, such as '
+        'course settings, questions, labels and roles, in the memory of each '
+        'frontend instance. This saves a memcache round trip on most page '
+        'views, but changes made on one instance may take a few seconds to '
+        'be seen on the others.'),
+    False)
 
 # performance counters
 CACHE_PUT = PerfCounter(
@@ -91,10 +104,140 @@ CACHE_MISS_LOCAL = PerfCounter(
     'gcb-models-cache-miss-local',
     'A number of times an object was not found in local memcache.')
 
+# performance counters for the process-scoped L1 cache
+CACHE_PUT_L1 = PerfCounter(
+    'gcb-models-cache-put-l1',
+    'A number of times an object was put into the L1 cache.')
+CACHE_HIT_L1 = PerfCounter(
+    'gcb-models-cache-hit-l1',
+    'A number of times an object was found in the L1 cache.')
+CACHE_MISS_L1 = PerfCounter(
+    'gcb-models-cache-miss-l1',
+    'A number of times an object was not found in the L1 cache.')
+CACHE_INVALIDATE_L1 = PerfCounter(
+    'gcb-models-cache-invalidate-l1',
+    'A number of times the L1 cache of a namespace was invalidated.')
+
+# performance counters for the request-scoped DAO identity map
+DAO_IDENTITY_MAP_HIT = PerfCounter(
+    'gcb-models-dao-identity-map-hit',
+    'A number of times an entity loaded earlier in the request was reused.')
+DAO_LOAD_BATCH = PerfCounter(
+    'gcb-models-dao-load-batch',
+    'A number of times entities were fetched together for BaseJsonDao.load().')
+
 # Intent for sending welcome notifications.
 WELCOME_NOTIFICATION_INTENT = 'welcome'
 
 
+class MemcacheL1Cache(caching.ProcessScopedSingleton):
+    """In-process copies of hot memcache values, shared by all requests.
+
+    Only keys starting with a prefix given to register_key_prefix() are
+    kept, for L1_CACHE_TTL_SECS at most.  Entries are stamped with a per
+    namespace generation kept in memcache.  Deleting any such key through
+    MemcacheManager, or saving the entity behind it through a DAO, moves the
+    generation on; other processes notice within
+    GENERATION_CHECK_INTERVAL_SECS and drop what they hold.  Setting a key
+    only fills the L1 cache, so reading through on a miss costs nothing more.
+    """
+
+    GENERATION_MEMCACHE_KEY = 'memcache-l1-generation'
+    GENERATION_CHECK_INTERVAL_SECS = 2
+
+    # Maps key prefixes to whether values under them are never modified
+    # once cached, and so can be handed out without a copy.
+    _KEY_PREFIXES = {}
+    _KEY_PREFIXES_TUPLE = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = caching.LRUCache(max_size_bytes=L1_CACHE_MAX_SIZE_BYTES)
+        self._cache.get_entry_size = self._get_entry_size
+        self._generation = caching.MemcacheGeneration(
+            self.GENERATION_MEMCACHE_KEY,
+            check_interval_secs=self.GENERATION_CHECK_INTERVAL_SECS)
+        self._namespace_counters = {}
+
+    @classmethod
+    def register_key_prefix(cls, prefix, immutable=False):
+        """Has values of keys starting with prefix kept in the L1 cache.
+
+        Args:
+          prefix: String the memcache keys start with.
+          immutable: Whether callers never modify the values they get, so
+              that the cached value itself can be returned instead of a deep
+              copy.  Values are still copied when set.
+        """
+        cls._KEY_PREFIXES[prefix] = immutable
+        cls._KEY_PREFIXES_TUPLE = tuple(cls._KEY_PREFIXES)
+
+    @classmethod
+    def get_key_mode(cls, key):
+        """Returns None if key is not cached, else whether it is immutable."""
+        if not (CAN_USE_L1_CACHE.value and isinstance(key, basestring) and
+                key.startswith(cls._KEY_PREFIXES_TUPLE)):
+            return None
+        for prefix, immutable in cls._KEY_PREFIXES.iteritems():
+            if key.startswith(prefix) and not immutable:
+                return False
+        return True
+
+    @classmethod
+    def _get_entry_size(cls, key, entry):
+        return sys.getsizeof(key) + entry[1]
+
+    def _get_namespace_counters(self, namespace):
+        counters = self._namespace_counters.get(namespace)
+        if not counters:
+            counters = (
+                PerfCounter(
+                    'gcb-models-cache-hit-l1:%s' % namespace,
+                    'A number of times an object of namespace %s was found '
+                    'in the L1 cache.' % namespace),
+                PerfCounter(
+                    'gcb-models-cache-miss-l1:%s' % namespace,
+                    'A number of times an object of namespace %s was not '
+                    'found in the L1 cache.' % namespace))
+            self._namespace_counters[namespace] = counters
+        return counters
+
+    def get(self, key, namespace):
+        """Returns a 2-tuple: whether the key was found, and its value."""
+        generation = self._generation.get(namespace)
+        with self._lock:
+            found, entry = self._cache.get((namespace, key))
+            if found and (entry[2] != generation or entry[3] < time.time()):
+                self._cache.delete((namespace, key))
+                found = False
+        hit_counter, miss_counter = self._get_namespace_counters(namespace)
+        if not found:
+            CACHE_MISS_L1.inc()
+            miss_counter.inc()
+            return False, None
+        CACHE_HIT_L1.inc()
+        hit_counter.inc()
+        return True, entry[0]
+
+    def put(self, key, namespace, value, size):
+        generation = self._generation.get(namespace)
+        if generation is None:
+            return
+        with self._lock:
+            if self._cache.put((namespace, key), (
+                    value, size, generation, time.time() + L1_CACHE_TTL_SECS)):
+                CACHE_PUT_L1.inc()
+
+    def delete(self, key, namespace):
+        with self._lock:
+            self._cache.delete((namespace, key))
+
+    def invalidate(self, namespace):
+        """Makes all processes drop what they cached for a namespace."""
+        CACHE_INVALIDATE_L1.inc()
+        self._generation.incr(namespace)
+
+
 class MemcacheManager(object):
     """Class that consolidates all memcache operations."""
 
@@ -216,6 +359,39 @@ class MemcacheManager(object):
             for key, value in values.items():
                 cls._local_cache_put(key, namespace, value)
 
+    @classmethod
+    def _l1_cache_put(cls, key, namespace, value):
+        try:
+            size = len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        except:  # pylint: disable=bare-except
+            logging.exception('Failed to size: %s, %s', key, namespace)
+            return
+        MemcacheL1Cache.instance().put(key, namespace, value, size)
+
+    @classmethod
+    def _l1_cache_delete_multi(cls, keys, namespace):
+        l1_keys = [
+            key for key in keys
+            if MemcacheL1Cache.get_key_mode(key) is not None]
+        if l1_keys:
+            for key in l1_keys:
+                MemcacheL1Cache.instance().delete(key, namespace)
+            MemcacheL1Cache.instance().invalidate(namespace)
+
+    @classmethod
+    def invalidate_l1(cls, keys, namespace=None):
+        """Makes other processes drop the L1 copies of changed values.
+
+        Call after writing new values for keys whose old values may still be
+        cached elsewhere; set() and set_multi() only fill the L1 cache of
+        this process.
+        """
+        if CAN_USE_MEMCACHE.value:
+            _namespace = cls._get_namespace(namespace)
+            if any(MemcacheL1Cache.get_key_mode(key) is not None
+                   for key in keys):
+                MemcacheL1Cache.instance().invalidate(_namespace)
+
     @classmethod
     def get_namespace(cls):
         """Look up namespace from namespace_manager or use default."""
@@ -241,6 +417,13 @@ class MemcacheManager(object):
         if is_cached:
             return copy.deepcopy(value)
 
+        l1_mode = MemcacheL1Cache.get_key_mode(key)
+        if l1_mode is not None:
+            is_cached, value = MemcacheL1Cache.instance().get(key, _namespace)
+            if is_cached:
+                cls._local_cache_put(key, _namespace, value)
+                return value if l1_mode else copy.deepcopy(value)
+
         value = memcache.get(key, namespace=_namespace)
 
         # We store some objects in memcache that don't evaluate to True, but are
@@ -248,11 +431,16 @@ class MemcacheManager(object):
         # an object is None.
         if value is not None:
             CACHE_HIT.inc()
+            if l1_mode is not None:
+                cls._l1_cache_put(key, _namespace, value)
         else:
             CACHE_MISS.inc(context=key)
 
+        # Values just read from memcache are only shared if cached locally.
         cls._local_cache_put(key, _namespace, value)
-        return copy.deepcopy(value)
+        if cls._IS_READONLY or l1_mode is False:
+            return copy.deepcopy(value)
+        return value
 
     @classmethod
     def get_multi(cls, keys, namespace=None):
@@ -266,32 +454,59 @@ class MemcacheManager(object):
         if is_cached:
             return values
 
-        values = memcache.get_multi(keys, namespace=_namespace)
+        l1_values = {}
+        l1_modes = {}
+        if CAN_USE_L1_CACHE.value:
+            for key in keys:
+                l1_mode = MemcacheL1Cache.get_key_mode(key)
+                if l1_mode is None:
+                    continue
+                l1_modes[key] = l1_mode
+                is_cached, value = MemcacheL1Cache.instance().get(
+                    key, _namespace)
+                if is_cached:
+                    l1_values[key] = value if l1_mode else copy.deepcopy(value)
+            keys = [key for key in keys if key not in l1_values]
+
+        values = memcache.get_multi(keys, namespace=_namespace) if keys else {}
         for key, value in values.items():
             if value is not None:
                 CACHE_HIT.inc()
+                if key in l1_modes:
+                    # Callers may modify mutable values they get.
+                    cls._l1_cache_put(
+                        key, _namespace,
+                        value if l1_modes[key] else copy.deepcopy(value))
             else:
                 logging.info('Cache miss, key: %s. %s', key, Exception())
                 CACHE_MISS.inc(context=key)
 
+        values.update(l1_values)
         cls._local_cache_put_multi(values, _namespace)
         return values
 
     @classmethod
     def set(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None):
         """Sets an item in memcache if memcache is enabled."""
-        # Ensure subsequent mods to value do not affect the cached copy.
-        value = copy.deepcopy(value)
-
         try:
             if CAN_USE_MEMCACHE.value:
-                size = sys.getsizeof(pickle.dumps(value))
+                # Measure the value as memcache itself will pickle it.
+                size = sys.getsizeof(
+                    cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
                 if size > MEMCACHE_MAX:
                     CACHE_PUT_TOO_BIG.inc()
                 else:
                     CACHE_PUT.inc()
                     _namespace = cls._get_namespace(namespace)
                     memcache.set(key, value, ttl, namespace=_namespace)
+                    l1_mode = MemcacheL1Cache.get_key_mode(key)
+                    if l1_mode is not None or cls._IS_READONLY:
+                        # Ensure subsequent mods to value do not affect the
+                        # cached copy.
+                        value = copy.deepcopy(value)
+                    if l1_mode is not None:
+                        MemcacheL1Cache.instance().put(
+                            key, _namespace, value, size)
                     cls._local_cache_put(key, _namespace, value)
         except:  # pylint: disable=bare-except
             logging.exception(
@@ -315,6 +530,11 @@ class MemcacheManager(object):
                     _namespace = cls._get_namespace(namespace)
                     memcache.set_multi(mapping, time=ttl, namespace=_namespace)
                     cls._local_cache_put_multi(mapping, _namespace)
+                    l1_keys = [key for key in mapping
+                               if MemcacheL1Cache.get_key_mode(key) is not None]
+                    for key in l1_keys:
+                        cls._l1_cache_put(
+                            key, _namespace, copy.deepcopy(mapping[key]))
         except:  # pylint: disable=bare-except
             logging.exception(
                 'Failed to set_multi: %s, %s',
@@ -327,7 +547,9 @@ class MemcacheManager(object):
         assert not cls._IS_READONLY
         if CAN_USE_MEMCACHE.value:
             CACHE_DELETE.inc()
-            memcache.delete(key, namespace=cls._get_namespace(namespace))
+            _namespace = cls._get_namespace(namespace)
+            memcache.delete(key, namespace=_namespace)
+            cls._l1_cache_delete_multi([key], _namespace)
 
     @classmethod
     def delete_multi(cls, key_list, namespace=None):
@@ -335,8 +557,9 @@ class MemcacheManager(object):
         assert not cls._IS_READONLY
         if CAN_USE_MEMCACHE.value:
             CACHE_DELETE.inc(increment=len(key_list))
-            memcache.delete_multi(
-                key_list, namespace=cls._get_namespace(namespace))
+            _namespace = cls._get_namespace(namespace)
+            memcache.delete_multi(key_list, namespace=_namespace)
+            cls._l1_cache_delete_multi(key_list, _namespace)
 
     @classmethod
     def incr(cls, key, delta, namespace=None):
@@ -1172,6 +1395,45 @@ class Student(BaseEntity):
     def profile(self):
         return StudentProfileDAO.get_profile_by_user_id(self.user_id)
 
+    def __getstate__(self):
+        # The decoded scores are derived from 'scores'; do not pickle them
+        # into memcache alongside the JSON they came from.
+        state = self.__dict__.copy()
+        state.pop('_decoded_scores', None)
+        return state
+
+    def get_scores(self):
+        """Returns a dict of assessment name to score.
+
+        The JSON in 'scores' is decoded at most once for each value it takes;
+        the result is cached on this instance. Callers must not modify the
+        returned dict; use set_scores() instead.
+        """
+        decoded = self.__dict__.get('_decoded_scores')
+        if decoded is None or decoded[0] is not self.scores:
+            scores = transforms.loads(self.scores) if self.scores else {}
+            decoded = (self.scores, scores)
+            self._decoded_scores = decoded
+        return decoded[1]
+
+    def get_score(self, assessment_name):
+        return self.get_scores().get(str(assessment_name))
+
+    def set_scores(self, scores_by_assessment):
+        """Updates the scores of several assessments with a single encode.
+
+        Scores of assessments not in scores_by_assessment are kept. The
+        caller must call put() to commit.
+
+        Args:
+            scores_by_assessment: dict of assessment name to score.
+        """
+        scores = dict(self.get_scores())
+        for assessment_name, score in scores_by_assessment.iteritems():
+            scores[str(assessment_name)] = score
+        self.scores = transforms.dumps_internal(scores)
+        self._decoded_scores = (self.scores, scores)
+
     @classmethod
     def _memcache_key(cls, key):
         """Makes a memcache key from primary key."""
@@ -1332,6 +1594,21 @@ class StudentAnswersEntity(BaseEntity):
         return db.Key.from_path(cls.kind(), transform_fn(db_key.id_or_name()))
 
 
+class _StudentPropertyValueProperty(db.TextProperty):
+    """Encodes items set by set_value_items() whenever 'value' is written.
+
+    This covers batched writes like db.put([...]) and entities.put([...]),
+    which do not go through StudentPropertyEntity.put().
+    """
+
+    def get_value_for_datastore(self, model_instance):
+        # pylint: disable=protected-access
+        model_instance._encode_value()
+        return super(
+            _StudentPropertyValueProperty, self).get_value_for_datastore(
+                model_instance)
+
+
 class StudentPropertyEntity(BaseEntity):
     """A property of a student, keyed by the string STUDENT_ID-PROPERTY_NAME."""
 
@@ -1339,7 +1616,7 @@ class StudentPropertyEntity(BaseEntity):
 
     name = db.StringProperty()
     # Each of the following is a string representation of a JSON dict.
-    value = db.TextProperty()
+    value = _StudentPropertyValueProperty()
 
     @classmethod
     def _memcache_key(cls, key):
@@ -1362,6 +1639,57 @@ class StudentPropertyEntity(BaseEntity):
         return db.Key.from_path(
             cls.kind(), '%s-%s' % (transform_fn(user_id), name))
 
+    def get_value_dict(self):
+        """Returns the JSON dict in 'value'.
+
+        The JSON is decoded at most once for each value it takes; the result
+        is cached on this instance. Callers must not modify the returned
+        dict; use set_value_items() instead.
+        """
+        decoded = self.__dict__.get('_decoded_value')
+        if decoded is None or decoded[0] is not self.value:
+            value_dict = transforms.loads(self.value) if self.value else {}
+            decoded = (self.value, value_dict)
+            self._decoded_value = decoded
+        return decoded[1]
+
+    def set_value_items(self, items):
+        """Updates some keys of the JSON dict in 'value'.
+
+        The dict is encoded again only once, when the entity is written,
+        whether by put() or by a batched db.put(). Until then 'value' does
+        not reflect the update; read it with get_value_dict().
+
+        Args:
+            items: dict of key to new value.
+        """
+        self.get_value_dict().update(items)
+        dirty_keys = self.__dict__.get('_dirty_value_keys')
+        if dirty_keys is None:
+            dirty_keys = set()
+            self._dirty_value_keys = dirty_keys
+        dirty_keys.update(items)
+
+    def has_dirty_value(self):
+        return bool(self.__dict__.get('_dirty_value_keys'))
+
+    def __getstate__(self):
+        # The decoded value is derived from 'value'; do not pickle it into
+        # memcache alongside the JSON it came from. Pending items are encoded
+        # first so that they are not lost with it.
+        self._encode_value()
+        state = self.__dict__.copy()
+        state.pop('_decoded_value', None)
+        return state
+
+    def _encode_value(self):
+        if not self.has_dirty_value():
+            return
+        value_dict = self.get_value_dict()
+        self.value = transforms.dumps_internal(value_dict)
+        self._decoded_value = (self.value, value_dict)
+        self._dirty_value_keys = None
+
     def put(self):
         """Do the normal put() and also add the object to memcache."""
         result = super(StudentPropertyEntity, self).put()
@@ -1404,6 +1732,52 @@ class StudentPropertyEntity(BaseEntity):
         return value
 
 
+class DaoIdentityMap(caching.RequestScopedSingleton):
+    """Entities loaded by BaseJsonDao subclasses during a course request.
+
+    Each entity is fetched at most once per request; loading it again only
+    builds a new DTO from it. Ids passed to BaseJsonDao.prefetch() are kept
+    pending until the first load() of that DAO, which fetches all of them
+    with one memcache and one datastore round trip.
+
+    The map is only used while a course request is being served, since only
+    then it is cleared when the request ends.
+    """
+
+    def __init__(self):
+        self._entities = {}
+        self._pending = {}
+
+    @classmethod
+    def is_active(cls):
+        from controllers import sites
+        return sites.has_path_info()
+
+    def get(self, namespace, memcache_key):
+        """Returns (is_loaded, entity or None) for an entity of this request."""
+        key = (namespace, memcache_key)
+        if key in self._entities:
+            DAO_IDENTITY_MAP_HIT.inc()
+            return True, self._entities[key]
+        return False, None
+
+    def is_loaded(self, namespace, memcache_key):
+        return (namespace, memcache_key) in self._entities
+
+    def put(self, namespace, memcache_key, entity):
+        self._entities[(namespace, memcache_key)] = entity
+
+    def forget(self, namespace, memcache_keys):
+        for memcache_key in memcache_keys:
+            self._entities.pop((namespace, memcache_key), None)
+
+    def add_pending(self, dao_class, namespace, obj_ids):
+        self._pending.setdefault((dao_class, namespace), set()).update(obj_ids)
+
+    def pop_pending(self, dao_class, namespace):
+        return self._pending.pop((dao_class, namespace), set())
+
+
 class BaseJsonDao(object):
     """Base DAO class for entities storing their data in a single JSON blob."""
 
@@ -1413,6 +1787,10 @@ class BaseJsonDao(object):
         def get_entity_by_key(cls, entity_class, key):
             return entity_class.get_by_id(int(key))
 
+        @classmethod
+        def get_entity_key(cls, entity_class, key):
+            return db.Key.from_path(entity_class.kind(), int(key))
+
         @classmethod
         def new_entity(cls, entity_class, unused_key):
             return entity_class()  # ID auto-generated when entity is put().
@@ -1423,6 +1801,10 @@ class BaseJsonDao(object):
         def get_entity_by_key(cls, entity_class, key):
             return entity_class.get_by_key_name(key)
 
+        @classmethod
+        def get_entity_key(cls, entity_class, key):
+            return db.Key.from_path(entity_class.kind(), key)
+
         @classmethod
         def new_entity(cls, entity_class, key_name):
             return entity_class(key_name=key_name)
@@ -1441,10 +1823,20 @@ class BaseJsonDao(object):
 
     @classmethod
     def get_all_mapped(cls):
+        result = cls.get_all_mapped_without_hooks()
+        cls._maybe_apply_post_load_hooks(result.itervalues())
+        return result
+
+    @classmethod
+    def get_all_mapped_without_hooks(cls):
+        """Like get_all_mapped(), but does not run the POST_LOAD_HOOKS.
+
+        For callers that keep the DTOs beyond the current request, and so must
+        not hold per request changes such as translations.
+        """
         # try to get from memcache
         entities = MemcacheManager.get(cls._memcache_all_key())
         if entities is not None and entities != NO_OBJECT:
-            cls._maybe_apply_post_load_hooks(entities.itervalues())
             return entities
 
         # get from datastore
@@ -1455,8 +1847,6 @@ class BaseJsonDao(object):
         if result:
             result_to_cache = result
         MemcacheManager.set(cls._memcache_all_key(), result_to_cache)
-
-        cls._maybe_apply_post_load_hooks(result.itervalues())
         return result
 
     @classmethod
@@ -1516,10 +1906,123 @@ class BaseJsonDao(object):
         if hasattr(cls, 'POST_SAVE_HOOKS'):
             common_utils.run_hooks(cls.POST_SAVE_HOOKS, dto_list)
 
+    @classmethod
+    def _maybe_apply_post_delete_hooks(cls, dto_list):
+        """Run any post-delete processing hooks.
+
+        Like POST_SAVE_HOOKS, hooks in the list POST_DELETE_HOOKS defined on
+        the DAO class are passed the list of DTO's that were deleted.
+
+        Args:
+            dto_list: list of DTO objects
+        """
+        if hasattr(cls, 'POST_DELETE_HOOKS'):
+            common_utils.run_hooks(cls.POST_DELETE_HOOKS, dto_list)
+
+    @classmethod
+    def prefetch(cls, obj_ids):
+        """Queues objects to be fetched together with the next load().
+
+        Callers which know the objects they are about to load one by one, like
+        the questions of an assessment, call this first so that the loads cost
+        one memcache and one datastore round trip in total. Outside of a
+        course request this does nothing.
+
+        Args:
+            obj_ids: list of ids of objects that are likely to be loaded.
+        """
+        if not DaoIdentityMap.is_active():
+            return
+        valid_ids = []
+        for obj_id in obj_ids:
+            if not obj_id:
+                continue
+            try:
+                cls.ENTITY_KEY_TYPE.get_entity_key(cls.ENTITY, obj_id)
+            except Exception:  # pylint: disable=broad-except
+                continue  # load() of this id reports the error to its caller
+            valid_ids.append(obj_id)
+        DaoIdentityMap.instance().add_pending(
+            cls, MemcacheManager.get_namespace(), valid_ids)
+
+    @classmethod
+    def _fetch_entities(cls, obj_ids):
+        """Gets entities with one memcache and one datastore round trip.
+
+        Args:
+            obj_ids: list of ids of the objects to fetch.
+
+        Returns:
+            A dict of object id: entity, or None if there is no such object.
+        """
+        memcache_keys = dict(
+            (obj_id, cls._memcache_key(obj_id)) for obj_id in obj_ids)
+        memcache_entities = MemcacheManager.get_multi(memcache_keys.values())
+
+        entities = {}
+        datastore_ids = []
+        for obj_id, memcache_key in memcache_keys.iteritems():
+            if memcache_key not in memcache_entities:
+                datastore_ids.append(obj_id)
+            elif NO_OBJECT == memcache_entities[memcache_key]:
+                entities[obj_id] = None
+            else:
+                entities[obj_id] = memcache_entities[memcache_key]
+
+        if datastore_ids:
+            memcache_update = {}
+            datastore_entities = db.get([
+                cls.ENTITY_KEY_TYPE.get_entity_key(cls.ENTITY, obj_id)
+                for obj_id in datastore_ids])
+            for obj_id, entity in zip(datastore_ids, datastore_entities):
+                entities[obj_id] = entity
+                memcache_update[memcache_keys[obj_id]] = (
+                    NO_OBJECT if entity is None else entity)
+            MemcacheManager.set_multi(memcache_update)
+        return entities
+
+    @classmethod
+    def _load_entities_in_request(cls, obj_ids):
+        """Gets entities through the identity map of the current request."""
+        identity_map = DaoIdentityMap.instance()
+        namespace = MemcacheManager.get_namespace()
+        entities = {}
+        missing_ids = set()
+        for obj_id in obj_ids:
+            is_loaded, entity = identity_map.get(
+                namespace, cls._memcache_key(obj_id))
+            if is_loaded:
+                entities[obj_id] = entity
+            else:
+                missing_ids.add(obj_id)
+        if not missing_ids:
+            return entities
+
+        fetch_ids = set(missing_ids)
+        for obj_id in identity_map.pop_pending(cls, namespace):
+            if not identity_map.is_loaded(namespace, cls._memcache_key(obj_id)):
+                fetch_ids.add(obj_id)
+        DAO_LOAD_BATCH.inc()
+        fetched = cls._fetch_entities(list(fetch_ids))
+        for obj_id, entity in fetched.iteritems():
+            identity_map.put(namespace, cls._memcache_key(obj_id), entity)
+        for obj_id in missing_ids:
+            entities[obj_id] = fetched[obj_id]
+        return entities
+
+    @classmethod
+    def _forget_loaded(cls, obj_ids):
+        if DaoIdentityMap.is_active():
+            DaoIdentityMap.instance().forget(
+                MemcacheManager.get_namespace(),
+                [cls._memcache_key(obj_id) for obj_id in obj_ids])
+
     @classmethod
     def _load_entity(cls, obj_id):
         if not obj_id:
             return None
+        if DaoIdentityMap.is_active():
+            return cls._load_entities_in_request([obj_id])[obj_id]
         memcache_key = cls._memcache_key(obj_id)
         entity = MemcacheManager.get(memcache_key)
         if NO_OBJECT == entity:
@@ -1545,51 +2048,20 @@ class BaseJsonDao(object):
     @classmethod
     @appengine_config.timeandlog('Models.bulk_load')
     def bulk_load(cls, obj_id_list):
-        # fetch from memcache
-        memcache_keys = [cls._memcache_key(obj_id) for obj_id in obj_id_list]
-        memcache_entities = MemcacheManager.get_multi(memcache_keys)
-
-        # fetch missing from datastore
-        both_keys = zip(obj_id_list, memcache_keys)
-        datastore_keys = [
-            obj_id for obj_id, memcache_key in both_keys
-            if memcache_key not in memcache_entities]
-        if datastore_keys:
-            datastore_entities = dict(zip(
-                datastore_keys, db.get([
-                    db.Key.from_path(cls.ENTITY.kind(), obj_id)
-                    for obj_id in datastore_keys])))
+        obj_ids = [obj_id for obj_id in obj_id_list if obj_id]
+        if DaoIdentityMap.is_active():
+            entities = cls._load_entities_in_request(obj_ids)
         else:
-            datastore_entities = {}
+            entities = cls._fetch_entities(obj_ids)
 
-        # weave the results together
         ret = []
-        memcache_update = {}
-        dtos_for_post_hooks = []
-        for obj_id, memcache_key in both_keys:
-            entity = datastore_entities.get(obj_id)
-            if entity is not None:
-                dto = cls.DTO(obj_id, transforms.loads(entity.data))
-                ret.append(dto)
-                dtos_for_post_hooks.append(dto)
-                memcache_update[memcache_key] = entity
-            elif memcache_key not in memcache_entities:
+        for obj_id in obj_id_list:
+            entity = entities.get(obj_id)
+            if entity is None:
                 ret.append(None)
-                memcache_update[memcache_key] = NO_OBJECT
             else:
-                entity = memcache_entities[memcache_key]
-                if NO_OBJECT == entity:
-                    ret.append(None)
-                else:
-                    ret.append(cls.DTO(obj_id, transforms.loads(entity.data)))
-
-        # run hooks
-        cls._maybe_apply_post_load_hooks(dtos_for_post_hooks)
-
-        # put into memcache
-        if datastore_entities:
-            MemcacheManager.set_multi(memcache_update)
-
+                ret.append(cls.DTO(obj_id, transforms.loads(entity.data)))
+        cls._maybe_apply_post_load_hooks([dto for dto in ret if dto])
         return ret
 
     @classmethod
@@ -1612,6 +2084,8 @@ class BaseJsonDao(object):
         MemcacheManager.delete(cls._memcache_all_key())
         id_or_name = entity.key().id_or_name()
         MemcacheManager.set(cls._memcache_key(id_or_name), entity)
+        MemcacheManager.invalidate_l1([cls._memcache_key(id_or_name)])
+        cls._forget_loaded([id_or_name])
         cls._maybe_apply_post_save_hooks([(id_or_name, dto)])
         return id_or_name
 
@@ -1628,8 +2102,11 @@ class BaseJsonDao(object):
         MemcacheManager.delete(cls._memcache_all_key())
         for key, entity in zip(keys, entities):
             MemcacheManager.set(cls._memcache_key(key.id_or_name()), entity)
+        MemcacheManager.invalidate_l1(
+            [cls._memcache_key(key.id_or_name()) for key in keys])
 
         id_or_name_list = [key.id_or_name() for key in keys]
+        cls._forget_loaded(id_or_name_list)
         cls._maybe_apply_post_save_hooks(zip(id_or_name_list, dtos))
         return id_or_name_list
 
@@ -1639,6 +2116,8 @@ class BaseJsonDao(object):
         entity.delete()
         MemcacheManager.delete(cls._memcache_all_key())
         MemcacheManager.delete(cls._memcache_key(entity.key().id_or_name()))
+        cls._forget_loaded([entity.key().id_or_name()])
+        cls._maybe_apply_post_delete_hooks([dto])
 
     @classmethod
     def clone(cls, dto):
@@ -1711,6 +2190,8 @@ class QuestionDAO(LastModfiedJsonDao):
     POST_LOAD_HOOKS = []
     # Enable other modules to add post-save transformations
     POST_SAVE_HOOKS = []
+    # Enable other modules to react to deletions
+    POST_DELETE_HOOKS = []
 
     @classmethod
     def used_by(cls, question_id):
@@ -2021,6 +2502,8 @@ class QuestionGroupDAO(LastModfiedJsonDao):
     POST_LOAD_HOOKS = []
     # Enable other modules to add post-save transformations
     POST_SAVE_HOOKS = []
+    # Enable other modules to react to deletions
+    POST_DELETE_HOOKS = []
 
     @classmethod
     def get_question_groups_descriptions(cls):
@@ -2348,3 +2831,10 @@ class RoleDAO(BaseJsonDao):
     DTO = RoleDTO
     ENTITY = RoleEntity
     ENTITY_KEY_TYPE = BaseJsonDao.EntityKeyTypeId
+
+
+# Questions, question groups and labels are read on most student pages.
+for _entity_class in (QuestionEntity, QuestionGroupEntity):
+    MemcacheL1Cache.register_key_prefix('(entity:%s:' % _entity_class.kind())
+MemcacheL1Cache.register_key_prefix(
+    '(entity-get-all:%s)' % LabelEntity.kind())
@@ -16,12 +16,37 @@
 
 __author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
 
+from common import utils as common_utils
+from models import models
+from models import services
 from modules.notifications import notifications
 
 from google.appengine.api import mail
 from google.appengine.api import users
 
 
+class EnrolledStudents(notifications.Recipients):
+    """Students enrolled in the current course, optionally by label."""
+
+    def __init__(self, label_ids=None):
+        super(EnrolledStudents, self).__init__()
+        self.label_ids = set(str(label_id) for label_id in label_ids or [])
+
+    def get_query(self):
+        # is_enrolled and labels are not indexed, so they are checked here.
+        return models.Student.all()
+
+    def get_email(self, student):
+        if not student.is_enrolled:
+            return None
+        if self.label_ids and not self.label_ids.intersection(
+                common_utils.text_to_list(student.labels)):
+            return None
+        if services.unsubscribe.has_unsubscribed(student.email):
+            return None
+        return student.email
+
+
 class EmailManager(object):
     """Notification Manager. Sends emails out."""
 
@@ -50,5 +75,14 @@ class EmailManager(object):
         """Send an announcement to course announcement list."""
         announce_email = self._course.get_course_announcement_list_email()
         if announce_email:
-            self.send_mail(subject, body, announce_email, self._user.email(), intent)
+            return self.send_mail(
+                subject, body, announce_email, self._user.email(), intent)
         return False
+
+    def send_announcement_to_students(
+            self, subject, body, intent, label_ids=None):
+        """Send an announcement to each enrolled student, in bulk."""
+        notifications.Manager.send_async_bulk(
+            EnrolledStudents(label_ids=label_ids), self._user.email(), intent,
+            body, subject)
+        return True
@@ -734,35 +734,45 @@ class UnitLessonCompletionTracker(object):
         self._put_event(
             student, 'activity', self._get_activity_key(unit_id, lesson_id))
 
-    def put_html_completed(self, student, unit_id, lesson_id):
-        """Records that the given student has completed a lesson page."""
+    def put_html_completed(self, student, unit_id, lesson_id, progress=None):
+        """Records that the given student has completed a lesson page.
+
+        Like put_block_completed() and put_component_completed(), this only
+        updates the given progress entity, and does not save it, when one is
+        passed in. Returns whether progress was updated.
+        """
         if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
-            return
-        self._put_event(
-            student, 'html', self._get_html_key(unit_id, lesson_id))
+            return False
+        return self._put_event(
+            student, 'html', self._get_html_key(unit_id, lesson_id),
+            progress=progress)
 
-    def put_block_completed(self, student, unit_id, lesson_id, block_id):
+    def put_block_completed(self, student, unit_id, lesson_id, block_id,
+                            progress=None):
         """Records that the given student has completed an activity block."""
         if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
-            return
+            return False
         if block_id not in self.get_valid_block_ids(unit_id, lesson_id):
-            return
-        self._put_event(
+            return False
+        return self._put_event(
             student,
             'block',
-            self._get_block_key(unit_id, lesson_id, block_id)
+            self._get_block_key(unit_id, lesson_id, block_id),
+            progress=progress
         )
 
-    def put_component_completed(self, student, unit_id, lesson_id, cpt_id):
+    def put_component_completed(self, student, unit_id, lesson_id, cpt_id,
+                                progress=None):
         """Records completion of a component in a lesson body."""
         if not self._get_course().is_valid_unit_lesson_id(unit_id, lesson_id):
-            return
+            return False
         if cpt_id not in self.get_valid_component_ids(unit_id, lesson_id):
-            return
-        self._put_event(
+            return False
+        return self._put_event(
             student,
             'component',
-            self._get_component_key(unit_id, lesson_id, cpt_id)
+            self._get_component_key(unit_id, lesson_id, cpt_id),
+            progress=progress
         )
 
     def put_assessment_completed(self, student, assessment_id):
@@ -802,18 +812,33 @@ class UnitLessonCompletionTracker(object):
         if not self.get_valid_component_ids(unit_id, lesson_id):
             self.put_html_completed(student, unit_id, lesson_id)
 
-    def _put_event(self, student, event_entity, event_key):
-        """Starts a cascade of updates in response to an event taking place."""
+    def _put_event(self, student, event_entity, event_key, progress=None):
+        """Starts a cascade of updates in response to an event taking place.
+
+        Args:
+          student: the student
+          event_entity: the name of the affected entity (unit, lesson, etc.)
+          event_key: the key for the recorded event
+          progress: the StudentPropertyEntity holding the student's progress.
+              If given, it is updated but not saved; the caller saves it once
+              it has recorded all of its events.
+        Returns:
+          True if the event was recorded.
+        """
         if student.is_transient or event_entity not in self.EVENT_CODE_MAPPING:
-            return
+            return False
 
-        progress = self.get_or_create_progress(student)
+        save = progress is None
+        if save:
+            progress = self.get_or_create_progress(student)
 
         self._update_event(
             student, progress, event_entity, event_key, direct_update=True)
 
         progress.updated_on = datetime.datetime.now()
-        progress.put()
+        if save:
+            progress.put()
+        return True
 
     def _update_event(self, student, progress, event_entity, event_key,
                       direct_update=False):
@@ -1014,6 +1039,49 @@ class UnitLessonCompletionTracker(object):
             }
         return result
 
+    def get_unit_and_lesson_progress(self, student, progress=None):
+        """Returns the states of all units and of the lessons in each unit.
+
+        This is what get_unit_progress() and get_lesson_progress() return
+        for every unit, computed in a single pass over the course.
+
+        Returns:
+          A pair of the dict get_unit_progress() returns and a dict of unit
+          id to the dict get_lesson_progress() returns for that unit.
+        """
+        if student.is_transient:
+            return {}, {}
+
+        course = self._get_course()
+        if progress is None:
+            progress = self.get_or_create_progress(student)
+        statuses = progress.get_value_dict()
+
+        unit_progress = {}
+        lesson_progress = {}
+        for unit in course.get_units():
+            if unit.type == verify.UNIT_TYPE_ASSESSMENT:
+                value = statuses.get(self._get_assessment_key(unit.unit_id))
+                unit_progress[unit.unit_id] = value is not None and value > 0
+            elif unit.type == verify.UNIT_TYPE_UNIT:
+                unit_progress[unit.unit_id] = statuses.get(
+                    self._get_unit_key(unit.unit_id)) or 0
+            elif unit.type == verify.UNIT_TYPE_CUSTOM:
+                unit_progress[unit.unit_id] = statuses.get(
+                    self._get_custom_unit_key(unit.unit_id)) or 0
+
+            lessons = {}
+            for lesson in course.get_lessons(unit.unit_id):
+                lessons[lesson.lesson_id] = {
+                    'html': statuses.get(self._get_html_key(
+                        unit.unit_id, lesson.lesson_id)) or 0,
+                    'activity': statuses.get(self._get_activity_key(
+                        unit.unit_id, lesson.lesson_id)) or 0,
+                    'has_activity': lesson.has_activity,
+                }
+            lesson_progress[unit.unit_id] = lessons
+        return unit_progress, lesson_progress
+
     def get_component_progress(self, student, unit_id, lesson_id, cpt_id):
         """Returns the progress status of the given component."""
         if student.is_transient:
@@ -1024,9 +1092,7 @@ class UnitLessonCompletionTracker(object):
             progress, unit_id, lesson_id, cpt_id) or 0
 
     def _get_entity_value(self, progress, event_key):
-        if not progress.value:
-            return None
-        return transforms.loads(progress.value).get(event_key)
+        return progress.get_value_dict().get(event_key)
 
     def _set_entity_value(self, student_property, key, value):
         """Sets the integer value of a student property.
@@ -1039,13 +1105,7 @@ class UnitLessonCompletionTracker(object):
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        progress_dict[key] = value
-        student_property.value = transforms.dumps(progress_dict)
+        student_property.set_value_items({key: value})
 
     def _inc(self, student_property, key, value=1):
         """Increments the integer value of a student property.
@@ -1058,17 +1118,8 @@ class UnitLessonCompletionTracker(object):
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        if key not in progress_dict:
-            progress_dict[key] = 0
-
-        progress_dict[key] += value
-        student_property.value = transforms.dumps(progress_dict)
-
+        current = student_property.get_value_dict().get(key, 0)
+        student_property.set_value_items({key: current + value})
 
     def get_all_progress(self, user_id):
         """Retrusn a dict with status of each unit/lesson"""
@@ -17,8 +17,12 @@
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 import collections
+import threading
+
 import config
+from common import caching
 from common import utils
+from models import MemcacheL1Cache
 from models import MemcacheManager
 from models import RoleDAO
 
@@ -57,6 +61,37 @@ GCB_ALLOWLISTED_USERS = config.ConfigProperty(
 Permission = collections.namedtuple('Permission', ['name', 'description'])
 
 
+class EmailListCache(caching.ProcessScopedSingleton):
+    """Lists of email addresses, as sets, keyed by the text they came from.
+
+    Admin lists and allowlists are checked on every request, for every course
+    on the course explorer, and a course allowlist may hold thousands of
+    addresses. The text of each list is split once per process instead of on
+    every check; looking up the same text again is cheap because Python caches
+    the hash of a string.
+    """
+
+    MAX_LISTS = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._email_sets = caching.LRUCache(max_item_count=self.MAX_LISTS)
+
+    def get(self, text):
+        """Returns a frozenset of the lowercase addresses listed in text."""
+        if not text:
+            return frozenset()
+        with self._lock:
+            found, email_set = self._email_sets.get(text)
+        if found:
+            return email_set
+        email_set = frozenset(utils.text_to_list(
+            text, utils.BACKWARD_COMPATIBLE_SPLITTER, to_lower=True))
+        with self._lock:
+            self._email_sets.put(text, email_set)
+        return email_set
+
+
 class Roles(object):
     """A class that provides information about user roles."""
 
@@ -112,8 +147,8 @@ class Roles(object):
 
     @classmethod
     def _user_email_in(cls, user, text):
-        return user and user.email().lower() in utils.text_to_list(
-            text, utils.BACKWARD_COMPATIBLE_SPLITTER, to_lower=True)
+        return user and (
+            user.email().lower() in EmailListCache.instance().get(text))
 
     @classmethod
     def update_permissions_map(cls):
@@ -207,3 +242,7 @@ class Roles(object):
     @classmethod
     def get_permissions(cls):
         return cls._REGISTERED_PERMISSIONS.iteritems()
+
+
+# The map is only read once loaded; update_permissions_map() replaces it.
+MemcacheL1Cache.register_key_prefix(Roles.memcache_key, immutable=True)
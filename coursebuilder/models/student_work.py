@@ -238,7 +238,7 @@ class Submission(BaseEntity):
         """
         return cls(
             unit_id=str(unit_id), reviewee_key=reviewee_key,
-            contents=transforms.dumps(contents)
+            contents=transforms.dumps_internal(contents)
         ).put()
 
     @classmethod
@@ -19,7 +19,7 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 import datetime
 import itertools
 import json
-from StringIO import StringIO
+import re
 import types
 import urlparse
 from xml.etree import ElementTree
@@ -122,6 +122,22 @@ def validate_object_matches_json_schema(obj, schema, path='', complaints=None):
       validated without error.
     """
 
+    if complaints is None:
+        complaints = []
+    if path:
+        _validate_object_matches_json_schema(obj, schema, path, complaints)
+    else:
+        complaints.extend(get_json_schema_validator(schema)(obj))
+    return complaints
+
+
+def _validate_object_matches_json_schema(obj, schema, path, complaints):
+    """Walks the schema for validate_object_matches_json_schema().
+
+    Compiled validators fall back to this for schemas they do not handle
+    themselves, so that both give the same complaints.
+    """
+
     def is_valid_url(obj):
         url = urlparse.urlparse(obj)
         return url.scheme and url.netloc
@@ -140,8 +156,6 @@ def validate_object_matches_json_schema(obj, schema, path='', complaints=None):
         except ValueError:
             return False
 
-    if complaints is None:
-        complaints = []
     if 'properties' in schema or isinstance(obj, dict):
         if not path:
             if 'id' in schema:
@@ -157,7 +171,7 @@ def validate_object_matches_json_schema(obj, schema, path='', complaints=None):
             if 'properties' in schema:
                 schema = schema['properties']
             for name, sub_schema in schema.iteritems():
-                validate_object_matches_json_schema(
+                _validate_object_matches_json_schema(
                     obj.get(name), sub_schema, path + '.' + name, complaints)
             for name in obj:
                 if name not in schema:
@@ -177,7 +191,7 @@ def validate_object_matches_json_schema(obj, schema, path='', complaints=None):
                 if item is None:
                     complaints.append('Found None at %s' % item_path)
                 else:
-                    validate_object_matches_json_schema(
+                    _validate_object_matches_json_schema(
                         item, schema['items'], item_path, complaints)
     else:
         if obj is None:
@@ -217,15 +231,268 @@ def validate_object_matches_json_schema(obj, schema, path='', complaints=None):
                 complaints.append(
                     'Unrecognized schema scalar type "%s" at %s' % (
                         schema['type'], path))
-    return complaints
+
+
+def _is_valid_url(obj):
+    url = urlparse.urlparse(obj)
+    return url.scheme and url.netloc
+
+
+# Values written exactly as ISO_8601_DATE_FORMAT and ISO_8601_DATETIME_FORMAT
+# do; anything else is left to the much slower strptime().
+_ISO_8601_DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})\Z')
+_ISO_8601_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})\.(\d{6})Z\Z')
+
+
+def _is_valid_date(obj):
+    match = _ISO_8601_DATE_RE.match(obj)
+    try:
+        if match:
+            datetime.date(*[int(part) for part in match.groups()])
+        else:
+            datetime.datetime.strptime(obj, ISO_8601_DATE_FORMAT)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_valid_datetime(obj):
+    match = _ISO_8601_DATETIME_RE.match(obj)
+    try:
+        if match:
+            datetime.datetime(*[int(part) for part in match.groups()])
+        else:
+            datetime.datetime.strptime(obj, ISO_8601_DATETIME_FORMAT)
+        return True
+    except ValueError:
+        return False
+
+
+# Expected Python type, format check and the name complaints give the check,
+# for each scalar type compiled validators know.  Other types are left to
+# _validate_object_matches_json_schema().
+_SCALAR_TYPE_CHECKS = {
+    'string': (basestring, None, None),
+    'text': (basestring, None, None),
+    'html': (basestring, None, None),
+    'file': (basestring, None, None),
+    'url': (basestring, _is_valid_url, 'is_valid_url'),
+    'integer': (int, None, None),
+    'timestamp': (int, None, None),
+    'number': (float, None, None),
+    'boolean': (bool, None, None),
+    'date': (basestring, _is_valid_date, 'is_valid_date'),
+    'datetime': (basestring, _is_valid_datetime, 'is_valid_datetime'),
+}
+MAX_CACHED_JSON_SCHEMA_VALIDATORS = 100
+_JSON_SCHEMA_VALIDATORS = {}
+
+
+def get_json_schema_validator(schema):
+    """Gets a function checking objects against a schema.
+
+    The schema is walked once, building a tree of closures with each type
+    check already looked up.  Calling the returned function on an object
+    gives the same complaints as validate_object_matches_json_schema(),
+    at a fraction of the cost; get one validator per batch of objects.
+
+    Args:
+      schema: A dict describing a schema, as for
+          validate_object_matches_json_schema().
+    Returns:
+      A function taking an object and returning a list of complaints.
+    """
+    try:
+        key = json.dumps(schema)
+    except (TypeError, ValueError):
+        return _compile_json_schema_validator(schema)
+    validator = _JSON_SCHEMA_VALIDATORS.get(key)
+    if validator is None:
+        if len(_JSON_SCHEMA_VALIDATORS) >= MAX_CACHED_JSON_SCHEMA_VALIDATORS:
+            _JSON_SCHEMA_VALIDATORS.clear()
+        validator = _compile_json_schema_validator(schema)
+        _JSON_SCHEMA_VALIDATORS[key] = validator
+    return validator
+
+
+def _compile_json_schema_validator(schema):
+    validate_node = _compile_schema_node(schema)
+
+    def validate(obj):
+        complaints = []
+        validate_node(obj, '', complaints)
+        return complaints
+    return validate
+
+
+def _compile_schema_node(schema):
+    def validate_by_walking(obj, path, complaints):
+        _validate_object_matches_json_schema(obj, schema, path, complaints)
+
+    if not isinstance(schema, dict):
+        return validate_by_walking
+    if 'properties' in schema:
+        if not isinstance(schema['properties'], dict):
+            return validate_by_walking
+        return _compile_object_node(schema, schema['properties'])
+
+    # Without 'properties', a dict is checked against the schema itself, as
+    # is done for the 'properties' member passed in by REST data sources.
+    validate_dict = validate_by_walking
+    if all(isinstance(sub_schema, dict) for sub_schema in schema.values()):
+        validate_dict = _compile_object_node(schema, schema)
+
+    def validate_other_by_walking(obj, path, complaints):
+        if isinstance(obj, dict):
+            validate_dict(obj, path, complaints)
+        else:
+            validate_by_walking(obj, path, complaints)
+
+    if 'items' in schema:
+        return _compile_array_node(
+            schema, validate_dict, validate_other_by_walking)
+    return _compile_scalar_node(
+        schema, validate_dict, validate_other_by_walking)
+
+
+def _compile_object_node(schema, properties):
+    root_path = schema['id'] if 'id' in schema else '(root)'
+    members = [(name, '.' + name, _compile_schema_node(sub_schema))
+               for name, sub_schema in properties.iteritems()]
+
+    def validate_object(obj, path, complaints):
+        if not path:
+            path = root_path
+        if obj is None:
+            return
+        if not isinstance(obj, dict):
+            complaints.append('Expected a dict at %s, but had %s' % (
+                path, type(obj)))
+            return
+        for name, suffix, validate_member in members:
+            validate_member(obj.get(name), path + suffix, complaints)
+        for name in obj:
+            if name not in properties:
+                complaints.append('Unexpected member "%s" in %s' % (
+                    name, path))
+    return validate_object
+
+
+def _compile_array_node(schema, validate_dict, validate_by_walking):
+    if not isinstance(schema['items'], dict):
+        return validate_by_walking
+    is_array_of_array = 'items' in schema['items']
+    validate_item = _compile_schema_node(schema['items'])
+
+    def validate_array(obj, path, complaints):
+        if isinstance(obj, dict):
+            validate_dict(obj, path, complaints)
+            return
+        if is_array_of_array:
+            complaints.append('Unsupported: array-of-array at ' + path)
+        if obj is None:
+            return
+        if not isinstance(obj, (list, tuple)):
+            complaints.append('Expected a list or tuple at %s, but had %s' % (
+                path, type(obj)))
+            return
+        for index, item in enumerate(obj):
+            item_path = path + '[%d]' % index
+            if item is None:
+                complaints.append('Found None at %s' % item_path)
+            else:
+                validate_item(item, item_path, complaints)
+    return validate_array
+
+
+def _compile_scalar_node(schema, validate_dict, validate_by_walking):
+    type_check = None
+    if isinstance(schema.get('type'), basestring):
+        type_check = _SCALAR_TYPE_CHECKS.get(schema['type'])
+    if not type_check:
+        return validate_by_walking
+    expected_type, check_format, check_name = type_check
+    optional = schema.get('optional')
+
+    def validate_scalar(obj, path, complaints):
+        if obj is None:
+            if not optional:
+                complaints.append('Missing mandatory value at ' + path)
+        elif isinstance(obj, expected_type):
+            if check_format and not check_format(obj):
+                complaints.append(
+                    'Value "%s" is not well-formed according to %s' % (
+                        str(obj), check_name))
+        elif isinstance(obj, dict):
+            validate_dict(obj, path, complaints)
+        else:
+            complaints.append('Expected %s at %s, but instead had %s' % (
+                expected_type, path, type(obj)))
+    return validate_scalar
+
+
+def _set_encoder(obj):
+    if isinstance(obj, set):
+        return list(obj)
+    return None
+
+
+def _datetime_encoder(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(ISO_8601_DATETIME_FORMAT)
+    return None
+
+
+class _CustomJSONEncoder(json.JSONEncoder):
+
+    def default(self, obj):
+        for f in CUSTOM_JSON_ENCODERS + [_set_encoder, _datetime_encoder]:
+            value = f(obj)
+            if value is not None:
+                return value
+        return super(_CustomJSONEncoder, self).default(obj)
+
+
+# Characters that must not appear verbatim in JSON that may end up in HTML.
+_UNSAFE_JSON_CHARS = re.compile(u'[<>]|[^\x00-\x7f]')
+
+
+def _escape_char(match):
+    char_val = ord(match.group())
+    if char_val > 0xffff:
+        # Outside the Basic Multilingual Plane; JSON needs a surrogate pair.
+        char_val -= 0x10000
+        return u'\\u%04X\\u%04X' % (
+            0xd800 + (char_val >> 10), 0xdc00 + (char_val & 0x3ff))
+    return u'\\u%04X' % char_val
+
+
+def _string_escape(in_str):
+    """Defends against XSS by escaping <, > and non-ASCII chars."""
+    if isinstance(in_str, str):
+        try:
+            # The common case: ensure_ascii left only '<' and '>' to escape.
+            in_str.decode('ascii')
+        except UnicodeDecodeError:
+            in_str = in_str.decode('utf8')
+        else:
+            if '<' in in_str or '>' in in_str:
+                in_str = in_str.replace('<', '\\u003C').replace(
+                    '>', '\\u003E')
+            return unicode(in_str)
+    return _UNSAFE_JSON_CHARS.sub(_escape_char, in_str)
 
 
 def dumps(*args, **kwargs):
     """Wrapper around json.dumps.
 
-    No additional behavior; present here so this module is a drop-in replacement
-    for json.dumps|loads. Clients should never use json.dumps|loads directly.
-    See usage docs at http://docs.python.org/2/library/json.html.
+    Present here so this module is a drop-in replacement for json.dumps|loads.
+    Clients should never use json.dumps|loads directly. See usage docs at
+    http://docs.python.org/2/library/json.html.
+
+    The output is safe to embed in HTML: '<', '>' and non-ASCII characters
+    are escaped.
 
     Args:
         *args: positional arguments delegated to json.dumps.
@@ -234,41 +501,27 @@ def dumps(*args, **kwargs):
     Returns:
         string. The converted JSON.
     """
+    if 'cls' not in kwargs:
+        kwargs['cls'] = _CustomJSONEncoder
+    return _string_escape(json.dumps(*args, **kwargs))
 
-    def set_encoder(obj):
-        if isinstance(obj, set):
-            return list(obj)
-        return None
-
-    def datetime_encoder(obj):
-        if isinstance(obj, datetime.datetime):
-            return obj.strftime(ISO_8601_DATETIME_FORMAT)
-        return None
 
-    def string_escape(in_str):
-        # Defend against XSS by escaping <, > and non-ASCII chars
-        out = StringIO()
-        for c in in_str.decode('utf8'):
-            char_val = ord(c)
-            if char_val > 0x7f or c == '<' or c == '>':
-                out.write('\\u%04X' % char_val)
-            else:
-                out.write(c)
-        return out.getvalue()
+def dumps_internal(*args, **kwargs):
+    """Like dumps(), but without escaping for HTML.
 
-    class CustomJSONEncoder(json.JSONEncoder):
+    Only use this for JSON that is stored or passed between servers and is
+    never written to a page; loads() reads it back like the output of dumps().
 
-        def default(self, obj):
-            for f in CUSTOM_JSON_ENCODERS + [set_encoder, datetime_encoder]:
-                value = f(obj)
-                if value is not None:
-                    return value
-            return super(CustomJSONEncoder, self).default(obj)
+    Args:
+        *args: positional arguments delegated to json.dumps.
+        **kwargs: keyword arguments delegated to json.dumps.
 
+    Returns:
+        string. The converted JSON.
+    """
     if 'cls' not in kwargs:
-        kwargs['cls'] = CustomJSONEncoder
-
-    return string_escape(json.dumps(*args, **kwargs))
+        kwargs['cls'] = _CustomJSONEncoder
+    return json.dumps(*args, **kwargs)
 
 
 def loads(s, prefix=JSON_XSSI_PREFIX, strict=True, **kwargs):
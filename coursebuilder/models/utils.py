@@ -163,12 +163,19 @@ def set_score(student, assessment_name, score):
         assessment_name: the name of the assessment.
         score: the student's score.
     """
-    if not student.scores:
-        score_dict = {}
-    else:
-        score_dict = transforms.loads(student.scores)
-    score_dict[str(assessment_name)] = score
-    student.scores = transforms.dumps(score_dict)
+    student.set_scores({assessment_name: score})
+
+
+def set_scores(student, scores_by_assessment):
+    """Stores the scores of several assessments for the given student.
+
+    The caller must call student.put() to commit.
+
+    Args:
+        student: the student whose scores should be stored.
+        scores_by_assessment: dict of assessment name to score.
+    """
+    student.set_scores(scores_by_assessment)
 
 
 def has_score(student, assessment_name):
@@ -178,10 +185,6 @@ def has_score(student, assessment_name):
         student: the student whose answer should be stored.
         assessment_name: the name of the assessment.
     """
-    if not student.scores:
-        return False
-
-    score_dict = transforms.loads(student.scores)
-    return score_dict.has_key(str(assessment_name))
+    return str(assessment_name) in student.get_scores()
 
 
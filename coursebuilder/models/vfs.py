@@ -287,14 +287,43 @@ class VirtualFileSystemTemplateLoader(jinja2.BaseLoader):
             for dir_name in dir_names:
                 self._dir_names.append(AbstractFileSystem.normpath(dir_name))
 
-    def get_source(self, unused_environment, template):
+    def _find(self, template):
         for dir_name in self._dir_names:
             filename = AbstractFileSystem.normpath(
                 os.path.join(dir_name, template))
             stream = self._fs.open(filename)
             if stream:
-                return stream.read().decode('utf-8'), filename, True
-        raise jinja2.TemplateNotFound(template)
+                return filename, stream
+        return None, None
+
+    @classmethod
+    def _get_version(cls, stream):
+        metadata = getattr(stream, 'metadata', None)
+        if not metadata:
+            return None
+        return metadata.updated_on
+
+    def _get_stamp(self):
+        return ProcessScopedVfsCache.instance().generation.get(self._fs.ns)
+
+    def get_source(self, unused_environment, template):
+        # Read the stamp before the file, so that a file saved meanwhile is
+        # loaded again under the next stamp.
+        stamp = self._get_stamp()
+        filename, stream = self._find(template)
+        if not stream:
+            raise jinja2.TemplateNotFound(template)
+        version = self._get_version(stream)
+
+        # Environments are pooled across requests; a compiled template stays
+        # in use until a file of the course changes. Files without metadata,
+        # such as inherited ones, are always loaded again.
+        def uptodate():
+            return (
+                stamp is not None and version is not None and
+                self._get_stamp() == stamp)
+
+        return stream.read().decode('utf-8'), filename, uptodate
 
     def list_templates(self):
         all_templates = []
@@ -306,6 +335,10 @@ class VirtualFileSystemTemplateLoader(jinja2.BaseLoader):
 class ProcessScopedVfsCache(caching.ProcessScopedSingleton):
     """This class holds in-process global cache of VFS objects."""
 
+    # Moved on in a namespace whenever a file in it is saved or deleted.
+    GENERATION_MEMCACHE_KEY = 'vfs-generation'
+    GENERATION_CHECK_INTERVAL_SECS = 5
+
     @classmethod
     def get_vfs_cache_len(cls):
         # pylint: disable=protected-access
@@ -321,6 +354,9 @@ class ProcessScopedVfsCache(caching.ProcessScopedSingleton):
             max_size_bytes=MAX_GLOBAL_CACHE_SIZE_BYTES,
             max_item_size_bytes=MAX_GLOBAL_CACHE_ITEM_SIZE_BYTES)
         self._cache.get_entry_size = self._get_entry_size
+        self._generation = caching.MemcacheGeneration(
+            self.GENERATION_MEMCACHE_KEY,
+            check_interval_secs=self.GENERATION_CHECK_INTERVAL_SECS)
 
     def _get_entry_size(self, key, value):
         return sys.getsizeof(key) + value.getsizeof() if value else 0
@@ -329,6 +365,10 @@ class ProcessScopedVfsCache(caching.ProcessScopedSingleton):
     def cache(self):
         return self._cache
 
+    @property
+    def generation(self):
+        return self._generation
+
 
 VFS_CACHE_LEN = PerfCounter(
     'gcb-models-VfsCacheConnection-cache-len',
@@ -610,6 +650,8 @@ class DatastoreBackedFileSystem(object):
         else:
             content = stream
         self._transactional_put(filename, content, is_draft, metadata_only)
+        # Again once committed, so that nothing read before is kept.
+        self._bump_generation()
 
     @db.transactional(xg=True)
     def _transactional_put(
@@ -685,6 +727,10 @@ class DatastoreBackedFileSystem(object):
 
         metadata.put()
         self.cache.delete(filename)
+        self._bump_generation()
+
+    def _bump_generation(self):
+        ProcessScopedVfsCache.instance().generation.incr(self._ns)
 
     def put_multi_async(self, filedata_list):
         """Initiate an async put of the given files.
@@ -742,11 +788,16 @@ class DatastoreBackedFileSystem(object):
         def wait_and_finalize():
             data_future.check_success()
             metadata_future.check_success()
+            self._bump_generation()
 
         return wait_and_finalize
 
-    @db.transactional(xg=True)
     def delete(self, filename):
+        self._transactional_delete(filename)
+        self._bump_generation()
+
+    @db.transactional(xg=True)
+    def _transactional_delete(self, filename):
         filename = self._logical_to_physical(filename)
         metadata = FileMetadataEntity.get_by_key_name(filename)
         if metadata:
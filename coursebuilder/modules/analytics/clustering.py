@@ -26,6 +26,14 @@ import urllib
 import zlib
 
 from mapreduce import context
+from mapreduce import operation as op
+
+try:
+    import numpy
+except ImportError:
+    # numpy is provided by the App Engine runtime (see app.yaml); dev setups
+    # without it compute cluster distances with plain lists instead.
+    numpy = None
 
 from common import schema_fields
 from controllers import utils
@@ -805,6 +813,188 @@ def hamming_distance(vector, student_vector):
     return distance
 
 
+class ClusterDistances(object):
+    """Hamming distances from student vectors to a fixed list of clusters.
+
+    The values of a student vector are packed in a row with one column per
+    dimension used by any cluster. Each dimension of each cluster is a range
+    check on one column, and the distance of a row to a cluster is the number
+    of the cluster's checks it fails, as in hamming_distance(). All checks of
+    all clusters run at once over a batch of rows.
+
+    Distances greater than max_distance are reported as max_distance + 1.
+    """
+
+    def __init__(self, clusters, max_distance):
+        self.cluster_ids = [cluster['id'] for cluster in clusters]
+        self.max_distance = max_distance
+        self._columns = {}
+        self._checks = []
+        for index, cluster in enumerate(clusters):
+            for dim in cluster['vector']:
+                column = self._columns.setdefault(
+                    (str(dim[DIM_ID]), dim[DIM_TYPE]), len(self._columns))
+                low = float(dim[DIM_LOW]) if _has_left_side(dim) else (
+                    float('-inf'))
+                high = float(dim[DIM_HIGH]) if _has_right_side(dim) else (
+                    float('inf'))
+                self._checks.append((column, low, high, index))
+
+        if numpy:
+            self._check_columns = numpy.array(
+                [check[0] for check in self._checks], dtype=int)
+            self._lows = numpy.array([check[1] for check in self._checks])
+            self._highs = numpy.array([check[2] for check in self._checks])
+            # Sums the failed checks of each cluster.
+            self._check_owners = numpy.zeros(
+                (len(self._checks), len(clusters)), dtype=int)
+            for index, check in enumerate(self._checks):
+                self._check_owners[index, check[3]] = 1
+
+    def pack(self, student_vector):
+        """Returns the row of the vector field of a StudentVector."""
+        row = [0.0] * len(self._columns)
+        seen = set()
+        for dim in student_vector:
+            column = self._columns.get((str(dim[DIM_ID]), dim[DIM_TYPE]))
+            if column is None or column in seen:
+                continue
+            seen.add(column)
+            row[column] = float(dim.get(DIM_VALUE) or 0)
+        return row
+
+    def get_distances(self, rows):
+        """Returns a list with the distances of each row to all clusters."""
+        if not rows:
+            return []
+        outside = self.max_distance + 1
+        if numpy:
+            values = numpy.array(rows, dtype=float).reshape(
+                len(rows), len(self._columns))[:, self._check_columns]
+            failed = (values < self._lows) | (values > self._highs)
+            distances = failed.astype(int).dot(self._check_owners)
+            return numpy.minimum(distances, outside).tolist()
+
+        result = []
+        for row in rows:
+            distances = [0] * len(self.cluster_ids)
+            for column, low, high, index in self._checks:
+                if not low <= row[column] <= high:
+                    distances[index] += 1
+            result.append([min(distance, outside) for distance in distances])
+        return result
+
+
+class ClusterHistogram(object):
+    """Counts of students close to each cluster and to each pair of them.
+
+    within[d][c] is the number of students at distance d or less of cluster
+    c, and pairs_within[d][c1][c2] the number of them at distance d or less
+    of both c1 and c2. Only distances up to max_distance are counted.
+    """
+
+    def __init__(self, num_clusters, max_distance):
+        self.num_clusters = num_clusters
+        self.max_distance = max_distance
+        shape = (max_distance + 1, num_clusters)
+        if numpy:
+            self.within = numpy.zeros(shape, dtype=int)
+            self.pairs_within = numpy.zeros(shape + (num_clusters,), dtype=int)
+        else:
+            self.within = [
+                [0] * num_clusters for _ in xrange(max_distance + 1)]
+            self.pairs_within = [
+                [[0] * num_clusters for _ in xrange(num_clusters)]
+                for _ in xrange(max_distance + 1)]
+
+    def add_distances(self, rows):
+        """Counts rows of distances, as returned by get_distances()."""
+        if not rows:
+            return
+        if numpy:
+            distances = numpy.array(rows, dtype=int).reshape(
+                len(rows), self.num_clusters)
+            for distance in xrange(self.max_distance + 1):
+                close = (distances <= distance).astype(int)
+                self.within[distance] += close.sum(axis=0)
+                self.pairs_within[distance] += close.T.dot(close)
+            return
+
+        for row in rows:
+            close = [
+                (index, distance) for index, distance in enumerate(row)
+                if distance <= self.max_distance]
+            for index, distance in close:
+                for limit in xrange(distance, self.max_distance + 1):
+                    self.within[limit][index] += 1
+            for first, (index1, distance1) in enumerate(close):
+                for index2, distance2 in close[first + 1:]:
+                    for limit in xrange(
+                            max(distance1, distance2), self.max_distance + 1):
+                        self.pairs_within[limit][index1][index2] += 1
+                        self.pairs_within[limit][index2][index1] += 1
+
+    def to_dict(self):
+        if numpy:
+            return {'within': self.within.tolist(),
+                    'pairs_within': self.pairs_within.tolist()}
+        return {'within': self.within, 'pairs_within': self.pairs_within}
+
+    def add(self, histogram_dict):
+        """Adds the counts of another histogram, as returned by to_dict()."""
+        if numpy:
+            self.within += numpy.array(histogram_dict['within'], dtype=int)
+            self.pairs_within += numpy.array(
+                histogram_dict['pairs_within'], dtype=int)
+            return
+
+        for distance in xrange(self.max_distance + 1):
+            for index1 in xrange(self.num_clusters):
+                self.within[distance][index1] += (
+                    histogram_dict['within'][distance][index1])
+                for index2 in xrange(self.num_clusters):
+                    self.pairs_within[distance][index1][index2] += (
+                        histogram_dict['pairs_within'][distance][index1][
+                            index2])
+
+    def get_statistics(self, cluster_ids):
+        """Yields the count and intersection statistics of the clusters.
+
+        They are the ones ClusteringGenerator.reduce() yields: for a cluster
+        that has students, ('count', (cluster_id, distances)), where the
+        i-th number is the number of students at distance i. For a pair of
+        clusters with students in common, ('intersection', ((cluster_id1,
+        cluster_id2), distances)), where the i-th number is the number of
+        students at distance i or less of both. The distances lists stop at
+        the largest distance seen.
+        """
+        histogram_dict = self.to_dict()
+        within = histogram_dict['within']
+        pairs_within = histogram_dict['pairs_within']
+        last = self.max_distance
+        for index, cluster_id in enumerate(cluster_ids):
+            if not within[last][index]:
+                continue
+            counts = [within[0][index]] + [
+                within[distance][index] - within[distance - 1][index]
+                for distance in xrange(1, last + 1)]
+            while not counts[-1]:
+                counts.pop()
+            yield ('count', (cluster_id, counts))
+        for index1, cluster_id1 in enumerate(cluster_ids):
+            for index2 in xrange(index1 + 1, len(cluster_ids)):
+                total = pairs_within[last][index1][index2]
+                if not total:
+                    continue
+                cumulative = []
+                for distance in xrange(last + 1):
+                    cumulative.append(pairs_within[distance][index1][index2])
+                    if cumulative[-1] == total:
+                        break
+                yield ('intersection', (
+                    (cluster_id1, cluster_ids[index2]), cumulative))
+
+
 class ClusteringGenerator(jobs.MapReduceJob):
     """A map reduce job to calculate which students belong to each cluster.
 
@@ -840,6 +1030,19 @@ class ClusteringGenerator(jobs.MapReduceJob):
             'max_distance': getattr(self, 'MAX_DISTANCE', 2)
         }
 
+    # The ClusterDistances of the running job, by mapreduce id.
+    _cluster_distances = {}
+
+    @classmethod
+    def _get_cluster_distances(cls):
+        spec = context.get().mapreduce_spec
+        if spec.mapreduce_id not in cls._cluster_distances:
+            cls._cluster_distances.clear()
+            cls._cluster_distances[spec.mapreduce_id] = ClusterDistances(
+                spec.mapper.params['clusters'],
+                spec.mapper.params['max_distance'])
+        return cls._cluster_distances[spec.mapreduce_id]
+
     @staticmethod
     def map(item):
         """Calculates the distance from the StudentVector to ClusterEntites.
@@ -849,38 +1052,34 @@ class ClusteringGenerator(jobs.MapReduceJob):
 
         Yields:
             Pairs (key, value). There are two types of keys:
-                1.  A cluster id: the value is a tuple (student_id, distance).
-                2.  A pair of clusters ids: the value is a 3-uple
-                    (student_id, distance1, distance2)
-                    distance1 is the distance from the student vector to the
-                    cluster with the first id of the tuple and distance2 is
-                    the distance to the second cluster in the tuple.
-                3.  A string 'student_count' with value 1.
-            One result is yielded for every cluster id and pair of clusters
-            ids. If (cluster1_id, cluster2_id) is yielded, then
-            (cluster2_id, cluster1_id) won't be yielded.
+                1.  'clusters': the value is the list of the distances from
+                    the student vector to all clusters, in the order of the
+                    mapper parameters, with max_distance + 1 for the clusters
+                    that are further away. It is yielded only if the student
+                    is close to some cluster.
+                2.  A string 'student_count' with value 1.
         """
         student = StudentVector.get_by_key_name(item.user_id)
         if student:
-            mapper_params = context.get().mapreduce_spec.mapper.params
-            max_distance = mapper_params['max_distance']
-            clusters = {}
-            item_vector = transforms.loads(student.vector)
-            for cluster in mapper_params['clusters']:
-                distance = hamming_distance(cluster['vector'], item_vector)
-                if distance > max_distance:
-                    continue
-                for cluster2_id, distance2 in clusters.items():
-                    key = transforms.dumps((cluster2_id, cluster['id']))
-                    value = (item.user_id, distance, distance2)
-                    yield (key, transforms.dumps(value))
-                clusters[cluster['id']] = distance
-                to_yield = (item.user_id, distance)
-                yield(cluster['id'], transforms.dumps(to_yield))
-            clusters = transforms.dumps(clusters)
-            StudentClusters(key_name=item.user_id, clusters=clusters).put()
+            distances = ClusteringGenerator._get_cluster_distances()
+            row = distances.get_distances(
+                [distances.pack(transforms.loads(student.vector))])[0]
+            clusters = dict(
+                (cluster_id, distance) for cluster_id, distance in zip(
+                    distances.cluster_ids, row)
+                if distance <= distances.max_distance)
+            yield op.db.Put(StudentClusters(
+                key_name=item.user_id, clusters=transforms.dumps(clusters)))
+            if clusters:
+                yield ('clusters', transforms.dumps(row))
         yield ('student_count', 1)
 
+    @staticmethod
+    def _new_histogram():
+        mapper_params = context.get().mapreduce_spec.mapper.params
+        return ClusterHistogram(
+            len(mapper_params['clusters']), mapper_params['max_distance'])
+
     @staticmethod
     def combine(key, values, previously_combined_outputs=None):
         """Combiner function called before the reducer.
@@ -892,10 +1091,14 @@ class ClusteringGenerator(jobs.MapReduceJob):
             that holds the combined output for other instances for the
             same key."""
         if key != 'student_count':
-            for value in values:
-                yield value
-            for value in previously_combined_outputs:
-                yield value
+            # Rows of distances are counted into a ClusterHistogram, a batch
+            # at a time.
+            histogram = ClusteringGenerator._new_histogram()
+            histogram.add_distances(
+                [transforms.loads(value) for value in values])
+            for value in previously_combined_outputs or []:
+                histogram.add(transforms.loads(value))
+            yield transforms.dumps(histogram.to_dict())
         else:
             total = sum([int(value) for value in values])
             if previously_combined_outputs is not None:
@@ -906,55 +1109,35 @@ class ClusteringGenerator(jobs.MapReduceJob):
     @staticmethod
     def reduce(item_id, values):
         """
-        This function can take two types of item_id (as json string).
-            A number: the values are 2-uples (student_id, distance) and is
-            used to calculate a count statistic.
-            A list: the item_id holds the IDs of two clusters and the value
-            corresponds to 3-uple (student_id, distance1, distance2). The
-            value is used to calculate an intersection stats.
+        This function can take two types of item_id.
+            'clusters': the values are the combined ClusterHistogram of all
+            students, and are used to calculate the count and intersection
+            statistics.
             A string 'student_count': The values is going to be a list of
             partial sums of numbers.
 
         Yields:
             A json string representing a tuple ('stat_name', (item_id,
-            distances)). For count stats, the i-th number in the distances
-            list corresponds to the number of students with distance equal to
-            i to the vector. For intersection, the i-th number in the distance
-            list corresponds to the students with distance less or equal than
-            i to both clusters. item_id is the same item_id received as
-            a parameter, but converted from the json string.
+            distances)). For count stats, the item_id is the id of a cluster
+            and the i-th number in the distances list corresponds to the
+            number of students with distance equal to i to the vector. For
+            intersection, the item_id is a pair of cluster ids and the i-th
+            number in the distance list corresponds to the students with
+            distance less or equal than i to both clusters.
             For the stat student_count the value is a single number
             representing the total number of StudentVector
         """
         if item_id == 'student_count':
             yield (item_id, sum(int(value) for value in values))
         else:
-            item_id = transforms.loads(item_id)
-            distances = collections.defaultdict(lambda: 0)
-            if isinstance(item_id, list):
-                stat_name = 'intersection'
-                for value in values:
-                    value = transforms.loads(value)
-                    # If a student vector has a distance 1 to cluster A
-                    # and distance 3 to cluster B, then it has a
-                    # distance of 3 (the greater) to the intersection
-                    intersection_distance = max(value[1], value[2])
-                    distances[intersection_distance] += 1
-                item_id = tuple(item_id)
-            else:
-                stat_name = 'count'
-                for value in values:
-                    value = transforms.loads(value)
-                    distances[value[1]] += 1
-            distances = dict(distances)
-            list_distances = [0] * (max([int(k) for k in distances]) + 1)
-            for distance, count in distances.items():
-                list_distances[int(distance)] = count
-            if stat_name == 'intersection':
-                # Accumulate the distances.
-                for index in range(1, len(list_distances)):
-                    list_distances[index] += list_distances[index - 1]
-            yield transforms.dumps((stat_name, (item_id, list_distances)))
+            histogram = ClusteringGenerator._new_histogram()
+            for value in values:
+                histogram.add(transforms.loads(value))
+            cluster_ids = [
+                cluster['id'] for cluster in
+                context.get().mapreduce_spec.mapper.params['clusters']]
+            for statistic in histogram.get_statistics(cluster_ids):
+                yield transforms.dumps(statistic)
 
 
 class TentpoleStudentVectorDataSource(data_sources.SynchronousQuery):
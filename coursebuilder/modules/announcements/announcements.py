@@ -265,9 +265,12 @@ class AnnouncementsItemRESTHandler(BaseRESTHandler):
     @classmethod
     def get_send_email_description(cls, announcement_email):
         """Get the description for Send Email field."""
+        description = (
+            'Email will be sent to the enrolled students with any of the '
+            'labels of the announcement, or to all of them if it has none')
         if announcement_email:
-            return 'Email will be sent to : ' + announcement_email
-        return 'Announcement list not configured.'
+            return '%s, and to : %s' % (description, announcement_email)
+        return description + '.'
 
     def get(self):
         """Handles REST GET verb and returns an object as JSON payload."""
@@ -347,14 +350,14 @@ class AnnouncementsItemRESTHandler(BaseRESTHandler):
         email_sent = False
         if entity.send_email:
             email_manager = notify.EmailManager(self.get_course())
-            email_sent = email_manager.send_announcement(
+            email_sent = email_manager.send_announcement_to_students(
+                entity.title, entity.html, ANNOUNCEMENTS_INTENT,
+                label_ids=utils.text_to_list(entity.labels))
+            email_manager.send_announcement(
                 entity.title, entity.html, intent=ANNOUNCEMENTS_INTENT)
 
         if entity.send_email and not email_sent:
-            if not self.get_course().get_course_announcement_list_email():
-                message = 'Saved. Announcement list not configured.'
-            else:
-                message = 'Saved, but there was an error sending email.'
+            message = 'Saved, but there was an error sending email.'
         else:
             message = 'Saved.'
         transforms.send_json_response(self, 200, message)
@@ -141,6 +141,10 @@ class QuestionTag(tags.BaseTag):
     def vendor(cls):
         return 'gcb'
 
+    def prefetch(self, nodes):
+        m_models.QuestionDAO.prefetch(
+            [node.attrib.get('quid') for node in nodes])
+
     def render(self, node, handler):
         """Renders a question."""
 
@@ -203,6 +207,10 @@ class QuestionGroupTag(tags.BaseTag):
     def vendor(cls):
         return 'gcb'
 
+    def prefetch(self, nodes):
+        m_models.QuestionGroupDAO.prefetch(
+            [node.attrib.get('qgid') for node in nodes])
+
     def render(self, node, handler):
         """Renders a question."""
 
@@ -211,6 +219,8 @@ class QuestionGroupTag(tags.BaseTag):
         question_group_dto = m_models.QuestionGroupDAO.load(qgid)
         if not question_group_dto:
             return tags.html_string_to_element_tree('[Deleted question group]')
+        m_models.QuestionDAO.prefetch(
+            [item['question'] for item in question_group_dto.dict['items']])
 
         template_values = question_group_dto.dict
         template_values['embedded'] = False
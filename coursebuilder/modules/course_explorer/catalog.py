@@ -0,0 +1,234 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshot of the courses and categories listed by the course explorer.
+
+Explorer pages used to query the course list and the categories, then read
+the settings of every course from its app context, on every page view. The
+snapshot holds what the pages need of each course as a plain CatalogCourse,
+and is shared by all requests of a process and, through memcache, by all
+instances. It is rebuilt when the course list or the categories change.
+
+Pages decorate copies of the courses with the state of the current student,
+so the shared snapshot is never changed by a request.
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import collections
+import copy
+import threading
+import time
+
+import appengine_config
+from common import caching
+from controllers import sites
+from models import counters
+from models import course_category
+from models import course_list
+from models.models import MemcacheManager
+from models.roles import Roles
+
+COUNTER_CATALOG_BUILT = counters.PerfCounter(
+    'gcb-course-explorer-catalog-built',
+    'number of times the course explorer catalog was built from the courses')
+COUNTER_CATALOG_MEMCACHE_HIT = counters.PerfCounter(
+    'gcb-course-explorer-catalog-memcache-hit',
+    'number of times the course explorer catalog was loaded from memcache')
+
+
+class CatalogCourse(object):
+    """What the explorer pages show of a course, without its app context."""
+
+    FIELDS = (
+        'allowlist', 'blurb', 'browsable', 'can_register', 'category',
+        'course_admin_email', 'course_preview_url', 'featured', 'namespace',
+        'now_available', 'registration', 'should_list', 'slug', 'title')
+
+    def __init__(self, **kwargs):
+        for name in self.FIELDS:
+            setattr(self, name, kwargs.get(name))
+        self.is_registered = False
+        self.is_completed = False
+
+    @classmethod
+    def from_app_context(cls, app_context):
+        slug = app_context.get_slug()
+        return cls(
+            allowlist=(app_context.allowlist or '').strip(),
+            blurb=app_context.blurb,
+            browsable=app_context.browsable,
+            can_register=app_context.can_register,
+            category=app_context.category,
+            course_admin_email=app_context.course_admin_email or '',
+            course_preview_url='/course' if slug == '/' else slug,
+            featured=app_context.featured,
+            namespace=app_context.get_namespace_name(),
+            now_available=app_context.now_available,
+            registration=app_context.registration,
+            should_list=app_context.should_list,
+            slug=slug,
+            title=app_context.title)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.FIELDS)
+
+    def get_namespace_name(self):
+        return self.namespace
+
+    def for_student(self, is_registered, is_completed):
+        """Returns a copy of this course with the state of a student."""
+        course = copy.copy(self)
+        course.is_registered = is_registered
+        course.is_completed = is_completed
+        return course
+
+
+class CourseCatalog(object):
+    """The courses and categories of the course explorer."""
+
+    def __init__(self, courses, categories):
+        self.courses = courses
+        self.categories = categories
+        self.category_defs = dict(
+            (category, description)
+            for category, description, _ in categories)
+        self.category_menu = collections.OrderedDict(sorted(
+            ((category, description)
+             for category, description, visible in categories if visible),
+            key=lambda item: item[1]))
+
+    @classmethod
+    def build(cls):
+        COUNTER_CATALOG_BUILT.inc()
+        courses = [
+            CatalogCourse.from_app_context(app_context)
+            for app_context in sites.get_all_courses()]
+        categories = [
+            (category.category, category.description, category.visible)
+            for category in (
+                course_category.CourseCategoryDAO.get_category_list())]
+        return cls(courses, categories)
+
+    def get_public_courses(self):
+        """Returns the courses the current user may see, in catalog order."""
+        if Roles.is_super_admin():
+            return list(self.courses)
+        return [
+            course for course in self.courses
+            if (course.now_available and Roles.is_user_allowlisted(course)) or
+            Roles.is_course_admin(course)]
+
+
+class CourseCatalogCache(caching.ProcessScopedSingleton):
+    """The CourseCatalog, shared by the requests of a process.
+
+    Changes made by this process are seen immediately; changes made by other
+    instances are noticed through the version stamps of the course list and
+    of the categories, which are polled at most every
+    VERSION_CHECK_INTERVAL_SECS. Courses defined in the courses config rather
+    than in the course list have no version stamp, so in that case the
+    catalog is built for every request.
+    """
+
+    VERSION_CHECK_INTERVAL_SECS = 5
+    MEMCACHE_KEY_PREFIX = 'course-explorer-catalog'
+    # Courses are stored in memcache in chunks so that no value is too big.
+    MEMCACHE_CHUNK_SIZE = 100
+    MEMCACHE_NAMESPACE = appengine_config.DEFAULT_NAMESPACE_NAME
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._versions = None
+        self._local_versions = None
+        self._version_checked_on = 0
+
+    @classmethod
+    def _get_local_versions(cls):
+        return (course_list.CourseListDAO.get_local_version(),
+                course_category.CourseCategoryDAO.get_local_version())
+
+    @classmethod
+    def _get_versions(cls):
+        return (course_list.CourseListDAO.get_version(),
+                course_category.CourseCategoryDAO.get_version())
+
+    @classmethod
+    def _memcache_key(cls, versions, chunk=None):
+        key = '%s:%s:%s' % ((cls.MEMCACHE_KEY_PREFIX,) + tuple(versions))
+        if chunk is not None:
+            key = '%s:%s' % (key, chunk)
+        return key
+
+    def get(self):
+        if not sites.USE_COURSE_LIST.value:
+            return CourseCatalog.build()
+
+        now = time.time()
+        local_versions = self._get_local_versions()
+        with self._lock:
+            catalog = self._catalog
+            if (catalog and local_versions == self._local_versions and
+                now - self._version_checked_on <
+                self.VERSION_CHECK_INTERVAL_SECS):
+                return catalog
+
+        versions = self._get_versions()
+        if (not catalog or versions != self._versions or
+            local_versions != self._local_versions):
+            catalog = self._load(versions)
+            if catalog is None:
+                catalog = CourseCatalog.build()
+                self._save(versions, catalog)
+        with self._lock:
+            self._catalog = catalog
+            self._versions = versions
+            self._local_versions = local_versions
+            self._version_checked_on = now
+        return catalog
+
+    def _load(self, versions):
+        manifest = MemcacheManager.get(
+            self._memcache_key(versions), namespace=self.MEMCACHE_NAMESPACE)
+        if manifest is None:
+            return None
+        keys = [
+            self._memcache_key(versions, chunk)
+            for chunk in xrange(manifest['num_chunks'])]
+        chunks = MemcacheManager.get_multi(
+            keys, namespace=self.MEMCACHE_NAMESPACE)
+        if len(chunks) != len(keys):
+            return None
+        COUNTER_CATALOG_MEMCACHE_HIT.inc()
+        courses = [
+            CatalogCourse(**record)
+            for key in keys for record in chunks[key]]
+        return CourseCatalog(courses, manifest['categories'])
+
+    def _save(self, versions, catalog):
+        records = [course.to_dict() for course in catalog.courses]
+        chunks = {}
+        for start in xrange(0, len(records), self.MEMCACHE_CHUNK_SIZE):
+            chunks[self._memcache_key(
+                versions, start / self.MEMCACHE_CHUNK_SIZE)] = (
+                    records[start:start + self.MEMCACHE_CHUNK_SIZE])
+        # Chunks go first, so a manifest is never seen without them.
+        for key, chunk in chunks.iteritems():
+            MemcacheManager.set(key, chunk, namespace=self.MEMCACHE_NAMESPACE)
+        MemcacheManager.set(
+            self._memcache_key(versions), {
+                'categories': catalog.categories,
+                'num_chunks': len(chunks)},
+            namespace=self.MEMCACHE_NAMESPACE)
@@ -19,7 +19,6 @@ __author__ = 'Rahul Singal (rahulsingal@google.com)'
 import mimetypes
 import os
 import random
-from collections import OrderedDict
 
 import course_explorer
 import webapp2
@@ -35,10 +34,10 @@ from controllers.utils import ReflectiveRequestHandler
 from controllers.utils import XsrfTokenManager
 from gae_mini_profiler import templatetags
 from models import courses as Courses
-from models import course_category
 from models import transforms
 from models.models import StudentProfileDAO
 from models.roles import Roles
+from modules.course_explorer import catalog as course_catalog
 from modules.course_explorer import layout as page_layout
 from modules.course_explorer import settings
 
@@ -82,8 +81,16 @@ class BaseStudentHandler(CBRequestHandler):
     def __init__(self, *args, **kwargs):
         super(BaseStudentHandler, self).__init__(*args, **kwargs)
         self.template_value = {}
+        self._catalog = None
         self.initialize_student_state()
 
+    @property
+    def catalog(self):
+        """The snapshot of listed courses and categories; see catalog.py."""
+        if self._catalog is None:
+            self._catalog = course_catalog.CourseCatalogCache.instance().get()
+        return self._catalog
+
     def get_locale_for_user(self):
         """Chooses locale for a user."""
         return 'en_US'  # TODO(psimakov): choose proper locale from profile
@@ -113,12 +120,7 @@ class BaseStudentHandler(CBRequestHandler):
 
     def get_public_courses(self):
         """Get all the public courses."""
-        public_courses = []
-        for course in sites.get_all_courses():
-            if ((course.now_available and Roles.is_user_allowlisted(course))
-                or Roles.is_course_admin(course)):
-                public_courses.append(course)
-        return public_courses
+        return self.catalog.get_public_courses()
 
     def get_listable_courses(self):
         """Get all the public courses."""
@@ -141,16 +143,9 @@ class BaseStudentHandler(CBRequestHandler):
         return False
 
     def get_course_info(self, course):
-        """Returns course info required in views."""
-        course_preview_url = course.slug
-        if course.slug == '/':
-            course_preview_url = '/course'
-        course.course_preview_url = course_preview_url
-        course.is_registered = self.is_enrolled(course)
-        course.is_completed = self.is_completed(course)
-
-
-        return course
+        """Returns a copy of a catalog course with the student's state."""
+        return course.for_student(
+            self.is_enrolled(course), self.is_completed(course))
 
     def get_enrolled_courses(self, courses):
         """Returns list of courses registered by student."""
@@ -311,13 +306,8 @@ class SearchCourseHandler(BaseStudentHandler):
         """Handles GET requests."""
         category_key = self.request.get('category')
         category_name = ''
-        category_list = course_category.CourseCategoryDAO.get_category_list()
-        category_defs = dict()
-        category_menu_list = dict()
-        for categ in category_list:
-            category_defs[categ.category] = categ.description
-            if categ.visible:
-                category_menu_list[categ.category] = categ.description
+        category_defs = self.catalog.category_defs
+        category_menu_list = self.catalog.category_menu
 
         if category_key in category_defs:
             category_name = category_defs[category_key]
@@ -340,20 +330,13 @@ class SearchCourseHandler(BaseStudentHandler):
 
         for course in listable_courses:
             if (course.category == category_key or category_key == 'all') \
-                            and course.category in category_menu_list.keys():
-                course.course_preview_url = course.course_preview_url
-                course.is_registered = self.is_enrolled(course)
-                course.is_completed = self.is_completed(course)
+                            and course.category in category_menu_list:
                 setSortStatus(course)
                 course_by_search_filter.append(course)
 
-        #sort the category_menu_list
-        category_menu_list_ordered = OrderedDict(sorted(category_menu_list.items(), key=lambda t: t[1]))
-
-
         self.template_value['category_key'] = category_key
         self.template_value['category_name'] = category_name
-        self.template_value['category_menu_list'] = category_menu_list_ordered
+        self.template_value['category_menu_list'] = category_menu_list
         self.template_value['course_by_search_filter'] = course_by_search_filter
         self.template_value['html_hooks'] = NullHtmlHooks()
         self.template_value['navbar'] = {'course_explorer': True, 'search_course':True }
@@ -385,29 +368,18 @@ class AllCoursesHandler(BaseStudentHandler):
         layout = page_layout.ExplorerLayoutDAO.get_layout()
         category_order = layout.category_order
 
-        category_list = course_category.CourseCategoryDAO.get_category_list()
-        category_defs = dict()
-        category_menu_list = dict()
-        for categ in category_list:
-            category_defs[categ.category] = categ.description
-            if categ.visible:
-                category_menu_list[categ.category] = categ.description
+        category_defs = self.catalog.category_defs
+        category_menu_list = self.catalog.category_menu
 
         course_groups = dict()
         for co in category_order:
-            if co in category_defs.keys():
+            if co in category_defs:
                 course_groups[co] = []
 
-
-        featured_courses_can_register = []
-        featured_courses_others = []
         for course in listable_courses:
-            course.course_preview_url = course.course_preview_url
-            course.is_registered = self.is_enrolled(course)
-            course.is_completed = self.is_completed(course)
-            if course.allowlist.strip():
+            if course.allowlist:
                 allowlisted_courses.append(course)
-            elif course.category in course_groups.keys():
+            elif course.category in course_groups:
                 course_groups[course.category].append(course)
                 if course.featured:
                     setSortStatus(course)
@@ -418,15 +390,11 @@ class AllCoursesHandler(BaseStudentHandler):
         #shuffle the fetaured courses
         random.shuffle(featured_courses)
 
-        #sort the category_menu_list
-        category_menu_list_ordered = OrderedDict(
-             sorted(category_menu_list.items(), key=lambda t: t[1]))
-
         if allowlisted_courses:
             self.template_value['allowlisted_courses'] = allowlisted_courses
         self.template_value['layout'] = layout
         self.template_value['category_defs'] = category_defs
-        self.template_value['category_menu_list'] = category_menu_list_ordered
+        self.template_value['category_menu_list'] = category_menu_list
         self.template_value['course_groups'] = course_groups
         self.template_value['featured_courses'] = featured_courses
         self.template_value['html_hooks'] = NullHtmlHooks()
@@ -454,22 +422,19 @@ class RegisteredCoursesHandler(BaseStudentHandler):
         layout = page_layout.ExplorerLayoutDAO.get_layout()
         category_order = layout.category_order
 
-        category_list = course_category.CourseCategoryDAO.get_category_list()
-        category_defs = dict()
-        for categ in category_list:
-            category_defs[categ.category] = categ.description
+        category_defs = self.catalog.category_defs
 
         course_groups = dict()
         for co in category_order:
-            if co in category_defs.keys():
+            if co in category_defs:
                 course_groups[co] = []
 
         enrolled_courses = self.get_enrolled_courses(courses)
         allowlisted_courses = []
         for course in enrolled_courses:
-            if course.allowlist.strip():
+            if course.allowlist:
                 allowlisted_courses.append(course)
-            elif course.category in course_groups.keys():
+            elif course.category in course_groups:
                 course_groups[course.category].append(course)
             else:
                 continue
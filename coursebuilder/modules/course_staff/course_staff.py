@@ -16,6 +16,8 @@
 
 __author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
 
+import random
+
 from models.entities import BaseEntity
 from google.appengine.ext import db
 
@@ -27,6 +29,9 @@ class CourseStaff(BaseEntity):
     can_grade = db.BooleanProperty(indexed=True)
     can_override = db.BooleanProperty(indexed=False)
 
+    # Counts as of the last FixNumAssigned run, or as kept before the
+    # counts moved to CourseStaffCounterShard. Use get_counts() to read the
+    # current counts and increment_counts() to change them.
     num_graded = db.IntegerProperty(default=0, indexed=True)
     num_assigned = db.IntegerProperty(default=0, indexed=True)
 
@@ -75,3 +80,67 @@ class CourseStaff(BaseEntity):
         """Loads programming answer entity."""
         key = cls.create_key(user_id)
         return cls.get_by_key_name(key)
+
+    @classmethod
+    def increment_counts(cls, user_id, num_assigned=0, num_graded=0):
+        """Adds to the number of submissions assigned to and graded by staff.
+
+        The change is written to one of the staff member's counter shards,
+        picked at random, so that submissions being assigned concurrently to
+        the same evaluator do not contend on a single entity. Runs in the
+        current transaction if there is one, in a new one otherwise.
+        """
+        key_name = CourseStaffCounterShard.key_name(
+            user_id, random.randrange(CourseStaffCounterShard.NUM_SHARDS))
+
+        def _update():
+            shard = CourseStaffCounterShard.get_by_key_name(key_name)
+            if not shard:
+                shard = CourseStaffCounterShard(
+                    key_name=key_name, user_id=user_id)
+            shard.num_assigned += num_assigned
+            shard.num_graded += num_graded
+            shard.put()
+
+        if db.is_in_transaction():
+            _update()
+        else:
+            db.run_in_transaction(_update)
+
+    @classmethod
+    def get_counts(cls, staff_list):
+        """Returns {user_id: (num_assigned, num_graded)} for course staff."""
+        counts = dict(
+            (cs.user_id, [cs.num_assigned or 0, cs.num_graded or 0])
+            for cs in staff_list)
+        query = CourseStaffCounterShard.all()
+        if len(counts) == 1:
+            query.filter('user_id =', counts.keys()[0])
+        for shard in query.run(batch_size=1000):
+            if shard.user_id in counts:
+                counts[shard.user_id][0] += shard.num_assigned
+                counts[shard.user_id][1] += shard.num_graded
+        return dict(
+            (user_id, tuple(user_counts))
+            for user_id, user_counts in counts.iteritems())
+
+
+class CourseStaffCounterShard(BaseEntity):
+    """Part of the assigned and graded counts of a course staff member."""
+    NUM_SHARDS = 8
+
+    user_id = db.StringProperty(indexed=True)
+    num_assigned = db.IntegerProperty(default=0, indexed=False)
+    num_graded = db.IntegerProperty(default=0, indexed=False)
+
+    _PROPERTY_EXPORT_DENYLIST = [user_id]
+
+    @classmethod
+    def key_name(cls, user_id, shard):
+        return '%s:%s' % (user_id, shard)
+
+    @classmethod
+    def safe_key(cls, db_key, transform_fn):
+        user_id, shard = db_key.name().rsplit(':', 1)
+        return db.Key.from_path(
+            cls.kind(), cls.key_name(transform_fn(user_id), shard))
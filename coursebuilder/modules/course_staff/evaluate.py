@@ -189,6 +189,10 @@ class EvaluationHandler(BaseHandler, ReflectiveRequestHandler):
             return
 
         self.template_value['evaluator'] = evaluator
+        num_assigned, num_graded = course_staff.CourseStaff.get_counts(
+            [evaluator])[evaluator.user_id]
+        self.template_value['num_assigned'] = num_assigned
+        self.template_value['num_graded'] = num_graded
         self.template_value['navbar'] = {'course': True}
         self.template_value['base'] = self.get_template('base_course.html')
         self.template_value['course_navbar'] = self.get_template('course_navbar.html')
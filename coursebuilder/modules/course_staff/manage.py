@@ -22,6 +22,7 @@ import jinja2
 from common import safe_dom
 from models import models
 from modules.course_staff import base
+from modules.manual_review import allocator
 from modules.manual_review import assign
 
 import course_staff
@@ -76,6 +77,8 @@ class CourseStaffDashboardHandler(base.CourseStaffBase):
                 cs.email = email
                 cs.put()
                 added_course_staff_list.append(email)
+        if added_course_staff_list:
+            allocator.EvaluatorAllocator.instance().invalidate()
 
         content = safe_dom.NodeList()
         if len(added_course_staff_list) > 0:
@@ -114,6 +117,7 @@ class CourseStaffDashboardHandler(base.CourseStaffBase):
         p = course_staff.CourseStaff.get(course_staff_id)
         if p:
             p.delete()
+            allocator.EvaluatorAllocator.instance().invalidate()
             # Reassign all associated ManualReviewStep objects.
             job = assign.ReassignSubmissionByCourseStaff(
                 handler.app_context, [course_staff_id])
@@ -130,6 +134,7 @@ class CourseStaffDashboardHandler(base.CourseStaffBase):
         if p:
             p.can_grade = False
             p.put()
+            allocator.EvaluatorAllocator.instance().invalidate()
 	handler.redirect(handler.get_action_url(
             cls.DASHBOARD_NAV,
             extra_args={'tab': cls.DASHBOARD_SHOW_LIST_TAB}))
@@ -142,6 +147,7 @@ class CourseStaffDashboardHandler(base.CourseStaffBase):
         if p:
             p.can_grade = True
             p.put()
+            allocator.EvaluatorAllocator.instance().invalidate()
 	handler.redirect(handler.get_action_url(
             cls.DASHBOARD_NAV,
             extra_args={'tab': cls.DASHBOARD_SHOW_LIST_TAB}))
@@ -91,6 +91,7 @@ def register_module():
     custom_module = custom_modules.Module(
         'Course',
         'A set of pages for delivering an online course.',
-        [], courses_routes,
+        [(lessons.EventsFlushHandler.URL, lessons.EventsFlushHandler)],
+        courses_routes,
         notify_module_enabled=on_module_enabled)
     return custom_module
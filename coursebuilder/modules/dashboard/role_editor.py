@@ -18,6 +18,7 @@ __author__ = 'Glenn De Jonghe (gdejonghe@google.com)'
 
 from common import schema_fields
 from common import utils
+from models.models import MemcacheManager
 from models.models import RoleDAO
 from models.roles import Roles
 from modules.dashboard import dto_editor
@@ -199,3 +200,4 @@ class RoleRESTHandler(dto_editor.BaseDatastoreRestHandler):
 
     def after_save_hook(self):
         Roles.update_permissions_map()
+        MemcacheManager.invalidate_l1([Roles.memcache_key])
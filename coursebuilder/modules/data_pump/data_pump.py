@@ -23,6 +23,7 @@ import collections
 import copy
 import datetime
 import logging
+import math
 import os
 import random
 import re
@@ -92,6 +93,12 @@ CONSECUTIVE_FAILURES = 'consecutive_failures'
 FAILURE_REASON = 'failure_reason'
 ITEMS_UPLOADED = 'items_uploaded'
 PII_SECRET = 'pii_secret'
+KEY_RANGES_BEFORE_PAGE = 'key_ranges_before_page'
+KEY_RANGES_AFTER_PAGE = 'key_ranges_after_page'
+
+# Number of key ranges DB tables are split into, so that each page of the
+# upload is read from all of them in parallel.
+NUM_KEY_RANGES = 8
 
 # Constants for items within course settings schema
 DATA_PUMP_SETTINGS_SCHEMA_SECTION = 'data_pump'
@@ -199,9 +206,26 @@ class DataPumpJob(jobs.DurableJobBase):
             FAILURE_REASON: '',
             ITEMS_UPLOADED: 0,
             PII_SECRET: pii_secret,
+            KEY_RANGES_BEFORE_PAGE: None,
+            KEY_RANGES_AFTER_PAGE: None,
             }
         return job_context
 
+    def _start_key_ranges(self, app_context, data_source_context,
+                          job_context):
+        """Split DB tables into key ranges read from in parallel.
+
+        Only plain table dumps are split; sources with filters or orderings
+        keep paging through the table with cursors.
+        """
+        data_source_class = _get_data_source_class_by_name(
+            self._data_source_class_name)
+        if (not hasattr(data_source_class, 'build_key_ranges') or
+            data_source_context.filters or data_source_context.orderings):
+            return
+        job_context[KEY_RANGES_AFTER_PAGE] = (
+            data_source_class.build_key_ranges(app_context, NUM_KEY_RANGES))
+
     def _load_state(self, job, sequence_num):
         if job.sequence_num != sequence_num:
             raise ValueError(
@@ -846,24 +870,7 @@ class DataPumpJob(jobs.DurableJobBase):
             data, _ = data_source_class.fetch_values(
                 app_context, data_source_context, schema, catch_and_log_,
                 next_page, *required_jobs)
-
-            # BigQuery has a somewhat unfortunate design: It does not attempt
-            # to parse/validate the data we send until all data has been
-            # uploaded and the upload has been declared a "success".  Rather
-            # than having to poll for an indefinite amount of time until the
-            # upload is parsed, we validate that the sent items exactly match
-            # the declared schema.  Somewhat expensive, but better than having
-            # completely unreported hidden failures.
-            for index, item in enumerate(data):
-                complaints = transforms.validate_object_matches_json_schema(
-                    item, schema)
-                if complaints:
-                    raise ValueError(
-                        'Data in item to pump does not match schema!  ' +
-                        'Item is item number %d ' % index +
-                        'on data page %d. ' % next_page +
-                        'Problems for this item are:\n' +
-                        '\n'.join(complaints))
+            self._validate_page_data(data, schema, next_page)
 
             if (data_source_class.get_default_chunk_size() == 0 or
                 not hasattr(data_source_context, 'chunk_size') or
@@ -887,6 +894,57 @@ class DataPumpJob(jobs.DurableJobBase):
                     is_last_page = True
             return data, is_last_page
 
+    def _fetch_key_range_page_data(self, app_context, data_source_context,
+                                   job_context, next_page):
+        """Get the next page of data from each key range of a DB table.
+
+        Each page takes about chunk_size items, spread over the key ranges
+        not yet exhausted.  The positions of the ranges before and after
+        the page are kept in the job context, so that a page BigQuery did
+        not receive completely can be read again.
+        """
+        data_source_class = _get_data_source_class_by_name(
+            self._data_source_class_name)
+        catch_and_log_ = catch_and_log.CatchAndLog()
+        with catch_and_log_.propagate_exceptions('Loading page of data'):
+            schema = data_source_class.get_schema(app_context, catch_and_log_,
+                                                  data_source_context)
+            if next_page == job_context[LAST_PAGE_SENT]:
+                positions = job_context[KEY_RANGES_BEFORE_PAGE]
+            else:
+                positions = job_context[KEY_RANGES_AFTER_PAGE]
+            num_active = len([p for p in positions if not p['done']])
+            limit = int(math.ceil(
+                float(data_source_context.chunk_size) / max(1, num_active)))
+            data, new_positions = data_source_class.fetch_key_ranges(
+                app_context, data_source_context, schema, catch_and_log_,
+                positions, limit)
+            self._validate_page_data(data, schema, next_page)
+
+            job_context[KEY_RANGES_BEFORE_PAGE] = positions
+            job_context[KEY_RANGES_AFTER_PAGE] = new_positions
+            is_last_page = all(p['done'] for p in new_positions)
+            return data, is_last_page
+
+    def _validate_page_data(self, data, schema, next_page):
+        # BigQuery has a somewhat unfortunate design: It does not attempt
+        # to parse/validate the data we send until all data has been
+        # uploaded and the upload has been declared a "success".  Rather
+        # than having to poll for an indefinite amount of time until the
+        # upload is parsed, we validate that the sent items exactly match
+        # the declared schema.  Somewhat expensive, but better than having
+        # completely unreported hidden failures.
+        validate = transforms.get_json_schema_validator(schema)
+        for index, item in enumerate(data):
+            complaints = validate(item)
+            if complaints:
+                raise ValueError(
+                    'Data in item to pump does not match schema!  ' +
+                    'Item is item number %d ' % index +
+                    'on data page %d. ' % next_page +
+                    'Problems for this item are:\n' +
+                    '\n'.join(complaints))
+
     def _send_next_page(self, sequence_num, job):
         """Coordinate table setup, job setup, sending pages of data."""
 
@@ -906,6 +964,8 @@ class DataPumpJob(jobs.DurableJobBase):
                 bigquery_service, bigquery_settings, http, app_context,
                 data_source_context)
             job_context = self._build_job_context(upload_url, pii_secret)
+            self._start_key_ranges(app_context, data_source_context,
+                                   job_context)
         else:
             job_context, data_source_context = self._load_state(
                 job, sequence_num)
@@ -921,8 +981,13 @@ class DataPumpJob(jobs.DurableJobBase):
         # able to send a page now.
         next_page, next_state = self._check_upload_state(http, job_context)
         if next_page is not None:
-            data, is_last_chunk = self._fetch_page_data(
-                app_context, data_source_context, next_page)
+            # Jobs started before key ranges were introduced have none.
+            if job_context.get(KEY_RANGES_AFTER_PAGE):
+                data, is_last_chunk = self._fetch_key_range_page_data(
+                    app_context, data_source_context, job_context, next_page)
+            else:
+                data, is_last_chunk = self._fetch_page_data(
+                    app_context, data_source_context, next_page)
             next_state = self._send_data_page_to_bigquery(
                 data, is_last_chunk, next_page,
                 http, job, sequence_num, job_context, data_source_context)
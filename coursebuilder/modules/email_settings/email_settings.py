@@ -277,9 +277,22 @@ def create_queue_settings_registry():
         extra_schema_dict_values={
             'className': 'inputEx-Field assessment-dropdown'}))
 
+    reg.add_property(SchemaField(
+        'max_emails_per_second', 'Max Emails Per Second', 'integer',
+        optional=True, description='Bulk notifications on this queue are '
+        'spread out to send at most this many emails per second. Leave '
+        'empty for no limit.'))
+
     return reg
 
 
+def _get_max_emails_per_second(entity_dict):
+    value = entity_dict.get('max_emails_per_second')
+    if value in (None, ''):
+        return None
+    return max(1, int(value))
+
+
 
 
 class AddNewQueueSettingsRESTHandler(BaseRESTHandler):
@@ -317,6 +330,7 @@ class AddNewQueueSettingsRESTHandler(BaseRESTHandler):
         entity = {
             'queue_id':'',
             'email_settings':'',
+            'max_emails_per_second': None,
             }
         json_entity = dict()
         self.registration().convert_entity_to_json_entity(entity, json_entity)
@@ -334,7 +348,9 @@ class AddNewQueueSettingsRESTHandler(BaseRESTHandler):
 
         esettings = email_settings_model.EmailSettings.get_by_id(email_settings)
         if esettings:
-            email_settings_model.QueueSettingsDAO.add_new_queue_settings(queue_id, esettings.key, errors=errors)
+            email_settings_model.QueueSettingsDAO.add_new_queue_settings(
+                queue_id, esettings.key, errors=errors,
+                max_emails_per_second=_get_max_emails_per_second(entity_dict))
         else:
             errors.append(
                 'Unable to find EmailSettings. Entry with the '
@@ -667,7 +683,8 @@ class QueueSettingsRESTHandler(BaseRESTHandler):
 
         entity = {
             'queue_id':l.queue_id,
-            'email_settings':l.email_settings.unique_name
+            'email_settings':l.email_settings.unique_name,
+            'max_emails_per_second': l.max_emails_per_second,
             }
 
         json_entity = dict()
@@ -685,7 +702,9 @@ class QueueSettingsRESTHandler(BaseRESTHandler):
         email_settings = entity_dict['email_settings']
         esettings = email_settings_model.EmailSettings.get_by_id(email_settings)
         if esettings:
-            email_settings_model.QueueSettingsDAO.update_queue_settings(queue_id, esettings.key, errors=errors)
+            email_settings_model.QueueSettingsDAO.update_queue_settings(
+                queue_id, esettings.key, errors=errors,
+                max_emails_per_second=_get_max_emails_per_second(entity_dict))
         else:
             errors.append(
                 'Unable to find EmailSettings. Entry with the '
@@ -140,6 +140,9 @@ class EmailSettingsDAO(object):
 class QueueSettings(ndb.Model):
     """Email Settings"""
     email_settings = ndb.KeyProperty(kind=EmailSettings)
+    # Bulk notifications on this queue are spread out so that no more than
+    # this many emails are sent per second on average. None means no limit.
+    max_emails_per_second = ndb.IntegerProperty(indexed=False)
 
     @property
     def queue_id(self):
@@ -152,8 +155,10 @@ class QueueSettingsDTO(object):
     def __init__(self, queue=None):
         self.queue_id = None
         self.email_settings = None
+        self.max_emails_per_second = None
         if queue:
             self.queue_id = queue.queue_id
+            self.max_emails_per_second = queue.max_emails_per_second
             self.email_settings = EmailSettingsDAO.get_email_settings_by_key(queue.email_settings.id())
 
 
@@ -199,19 +204,23 @@ class QueueSettingsDAO(object):
 
     @classmethod
     @ndb.transactional()
-    def add_new_queue_settings(cls, queue_id, email_settings, errors):
+    def add_new_queue_settings(cls, queue_id, email_settings, errors,
+                               max_emails_per_second=None):
         with Namespace(cls.TARGET_NAMESPACE):
             if cls.get_queue_settings_by_key(queue_id):
                 errors.append(
                     'Unable to add new QueueSettings. Entry with the '
                     'same key \'%s\' already exists.' % queue)
                 return
-            settings = QueueSettings(id=queue_id,email_settings=email_settings)
+            settings = QueueSettings(
+                id=queue_id, email_settings=email_settings,
+                max_emails_per_second=max_emails_per_second)
             settings = settings.put()
             models.MemcacheManager.delete(cls.list_memcache_key, namespace=cls.TARGET_NAMESPACE)
 
     @classmethod
-    def update_queue_settings(cls, queue_id, email_settings, errors):
+    def update_queue_settings(cls, queue_id, email_settings, errors,
+                              max_emails_per_second=None):
         with Namespace(cls.TARGET_NAMESPACE):
             c = QueueSettings.get_by_id(queue_id)
             if not c:
@@ -220,6 +229,7 @@ class QueueSettingsDAO(object):
                 return
             if email_settings is not None:
                 c.email_settings = email_settings
+            c.max_emails_per_second = max_emails_per_second
 
             c.put()
             models.MemcacheManager.delete(cls.list_memcache_key, namespace=cls.TARGET_NAMESPACE)
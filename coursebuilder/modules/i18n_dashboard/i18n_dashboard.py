@@ -249,6 +249,9 @@ class ResourceBundleDAO(NamedJsonDAO):
 
     DTO = ResourceBundleDTO
     ENTITY = ResourceBundleEntity
+    # Enable other modules to react to changed translations
+    POST_SAVE_HOOKS = []
+    POST_DELETE_HOOKS = []
 
     @classmethod
     def before_put(cls, dto, entity):
@@ -270,8 +273,11 @@ class ResourceBundleDAO(NamedJsonDAO):
         # allowed for deletion, but apparently not so much.  Here, at least
         # we are only round-tripping the keys, not the whole objects through
         # memory.
-        db.delete(list(common_utils.iter_all(
-            cls.ENTITY.all(keys_only=True).filter('locale = ', locale))))
+        keys = list(common_utils.iter_all(
+            cls.ENTITY.all(keys_only=True).filter('locale = ', locale)))
+        db.delete(keys)
+        cls._maybe_apply_post_delete_hooks(
+            [cls.DTO(key.id_or_name(), {}) for key in keys])
 
 
 class TableRow(object):
@@ -0,0 +1,163 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Picks the least loaded course staff to evaluate submissions.
+
+Finding an evaluator used to query all course staff who can grade and sort
+them by their number of pending evaluations, once per submission. Instead,
+every instance keeps an index of the staff of a course bucketed by that load,
+refreshed from the datastore every EVALUATOR_INDEX_TTL_SECS seconds. Taking
+an evaluator moves them to the next bucket, so submissions assigned by this
+instance are spread without reading the counts back. Evaluators are picked at
+random from the least loaded bucket so that instances working from the same
+snapshot do not all pick the same evaluator.
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import heapq
+import random
+import threading
+import time
+
+from common import caching
+from models import counters
+from modules.course_staff import course_staff
+
+from google.appengine.api import namespace_manager
+
+EVALUATOR_INDEX_TTL_SECS = 60
+
+COUNTER_EVALUATOR_INDEX_LOAD = counters.PerfCounter(
+    'gcb-manual-review-evaluator-index-load',
+    'number of times the load of course staff was read from the datastore')
+COUNTER_EVALUATORS_TAKEN = counters.PerfCounter(
+    'gcb-manual-review-evaluators-taken',
+    'number of evaluators picked from the evaluator load index')
+
+
+class EvaluatorLoadIndex(object):
+    """Course staff who can grade, bucketed by their pending evaluations."""
+
+    def __init__(self, staff_list, counts, ttl_secs=EVALUATOR_INDEX_TTL_SECS):
+        self._staff = dict((cs.user_id, cs) for cs in staff_list)
+        self._loads = {}
+        self._buckets = {}
+        self._bucket_loads = []
+        for user_id in self._staff:
+            num_assigned, num_graded = counts.get(user_id, (0, 0))
+            self._add(user_id, num_assigned - num_graded)
+        self._expires_at = time.time() + ttl_secs
+
+    def is_expired(self):
+        return time.time() >= self._expires_at
+
+    def _add(self, user_id, load):
+        self._loads[user_id] = load
+        bucket = self._buckets.get(load)
+        if bucket is None:
+            bucket = self._buckets[load] = []
+            heapq.heappush(self._bucket_loads, load)
+        bucket.append(user_id)
+
+    def _move(self, user_id, delta):
+        load = self._loads[user_id]
+        bucket = self._buckets[load]
+        bucket.remove(user_id)
+        if not bucket:
+            # Its load stays in the heap until it comes up in _take_one().
+            del self._buckets[load]
+        self._add(user_id, load + delta)
+
+    def _take_one(self, exclude_user_ids):
+        skipped = []
+        user_id = None
+        while self._bucket_loads:
+            load = self._bucket_loads[0]
+            bucket = self._buckets.get(load)
+            if bucket is None:
+                heapq.heappop(self._bucket_loads)
+                continue
+            candidates = [
+                candidate for candidate in bucket
+                if candidate not in exclude_user_ids]
+            if candidates:
+                user_id = random.choice(candidates)
+                break
+            skipped.append(heapq.heappop(self._bucket_loads))
+        for load in skipped:
+            heapq.heappush(self._bucket_loads, load)
+        if user_id is not None:
+            self._move(user_id, 1)
+        return user_id
+
+    def take(self, count, exclude_user_ids=()):
+        """Returns up to count least loaded staff, counting them as assigned.
+
+        Args:
+            count: int. Maximum number of evaluators to return.
+            exclude_user_ids: collection of user ids of staff not to return.
+
+        Returns:
+            List of course_staff.CourseStaff, each one once.
+        """
+        exclude_user_ids = set(exclude_user_ids)
+        taken = []
+        while len(taken) < count:
+            user_id = self._take_one(exclude_user_ids)
+            if user_id is None:
+                break
+            exclude_user_ids.add(user_id)
+            taken.append(self._staff[user_id])
+        return taken
+
+
+class EvaluatorAllocator(caching.ProcessScopedSingleton):
+    """Per-instance EvaluatorLoadIndex of every course, by namespace."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def _get_index(self, namespace):
+        with self._lock:
+            index = self._indexes.get(namespace)
+        if index is not None and not index.is_expired():
+            return index
+
+        # Several threads may reload an index at the same time; the last one
+        # to finish wins, which is no worse than an index a few seconds old.
+        COUNTER_EVALUATOR_INDEX_LOAD.inc()
+        staff_list = course_staff.CourseStaff.all().filter(
+            course_staff.CourseStaff.can_grade.name, True).fetch(None)
+        index = EvaluatorLoadIndex(
+            staff_list, course_staff.CourseStaff.get_counts(staff_list))
+        with self._lock:
+            self._indexes[namespace] = index
+        return index
+
+    def find_evaluators(self, count, exclude_user_ids=()):
+        """Takes up to count evaluators for a submission in this namespace."""
+        index = self._get_index(namespace_manager.get_namespace())
+        with self._lock:
+            evaluators = index.take(count, exclude_user_ids)
+        COUNTER_EVALUATORS_TAKEN.inc(increment=len(evaluators))
+        return evaluators
+
+    def invalidate(self, namespace=None):
+        """Rereads the staff of a course the next time it needs evaluators."""
+        if namespace is None:
+            namespace = namespace_manager.get_namespace()
+        with self._lock:
+            self._indexes.pop(namespace, None)
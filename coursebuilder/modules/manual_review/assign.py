@@ -21,6 +21,7 @@ from mapreduce import context
 
 from google.appengine.api import namespace_manager
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 from controllers import sites
 from controllers.utils import BaseHandler
@@ -35,24 +36,29 @@ from models import courses
 from models import transforms
 from modules.manual_review import staff
 from modules.manual_review import manage
+from modules.manual_review import pool
 from modules.subjective_assignments import question
 
+# Submissions of a unit are assigned in this many batches, one per reduce key.
+NUM_ASSIGNMENT_BATCHES = 16
+# A batch is assigned by deferred tasks of at most this many submissions, so
+# that the Drive sharing and transactions of a task fit in one request.
+ASSIGNMENT_TASK_SIZE = 50
+
 
 @db.transactional(xg=True)
 def remove_step(step):
     """Function to remove a manual evaluation step and perform related tasks"""
-    evaluator_key = db.Key.from_path(
-        course_staff.CourseStaff.kind(), step.evaluator)
-    evaluator, summary = entities.get(
-        [evaluator_key, step.manual_evaluation_summary_key])
+    summary = entities.get(step.manual_evaluation_summary_key)
     if summary:
         summary.decrement_count(step.state)
     else:
         manage.COUNTER_DELETE_REVIEWER_SUMMARY_MISS.inc()
     step.removed = True
-    if evaluator:
-        evaluator.num_assigned -= 1
-    entities.put([entity for entity in [step, summary, evaluator] if entity])
+    course_staff.CourseStaff.increment_counts(step.evaluator, num_assigned=-1)
+    entities.put([entity for entity in [step, summary] if entity])
+    if summary:
+        pool.AssignmentPool.summary_changed(summary)
 
 def assign_course_staff(entity):
     """
@@ -62,10 +68,9 @@ def assign_course_staff(entity):
     """
     unit_id = entity.unit_id
     submission_key = entity.submission_key
-    students = entities.get([entity.reviewee_key])
-    if not students:
+    student = get_students_by_user_id([entity.reviewee_key.name()])[0]
+    if not student:
         return False
-    student = students[0]
 
     namespace = namespace_manager.get_namespace()
     if namespace:
@@ -81,6 +86,100 @@ def assign_course_staff(entity):
     logging.error('Could not load unit for entity ' + entity.key().name())
     return False
 
+def map_for_assignment(entity, step_key=None):
+    """
+    Maps a ManualEvaluationSummary or ManualEvaluationStep to the reduce key
+    of the batch of its unit's submissions that assign_course_staff_in_batch
+    will assign together. step_key is the key of a step to remove before the
+    submission is assigned again.
+    """
+    batch = hash(str(entity.submission_key)) % NUM_ASSIGNMENT_BATCHES
+    return ('%s:%s' % (entity.unit_id, batch), transforms.dumps(
+        [str(entity.submission_key), str(entity.reviewee_key),
+         str(step_key) if step_key else None]))
+
+def assign_course_staff_in_batch(key, data_list, exclude_user_ids=()):
+    """
+    Reduce function handing the batch of submissions mapped by
+    map_for_assignment to deferred tasks of ASSIGNMENT_TASK_SIZE submissions,
+    so that the work of a reduce call does not grow with the course.
+    """
+    unit_id = key.rsplit(':', 1)[0]
+    namespace = context.get().mapreduce_spec.mapper.params['namespace']
+
+    # A submission is mapped once for every step of it being reassigned.
+    step_keys_by_submission = {}
+    for data in data_list:
+        submission_key, reviewee_key, step_key = transforms.loads(data)
+        step_keys = step_keys_by_submission.setdefault(
+            (submission_key, reviewee_key), [])
+        if step_key:
+            step_keys.append(step_key)
+    submissions = sorted(
+        [submission_key, reviewee_key, step_keys]
+        for (submission_key, reviewee_key), step_keys
+        in step_keys_by_submission.iteritems())
+
+    for start in xrange(0, len(submissions), ASSIGNMENT_TASK_SIZE):
+        deferred.defer(
+            assign_course_staff_task, namespace, unit_id,
+            submissions[start:start + ASSIGNMENT_TASK_SIZE],
+            list(exclude_user_ids))
+
+def assign_course_staff_task(namespace, unit_id, submissions,
+                             exclude_user_ids):
+    """
+    Deferred task assigning course staff to submissions of a unit, given as
+    [submission_key, reviewee_key, step_keys] lists of key strings. The steps
+    being reassigned are removed here, right before the submission gets its
+    new evaluators, rather than in map: a submission then goes without an
+    evaluator for the length of this task instead of until the reduce phase
+    reaches it. The removal and the assignment are still separate
+    transactions; if the task fails in between, it is retried, skipping the
+    steps already removed and the submissions that have their evaluators.
+
+    The course and unit are loaded once, the students queried together, and
+    the evaluators found in one pass over the evaluator load index. Staff in
+    exclude_user_ids are not assigned, even if the index, which may be a
+    minute old, still lists them.
+    """
+    with Namespace(namespace):
+        app_context = sites.get_app_context_for_namespace(namespace)
+        course = courses.Course.get(app_context) if app_context else None
+        unit = course.find_unit_by_id(unit_id) if course else None
+        if not unit:
+            logging.error('Could not load unit %s in %s', unit_id, namespace)
+            return
+
+        steps = entities.get([
+            db.Key(step_key)
+            for _, _, step_keys in submissions for step_key in step_keys])
+        for step in steps:
+            if (step and not step.removed and
+                    step.state != staff.REVIEW_STATE_COMPLETED):
+                remove_step(step)
+
+        students = get_students_by_user_id(
+            [db.Key(reviewee_key).name() for _, reviewee_key, _ in submissions])
+        manage.Manager.find_and_add_evaluators(
+            course, unit,
+            [(db.Key(submission_key), student)
+             for (submission_key, _, _), student in zip(submissions, students)
+             if student],
+            exclude_user_ids=exclude_user_ids)
+
+def get_students_by_user_id(user_ids):
+    """
+    Returns the Student with each user id, or None. Students are stored by
+    email, while reviewee keys of submissions are made from the user id, so
+    they are queried, all at once.
+    """
+    queries = [
+        models.Student.all().filter(
+            models.Student.user_id.name, user_id).run(limit=1)
+        for user_id in user_ids]
+    return [next(iter(query), None) for query in queries]
+
 def reshare_submission_with_evaluator(step):
     """Function to share the step's submission contents with the course staff"""
 
@@ -146,11 +245,11 @@ class AssignSubmission(jobs.MapReduceJob):
     def map(entity):
         if entity.assigned_count > 0:
             return
-        assign_course_staff(entity)
+        yield map_for_assignment(entity)
 
     @staticmethod
     def reduce(key, data_list):
-        pass
+        assign_course_staff_in_batch(key, data_list)
 
 # TODO(rthakker) While re-assigning reviews to course staff, check whether
 # we should assign even the COMPLETED reviews. Currently not doing that.
@@ -188,12 +287,14 @@ class ReassignSubmissionByCourseStaff(jobs.MapReduceJob):
         course_staff_user_ids = mapper_params['course_staff_user_ids']
         if entity.evaluator not in course_staff_user_ids:
             return
-        remove_step(entity)
-        assign_course_staff(entity)
+        yield map_for_assignment(entity, step_key=entity.key())
 
     @staticmethod
     def reduce(key, data_list):
-        pass
+        mapper_params = context.get().mapreduce_spec.mapper.params
+        assign_course_staff_in_batch(
+            key, data_list,
+            exclude_user_ids=mapper_params['course_staff_user_ids'])
 
 
 class ReassignSubmissionByExcludingCourseStaff(jobs.MapReduceJob):
@@ -230,12 +331,11 @@ class ReassignSubmissionByExcludingCourseStaff(jobs.MapReduceJob):
             'exclude_course_staff_user_ids']
         if entity.evaluator in exclude_course_staff_user_ids:
             return
-        remove_step(entity)
-        assign_course_staff(entity)
+        yield map_for_assignment(entity, step_key=entity.key())
 
     @staticmethod
     def reduce(key, data_list):
-        pass
+        assign_course_staff_in_batch(key, data_list)
 
 
 class FixDrivePermissions(jobs.MapReduceJob):
@@ -402,7 +502,11 @@ class FixNumAssigned(jobs.MapReduceJob):
         num_assigned = len(assigned_steps)
         logging.debug('num_assigned for %s: %s', entity.email, num_assigned)
         entity.num_assigned = num_assigned
-        entity.put()
+        shards = course_staff.CourseStaffCounterShard.all().filter(
+            'user_id =', entity.user_id).fetch(None)
+        for shard in shards:
+            shard.num_assigned = 0
+        entities.put([entity] + shards)
 
     @staticmethod
     def reduce(key, data_list):
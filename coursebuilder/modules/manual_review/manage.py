@@ -30,6 +30,8 @@ from models import utils
 from models import transforms
 import models.review
 from modules.course_staff import course_staff
+from modules.manual_review import allocator
+from modules.manual_review import pool
 from modules.manual_review import staff
 from modules.review import domain
 from modules.review import peer
@@ -152,6 +154,22 @@ COUNTER_GET_NEW_REVIEW_FAILED = counters.PerfCounter(
 COUNTER_GET_NEW_REVIEW_NOT_ASSIGNABLE = counters.PerfCounter(
     'gcb-pr-get-new-manual-review-none-assignable',
     'number of times get_new_manual-review() failed to find an assignable manual-review')
+COUNTER_GET_NEW_REVIEW_POOL_ASSIGNED = counters.PerfCounter(
+    'gcb-pr-get-new-manual-review-pool-assigned',
+    ('number of times get_new_manual-review() assigned a manual-review leased '
+     'from the assignment pool'))
+COUNTER_GET_NEW_REVIEW_POOL_CONTENDED = counters.PerfCounter(
+    'gcb-pr-get-new-manual-review-pool-contended',
+    ('number of times get_new_manual-review() failed to lease from a pool '
+     'shard because another request was writing it'))
+COUNTER_GET_NEW_REVIEW_POOL_LEASED = counters.PerfCounter(
+    'gcb-pr-get-new-manual-review-pool-leased',
+    ('number of manual-review summaries get_new_manual-review() leased from '
+     'the assignment pool'))
+COUNTER_GET_NEW_REVIEW_POOL_MISS = counters.PerfCounter(
+    'gcb-pr-get-new-manual-review-pool-miss',
+    ('number of times get_new_manual-review() assigned nothing from the '
+     'assignment pool and fell back to the candidates query'))
 COUNTER_GET_NEW_REVIEW_REASSIGN_EXISTING = counters.PerfCounter(
     'gcb-pr-get-new-manual-review-reassign-existing',
     ('number of times get_new_manual-review() unremoved and reassigned an existing '
@@ -306,41 +324,29 @@ class Manager(object):
     """Object that manages the manual-review subsystem."""
 
     @classmethod
-    @db.transactional()
     def _increment_evaluator_num_assigned_in_txn(cls, user_id, num_increment=1):
-        """Increments and returns evaluator.num_assigned in a transaction"""
-        cs = course_staff.CourseStaff.get_by_key_name(user_id)
-        if cs.num_assigned:
-            cs.num_assigned += num_increment
-        else:
-            cs.num_assigned = num_increment
-        cs.put()
-        return cs.num_assigned
+        """Increments evaluator's num_assigned in a transaction"""
+        course_staff.CourseStaff.increment_counts(
+            user_id, num_assigned=num_increment)
 
     @classmethod
-    @db.transactional()
     def _increment_evaluator_num_graded_in_txn(cls, user_id, num_increment=1):
-        """Increments and returns evaluator.num_graded in a transaction"""
-        cs = course_staff.CourseStaff.get_by_key_name(user_id)
-        if cs.num_graded:
-            cs.num_graded += num_increment
-        else:
-            cs.num_graded = num_increment
-        cs.put()
-        return cs.num_graded
+        """Increments evaluator's num_graded in a transaction"""
+        course_staff.CourseStaff.increment_counts(
+            user_id, num_graded=num_increment)
 
     @classmethod
     def _decrement_evaluator_num_assigned_in_txn(cls, user_id, num_decrement=1):
-        """Decrements and returns evaluator.num_assigned in a transaction"""
+        """Decrements evaluator's num_assigned in a transaction"""
         num_decrement *= -1
-        return cls._increment_evaluator_num_assigned_in_txn(
+        cls._increment_evaluator_num_assigned_in_txn(
             user_id, num_increment=num_decrement)
 
     @classmethod
     def _decrement_evaluator_num_graded_in_txn(cls, user_id, num_decrement=1):
-        """Decrements and returns evaluator.num_graded in a transaction"""
+        """Decrements evaluator's num_graded in a transaction"""
         num_decrement *= -1
-        return cls._increment_evaluator_num_graded_in_txn(
+        cls._increment_evaluator_num_graded_in_txn(
             user_id, num_increment=num_decrement)
 
     @classmethod
@@ -380,27 +386,26 @@ class Manager(object):
                 reviewee_key=reviewee_key, submission_key=submission_key,
                 unit_id=unit_id)
             summary.put()
+            pool.AssignmentPool.summary_changed(summary)
 
     @classmethod
-    def find_evaluator(cls, student, evaluator_id=None):
-        staff_list = None
+    def find_evaluator(cls, student, evaluator_id=None, count=1,
+                       exclude_user_ids=()):
+        """Returns up to count course staff to evaluate a student's work.
+
+        Unless evaluator_id names the evaluator, the staff with the fewest
+        pending evaluations are taken from the evaluator allocator, which
+        counts them as assigned from then on.
+        """
+        exclude_user_ids = set(exclude_user_ids)
+        exclude_user_ids.add(student.user_id)
         if evaluator_id:
             cs = course_staff.CourseStaff.get_by_key_name(evaluator_id)
-            if cs:
-                if not cs.can_grade:
-                    staff_list = []
-                else:
-                    staff_list = [cs]
-            else:
-                staff_list = []
-        else:
-            staff_list = course_staff.CourseStaff.all(
-                ).filter(course_staff.CourseStaff.can_grade.name, True
-                ).fetch(None)
-
-        filtered_list = [s for s in staff_list if s.user_id != student.user_id]
-        return sorted(filtered_list,
-                      key=lambda staff: staff.num_assigned - staff.num_graded)
+            if cs and cs.can_grade and cs.user_id not in exclude_user_ids:
+                return [cs]
+            return []
+        return allocator.EvaluatorAllocator.instance().find_evaluators(
+            count, exclude_user_ids)
 
     @classmethod
     def get_submission_contents_dict(cls, submission_key):
@@ -464,51 +469,79 @@ class Manager(object):
     def find_and_add_evaluator(cls, course, unit, submission_key, student,
             evaluator_id=None):
         """Finds and adds a manual evaluator. Also shares the file if required"""
+        return cls.find_and_add_evaluators(
+            course, unit, [(submission_key, student)],
+            evaluator_id=evaluator_id)[0]
+
+    @classmethod
+    def find_and_add_evaluators(cls, course, unit, submissions,
+            evaluator_id=None, exclude_user_ids=()):
+        """Finds and adds manual evaluators for many submissions of a unit.
+
+        Args:
+            course: courses.Course the unit belongs to.
+            unit: the subjective assignment unit.
+            submissions: list of (submission_key, student) pairs.
+            evaluator_id: string. If given, the user id of the only course
+                staff to assign.
+            exclude_user_ids: user ids of course staff not to assign.
+
+        Returns:
+            List with, for each submission, whether it has evaluators.
+        """
         unit_id = str(unit.unit_id)
-        evaluator = cls.find_evaluator(student, evaluator_id)
-        drive_permission_list_dump = None
-        # Share the file with the evaluator
         content = question.SubjectiveAssignmentBaseHandler.get_content(
             course, unit)
         num_reviewers = content.get(
             question.SubjectiveAssignmentBaseHandler.OPT_NUM_REVIEWERS, 1)
+        is_drive_submission = (
+            question.SubjectiveAssignmentBaseHandler.BLOB == content.get(
+                question.SubjectiveAssignmentBaseHandler.OPT_QUESTION_TYPE))
 
+        # Start the queries for all submissions before reading any of them,
+        # so that they run in parallel.
         # TODO(rthakker) add this to filter once all required entries have
         # indices.
-        existing_steps = staff.ManualEvaluationStep.all(
-        ).filter('submission_key =', submission_key
-        ).fetch(None)
-        existing_steps = [step for step in existing_steps if not step.removed]
-
-        existing_evaluators = [step.evaluator for step in existing_steps]
-        existing_evaluator_count = len(existing_evaluators)
-        required_evaluator_count = num_reviewers - existing_evaluator_count
-
-        if evaluator:
-            i = 0
-            assigned_evaluator_count = 0
-            while (assigned_evaluator_count < min(
-                    required_evaluator_count, len(evaluator)) and
-                    i < len(evaluator)):
-                if question.SubjectiveAssignmentBaseHandler.BLOB == (
-                        content.get(question.SubjectiveAssignmentBaseHandler.
-                                    OPT_QUESTION_TYPE)):
-                    submission_contents = cls.get_submission_contents_dict(
-                        submission_key)
-                    if submission_contents:
-                        drive_permission_list_dump = transforms.dumps(
-                            cls.share_submission_with_evaluator(
-                                submission_contents, evaluator[i].email))
-                if evaluator[i].user_id not in existing_evaluators:
-                    cls.add_evaluator(
-                        unit_id, submission_key, student.key(), evaluator[i],
-                        drive_permission_list=drive_permission_list_dump)
-                    assigned_evaluator_count += 1
-                i += 1
-            return True
-        else:
-            cls._create_submission(unit_id, submission_key, student.key())
-            return False
+        existing_steps_list = [
+            staff.ManualEvaluationStep.all().filter(
+                'submission_key =', submission_key).run(batch_size=1000)
+            for submission_key, _ in submissions]
+
+        results = []
+        for (submission_key, student), existing_steps in zip(
+                submissions, existing_steps_list):
+            existing_evaluators = [
+                step.evaluator for step in existing_steps if not step.removed]
+            required_evaluator_count = num_reviewers - len(existing_evaluators)
+            if required_evaluator_count <= 0:
+                results.append(True)
+                continue
+
+            evaluators = cls.find_evaluator(
+                student, evaluator_id, count=required_evaluator_count,
+                exclude_user_ids=set(existing_evaluators).union(
+                    exclude_user_ids))
+            if not evaluators:
+                cls._create_submission(unit_id, submission_key, student.key())
+                results.append(False)
+                continue
+
+            submission_contents = None
+            if is_drive_submission:
+                submission_contents = cls.get_submission_contents_dict(
+                    submission_key)
+            for evaluator in evaluators:
+                # Share the file with the evaluator
+                drive_permission_list_dump = None
+                if submission_contents:
+                    drive_permission_list_dump = transforms.dumps(
+                        cls.share_submission_with_evaluator(
+                            submission_contents, evaluator.email))
+                cls.add_evaluator(
+                    unit_id, submission_key, student.key(), evaluator,
+                    drive_permission_list=drive_permission_list_dump)
+            results.append(True)
+        return results
 
     @classmethod
     def add_evaluator(cls, unit_id, submission_key, reviewee_key, evaluator,
@@ -598,6 +631,7 @@ class Manager(object):
 
         cls._increment_evaluator_num_assigned_in_txn(evaluator.user_id)
         step_key, written_summary_key = entities.put([step, summary])
+        pool.AssignmentPool.summary_changed(summary)
 
         if summary_key != written_summary_key:
             COUNTER_ADD_REVIEWER_BAD_SUMMARY_KEY.inc()
@@ -627,14 +661,13 @@ class Manager(object):
                 step.state = staff.REVIEW_STATE_ASSIGNED
                 summary.decrement_count(staff.REVIEW_STATE_EXPIRED)
                 summary.increment_count(staff.REVIEW_STATE_ASSIGNED)
-                evaluator.num_assigned += 1
                 cls._increment_evaluator_num_assigned_in_txn(evaluator.user_id)
             elif step.state == staff.REVIEW_STATE_COMPLETED:
                 step.state = staff.REVIEW_STATE_ASSIGNED
                 summary.decrement_count(staff.REVIEW_STATE_COMPLETED)
                 summary.increment_count(staff.REVIEW_STATE_ASSIGNED)
-                cls._increment_evaluator_num_assigned_in_txn(evaluator.user_id)
-                cls._increment_evaluator_num_graded_in_txn(evaluator.user_id)
+                course_staff.CourseStaff.increment_counts(
+                    evaluator.user_id, num_assigned=1, num_graded=1)
         else:
             should_increment_unremoved = True
             step.removed = False
@@ -656,6 +689,7 @@ class Manager(object):
             step.drive_permission_list = drive_permission_list
 
         step_key = entities.put([step, summary])[0]
+        pool.AssignmentPool.summary_changed(summary)
 
         if should_increment_human:
             COUNTER_ADD_REVIEWER_SET_ASSIGNER_KIND_HUMAN.inc()
@@ -722,7 +756,9 @@ class Manager(object):
         cls._decrement_evaluator_num_assigned_in_txn(step.evaluator)
         step.removed = True
         summary.decrement_count(step.state)
-        return entities.put([step, summary])[0]
+        step_key = entities.put([step, summary])[0]
+        pool.AssignmentPool.summary_changed(summary)
+        return step_key
 
     @classmethod
     def expire_manual_review(cls, manual_review_step_key):
@@ -787,7 +823,9 @@ class Manager(object):
         summary.decrement_count(step.state)
         step.state = staff.REVIEW_STATE_EXPIRED
         summary.increment_count(step.state)
-        return entities.put([step, summary])[0]
+        step_key = entities.put([step, summary])[0]
+        pool.AssignmentPool.summary_changed(summary)
+        return step_key
 
     @classmethod
     def expire_old_manual_reviews_for_unit(cls, manual_review_window_mins, unit_id):
@@ -894,6 +932,12 @@ class Manager(object):
         cls, unit_id, evaluator, candidate_count=20, max_retries=5):
         """Attempts to assign a manual_review to a manual_evaluator.
 
+        Submissions nobody is evaluating are first leased from random shards
+        of the unit's pool.AssignmentPool, so concurrent callers rarely contend
+        for the same entities. Only when nothing could be assigned from the
+        pool do we fall back to the candidates query below, which also finds
+        summaries that are not pending or did not fit in the pool.
+
         We prioritize possible manual_reviews by querying manual_review summary objects,
         finding those that best satisfy cls.get_assignment_candidates_query.
 
@@ -908,13 +952,14 @@ class Manager(object):
         the list. We then retry assignment up to max_retries times. If we run
         out of retries or candidates, we raise staff.NotAssignableError.
 
-        This is a naive implementation because it scales only to relatively low
-        new manual_review assignments per second and because it can raise
-        staff.NotAssignableError when there are in fact assignable manual_reviews.
+        The fallback is a naive implementation because it scales only to
+        relatively low new manual_review assignments per second and because it
+        can raise staff.NotAssignableError when there are in fact assignable
+        manual_reviews.
 
         Args:
             unit_id: string. The unit to assign work from.
-            evaluator: db.Key of models.models.Student. The manual_evaluator to
+            evaluator: string. The user_id of the manual_evaluator to
                 attempt to assign the manual_review to.
             candidate_count: int. The number of candidate keys to fetch and
                 attempt to assign from. Increasing this decreases the chance
@@ -922,11 +967,12 @@ class Manager(object):
                 num_results datastore reads and can get expensive for large
                 courses.
             max_retries: int. Number of times to retry failed assignment
-                attempts. Careful not to set this too high as a) datastore
-                throughput is slow and latency from this method is user-facing,
-                and b) if you encounter a few failures it is likely that all
-                candidates are now failures, so each retry past the first few is
-                of questionable value.
+                attempts, from the pool and then from the query. Careful
+                not to set this too high as a) datastore throughput is slow
+                and latency from this method is user-facing, and b) if you
+                encounter a few failures it is likely that all candidates are
+                now failures, so each retry past the first few is of
+                questionable value.
 
         Raises:
             staff.NotAssignableError: if no manual_review can currently be assigned
@@ -937,6 +983,12 @@ class Manager(object):
         """
         try:
             COUNTER_GET_NEW_REVIEW_START.inc()
+            assigned_key = cls._assign_from_pool(
+                unit_id, evaluator, max_retries)
+            if assigned_key:
+                COUNTER_GET_NEW_REVIEW_SUCCESS.inc()
+                return assigned_key
+
             # Filter out candidates that are for submissions by the manual_evaluator.
             raw_candidates = cls.get_assignment_candidates_query(unit_id).fetch(
                 candidate_count)
@@ -944,7 +996,7 @@ class Manager(object):
                 increment=len(raw_candidates))
             candidates = [
                 candidate for candidate in raw_candidates
-                if candidate.reviewee_key != evaluator]
+                if not cls._is_own_submission(candidate, evaluator)]
 
             retries = 0
             while True:
@@ -968,6 +1020,49 @@ class Manager(object):
             COUNTER_GET_NEW_REVIEW_FAILED.inc()
             raise e
 
+    @classmethod
+    def _assign_from_pool(cls, unit_id, evaluator, max_retries):
+        """Assigns a summary leased from the assignment pool, if possible.
+
+        Summaries that cannot be assigned to this manual_evaluator stay leased,
+        so that other callers skip them until the lease runs out.
+
+        Returns:
+            db.Key of staff.ManualEvaluationStep, or None if nothing could be
+            assigned from the pool.
+        """
+        retries = 0
+        for shard_index in pool.AssignmentPool.get_leasable_shards(unit_id):
+            while retries < max_retries:
+                try:
+                    summary_key = pool.AssignmentPool.lease(
+                        unit_id, shard_index)
+                except db.TransactionFailedError:
+                    # Another caller is writing this shard; try the next one.
+                    COUNTER_GET_NEW_REVIEW_POOL_CONTENDED.inc()
+                    retries += 1
+                    break
+                if not summary_key:
+                    break
+
+                COUNTER_GET_NEW_REVIEW_POOL_LEASED.inc()
+                summary = entities.get(summary_key)
+                if summary and not cls._is_own_submission(summary, evaluator):
+                    assigned_key = cls._attempt_manual_review_assignment(
+                        summary_key, evaluator, summary.change_date)
+                    if assigned_key:
+                        COUNTER_GET_NEW_REVIEW_POOL_ASSIGNED.inc()
+                        return assigned_key
+                retries += 1
+
+        COUNTER_GET_NEW_REVIEW_POOL_MISS.inc()
+        return None
+
+    @classmethod
+    def _is_own_submission(cls, summary, evaluator):
+        # Submissions are keyed by Student.get_key(), which uses the user_id.
+        return summary.reviewee_key.name() == evaluator
+
     @classmethod
     def _choose_assignment_candidate(cls, candidates):
         """Seam that allows different choice functions in tests."""
@@ -1019,7 +1114,9 @@ class Manager(object):
                 return
 
         summary.increment_count(staff.REVIEW_STATE_ASSIGNED)
-        return entities.put([step, summary])[0]
+        step_key = entities.put([step, summary])[0]
+        pool.AssignmentPool.summary_changed(summary)
+        return step_key
 
     @classmethod
     def get_manual_review_step_keys_by(cls, unit_id, evaluator):
@@ -1225,10 +1322,13 @@ class Manager(object):
             COUNTER_START_REVIEW_PROCESS_FOR_ALREADY_STARTED.inc()
             raise staff.ReviewProcessAlreadyStartedError()
 
-        return staff.ManualEvaluationSummary(
+        summary = staff.ManualEvaluationSummary(
             reviewee_key=reviewee_key, submission_key=submission_key,
             unit_id=unit_id,
-        ).put()
+        )
+        summary_key = summary.put()
+        pool.AssignmentPool.summary_changed(summary)
+        return summary_key
 
     @classmethod
     def write_manual_review(
@@ -1359,12 +1459,9 @@ class Manager(object):
         step.state = staff.REVIEW_STATE_COMPLETED
         summary.increment_count(step.state)
 
-        cs = course_staff.CourseStaff.get_by_key_name(step.evaluator)
-        if cs.num_graded:
-            cs.num_graded += 1
-        else:
-            cs.num_graded = 1
-        entities.put([step, summary, cs])
+        cls._increment_evaluator_num_graded_in_txn(step.evaluator)
+        entities.put([step, summary])
+        pool.AssignmentPool.summary_changed(summary)
 
         if should_increment_assigned_to_completed:
             COUNTER_WRITE_REVIEW_COMPLETED_ASSIGNED_STEP.inc()
@@ -0,0 +1,200 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharded pool of submissions waiting for an evaluator.
+
+Manager.get_new_manual_review() used to query the head of the summaries of a
+unit ordered by their counts and try transactions on candidates picked from
+it, so evaluators asking at the same time mostly raced for the same few
+summaries. Instead, the summaries of a unit that nobody is evaluating are
+kept in NUM_SHARDS AssignmentPoolShard entities. A summary always hashes to
+the same shard, which a task updates whenever the summary changes.
+Evaluators lease a summary from a random shard, so concurrent claims rarely
+write the same entity group; a lease runs out after LEASE_SECS, so summaries
+that could not be assigned go back to the pool.
+
+Each shard is a single entity group, and every lease and every update task
+writes one. The datastore sustains about one write per second on an entity
+group, so the pool of a unit handles roughly NUM_SHARDS leases and summary
+changes per second in all; raise NUM_SHARDS for units that need more.
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import random
+import time
+import zlib
+
+from common import utils as common_utils
+from models import counters
+from models import entities
+
+from google.appengine.api import namespace_manager
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+NUM_SHARDS = 16
+# Summaries past this many in a shard are only found by the candidates query.
+MAX_SHARD_SIZE = 1000
+LEASE_SECS = 60
+
+COUNTER_POOL_UPDATE_SCHEDULED = counters.PerfCounter(
+    'gcb-manual-review-pool-update-scheduled',
+    'number of tasks scheduled to update the assignment pool')
+COUNTER_POOL_SUMMARY_ADDED = counters.PerfCounter(
+    'gcb-manual-review-pool-summary-added',
+    'number of summaries added to the assignment pool')
+COUNTER_POOL_SUMMARY_REMOVED = counters.PerfCounter(
+    'gcb-manual-review-pool-summary-removed',
+    'number of summaries removed from the assignment pool')
+COUNTER_POOL_SHARD_FULL = counters.PerfCounter(
+    'gcb-manual-review-pool-shard-full',
+    'number of summaries not added because their pool shard was full')
+
+
+class AssignmentPoolShard(entities.BaseEntity):
+    """Pending summaries of a unit that hash to one shard, oldest first."""
+
+    # Keys of staff.ManualEvaluationSummary entities.
+    summary_keys = db.ListProperty(db.Key, indexed=False)
+    # Time in seconds since the epoch when the lease of the summary at the
+    # same index runs out; 0 if it was never leased.
+    leased_until = db.ListProperty(int, indexed=False)
+
+    @classmethod
+    def key_name(cls, unit_id, shard_index):
+        return '(manual_review_pool:%s:%s)' % (unit_id, shard_index)
+
+    def add(self, summary_key):
+        if summary_key in self.summary_keys:
+            return False
+        if len(self.summary_keys) >= MAX_SHARD_SIZE:
+            COUNTER_POOL_SHARD_FULL.inc()
+            return False
+        self.summary_keys.append(summary_key)
+        self.leased_until.append(0)
+        return True
+
+    def remove(self, summary_key):
+        if summary_key not in self.summary_keys:
+            return False
+        index = self.summary_keys.index(summary_key)
+        del self.summary_keys[index]
+        del self.leased_until[index]
+        return True
+
+    def is_leasable(self, now):
+        return any(until <= now for until in self.leased_until)
+
+    def lease(self, now, lease_secs):
+        for index, until in enumerate(self.leased_until):
+            if until <= now:
+                self.leased_until[index] = int(now) + lease_secs
+                return self.summary_keys[index]
+        return None
+
+
+class AssignmentPool(object):
+    """Adds, removes and leases the pending summaries of a unit."""
+
+    @classmethod
+    def is_pending(cls, summary):
+        """Whether a summary waits for an evaluator."""
+        return not summary.assigned_count and not summary.completed_count
+
+    @classmethod
+    def get_shard_index(cls, summary_key):
+        return (zlib.crc32(str(summary_key)) & 0xffffffff) % NUM_SHARDS
+
+    @classmethod
+    def _get_shard_key(cls, unit_id, shard_index):
+        return db.Key.from_path(
+            AssignmentPoolShard.kind(),
+            AssignmentPoolShard.key_name(unit_id, shard_index))
+
+    @classmethod
+    def summary_changed(cls, summary):
+        """Schedules the update of the pool for a summary that was written.
+
+        When called in a transaction, the task only runs if it commits.
+        """
+        COUNTER_POOL_UPDATE_SCHEDULED.inc()
+        deferred.defer(
+            cls._update_task, namespace_manager.get_namespace(),
+            summary.unit_id, summary.key(),
+            _transactional=db.is_in_transaction())
+
+    @classmethod
+    def _update_task(cls, namespace, unit_id, summary_key):
+        with common_utils.Namespace(namespace):
+            cls._update_shard(unit_id, summary_key)
+
+    @classmethod
+    @db.transactional(xg=True)
+    def _update_shard(cls, unit_id, summary_key):
+        # The summary is read here rather than passed in, so that tasks for
+        # the same summary leave the pool right whatever order they run in.
+        summary = entities.get(summary_key)
+        shard_key = cls._get_shard_key(
+            unit_id, cls.get_shard_index(summary_key))
+        shard = entities.get(shard_key)
+        if summary is not None and cls.is_pending(summary):
+            if shard is None:
+                shard = AssignmentPoolShard(key_name=shard_key.name())
+            if shard.add(summary_key):
+                COUNTER_POOL_SUMMARY_ADDED.inc()
+                shard.put()
+        elif shard is not None and shard.remove(summary_key):
+            COUNTER_POOL_SUMMARY_REMOVED.inc()
+            shard.put()
+
+    @classmethod
+    def get_leasable_shards(cls, unit_id):
+        """Returns the indexes of shards with summaries to lease, shuffled."""
+        now = time.time()
+        shards = entities.get([
+            cls._get_shard_key(unit_id, shard_index)
+            for shard_index in xrange(NUM_SHARDS)])
+        shard_indexes = [
+            shard_index for shard_index, shard in enumerate(shards)
+            if shard is not None and shard.is_leasable(now)]
+        random.shuffle(shard_indexes)
+        return shard_indexes
+
+    @classmethod
+    @db.transactional(retries=0)
+    def lease(cls, unit_id, shard_index, lease_secs=LEASE_SECS):
+        """Leases the oldest summary of a shard that is not leased.
+
+        Args:
+            unit_id: string. The unit of the pool.
+            shard_index: int. The shard to lease from.
+            lease_secs: int. How long the summary is not leased again.
+
+        Raises:
+            db.TransactionFailedError: if another request wrote the shard
+                meanwhile. The transaction is not retried, since the caller
+                can lease from another shard instead.
+
+        Returns:
+            db.Key of staff.ManualEvaluationSummary, or None if the shard has
+            nothing to lease.
+        """
+        shard = entities.get(cls._get_shard_key(unit_id, shard_index))
+        if shard is None:
+            return None
+        summary_key = shard.lease(time.time(), lease_secs)
+        if summary_key is not None:
+            shard.put()
+        return summary_key
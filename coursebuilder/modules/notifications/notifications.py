@@ -59,6 +59,13 @@ is:
     notifications.Manager.send_async(
         user.email, 'sender@example.com', 'intent', 'subject', 'body'
     )
+
+To send the same message to many users, such as all students enrolled in a
+course, use Manager.send_async_bulk with a Recipients instance instead of
+calling send_async in a loop. It pages through the recipients in a task,
+writes notifications and payloads in batches without transactions, and sends
+each batch of emails from a single task, spread out to the max emails per
+second configured for the queue in the email settings module.
 """
 
 __author__ = [
@@ -67,9 +74,12 @@ __author__ = [
 
 import datetime
 import logging
+import uuid
+
 import sendgrid
 from sendgrid.helpers import mail as sendgrid_email
 
+from common import utils as common_utils
 from models import counters
 from models import custom_modules
 from models import entities
@@ -81,6 +91,7 @@ from modules.email_settings import email_settings_model
 
 from google.appengine.api import mail
 from google.appengine.api import mail_errors
+from google.appengine.api import namespace_manager
 from google.appengine.api import taskqueue
 from google.appengine.datastore import datastore_rpc
 from google.appengine.ext import db
@@ -95,6 +106,8 @@ _APP_ENGINE_MAIL_FATAL_ERRORS = frozenset([
     mail_errors.BadRequestError, mail_errors.InvalidSenderError,
 ])
 _ENQUEUED_BUFFER_MULTIPLIER = 1.5
+# Number of recipient query results handled by each task of a bulk send.
+_FAN_OUT_PAGE_SIZE = 500
 _KEY_DELIMITER = ':'
 _MAX_ENQUEUED_HOURS = 3
 _MAX_RETRY_DAYS = 3
@@ -102,6 +115,9 @@ _MAX_RETRY_DAYS = 3
 # hard failure. Used as a brake on runaway queues. Should be larger than the
 # expected cap on the number of retries imposed by taskqueue.
 _RECOVERABLE_FAILURE_CAP = 20
+# Number of emails sent by each batch task of a bulk send. Its notifications
+# and payloads are written in one datastore put, so this must be at most 250.
+_SEND_MAIL_BATCH_SIZE = 100
 _SECONDS_PER_HOUR = 60 * 60
 _SECONDS_PER_DAY = 24 * _SECONDS_PER_HOUR
 _USECS_PER_SECOND = 10 ** 6
@@ -110,6 +126,18 @@ COUNTER_RETENTION_POLICY_RUN = counters.PerfCounter(
     'gcb-notifications-retention-policy-run',
     'number of times a retention policy was run'
 )
+COUNTER_SEND_ASYNC_BULK_PAGE = counters.PerfCounter(
+    'gcb-notifications-send-async-bulk-page',
+    'number of pages of recipients handled by send_async_bulk'
+)
+COUNTER_SEND_ASYNC_BULK_SAVED = counters.PerfCounter(
+    'gcb-notifications-send-async-bulk-saved',
+    'number of notifications saved by send_async_bulk'
+)
+COUNTER_SEND_ASYNC_BULK_START = counters.PerfCounter(
+    'gcb-notifications-send-async-bulk-called',
+    'number of times send_async_bulk has been called'
+)
 COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS = counters.PerfCounter(
     'gcb-notifications-send-async-failed-bad-arguments',
     'number of times send_async failed because arguments were bad'
@@ -126,6 +154,10 @@ COUNTER_SEND_ASYNC_SUCCESS = counters.PerfCounter(
     'gcb-notifications-send-async-success',
     'number of times send_async succeeded'
 )
+COUNTER_SEND_MAIL_BATCH_TASK_STARTED = counters.PerfCounter(
+    'gcb-notifications-send-mail-batch-task-started',
+    'number of times the send mail batch task was dequeued and started'
+)
 COUNTER_SEND_MAIL_TASK_FAILED = counters.PerfCounter(
     'gcb-notifications-send-mail-task-failed',
     'number of times the send mail task failed, but could be retried'
@@ -343,6 +375,26 @@ def send_html_email_sendgrid(sender, to, subject, body, api_key):
     return response
 
 
+class Recipients(object):
+    """The users a notification is sent to by Manager.send_async_bulk().
+
+    Instances are pickled into the tasks of a bulk send, so subclasses must
+    be defined at module level and hold only picklable state.
+    """
+
+    def __init__(self):
+        # Namespace the recipient query runs in; bulk send tasks may not.
+        self.namespace = namespace_manager.get_namespace()
+
+    def get_query(self):
+        """Returns a new db.Query over the entities naming recipients."""
+        raise NotImplementedError()
+
+    def get_email(self, entity):
+        """Returns the email address to notify for entity, or None to skip."""
+        raise NotImplementedError()
+
+
 class Manager(object):
     """Manages state and operation of the notifications subsystem."""
 
@@ -494,6 +546,181 @@ class Manager(object):
 
         return notification_key, payload_key
 
+    @classmethod
+    def send_async_bulk(
+            cls, recipients, sender, intent, body, subject, audit_trail=None,
+            retention_policy=None):
+        """Asyncronously sends the same notification to many recipients.
+
+        Works like send_async() called for every recipient, without the
+        transaction and the task send_async() uses for each one. A task pages
+        through recipients.get_query(), resuming from the cursor of the last
+        page, and writes the notifications and payloads of each page in
+        batches. Each batch is sent by a single task on the intent queue.
+        If the queue settings of the intent set max_emails_per_second, the
+        batches are scheduled so that mail goes out no faster than that.
+
+        Args:
+            recipients: Recipients. The users to notify.
+            sender: string. Email address of the sender; see send_async().
+            intent: string. Intent of the notifications; see send_async().
+            body: string. The data payload of each notification.
+            subject: string. Subject line for the notifications.
+            audit_trail: JSON-serializable object. Audit trail retained for
+                    each notification; see send_async().
+            retention_policy: RetentionPolicy. The retention policy to use;
+                    see send_async().
+
+        Returns:
+            The enqueue_date datetime shared by all the notifications, which
+            Manager.query() reports for them.
+
+        Raises:
+            ValueError: if sender, intent or retention_policy are invalid.
+                    Recipients with malformed email addresses are skipped.
+        """
+        COUNTER_SEND_ASYNC_BULK_START.inc()
+        retention_policy = (
+            retention_policy if retention_policy else RetainAuditTrail)
+
+        if not mail.is_email_valid(sender):
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Malformed email address: "%s"' % sender)
+
+        if retention_policy.NAME not in _RETENTION_POLICIES:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Invalid retention policy: ' +
+                             str(retention_policy))
+
+        try:
+            _IntentProperty.check(intent)
+        except ValueError:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise
+
+        enqueue_date = datetime.datetime.utcnow()
+        job = {
+            'audit_trail': audit_trail,
+            'body': body,
+            'cursor': None,
+            'enqueue_date': enqueue_date,
+            'id': uuid.uuid4().hex,
+            'intent': intent,
+            'max_emails_per_second': cls._get_max_emails_per_second(intent),
+            'num_batches': 0,
+            'num_scheduled': 0,
+            'page': 0,
+            'recipients': recipients,
+            'retention_policy': retention_policy.NAME,
+            'sender': sender,
+            'subject': subject,
+        }
+        cls._defer_once(
+            'notifications-%s-page-0' % job['id'], cls._fan_out_task, job)
+        return enqueue_date
+
+    @classmethod
+    def _fan_out_task(cls, job):
+        with common_utils.Namespace(job['recipients'].namespace):
+            COUNTER_SEND_ASYNC_BULK_PAGE.inc()
+            query = job['recipients'].get_query()
+            if job['cursor']:
+                query.with_cursor(job['cursor'])
+            results = query.fetch(_FAN_OUT_PAGE_SIZE)
+
+            to_list = []
+            seen = set()
+            for entity in results:
+                to = job['recipients'].get_email(entity)
+                if not to or to in seen:
+                    continue
+                if not mail.is_email_valid(to):
+                    COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+                    _LOG.warning(
+                        'Skipping malformed email address "%s" in bulk send '
+                        '%s', to, job['id'])
+                    continue
+                seen.add(to)
+                to_list.append(to)
+
+            for start in xrange(0, len(to_list), _SEND_MAIL_BATCH_SIZE):
+                cls._save_and_enqueue_batch(
+                    job, job['num_batches'] + start / _SEND_MAIL_BATCH_SIZE,
+                    job['num_scheduled'] + start,
+                    to_list[start:start + _SEND_MAIL_BATCH_SIZE])
+
+            if len(results) < _FAN_OUT_PAGE_SIZE:
+                return
+            num_batches = (
+                len(to_list) + _SEND_MAIL_BATCH_SIZE - 1
+                ) / _SEND_MAIL_BATCH_SIZE
+            job = dict(
+                job, cursor=query.cursor(), page=job['page'] + 1,
+                num_batches=job['num_batches'] + num_batches,
+                num_scheduled=job['num_scheduled'] + len(to_list))
+            cls._defer_once(
+                'notifications-%s-page-%s' % (job['id'], job['page']),
+                cls._fan_out_task, job)
+
+    @classmethod
+    def _save_and_enqueue_batch(cls, job, batch_index, num_scheduled, to_list):
+        # A retried page task writes and enqueues the same batches again;
+        # notifications saved by the first attempt may already be sent, so
+        # only the missing ones are written.
+        eta = None
+        if job['max_emails_per_second']:
+            eta = job['enqueue_date'] + datetime.timedelta(
+                seconds=float(num_scheduled) / job['max_emails_per_second'])
+        unsaved = []
+        existing = db.get([
+            db.Key.from_path(Notification.kind(), Notification.key_name(
+                to, job['intent'], job['enqueue_date']))
+            for to in to_list])
+        for to, notification in zip(to_list, existing):
+            if notification:
+                continue
+            # pylint: disable=unbalanced-tuple-unpacking,unpacking-non-sequence
+            notification, payload = cls._make_unsaved_models(
+                job['audit_trail'], job['body'], job['enqueue_date'],
+                job['intent'], job['retention_policy'], job['sender'],
+                job['subject'], to)
+            # The cron must not re-enqueue notifications whose batch is
+            # scheduled for later.
+            cls._mark_enqueued(notification, eta or job['enqueue_date'])
+            unsaved.extend([notification, payload])
+
+        if unsaved:
+            try:
+                db.put(unsaved)
+            except Exception, e:
+                COUNTER_SEND_ASYNC_FAILED_DATASTORE_ERROR.inc()
+                raise e
+            COUNTER_SEND_ASYNC_BULK_SAVED.inc(increment=len(unsaved) / 2)
+
+        cls._defer_once(
+            'notifications-%s-batch-%s' % (job['id'], batch_index),
+            cls._send_mail_batch_task, job['recipients'].namespace,
+            job['intent'], job['enqueue_date'], to_list,
+            _eta=eta, _queue=job['intent'],
+            _retry_options=cls._get_retry_options())
+
+    @classmethod
+    def _defer_once(cls, name, fn, *args, **kwargs):
+        try:
+            deferred.defer(fn, *args, _name=name, **kwargs)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            _LOG.info('Task %s was already enqueued; not adding it again', name)
+
+    @classmethod
+    def _get_max_emails_per_second(cls, queue_id):
+        queue_settings = (
+            email_settings_model.QueueSettingsDAO.get_queue_settings_by_key(
+                queue_id))
+        if queue_settings:
+            return queue_settings.max_emails_per_second
+        return None
+
     @classmethod
     def _make_unsaved_models(
         cls, audit_trail, body, enqueue_date, intent, retention_policy, sender,
@@ -581,28 +808,13 @@ class Manager(object):
 
             raise permanent_failure
 
-        send_mail_fn = None
         from_email = notification.sender
         api_key = None
         if test_send_mail_fn:
             #for test get local test function
             send_mail_fn = test_send_mail_fn
         else:
-            #get email settings for the queue_id
-            queue_settings = email_settings_model.QueueSettingsDAO.get_queue_settings_by_key(queue_id)
-            if queue_settings:
-                queue_email_settings = queue_settings.email_settings
-                api_key = queue_email_settings.api_key
-
-                if queue_email_settings.provider == email_settings_model.APP_ENGINE_EMAIL:
-                    send_mail_fn = send_html_email
-                elif queue_email_settings.provider == email_settings_model.SEND_GRID:
-                    send_mail_fn = send_html_email_sendgrid
-
-        if send_mail_fn is None:
-            #if email settings for the queue is not setup then
-            #use default service
-            send_mail_fn = send_html_email
+            send_mail_fn, api_key = cls._get_send_mail_fn(queue_id)
 
         try:
             send_mail_fn(
@@ -660,6 +872,128 @@ class Manager(object):
 
         COUNTER_SEND_MAIL_TASK_SUCCESS.inc()
 
+    @classmethod
+    def _get_send_mail_fn(cls, queue_id):
+        """Returns (send_mail_fn, api_key) for the email settings of a queue."""
+        send_mail_fn = None
+        api_key = None
+        #get email settings for the queue_id
+        queue_settings = (
+            email_settings_model.QueueSettingsDAO.get_queue_settings_by_key(
+                queue_id))
+        if queue_settings:
+            queue_email_settings = queue_settings.email_settings
+            api_key = queue_email_settings.api_key
+            provider = queue_email_settings.provider
+
+            if provider == email_settings_model.APP_ENGINE_EMAIL:
+                send_mail_fn = send_html_email
+            elif provider == email_settings_model.SEND_GRID:
+                send_mail_fn = send_html_email_sendgrid
+
+        if send_mail_fn is None:
+            #if email settings for the queue is not setup then
+            #use default service
+            send_mail_fn = send_html_email
+        return send_mail_fn, api_key
+
+    @classmethod
+    def _send_mail_batch_task(cls, namespace, intent, enqueue_date, to_list):
+        """Sends the notifications of one batch of a bulk send.
+
+        Unlike _send_mail_task(), a recoverable send failure does not fail
+        the task, because retrying it would send the rest of the batch again.
+        The failure is recorded on the notification instead, and the cron
+        re-enqueues it on its own like any other pending notification.
+        """
+        with common_utils.Namespace(namespace):
+            COUNTER_SEND_MAIL_BATCH_TASK_STARTED.inc()
+            keys = [
+                db.Key.from_path(model.kind(), model.key_name(
+                    to, intent, enqueue_date))
+                for model in (Notification, Payload) for to in to_list]
+            entities = db.get(keys)
+            send_mail_fn, api_key = cls._get_send_mail_fn(intent)
+            now = datetime.datetime.utcnow()
+            changed = []
+            try:
+                for index, notification_key in enumerate(keys[:len(to_list)]):
+                    notification = entities[index]
+                    payload = entities[len(to_list) + index]
+                    if cls._send_batched_mail(
+                            notification_key, notification, payload,
+                            send_mail_fn, api_key, now):
+                        changed.extend([notification, payload])
+            finally:
+                # Record what was sent even if the task is interrupted, so
+                # that a retry does not send it again.
+                if changed:
+                    db.put(changed)
+
+    @classmethod
+    def _send_batched_mail(
+            cls, notification_key, notification, payload, send_mail_fn,
+            api_key, now):
+        """Sends one notification of a batch; returns whether it changed."""
+        COUNTER_SEND_MAIL_TASK_STARTED.inc()
+        if not notification or not payload:
+            _LOG.error(
+                'Notification or payload missing for notification key %s',
+                notification_key)
+            COUNTER_SEND_MAIL_TASK_FAILED_PERMANENTLY.inc()
+            return False
+
+        policy = _RETENTION_POLICIES.get(notification._retention_policy)
+        if not policy:
+            _LOG.error(
+                'Unknown retention policy %s for notification %s',
+                notification._retention_policy, notification.key())
+            COUNTER_SEND_MAIL_TASK_FAILED_PERMANENTLY.inc()
+            return False
+
+        if (cls._done(notification) or cls._failed(notification) or
+                cls._sent(notification)):
+            COUNTER_SEND_MAIL_TASK_SKIPPED.inc()
+            COUNTER_SEND_MAIL_TASK_SUCCESS.inc()
+            return False
+
+        failure = None
+        if notification._recoverable_failure_count > _RECOVERABLE_FAILURE_CAP:
+            failure = deferred.PermanentTaskFailure((
+                'Recoverable failure cap (%s) exceeded for notification with '
+                'key %s') % (_RECOVERABLE_FAILURE_CAP, str(notification.key())))
+            _LOG.error(str(failure))
+            COUNTER_SEND_MAIL_TASK_FAILURE_CAP_EXCEEDED.inc()
+        else:
+            try:
+                send_mail_fn(
+                    notification.sender, notification.to, notification.subject,
+                    payload.body, api_key)
+            # Must be vague. pylint: disable=broad-except
+            except Exception, e:
+                if not cls._is_send_mail_error_permanent(e):
+                    notification._recoverable_failure_count += 1
+                    cls._mark_failed(notification, now, e)
+                    _LOG.error(
+                        'Recoverable error encountered when sending '
+                        'notification %s; cron will retry. Error was: %s',
+                        notification.key(), e)
+                    COUNTER_SEND_MAIL_TASK_FAILED.inc()
+                    return True
+                failure = e
+
+        if failure:
+            cls._mark_failed(notification, now, failure, permanent=True)
+            COUNTER_SEND_MAIL_TASK_FAILED_PERMANENTLY.inc()
+        else:
+            cls._mark_sent(notification, now)
+            COUNTER_SEND_MAIL_TASK_SENT.inc()
+        policy.run(notification, payload)
+        cls._mark_done(notification, now)
+        COUNTER_RETENTION_POLICY_RUN.inc()
+        COUNTER_SEND_MAIL_TASK_SUCCESS.inc()
+        return True
+
     @classmethod
     @db.transactional(
             propagation=datastore_rpc.TransactionOptions.INDEPENDENT, xg=True)
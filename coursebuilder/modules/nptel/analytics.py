@@ -24,9 +24,6 @@ import urlparse
 import StringIO
 import time
 
-from apiclient import errors
-from apiclient.http import MediaIoBaseUpload
-
 from mapreduce import context
 
 from common import csv_unicode
@@ -43,8 +40,7 @@ from models import transforms
 from models import utils
 from models import data_sources
 from models import analytics
-from modules.google_service_account import google_service_account
-from modules.nptel import settings
+from modules.nptel import report_writer
 
 from models.models import PersonalProfile
 from models.models import Student
@@ -52,43 +48,6 @@ from models.models import StudentProfileDAO
 from models.course_list import CourseListDAO
 
 
-# ID of directory where all the generated student file list are stored.
-_PARENT_ID = "0B0CGOzyU-WMVNDM5R0dZNjBXREk"
-
-
-def get_folder_id(course_info):
-    if not course_info:
-        return _PARENT_ID
-    nptel_settings = course_info.get(settings.NPTEL_SECTION, dict())
-    folder_id = nptel_settings.get(settings.DUMP_FOLDER_ID, _PARENT_ID)
-    if folder_id.strip():
-        return folder_id
-    return _PARENT_ID
-
-
-def insert_file(title, description, content, course_info):
-    """Insert new file to gdrive."""
-    body = {'title' : title, 'description': description}
-    body['parents'] = [{'id': get_folder_id(course_info)}]
-    media = MediaIoBaseUpload(content, mimetype='text/csv', resumable=True)
-    try:
-        drive_service = google_service_account.GoogleServiceManager.get_service(
-            name='drive', version='v2')
-        if not drive_service:
-            logging.error('Drive service not defined')
-            return None
-        drive = drive_service.files()
-        out = drive.insert(
-            body=body,
-            media_body=media).execute()
-        return out
-    except errors.HttpError, error:
-        logging.error('An error occured: %s' % error)
-        return None
-    finally:
-        logging.info('cleanup')
-
-
 class ProfileDataDumpMapReduce(jobs.MapReduceJob):
     """A job that dumps the profile information per course"""
 
@@ -165,7 +124,7 @@ class ProfileDataDumpMapReduce(jobs.MapReduceJob):
         c = courses.Course(None, app_context=app_context)
         settings = c.get_environ(app_context)
 
-        insert_file(filename, '', output, settings)
+        report_writer.insert_file(filename, '', output, settings)
         output.close()
 
 
@@ -191,15 +150,30 @@ class PerCourseCourseDurableJob(jobs.DurableJob):
         return courses.Course(None, app_context=self._app_context)
 
 
-class ComputeStudentReport(PerCourseCourseDurableJob):
+class PerCourseReportJob(report_writer.CsvReportJob):
+    """A sharded CSV report over the students of one course."""
+
+    @property
+    def _course(self):
+        return courses.Course(None, app_context=self._app_context)
+
+    @staticmethod
+    def entity_class():
+        return Student
+
+
+class ComputeStudentReport(PerCourseReportJob):
     """A job that computes student statistics."""
 
-    def __init__(self, app_context):
-        super(ComputeStudentReport, self).__init__(app_context)
-        self._app_context = app_context
+    def __init__(self, app_context, storage=None):
+        super(ComputeStudentReport, self).__init__(app_context, storage=storage)
         self._unit_id_to_title_list = []
         self._update_units()
 
+    @staticmethod
+    def get_description():
+        return 'student report'
+
     def _update_units(self):
         for unit in self._course.get_units():
             if unit.scored():
@@ -217,14 +191,12 @@ class ComputeStudentReport(PerCourseCourseDurableJob):
     class StudentRow(object):
         """Aggregates scores statistics."""
 
-        def __init__(self, output, unit_id_to_title_list):
-            self._output = output
+        def __init__(self, unit_id_to_title_list):
             self._unit_id_to_title_list = unit_id_to_title_list
 
         def get_scores_row(self, student):
             scores_row = []
-            score_dict = (
-                transforms.loads(student.scores) if student.scores else dict())
+            score_dict = student.get_scores()
             for u in self._unit_id_to_title_list:
                 unit_name = str(u[0])
                 score = ''
@@ -233,36 +205,27 @@ class ComputeStudentReport(PerCourseCourseDurableJob):
                 scores_row.append(score)
             return scores_row
 
-        def visit(self, student):
+        def get_row(self, student):
             basic_info_row = [student.email, student.user_id]
-            scores_row = self.get_scores_row(student)
-            self._output.writerow(basic_info_row + scores_row)
-
-    def run(self):
-        """Computes student statistics."""
-        output = StringIO.StringIO()
-        writer = csv_unicode.UnicodeWriter(
-            output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            return basic_info_row + self.get_scores_row(student)
 
+    def get_header_row(self):
         head_row = ['email', 'user id']
         for u in self._unit_id_to_title_list:
             head_row.append(u[1] + '(' + str(u[0]) + ')')
-        writer.writerow(head_row)
-
-        student_row = self.StudentRow(writer, self._unit_id_to_title_list)
+        return head_row
 
-        mapper = utils.QueryMapper(
-            Student.all(), batch_size=500, report_every=1000)
+    def get_report_title(self):
+        return '%s_%s.csv' % (
+            self._namespace, time.strftime("%d-%m-%Y_%H-%M"))
 
-        def map_fn(student):
-            student_row.visit(student)
+    def build_row_params(self, unused_app_context):
+        return {'unit_id_to_title_list': self._unit_id_to_title_list}
 
-        mapper.run(map_fn)
-
-        filename = '%s_%s.csv' % (self._namespace, time.strftime("%d-%m-%Y_%H-%M"))
-        settings = self._course.get_environ(self._app_context)
-        file = insert_file(filename, '', output, settings)
-        output.close()
+    @staticmethod
+    def build_row(student, row_params):
+        return ComputeStudentReport.StudentRow(
+            row_params['unit_id_to_title_list']).get_row(student)
 
 
 class SaveCourseSettings(PerCourseCourseDurableJob):
@@ -277,16 +240,21 @@ class SaveCourseSettings(PerCourseCourseDurableJob):
         self._course.save_settings(settings)
 
 
-class ComputeQualificationForMains(PerCourseCourseDurableJob):
+class ComputeQualificationForMains(PerCourseReportJob):
     """A job that computes student Qualification."""
 
-    def __init__(self, app_context):
-        super(ComputeQualificationForMains, self).__init__(app_context)
+    def __init__(self, app_context, storage=None):
+        super(ComputeQualificationForMains, self).__init__(
+            app_context, storage=storage)
         self._first_cutoff_units = set()
         self._second_cutoff_units = set()
         self._unit_to_multiplier = dict()
         self._update_units()
 
+    @staticmethod
+    def get_description():
+        return 'qualified students'
+
     def _add_subunits(self, punit_id, l):
         for unit in self._course.get_subunits(punit_id):
             if not unit.now_available:
@@ -310,8 +278,7 @@ class ComputeQualificationForMains(PerCourseCourseDurableJob):
     class StudentRow(object):
         """Aggregates scores statistics."""
 
-        def __init__(self, output, multiplier, first_cutoff_units, second_cutoff_units):
-            self._output = output
+        def __init__(self, multiplier, first_cutoff_units, second_cutoff_units):
             self._multiplier = multiplier
             self._first_cutoff_units = first_cutoff_units
             self._second_cutoff_units = second_cutoff_units
@@ -328,13 +295,12 @@ class ComputeQualificationForMains(PerCourseCourseDurableJob):
                     return True
             return False
 
-        def visit(self, student):
+        def get_row(self, student):
             if not student.is_enrolled:
-                return
+                return None
             write_output = False
             cleared_row_info = [student.email, student.user_id]
-            score_dict = (
-                transforms.loads(student.scores) if student.scores else dict())
+            score_dict = student.get_scores()
 
             if self.clears_cutoff(score_dict, self._first_cutoff_units):
                 cleared_row_info += [True]
@@ -349,40 +315,36 @@ class ComputeQualificationForMains(PerCourseCourseDurableJob):
                 cleared_row_info += [False]
 
             if write_output:
-                self._output.writerow(cleared_row_info)
-
-
-    def run(self):
-        """Computes student statistics."""
-        output = StringIO.StringIO()
-        writer = csv_unicode.UnicodeWriter(
-            output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                return cleared_row_info
+            return None
 
-        head_row = ['email', 'user id', 'Qualified in First', 'Qualified in Second']
-        writer.writerow(head_row)
+    def get_header_row(self):
+        return ['email', 'user id', 'Qualified in First', 'Qualified in Second']
 
-        student_row = self.StudentRow(
-            writer, self._unit_to_multiplier, self._first_cutoff_units,
-            self._second_cutoff_units)
+    def get_report_title(self):
+        return 'qualified_%s_%s.csv' % (
+            self._namespace, time.strftime("%d-%m-%Y_%H-%M"))
 
-        mapper = utils.QueryMapper(
-            Student.all(), batch_size=500, report_every=1000)
+    def build_row_params(self, unused_app_context):
+        return {
+            'unit_to_multiplier': self._unit_to_multiplier,
+            'first_cutoff_units': list(self._first_cutoff_units),
+            'second_cutoff_units': list(self._second_cutoff_units),
+        }
 
-        def map_fn(student):
-            student_row.visit(student)
-
-        mapper.run(map_fn)
-
-        filename = 'qualified_%s_%s.csv' % (self._namespace, time.strftime("%d-%m-%Y_%H-%M"))
-        settings = self._course.get_environ(self._app_context)
-        file = insert_file(filename, '', output, settings)
-        output.close()
+    @staticmethod
+    def build_row(student, row_params):
+        return ComputeQualificationForMains.StudentRow(
+            row_params['unit_to_multiplier'],
+            row_params['first_cutoff_units'],
+            row_params['second_cutoff_units']).get_row(student)
 
 
-class DumpStudentProfile(jobs.DurableJob):
+class DumpStudentProfile(report_writer.CsvReportJob):
     """A job that computes student statistics."""
 
-    def __init__(self, app_context):
+    def __init__(self, app_context, storage=None):
+        self._app_context = app_context
         self._namespace = ''
         if app_context:
             self._course = courses.Course(None, app_context=app_context)
@@ -394,22 +356,30 @@ class DumpStudentProfile(jobs.DurableJob):
             self._course_namespace = ''
         self._job_name = 'job-%s-%s' % (
             self.__class__.__name__, self._course_namespace)
+        self._storage = storage or report_writer.get_default_storage()
+
+    @staticmethod
+    def get_description():
+        return 'student profiles'
+
+    @staticmethod
+    def entity_class():
+        return PersonalProfile
 
     class StudentRow(object):
         """Aggregates scores statistics."""
 
-        def __init__(self, output, course_namespace):
-            self._output = output
+        def __init__(self, course_namespace):
             self._course_namespace = course_namespace
 
-        def visit(self, profile):
+        def get_row(self, profile):
             if not profile.enrollment_info:
-                return
+                return None
             enrollment_info = transforms.loads(profile.enrollment_info)
-	    if (self._course_namespace and self._course_namespace not in
+            if (self._course_namespace and self._course_namespace not in
                 enrollment_info.keys()):
-                return
-            self._output.writerow([
+                return None
+            return [
                 profile.email, profile.user_id, profile.nick_name,
                 profile.age_group,
                 profile.mobile_number,
@@ -417,31 +387,29 @@ class DumpStudentProfile(jobs.DurableJob):
                 profile.city_of_residence, profile.name_of_college,
                 profile.college_roll_no, profile.local_chapter,
                 profile.college_id,profile.graduation_year,
-                profile.profession,profile.employer_name])
+                profile.profession,profile.employer_name]
 
-    def run(self):
-        """Computes student statistics."""
-        output = StringIO.StringIO()
-        writer = csv_unicode.UnicodeWriter(
-            output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        writer.writerow([
-	    'email', 'user id', 'name', 'age_group', 'mobile_number',
-	    'country', 'state', 'city', 'college', 'college_roll_no',
-            'local_chapter','college_id' ,'graduation year', 'profession', 'employer name'])
-        student_row = self.StudentRow(writer, self._course_namespace)
+    def get_header_row(self):
+        return [
+            'email', 'user id', 'name', 'age_group', 'mobile_number',
+            'country', 'state', 'city', 'college', 'college_roll_no',
+            'local_chapter', 'college_id', 'graduation year', 'profession',
+            'employer name']
 
-        mapper = utils.QueryMapper(
-            PersonalProfile.all(), batch_size=500, report_every=1000)
+    def get_report_title(self):
+        return 'profile_%s_%s.csv' % (
+            self._course_namespace, time.strftime("%d-%m-%Y_%H-%M"))
 
-        def map_fn(student):
-            student_row.visit(student)
+    def get_course_info(self):
+        return self._settings
 
-        mapper.run(map_fn)
+    def build_row_params(self, unused_app_context):
+        return {'course_namespace': self._course_namespace}
 
-	filename = 'profile_%s_%s.csv' % (self._course_namespace,
-			time.strftime("%d-%m-%Y_%H-%M"))
-        file = insert_file(filename, '', output, self._settings)
-        output.close()
+    @staticmethod
+    def build_row(profile, row_params):
+        return DumpStudentProfile.StudentRow(
+            row_params['course_namespace']).get_row(profile)
 
 
 class ReIndexStudentProfile(jobs.DurableJob):
@@ -60,16 +60,20 @@ function gcbAssessmentAudit(data_dict) {
   gcbAudit(gcbCanPostEvents, data_dict, 'attempt-assessment', true);
 }
 
-function gcbAudit(can_post, data_dict, source, is_async) {
-  // There may be a course-specific config to save $$ by preventing us
-  // from emitting too much volume to AppEngine; respect that setting.
-  if (can_post) {
-    data_dict['location'] = '' + window.location;
-    data_dict['loc'] = {}
-    data_dict['loc']['page_locale'] = $('body').data('gcb-page-locale')
+// Events waiting to be posted together; see gcbFlushEvents().
+var gcbPendingEvents = [];
+var gcbEventFlushTimer = null;
+var GCB_EVENT_BATCH_DELAY_MS = 2000;
+var GCB_MAX_EVENTS_PER_BATCH = 100;
+
+function gcbFlushEvents(is_async) {
+  if (gcbEventFlushTimer) {
+    clearTimeout(gcbEventFlushTimer);
+    gcbEventFlushTimer = null;
+  }
+  while (gcbPendingEvents.length) {
     var request = {
-        'source': source,
-        'payload': JSON.stringify(data_dict),
+        'events': gcbPendingEvents.splice(0, GCB_MAX_EVENTS_PER_BATCH),
         'xsrf_token': eventXsrfToken};
     $.ajax({
         url: 'rest/events',
@@ -80,6 +84,30 @@ function gcbAudit(can_post, data_dict, source, is_async) {
         error: function(){}
     });
   }
+}
+
+function gcbAudit(can_post, data_dict, source, is_async) {
+  // There may be a course-specific config to save $$ by preventing us
+  // from emitting too much volume to AppEngine; respect that setting.
+  if (can_post) {
+    data_dict['location'] = '' + window.location;
+    data_dict['loc'] = {}
+    data_dict['loc']['page_locale'] = $('body').data('gcb-page-locale')
+    gcbPendingEvents.push({
+        'source': source,
+        'payload': JSON.stringify(data_dict)});
+
+    // Asynchronous events are posted in batches, a little later; anything
+    // still pending goes out with the next synchronous event.
+    if (!is_async || gcbPendingEvents.length >= GCB_MAX_EVENTS_PER_BATCH) {
+      gcbFlushEvents(is_async);
+    } else if (!gcbEventFlushTimer) {
+      gcbEventFlushTimer = setTimeout(function() {
+        gcbEventFlushTimer = null;
+        gcbFlushEvents(true);
+      }, GCB_EVENT_BATCH_DELAY_MS);
+    }
+  }
 
   // ----------------------------------------------------------------------
   // Report to the Google Tag manager, if it's configured.  The 'dataLayer'
@@ -907,4 +935,6 @@ $(window).unload(function() {
     // duration is in milliseconds
     gcbPageEventAudit({'duration': (new Date() - gcbBeginningOfTime)}, 'exit-page');
   } catch (e){}
+  // page events may be turned off; post whatever else is still pending
+  gcbFlushEvents(false);
 });
@@ -0,0 +1,466 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharded generation of CSV reports that are uploaded to Google Drive.
+
+A report is a map/reduce job. Every mapper slice turns its entities into CSV
+rows and writes them to a part file in shard storage (Cloud Storage, or a
+local directory in tests). The single reducer streams the header and all the
+part files, in order, to Drive as one resumable upload and then deletes the
+parts. No task ever holds more than one part of the report in memory.
+
+To add a report, extend CsvReportJob:
+
+    class EnrolledStudents(report_writer.CsvReportJob):
+
+        @staticmethod
+        def get_description():
+            return 'enrolled students'
+
+        @staticmethod
+        def entity_class():
+            return models.Student
+
+        def get_header_row(self):
+            return ['email']
+
+        def get_report_title(self):
+            return 'enrolled_%s.csv' % self._namespace
+
+        @staticmethod
+        def build_row(student, unused_row_params):
+            if student.is_enrolled:
+                return [student.email]
+            return None
+"""
+
+__author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
+
+import csv
+import logging
+import os
+import StringIO
+import time
+
+from apiclient import errors
+from apiclient.http import MediaIoBaseUpload
+import cloudstorage
+
+from mapreduce import context
+from mapreduce import model as mapreduce_model
+from mapreduce import util as mapreduce_util
+
+from common import csv_unicode
+from models import counters
+from models import courses
+from models import jobs
+from modules.google_service_account import google_service_account
+from modules.nptel import settings
+
+from google.appengine.api import app_identity
+
+
+# ID of directory where all the generated student file list are stored.
+_PARENT_ID = "0B0CGOzyU-WMVNDM5R0dZNjBXREk"
+
+# Drive needs resumable upload chunks to be multiples of 256KB.
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024
+
+REPORT_KEY = 'report'
+SHARD_DIR = 'nptel-reports'
+
+COUNTER_ROWS_WRITTEN = counters.PerfCounter(
+    'gcb-nptel-report-rows-written',
+    'number of CSV rows written to report shards')
+COUNTER_PARTS_WRITTEN = counters.PerfCounter(
+    'gcb-nptel-report-parts-written',
+    'number of report part files written to shard storage')
+COUNTER_BYTES_UPLOADED = counters.PerfCounter(
+    'gcb-nptel-report-bytes-uploaded',
+    'number of bytes of CSV reports uploaded to Drive')
+
+
+def get_folder_id(course_info):
+    if not course_info:
+        return _PARENT_ID
+    nptel_settings = course_info.get(settings.NPTEL_SECTION, dict())
+    folder_id = nptel_settings.get(settings.DUMP_FOLDER_ID, _PARENT_ID)
+    if folder_id.strip():
+        return folder_id
+    return _PARENT_ID
+
+
+def insert_file(title, description, content, course_info, folder_id=None):
+    """Insert new file to gdrive.
+
+    The content is sent in chunks of UPLOAD_CHUNK_SIZE bytes and read from the
+    stream only as each chunk goes out, so it may be larger than memory.
+    """
+    body = {'title' : title, 'description': description}
+    body['parents'] = [{'id': folder_id or get_folder_id(course_info)}]
+    media = MediaIoBaseUpload(
+        content, mimetype='text/csv', chunksize=UPLOAD_CHUNK_SIZE,
+        resumable=True)
+    start = time.time()
+    try:
+        drive_service = google_service_account.GoogleServiceManager.get_service(
+            name='drive', version='v2')
+        if not drive_service:
+            logging.error('Drive service not defined')
+            return None
+        request = drive_service.files().insert(body=body, media_body=media)
+        out = None
+        while out is None:
+            status, out = request.next_chunk()
+            if status:
+                _log_progress(title, status.resumable_progress,
+                              status.total_size, start)
+        COUNTER_BYTES_UPLOADED.inc(media.size())
+        _log_progress(title, media.size(), media.size(), start)
+        return out
+    except errors.HttpError, error:
+        logging.error('An error occured: %s' % error)
+        return None
+    finally:
+        logging.info('cleanup')
+
+
+def _log_progress(title, done, total, start):
+    elapsed = max(time.time() - start, 0.001)
+    logging.info(
+        'Uploading %s: %d of %d bytes (%d%%), %.1f KB/s', title, done, total,
+        100 * done / max(total, 1), done / elapsed / 1024)
+
+
+def _encode_rows(rows):
+    output = StringIO.StringIO()
+    writer = csv_unicode.UnicodeWriter(
+        output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+class GcsShardStorage(object):
+    """Keeps report parts in a Cloud Storage bucket."""
+
+    KIND = 'gcs'
+
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def to_params(self):
+        return {'kind': self.KIND, 'bucket': self._bucket}
+
+    def _path(self, name):
+        return '/%s/%s' % (self._bucket, name)
+
+    def write(self, name, content):
+        with cloudstorage.open(
+            self._path(name), 'w', content_type='text/csv') as gcs_file:
+            gcs_file.write(content)
+
+    def get_size(self, name):
+        """Returns the size of a part, or None if it was never written."""
+        try:
+            return cloudstorage.stat(self._path(name)).st_size
+        except cloudstorage.NotFoundError:
+            return None
+
+    def open(self, name):
+        return cloudstorage.open(self._path(name))
+
+    def delete(self, name):
+        try:
+            cloudstorage.delete(self._path(name))
+        except cloudstorage.NotFoundError:
+            pass
+
+
+class LocalShardStorage(object):
+    """Keeps report parts in a local directory; a stand-in for tests."""
+
+    KIND = 'local'
+
+    def __init__(self, root):
+        self._root = root
+
+    def to_params(self):
+        return {'kind': self.KIND, 'root': self._root}
+
+    def _path(self, name):
+        return os.path.join(self._root, *name.split('/'))
+
+    def write(self, name, content):
+        path = self._path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as local_file:
+            local_file.write(content)
+
+    def get_size(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        return os.path.getsize(path)
+
+    def open(self, name):
+        return open(self._path(name), 'rb')
+
+    def delete(self, name):
+        path = self._path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def get_default_storage():
+    return GcsShardStorage(app_identity.get_default_gcs_bucket_name())
+
+
+def storage_from_params(params):
+    if params['kind'] == LocalShardStorage.KIND:
+        return LocalShardStorage(params['root'])
+    return GcsShardStorage(params['bucket'])
+
+
+class ConcatenatedStream(object):
+    """A read-only, seekable stream over a sequence of parts.
+
+    Each part is a (size, opener) pair; opener() returns a file-like object
+    positioned at the start of the part. Only the part that is being read is
+    open at any time, which lets a resumable upload stream any number of
+    report shards without copying them into a single file first.
+    """
+
+    def __init__(self, parts):
+        self._parts = list(parts)
+        self._starts = []
+        self._size = 0
+        for size, _ in self._parts:
+            self._starts.append(self._size)
+            self._size += size
+        self._position = 0
+        self._open_index = None
+        self._open_file = None
+
+    @property
+    def size(self):
+        return self._size
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._position = min(max(offset, 0), self._size)
+
+    def _get_file(self, index):
+        if self._open_index != index:
+            self.close()
+            self._open_file = self._parts[index][1]()
+            self._open_index = index
+        return self._open_file
+
+    def _find_part(self, position):
+        index = len(self._starts) - 1
+        while self._starts[index] > position:
+            index -= 1
+        return index
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self._size - self._position
+        chunks = []
+        while size > 0 and self._position < self._size:
+            index = self._find_part(self._position)
+            offset = self._position - self._starts[index]
+            part_file = self._get_file(index)
+            part_file.seek(offset)
+            data = part_file.read(min(size, self._parts[index][0] - offset))
+            if not data:
+                raise IOError('Report part %s ended early.' % index)
+            chunks.append(data)
+            self._position += len(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+    def close(self):
+        if self._open_file is not None:
+            self._open_file.close()
+        self._open_file = None
+        self._open_index = None
+
+
+class _CsvShardPool(context.Pool):
+    """Buffers the CSV rows of a mapper slice and writes them as part files.
+
+    Part names sort in shard, slice and part order, and a retried slice
+    rewrites the same names, so the reducer never sees duplicate rows.
+    """
+
+    POOL_KEY = 'nptel-csv-report-shard'
+    MAX_PART_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, mapper_context):
+        params = mapper_context.mapreduce_spec.mapper.params
+        self.job_class = mapreduce_util.for_name(params['report_job_class'])
+        self.row_params = params['report_row_params']
+        self._storage = storage_from_params(params['report_storage'])
+        self._counters = mapper_context.counters
+        # The stored state of the shard was written when the slice took its
+        # lease, so it names the slice that is running.
+        shard_state = mapreduce_model.ShardState.get_by_shard_id(
+            mapper_context.shard_id)
+        self._name_prefix = '%s/%s/shard-%05d-slice-%05d' % (
+            SHARD_DIR, mapper_context.mapreduce_id, shard_state.shard_number,
+            shard_state.slice_id)
+        self._part_number = 0
+        self._rows = []
+        self._num_bytes = 0
+
+    @classmethod
+    def get(cls):
+        mapper_context = context.get()
+        pool = mapper_context.get_pool(cls.POOL_KEY)
+        if pool is None:
+            pool = cls(mapper_context)
+            mapper_context.register_pool(cls.POOL_KEY, pool)
+        return pool
+
+    def _part_name(self):
+        return '%s-part-%03d.csv' % (self._name_prefix, self._part_number)
+
+    def append(self, row):
+        """Adds a row; returns the part name when the row starts a new part."""
+        new_part = None
+        if not self._rows:
+            new_part = self._part_name()
+        encoded = _encode_rows([row])
+        self._rows.append(encoded)
+        self._num_bytes += len(encoded)
+        if self._num_bytes >= self.MAX_PART_BYTES:
+            self.flush()
+        return new_part
+
+    def flush(self):
+        if not self._rows:
+            return
+        content = ''.join(self._rows)
+        self._storage.write(self._part_name(), content)
+        self._counters.increment('report-rows-written', len(self._rows))
+        self._counters.increment('report-bytes-written', len(content))
+        COUNTER_ROWS_WRITTEN.inc(len(self._rows))
+        COUNTER_PARTS_WRITTEN.inc()
+        self._part_number += 1
+        self._rows = []
+        self._num_bytes = 0
+
+
+class CsvReportJob(jobs.MapReduceJob):
+    """A map/reduce job that writes one CSV row per entity to Drive.
+
+    Subclasses provide entity_class(), get_header_row(), get_report_title()
+    and a static build_row(); anything build_row() needs besides the entity
+    is computed once by build_row_params() when the job is submitted.
+    Entities for which build_row() returns None are left out of the report.
+    A report is only uploaded when at least one row was written.
+    """
+
+    def __init__(self, app_context, storage=None):
+        super(CsvReportJob, self).__init__(app_context)
+        self._storage = storage or get_default_storage()
+
+    def get_header_row(self):
+        raise NotImplementedError(
+            'Classes derived from CsvReportJob must implement get_header_row()')
+
+    def get_report_title(self):
+        raise NotImplementedError(
+            'Classes derived from CsvReportJob must implement '
+            'get_report_title()')
+
+    def get_course_info(self):
+        """Returns the course settings that name the Drive folder to use."""
+        return courses.Course.get_environ(self._app_context)
+
+    def build_row_params(self, unused_app_context):
+        """Returns plain data made available to build_row()."""
+        return {}
+
+    @staticmethod
+    def build_row(unused_item, unused_row_params):
+        """Returns the CSV row for an entity, or None to skip it."""
+        raise NotImplementedError(
+            'Classes derived from CsvReportJob must implement build_row() as '
+            'a @staticmethod.')
+
+    def build_additional_mapper_params(self, app_context):
+        return {
+            'report_job_class': '%s.%s' % (
+                self.__class__.__module__, self.__class__.__name__),
+            'report_row_params': self.build_row_params(app_context),
+            'report_storage': self._storage.to_params(),
+            'report_title': self.get_report_title(),
+            'report_header': self.get_header_row(),
+            'report_folder_id': get_folder_id(self.get_course_info()),
+        }
+
+    @staticmethod
+    def map(item):
+        pool = _CsvShardPool.get()
+        row = pool.job_class.build_row(item, pool.row_params)
+        if row is None:
+            return
+        new_part = pool.append(row)
+        if new_part:
+            yield (REPORT_KEY, new_part)
+
+    @staticmethod
+    def reduce(unused_key, part_names):
+        params = context.get().mapreduce_spec.mapper.params
+        storage = storage_from_params(params['report_storage'])
+        header = _encode_rows([params['report_header']])
+
+        parts = [(len(header), lambda: StringIO.StringIO(header))]
+        part_names = sorted(set(part_names))
+        for name in part_names:
+            size = storage.get_size(name)
+            if size is None:
+                logging.warning('Report part %s is missing.', name)
+                continue
+            parts.append((size, lambda name=name: storage.open(name)))
+
+        stream = ConcatenatedStream(parts)
+        start = time.time()
+        try:
+            out = insert_file(
+                params['report_title'], '', stream, None,
+                folder_id=params['report_folder_id'])
+        finally:
+            stream.close()
+        elapsed = max(time.time() - start, 0.001)
+        num_bytes = stream.size
+
+        if out:
+            for name in part_names:
+                storage.delete(name)
+        yield (params['report_title'], {
+            'uploaded': bool(out),
+            'parts': len(parts) - 1,
+            'bytes': num_bytes,
+            'seconds': round(elapsed, 1),
+            'kb_per_second': round(num_bytes / elapsed / 1024, 1),
+        })
@@ -0,0 +1,282 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Concurrent dispatch of code evaluation requests to nsjail servers.
+
+A single submission used to be one blocking HTTP round trip. The dispatcher
+keeps a bounded number of asynchronous urlfetch RPCs in flight per nsjail
+backend, coalesces identical requests into one RPC, and hands back replies in
+the order they complete, so a batch of submissions costs roughly as much as
+its slowest member rather than the sum of all of them.
+"""
+
+__author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
+
+import collections
+import hashlib
+import json
+import logging
+
+from google import protobuf
+
+from models import config
+from models import counters
+from modules.nsjail.proto import request_pb2
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import urlfetch
+
+
+NSJAIL_MAX_CONCURRENT_REQUESTS = config.ConfigProperty(
+    'nsjail_max_concurrent_requests_per_backend', int,
+    'The maximum number of evaluation requests that are sent concurrently to '
+    'a single nsjail server.', 4)
+
+DEFAULT_TIMEOUT = 10
+
+COUNTER_REQUESTS_SENT = counters.PerfCounter(
+    'gcb-nsjail-requests-sent',
+    'number of evaluation requests sent to nsjail servers')
+COUNTER_REQUESTS_COALESCED = counters.PerfCounter(
+    'gcb-nsjail-requests-coalesced',
+    'number of evaluation requests answered by an identical in-flight request')
+COUNTER_REQUESTS_RETRIED = counters.PerfCounter(
+    'gcb-nsjail-requests-retried',
+    'number of evaluation requests retried after a deadline was exceeded')
+COUNTER_REQUESTS_FAILED = counters.PerfCounter(
+    'gcb-nsjail-requests-failed',
+    'number of evaluation requests that got no usable reply')
+
+
+def parse_backends(targets):
+    """Splits a comma separated list of nsjail servers into a list."""
+    if not targets:
+        return []
+    return [target.strip() for target in targets.split(',') if target.strip()]
+
+
+def get_settings_dict(lang_settings):
+    settings_dict = {
+        'time_limit': None,
+        'memory_limit': None,
+        'process_limit': None,
+        'compilation_time_limit': None,
+        'compilation_memory_limit': None,
+        'compilation_process_limit': None
+    }
+    if lang_settings:
+        for key, val in lang_settings.iteritems():
+            if val:
+                settings_dict[key] = val
+    return settings_dict
+
+
+def build_code_request(code, filename, tests, lang, lang_settings):
+    """Builds the CodeRequest proto for a submission."""
+    settings_dict = get_settings_dict(lang_settings)
+
+    request_proto = request_pb2.CodeRequest()
+    request_proto.code.full_code = code
+    request_proto.code.filename = filename
+    request_proto.code.binary_filename = '.'.join(filename.split('.')[:-1])
+    request_proto.language = lang
+    if settings_dict['compilation_time_limit']:
+        request_proto.compilation_options.resource_limits.time_limit = (
+            settings_dict['compilation_time_limit'])
+    if settings_dict['compilation_memory_limit']:
+        request_proto.compilation_options.resource_limits.memory_limit = (
+            settings_dict['compilation_memory_limit'])
+    if settings_dict['compilation_process_limit']:
+        request_proto.compilation_options.resource_limits.process_limit = (
+            settings_dict['compilation_process_limit'])
+
+    if settings_dict['time_limit']:
+        request_proto.runtime_options.resource_limits.time_limit = (
+            settings_dict['time_limit'])
+    if settings_dict['memory_limit']:
+        request_proto.runtime_options.resource_limits.memory_limit = (
+            settings_dict['memory_limit'])
+    if settings_dict['process_limit']:
+        request_proto.runtime_options.resource_limits.process_limit = (
+            settings_dict['process_limit'])
+
+    for test in tests:
+        testcase = request_proto.testcases.add()
+        testcase.input = test['input']
+        testcase.output = test['output']
+
+    exec_args = settings_dict.get('exec')
+    compile_args = settings_dict.get('build')
+    if exec_args:
+        request_proto.runtime_options.extra_args.extend(exec_args.split())
+    if compile_args:
+        request_proto.compilation_options.extra_args.extend(
+            compile_args.split())
+    return request_proto
+
+
+def get_min_timeout(lang_settings):
+    """Returns the timeout of the first attempt for a submission."""
+    settings_dict = get_settings_dict(lang_settings)
+    max_time_limit = max(
+        settings_dict['time_limit'],
+        settings_dict['compilation_time_limit'])
+    if max_time_limit:
+        return max_time_limit + 1
+    return DEFAULT_TIMEOUT
+
+
+def build_request_body(request_proto):
+    return json.dumps({
+        'message': protobuf.text_format.MessageToString(request_proto)
+    })
+
+
+class _PendingRequest(object):
+    """A unique request body and every key waiting for its reply."""
+
+    def __init__(self, body, min_timeout):
+        self.body = body
+        self.min_timeout = min_timeout
+        self.keys = []
+        self.attempt_number = 0
+
+    @property
+    def timeout(self):
+        # Each retry waits one more multiple of the minimum timeout.
+        return self.min_timeout * (self.attempt_number + 1)
+
+
+class EvaluationDispatcher(object):
+    """Sends evaluation requests to a pool of nsjail servers concurrently.
+
+    Usage:
+        dispatcher = EvaluationDispatcher(['10.0.0.1', '10.0.0.2'])
+        for key, body, timeout in requests:
+            dispatcher.add(key, body, timeout)
+        for key, response in dispatcher.run():
+            ...
+
+    The response for each key is the decoded JSON reply of the server, or ''
+    when no usable reply could be obtained; this matches what
+    NsjailEvaluator.parse_test_results() expects.
+    """
+
+    def __init__(self, backends, max_concurrent_per_backend=None,
+                 num_attempts=3):
+        if not backends:
+            raise ValueError('At least one nsjail server is required.')
+        if max_concurrent_per_backend is None:
+            max_concurrent_per_backend = NSJAIL_MAX_CONCURRENT_REQUESTS.value
+        self._backends = list(backends)
+        self._max_concurrent = max(1, max_concurrent_per_backend)
+        self._num_attempts = num_attempts
+        self._in_flight = dict((backend, 0) for backend in self._backends)
+        self._pending = collections.OrderedDict()
+
+    def add(self, key, body, min_timeout=DEFAULT_TIMEOUT):
+        """Queues a request; identical bodies share a single RPC."""
+        digest = hashlib.sha1(body).hexdigest()
+        pending = self._pending.get(digest)
+        if pending is None:
+            pending = _PendingRequest(body, min_timeout)
+            self._pending[digest] = pending
+        else:
+            COUNTER_REQUESTS_COALESCED.inc()
+            pending.min_timeout = max(pending.min_timeout, min_timeout)
+        pending.keys.append(key)
+
+    def _pick_backend(self):
+        backend = min(self._backends, key=lambda b: self._in_flight[b])
+        if self._in_flight[backend] >= self._max_concurrent:
+            return None
+        return backend
+
+    def _start(self, pending, backend):
+        rpc = urlfetch.create_rpc(deadline=pending.timeout)
+        urlfetch.make_fetch_call(
+            rpc, 'http://%s' % backend, payload=pending.body,
+            method=urlfetch.POST,
+            headers={
+                'Content-type': 'application/json',
+                'Connection': 'keep-alive'})
+        self._in_flight[backend] += 1
+        COUNTER_REQUESTS_SENT.inc()
+        return rpc
+
+    def _get_response(self, pending, rpc):
+        """Returns (response, retry) for a completed RPC."""
+        try:
+            reply = rpc.get_result()
+        except urlfetch.DeadlineExceededError:
+            if pending.attempt_number + 1 < self._num_attempts:
+                logging.info('deadline exceeded .. retrying')
+                return None, True
+            logging.error(
+                '%s retries done, all failed with deadline exceeded.',
+                self._num_attempts)
+            return '', False
+        except urlfetch.Error, e:
+            logging.error(str(e))
+            return '', False
+        if reply.status_code != 200:
+            logging.error(
+                'nsjail server returned HTTP %s', reply.status_code)
+            return '', False
+        try:
+            return json.loads(reply.content), False
+        except ValueError, e:
+            logging.error(str(e))
+            return '', False
+
+    def run(self):
+        """Yields (key, response) pairs in the order replies arrive."""
+        queue = collections.deque(self._pending.values())
+        self._pending = collections.OrderedDict()
+        rpcs = {}
+
+        while queue or rpcs:
+            while queue:
+                backend = self._pick_backend()
+                if backend is None:
+                    break
+                pending = queue.popleft()
+                rpcs[self._start(pending, backend)] = (pending, backend)
+
+            rpc = apiproxy_stub_map.UserRPC.wait_any(rpcs.keys())
+            pending, backend = rpcs.pop(rpc)
+            self._in_flight[backend] -= 1
+
+            response, retry = self._get_response(pending, rpc)
+            if retry:
+                COUNTER_REQUESTS_RETRIED.inc()
+                pending.attempt_number += 1
+                queue.append(pending)
+                continue
+            if response == '':
+                COUNTER_REQUESTS_FAILED.inc(len(pending.keys))
+            for key in pending.keys:
+                yield key, response
+
+    def run_all(self):
+        """Waits for every queued request; returns a dict of key: response."""
+        return dict(self.run())
+
+
+def parse_reply(response):
+    """Returns the CodeReply proto for a server response, or None."""
+    if not response:
+        return None
+    return protobuf.text_format.Merge(
+        response['message'], request_pb2.CodeReply())
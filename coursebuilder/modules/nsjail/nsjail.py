@@ -23,17 +23,13 @@ __author__ = [
     'Thejesh GN (tgn@google.com)',
     'Rishav Thakker(rthakker@google.com)']
 
-from httplib import HTTPException
 import logging
-import urllib2
-import json
-
-from google import protobuf
 
 from common.schema_fields import SchemaField
 from models import config
 from models import courses
 from models import custom_modules
+from modules.nsjail import dispatcher
 from modules.nsjail.proto import request_pb2
 from modules.programming_assignments import base
 from modules.programming_assignments import evaluator
@@ -68,8 +64,7 @@ class NsjailEvaluator(evaluator.ProgramEvaluator):
             return evaluation_result
 
         # Merge response
-        response_proto = protobuf.text_format.Merge(
-            response['message'], request_pb2.CodeReply())
+        response_proto = dispatcher.parse_reply(response)
 
         # Check for compilation errors
         if (response_proto.compilation_result.status ==
@@ -129,126 +124,77 @@ class NsjailEvaluator(evaluator.ProgramEvaluator):
             evaluation_result.summary = 'All Cases Passed'
         return evaluation_result
 
+    @classmethod
+    def get_backends(cls, nsjail_ip):
+        backends = dispatcher.parse_backends(nsjail_ip)
+        if not backends:
+            backends = dispatcher.parse_backends(NSJAIL_TARGET.value)
+        return backends
+
     @classmethod
     def send_request(cls, nsjail_ip, code, program_name, pa_id, filename, tests,
         lang, lang_settings, num_attempts=3):
-        server_ip = nsjail_ip if nsjail_ip else NSJAIL_TARGET.value
-        request_url = 'http://%s' % server_ip
-
-        settings_dict = {
-            'time_limit': None,
-            'memory_limit': None,
-            'process_limit': None,
-            'compilation_time_limit': None,
-            'compilation_memory_limit': None,
-            'compilation_process_limit': None
-        }
-        if lang_settings:
-            for key, val in lang_settings.iteritems():
-                if val:
-                    settings_dict[key] = val
-
-        request_proto = request_pb2.CodeRequest()
-        request_proto.code.full_code = code
-        request_proto.code.filename = filename
-        request_proto.code.binary_filename = '.'.join(filename.split('.')[:-1])
-        request_proto.language = lang
-        if settings_dict['compilation_time_limit']:
-            request_proto.compilation_options.resource_limits.time_limit = (
-                settings_dict['compilation_time_limit'])
-        if settings_dict['compilation_memory_limit']:
-            request_proto.compilation_options.resource_limits.memory_limit = (
-                settings_dict['compilation_memory_limit'])
-        if settings_dict['compilation_process_limit']:
-            request_proto.compilation_options.resource_limits.process_limit = (
-                settings_dict['compilation_process_limit'])
-
-        if settings_dict['time_limit']:
-            request_proto.runtime_options.resource_limits.time_limit = (
-                settings_dict['time_limit'])
-        if settings_dict['memory_limit']:
-            request_proto.runtime_options.resource_limits.memory_limit = (
-                settings_dict['memory_limit'])
-        if settings_dict['process_limit']:
-            request_proto.runtime_options.resource_limits.process_limit = (
-                settings_dict['process_limit'])
-
-        for test in tests:
-            testcase = request_proto.testcases.add()
-            testcase.input = test['input']
-            testcase.output = test['output']
-
-        exec_args = settings_dict.get('exec')
-        compile_args = settings_dict.get('build')
-        if exec_args:
-            request_proto.runtime_options.extra_args.extend(exec_args.split())
-        if compile_args:
-            request_proto.compilation_options.extra_args.extend(
-                compile_args.split())
-
-        # Build the request
-        request = urllib2.Request(request_url)
-        body = json.dumps({
-            'message': protobuf.text_format.MessageToString(request_proto)
-        })
-        request.add_header('Content-type', 'application/json')
-        request.add_header('Content-length', len(body))
-        request.add_data(body)
-
-        max_time_limit = max(
-            settings_dict['time_limit'],
-            settings_dict['compilation_time_limit'])
-
-        if max_time_limit:
-            min_timeout = max_time_limit + 1
-        else:
-            min_timeout = 10
-
-        for attempt_number in range(num_attempts):
-            try:
-                timeout = min_timeout
-                if 1 == attempt_number:
-                    timeout = min_timeout * 2
-                elif 2 == attempt_number:
-                    timeout = min_timeout * 3
-                response = urllib2.urlopen(request, timeout=timeout).read()
-                return json.loads(response)
-            except urllib2.HTTPError, e:
-                logging.error(str(e))
-                break
-            except urllib2.URLError, e:
-                logging.error(str(e))
-                break
-            except HTTPException, e:
-                err = str(e)
-                if not err.startswith(
-                    'Deadline exceeded while waiting for HTTP response'):
-                    break
-                if 2 == attempt_number:
-                    logging.error(
-                        '3 retries done, all failed with deadline exceeded.')
-                else:
-                    logging.info('deadline exceeded .. retrying')
-        return ''
+        responses = cls.send_requests(
+            nsjail_ip, [(None, code, filename, tests, lang, lang_settings)],
+            num_attempts=num_attempts)
+        return responses.get(None, '')
 
+    @classmethod
+    def send_requests(cls, nsjail_ip, requests, num_attempts=3):
+        """Evaluates many submissions concurrently.
+
+        Args:
+            nsjail_ip: comma separated nsjail servers; NSJAIL_TARGET if empty.
+            requests: list of (key, code, filename, tests, lang, lang_settings).
+            num_attempts: number of times a timed out request is sent.
+        Returns:
+            A dict of key to the server response ('' on failure).
+        """
+        backends = cls.get_backends(nsjail_ip)
+        if not backends:
+            logging.error('No nsjail server configured.')
+            return dict((request[0], '') for request in requests)
+
+        request_dispatcher = dispatcher.EvaluationDispatcher(
+            backends, num_attempts=num_attempts)
+        for key, code, filename, tests, lang, lang_settings in requests:
+            request_proto = dispatcher.build_code_request(
+                code, filename, tests, lang, lang_settings)
+            request_dispatcher.add(
+                key, dispatcher.build_request_body(request_proto),
+                dispatcher.get_min_timeout(lang_settings))
+        return request_dispatcher.run_all()
 
     @classmethod
     def evalute_code(cls, course, course_settings, unit, full_code,
                      program_name, test_id, filename, tests,
                      ignore_presentation_errors, lang):
-        course_language_settings = None
-        if course_settings.has_key("allowed_languages"):
-            for language_settings in course_settings.get("allowed_languages"):
-                if language_settings['language'] == lang:
-                    course_language_settings = language_settings
-                    break
-
+        course_language_settings = cls.get_course_language_settings(
+            course_settings, lang)
         response = cls.send_request(
             course_settings.get(NSJAIL_SERVER), full_code, program_name,
             test_id, filename, tests, lang, course_language_settings)
         return cls.parse_test_results(
             course, unit, tests, response, ignore_presentation_errors, filename)
 
+    @classmethod
+    def evalute_codes(cls, course, course_settings, unit, requests):
+        requests_to_send = []
+        for index, request in enumerate(requests):
+            requests_to_send.append((
+                index, request.full_code, request.filename, request.tests,
+                request.lang, cls.get_course_language_settings(
+                    course_settings, request.lang)))
+        responses = cls.send_requests(
+            course_settings.get(NSJAIL_SERVER), requests_to_send)
+
+        results = []
+        for index, request in enumerate(requests):
+            results.append(cls.parse_test_results(
+                course, unit, request.tests, responses.get(index, ''),
+                request.ignore_presentation_errors, request.filename))
+        return results
+
 
 custom_module = None
 
@@ -0,0 +1,148 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A fake nsjail programming server for local benchmarking.
+
+The server accepts the same JSON-wrapped CodeRequest as a real nsjail server
+and answers every test case as passed after a configurable delay, which
+stands in for compilation and execution time. Run one or more instances,
+point the 'nsjail_target' setting (or the course's nsjail server setting, a
+comma separated list) of a dev_appserver at them, and reevaluate an
+assignment:
+
+$ PYTHONPATH=.:lib/google-protobuf.zip python \
+    modules/nsjail/scripts/fake_server.py --port 8081 --latency 2
+
+Statistics about the served requests are printed when the server is stopped
+with Ctrl-C.
+"""
+
+__author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
+
+import argparse
+import BaseHTTPServer
+import json
+import random
+import SocketServer
+import threading
+import time
+
+from google.protobuf import text_format
+
+from modules.nsjail.proto import request_pb2
+
+
+class _Stats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_in_flight = 0
+        self.max_in_flight = 0
+        self.total_seconds = 0.0
+        self.started = time.time()
+
+    def start(self):
+        with self._lock:
+            self.num_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+
+    def finish(self, seconds):
+        with self._lock:
+            self.num_in_flight -= 1
+            self.num_requests += 1
+            self.total_seconds += seconds
+
+    def report(self):
+        elapsed = time.time() - self.started
+        print 'Requests served: %s' % self.num_requests
+        print 'Max concurrent requests: %s' % self.max_in_flight
+        if self.num_requests:
+            print 'Mean handling time: %.3fs' % (
+                self.total_seconds / self.num_requests)
+        if elapsed:
+            print 'Throughput: %.2f requests/s' % (self.num_requests / elapsed)
+
+
+def build_reply(request_proto):
+    reply = request_pb2.CodeReply()
+    reply.compilation_result.status = request_pb2.CodeReply.OK
+    for testcase in request_proto.testcases:
+        test_case_result = reply.test_case_results.add()
+        test_case_result.status = request_pb2.CodeReply.OK
+        test_case_result.actual_output = testcase.output
+    return reply
+
+
+def make_handler(stats, latency, jitter):
+
+    class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            start = time.time()
+            stats.start()
+            try:
+                body = self.rfile.read(int(self.headers['Content-length']))
+                request_proto = text_format.Merge(
+                    json.loads(body)['message'], request_pb2.CodeRequest())
+                time.sleep(max(0, latency + random.uniform(-jitter, jitter)))
+                response = json.dumps({
+                    'message': text_format.MessageToString(
+                        build_reply(request_proto))})
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Content-length', len(response))
+                self.end_headers()
+                self.wfile.write(response)
+            finally:
+                stats.finish(time.time() - start)
+
+        def log_message(self, *unused_args):
+            pass
+
+    return _Handler
+
+
+class _ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--port', default=8081, type=int, help='port to listen on')
+    parser.add_argument(
+        '--latency', default=1.0, type=float,
+        help='seconds spent on each request')
+    parser.add_argument(
+        '--jitter', default=0.0, type=float,
+        help='maximum random deviation from --latency, in seconds')
+    args = parser.parse_args()
+
+    stats = _Stats()
+    server = _ThreadedServer(
+        ('', args.port), make_handler(stats, args.latency, args.jitter))
+    print 'Fake nsjail server listening on port %s' % args.port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stats.report()
+
+
+if __name__ == '__main__':
+    main()
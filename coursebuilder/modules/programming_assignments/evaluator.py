@@ -19,10 +19,14 @@ __author__ = [
     'Ambika Agarwal (ambikaagarwal@google.com)']
 
 
+import hashlib
 import logging
 
+from models import config
+from models import counters
 from models import utils
 from models import transforms
+from models.models import MemcacheManager
 import base
 from prog_models import ProgrammingAnswersEntity
 from prog_models import ProgrammingSumissionEntity
@@ -33,6 +37,75 @@ from google.appengine.ext import db
 import result
 
 
+CAN_CACHE_EVALUATION_RESULTS = config.ConfigProperty(
+    'gcb_can_cache_programming_evaluation_results', bool,
+    'Whether evaluation results of programming assignments are cached and '
+    'reused for identical submissions instead of being sent to the evaluator '
+    'backend again.', True)
+
+COUNTER_RESULT_CACHE_HIT = counters.PerfCounter(
+    'gcb-prog-assignment-result-cache-hit',
+    'number of programming submissions answered from the result cache')
+COUNTER_RESULT_CACHE_MISS = counters.PerfCounter(
+    'gcb-prog-assignment-result-cache-miss',
+    'number of programming submissions sent to an evaluator backend')
+
+
+class EvaluationResultCache(object):
+    """Content-addressed cache of evaluator backend results.
+
+    The key is a hash of everything the backend sees: the full code, the
+    language, the test cases, the language resource limits and the
+    evaluator. Editing the test cases or the language settings of a unit
+    therefore changes the key of every submission to it, so stale results are
+    never found again and simply expire from memcache.
+    """
+
+    TTL_SECS = 60 * 60 * 6
+
+    @classmethod
+    def make_key(cls, evaluator_class, unit, request, lang_settings):
+        adict = {
+            'evaluator': evaluator_class.__name__,
+            'unit_id': str(unit.unit_id),
+            'pa_id': request.pa_id,
+            'lang': request.lang,
+            'filename': request.filename,
+            'full_code': request.full_code,
+            'tests': [(test['input'], test['output'])
+                      for test in request.tests],
+            'ignore_presentation_errors': request.ignore_presentation_errors,
+            'lang_settings': lang_settings,
+        }
+        dumped = transforms.dumps(adict, sort_keys=True)
+        if isinstance(dumped, unicode):
+            dumped = dumped.encode('utf-8')
+        return 'prog-evaluation-result:%s' % hashlib.sha1(dumped).hexdigest()
+
+    @classmethod
+    def get_multi(cls, keys):
+        """Returns a dict of key to ProgramEvaluationResult for cached keys."""
+        if not CAN_CACHE_EVALUATION_RESULTS.value or not keys:
+            return {}
+        values = MemcacheManager.get_multi(keys)
+        return dict(
+            (key, result.ProgramEvaluationResult.deserialize(value))
+            for key, value in values.iteritems() if value)
+
+    @classmethod
+    def set_multi(cls, key_to_result):
+        if not CAN_CACHE_EVALUATION_RESULTS.value:
+            return
+        mapping = {}
+        for key, evaluation_result in key_to_result.iteritems():
+            # Only outcomes of the submitted code itself are reusable.
+            if evaluation_result.status in (
+                    result.Status.OK, result.Status.COMPILATION_ERROR):
+                mapping[key] = evaluation_result.serialize()
+        if mapping:
+            MemcacheManager.set_multi(mapping, ttl=cls.TTL_SECS)
+
+
 class ProgramEvaluator(object):
     def __init__(self, course, course_settings, unit, content):
         self._course = course
@@ -93,6 +166,14 @@ class ProgramEvaluator(object):
             full_code += suffixed_invisible_code
         return full_code
 
+    @classmethod
+    def get_course_language_settings(cls, course_settings, lang):
+        if course_settings.has_key("allowed_languages"):
+            for language_settings in course_settings.get("allowed_languages"):
+                if language_settings['language'] == lang:
+                    return language_settings
+        return None
+
     def get_lang_specifc_data(self, lang):
         for lang_details in self._content['allowed_languages']:
             if lang == lang_details['language']:
@@ -124,7 +205,22 @@ class ProgramEvaluator(object):
                         lang):
         raise NotImplementedError
 
-    def evaluate(self, student, is_public, lang, filename, answer):
+    @classmethod
+    def evalute_codes(cls, course, course_settings, unit, requests):
+        """Evaluates a list of EvaluationRequest; returns results in order.
+
+        Evaluators that can talk to their backend concurrently should
+        override this; the default evaluates the requests one at a time.
+        """
+        return [
+            cls.evalute_code(
+                course, course_settings, unit, request.full_code,
+                request.program_name, request.pa_id, request.filename,
+                request.tests, request.ignore_presentation_errors,
+                request.lang)
+            for request in requests]
+
+    def _build_request(self, student, is_public, lang, filename, answer):
         lang_data = self.get_lang_specifc_data(lang)
         full_code = self.get_full_code(lang_data, answer)
         pa_id = self._unit.properties.get(base.ProgAssignment.PA_ID_KEY)
@@ -145,9 +241,14 @@ class ProgramEvaluator(object):
         else:
             tests = self._content['private_testcase']
 
-        evaluation_result = self.evalute_code(
-            self._course, self._course_settings, self._unit, full_code,
-            program_name, pa_id, filename, tests, ignore_presentation_errors, lang)
+        return EvaluationRequest(
+            student, is_public, lang, filename, full_code, program_name, pa_id,
+            tests, ignore_presentation_errors)
+
+    def _record_result(self, request, evaluation_result):
+        student = request.student
+        is_public = request.is_public
+        tests = request.tests
 
         if (result.Status.BACKEND_ERROR == evaluation_result.status
             or result.Status.OTHER == evaluation_result.status):
@@ -186,6 +287,71 @@ class ProgramEvaluator(object):
         student.put()
         return evaluation_result
 
+    def _evaluate_requests(self, requests):
+        """Evaluates requests, reusing cached results of identical ones."""
+        cache_keys = [
+            EvaluationResultCache.make_key(
+                self.__class__, self._unit, request,
+                self.get_course_language_settings(
+                    self._course_settings, request.lang))
+            for request in requests]
+        cached_results = EvaluationResultCache.get_multi(cache_keys)
+
+        misses = [
+            (key, request) for key, request in zip(cache_keys, requests)
+            if key not in cached_results]
+        COUNTER_RESULT_CACHE_HIT.inc(len(requests) - len(misses))
+        COUNTER_RESULT_CACHE_MISS.inc(len(misses))
+
+        new_results = {}
+        if misses:
+            evaluation_results = self.evalute_codes(
+                self._course, self._course_settings, self._unit,
+                [request for _, request in misses])
+            for (key, _), evaluation_result in zip(misses, evaluation_results):
+                new_results[key] = evaluation_result
+            EvaluationResultCache.set_multi(new_results)
+
+        return [
+            cached_results.get(key) or new_results[key] for key in cache_keys]
+
+    def evaluate(self, student, is_public, lang, filename, answer):
+        request = self._build_request(
+            student, is_public, lang, filename, answer)
+        evaluation_result = self._evaluate_requests([request])[0]
+        return self._record_result(request, evaluation_result)
+
+    def evaluate_many(self, submissions):
+        """Evaluates a batch of submissions to this unit.
+
+        Args:
+            submissions: list of (student, is_public, lang, filename, answer).
+        Returns:
+            A list of ProgramEvaluationResult in the order of submissions.
+        """
+        requests = [
+            self._build_request(*submission) for submission in submissions]
+        evaluation_results = self._evaluate_requests(requests)
+        return [
+            self._record_result(request, evaluation_result)
+            for request, evaluation_result in zip(requests, evaluation_results)]
+
+
+class EvaluationRequest(object):
+    """Everything an evaluator backend needs to evaluate one submission."""
+
+    def __init__(self, student, is_public, lang, filename, full_code,
+                 program_name, pa_id, tests, ignore_presentation_errors):
+        self.student = student
+        self.is_public = is_public
+        self.lang = lang
+        self.filename = filename
+        self.full_code = full_code
+        self.program_name = program_name
+        self.pa_id = pa_id
+        self.tests = tests
+        self.ignore_presentation_errors = ignore_presentation_errors
+
 
 class ProgramEvaluatorRegistory(object):
     """A registry that holds all programming evaluators."""
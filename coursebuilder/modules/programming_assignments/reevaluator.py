@@ -48,18 +48,31 @@ class ReevaluateSubmission(jobs.MapReduceJob, base.ProgAssignment):
 
     @staticmethod
     def map(entity):
-        mapper_params = context.get().mapreduce_spec.mapper.params
+        mapper_context = context.get()
+        mapper_params = mapper_context.mapreduce_spec.mapper.params
         namespace = mapper_params['course']
         unit_id = mapper_params['unit_id']
         content = mapper_params['content']
         settings = mapper_params['settings']
 
-        app_context = sites.get_app_context_for_namespace(namespace)
-        course = courses.Course(None, app_context=app_context)
-        unit = course.find_unit_by_id(str(unit_id))
+        pool = mapper_context.get_pool(_ReevaluationPool.POOL_KEY)
+        if pool is None:
+            app_context = sites.get_app_context_for_namespace(namespace)
+            course = courses.Course(None, app_context=app_context)
+            unit = course.find_unit_by_id(str(unit_id))
+
+            evaluator_id = content.get('evaluator', 'mooshak')
+            evaluator_class = evaluator.ProgramEvaluatorRegistory.get(
+                evaluator_id)
+            if not evaluator_class:
+                return
+            pool = _ReevaluationPool(
+                course, unit, evaluator_class(course, settings, unit, content),
+                mapper_context.counters)
+            mapper_context.register_pool(_ReevaluationPool.POOL_KEY, pool)
 
         submitted_contents = student_work.Submission.get_contents(
-                unit.unit_id, entity.get_key())
+                pool.unit.unit_id, entity.get_key())
         if not submitted_contents:
             return
         submission = transforms.loads(submitted_contents)
@@ -69,17 +82,9 @@ class ReevaluateSubmission(jobs.MapReduceJob, base.ProgAssignment):
         code = submission[lang]['code']
         filename = submission[lang]['filename']
 
-        evaluator_id = content.get('evaluator', 'mooshak')
-        evaluator_class = evaluator.ProgramEvaluatorRegistory.get(evaluator_id)
-        if not evaluator_class:
-            return
-
-        old_score = course.get_score(entity, unit.unit_id)
-        prog_evaluator = evaluator_class(course, settings, unit, content)
-        prog_evaluator.evaluate(entity, False, lang, filename, code)
-        new_score = course.get_score(entity, unit.unit_id)
-        yield (str(old_score), new_score)
-
+        pool.append(entity, lang, filename, code)
+        if pool.is_full():
+            pool.flush()
 
     def build_additional_mapper_params(self, app_context):
         course = courses.Course(None, app_context=app_context)
@@ -95,13 +100,55 @@ class ReevaluateSubmission(jobs.MapReduceJob, base.ProgAssignment):
 
     @staticmethod
     def reduce(key, data_list):
-        score_dict = dict()
-        for new_score in data_list:
-            if new_score not in score_dict:
-                score_dict[new_score] = 1
-            else:
-                score_dict[new_score] += 1
-        yield (key, score_dict)
+        pass
+
+
+class _ReevaluationPool(context.Pool):
+    """Collects submissions of a mapper slice and evaluates them together.
+
+    Evaluators such as nsjail send a batch of submissions to their backends
+    concurrently, so a slice no longer waits on one round trip per student.
+    Full batches are evaluated from map(), and the rest when the mapreduce
+    library flushes the pool at the end of the slice. Nothing can be yielded
+    to the reducer from there, so the outcome of every submission is kept in
+    the mapper counters instead, which the status page of the job lists:
+    submissions-reevaluated, and a "score <old> -> <new>" counter for each
+    pair of old and new scores.
+    """
+
+    POOL_KEY = 'prog-assignment-reevaluation'
+    BATCH_SIZE = 20
+
+    def __init__(self, course, unit, prog_evaluator, mapper_counters):
+        self.course = course
+        self.unit = unit
+        self._evaluator = prog_evaluator
+        self._counters = mapper_counters
+        self._submissions = []
+        self._old_scores = []
+
+    def append(self, student, lang, filename, code):
+        self._old_scores.append(
+            self.course.get_score(student, self.unit.unit_id))
+        self._submissions.append((student, False, lang, filename, code))
+
+    def is_full(self):
+        return len(self._submissions) >= self.BATCH_SIZE
+
+    def flush(self):
+        submissions = self._submissions
+        old_scores = self._old_scores
+        self._submissions = []
+        self._old_scores = []
+        if not submissions:
+            return
+
+        self._evaluator.evaluate_many(submissions)
+        self._counters.increment('submissions-reevaluated', len(submissions))
+        for old_score, submission in zip(old_scores, submissions):
+            new_score = self.course.get_score(submission[0], self.unit.unit_id)
+            self._counters.increment(
+                'score %s -> %s' % (old_score, new_score))
 
 
 class ReevaulateSubmissionHandler(BaseHandler):
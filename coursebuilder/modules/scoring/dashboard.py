@@ -20,6 +20,8 @@ import os
 import jinja2
 
 from models import courses
+from models import jobs
+from models import transforms
 from modules.scoring import base
 from modules.scoring import rescorer
 from tools import verify
@@ -42,8 +44,20 @@ class ScoringDashboardHandler(base.ScoringBase):
                 if grader == courses.AUTO_GRADER:
                     units.append(unit)
 
+        results = []
+        for unit in units:
+            job = rescorer.BulkRescorer(course.app_context, unit.unit_id).load()
+            if job and job.status_code == jobs.STATUS_CODE_COMPLETED:
+                output = transforms.loads(job.output)
+                if output:
+                    results.append({
+                        'unit': unit,
+                        'updated_on': job.updated_on,
+                        'output': output})
+
         template_values = {}
         template_values['rescore_units'] = units
+        template_values['rescore_results'] = results
         template_values['submit_xsrf_token'] = handler.create_xsrf_token(
             cls.RESCORE_OBJ_ASSESSMENT_ACTION)
         template_values['rescore_url'] = handler.get_action_url(
@@ -59,6 +73,7 @@ class ScoringDashboardHandler(base.ScoringBase):
         course = handler.get_course()
         unit_id = handler.request.get('unit_id')
         ignore_order = handler.request.get('ignore_order')
+        dry_run = handler.request.get('dry_run')
         unit = course.find_unit_by_id(str(unit_id))
         template_values = {}
         if not unit:
@@ -69,6 +84,7 @@ class ScoringDashboardHandler(base.ScoringBase):
         else:
             template_values['unit'] = unit
             template_values['ignore_order'] = ignore_order
+            template_values['dry_run'] = dry_run
 
         template_values['submit_xsrf_token'] = handler.create_xsrf_token(
             cls.RESCORE_OBJ_ASSESSMENT_CONFIRMED_ACTION)
@@ -100,12 +116,15 @@ class ScoringDashboardHandler(base.ScoringBase):
                     extra_args={'tab': cls.DASHBOARD_RESCORING_TAB}))
             return
 
-        job = rescorer.RescorerSubmission(course.app_context, unit.unit_id,
-            ignore_order=True if ignore_order =="yes" else False)
+        dry_run = handler.request.get('dry_run') == 'yes'
+        job = rescorer.BulkRescorer(course.app_context, unit.unit_id,
+            ignore_order=True if ignore_order =="yes" else False,
+            dry_run=dry_run)
         job.submit()
 
         template_values = {}
         template_values['unit'] = unit
+        template_values['dry_run'] = dry_run
         content = jinja2.utils.Markup(
             handler.get_template(
                 'templates/rescore_confirmation.html',
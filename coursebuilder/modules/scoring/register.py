@@ -18,8 +18,10 @@ __author__ = 'Thejesh GN (tgn@google.com)'
 
 
 from models import custom_modules
+from models import models
 from modules.dashboard import dashboard
 from modules.dashboard import tabs
+from modules.i18n_dashboard import i18n_dashboard
 from modules.scoring import base
 from modules.scoring import scorer
 from modules.scoring import dashboard as scoring_dashboard
@@ -50,6 +52,12 @@ def register_module():
         base.ScoringBase.RESCORE_OBJ_ASSESSMENT_CONFIRMED_ACTION,
         scoring_dashboard.ScoringDashboardHandler.rescore_assignment)
 
+    for dao in (models.QuestionDAO, models.QuestionGroupDAO,
+                i18n_dashboard.ResourceBundleDAO):
+        for hooks in (dao.POST_SAVE_HOOKS, dao.POST_DELETE_HOOKS):
+            if scorer.GradingPlanCache.on_questions_changed not in hooks:
+                hooks.append(scorer.GradingPlanCache.on_questions_changed)
+
     global custom_module
     custom_module = custom_modules.Module(
         base.ScoringBase.NAME,
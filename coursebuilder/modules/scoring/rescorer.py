@@ -16,27 +16,74 @@
 
 __author__ = 'Thejesh GN (tgn@google.com)'
 
-from mapreduce import context
+import collections
+import datetime
+import logging
+import time
+import traceback
 
-from controllers import sites
-from controllers.utils import BaseHandler
+from common.utils import Namespace
+from models import counters
 from models import courses
+from models import entities
 from models import jobs
 from models import models
 from models import student_work
 from models import transforms
 from models import utils
-from modules.scoring import base
 from modules.scoring import scorer
 from tools import verify
 
-class RescorerSubmission(jobs.MapReduceJob, base.ScoringBase):
-    """A job that submits request for rescoring."""
+from google.appengine.ext import db
+from google.appengine.ext import deferred
 
-    def __init__(self, app_context, unit_id, ignore_order=False):
-        super(RescorerSubmission, self).__init__(app_context)
-        self._unit_id = unit_id
+
+COUNTER_BULK_RESCORE_SUBMISSIONS = counters.PerfCounter(
+    'gcb-scoring-bulk-rescore-submissions',
+    'number of submissions scored by bulk rescoring jobs')
+COUNTER_BULK_RESCORE_STUDENTS_UPDATED = counters.PerfCounter(
+    'gcb-scoring-bulk-rescore-students-updated',
+    'number of students whose score was changed by bulk rescoring jobs')
+
+
+class BulkRescorer(jobs.DurableJobBase):
+    """Rescores all submissions to an objective assessment in batches.
+
+    The students of the course are split into up to NUM_SHARDS key ranges,
+    which are rescored in parallel, each by a chain of deferred tasks. A
+    task reads the next BATCH_SIZE students of its range, loads their
+    submissions with a single get and scores all of them at once with
+    score_assessments(). The position of every range and the counts so far
+    are saved in the job after each batch, so a task that fails is retried
+    from the start of its batch rather than of the whole job.
+
+    Changed scores are written MAX_STUDENTS_PER_TRANSACTION students at a
+    time: the students are read again with one get in a cross-group
+    transaction, and only those who still have the score that was read are
+    put, with one put, so that a student who submitted again meanwhile
+    keeps the score of the new submission.
+
+    A dry run writes nothing. Either way the output of the job counts the
+    students by how much their score changed: a histogram of new score minus
+    old score, with students who had no score yet counted separately. Scores
+    written by a task that failed are counted as unchanged when it retries.
+    """
+
+    NUM_SHARDS = 8
+    BATCH_SIZE = 500
+    # Cross-group transactions are limited to 25 entity groups.
+    MAX_STUDENTS_PER_TRANSACTION = 25
+    # Scatter samples read per key range when splitting the students.
+    KEY_RANGE_OVERSAMPLING = 32
+
+    xg_on = db.create_transaction_options(xg=True)
+
+    def __init__(self, app_context, unit_id, ignore_order=False,
+                 dry_run=False):
+        super(BulkRescorer, self).__init__(app_context)
+        self._unit_id = str(unit_id)
         self._ignore_order = ignore_order
+        self._dry_run = dry_run
         self._job_name = 'job-%s-%s-%s' % (
             self.__class__.__name__, self._namespace, self._unit_id)
 
@@ -44,52 +91,266 @@ class RescorerSubmission(jobs.MapReduceJob, base.ScoringBase):
     def get_description():
         return 'Rescore Objective Assessments'
 
-    @staticmethod
-    def entity_class():
-        return models.Student
+    def non_transactional_submit(self):
+        sequence_num = super(BulkRescorer, self).non_transactional_submit()
+        deferred.defer(self.main, sequence_num)
+        return sequence_num
 
-    @staticmethod
-    def map(entity):
-        mapper_params = context.get().mapreduce_spec.mapper.params
-        namespace = mapper_params['course']
-        unit_id = mapper_params['unit_id']
-        ignore_order = mapper_params['ignore_order']
-
-        app_context = sites.get_app_context_for_namespace(namespace)
-        course = courses.Course(None, app_context=app_context)
-        unit = course.find_unit_by_id(str(unit_id))
-
-        if verify.UNIT_TYPE_ASSESSMENT == unit.type:
-            grader = unit.workflow.get_grader()
-            if grader == courses.AUTO_GRADER:
-                pass
+    def main(self, sequence_num):
+        """Splits the students into key ranges and starts rescoring each."""
+        job = self.load()
+        if not job:
+            raise deferred.PermanentTaskFailure(
+                'Job object for %s not found!' % self._job_name)
+        if job.has_finished or job.sequence_num != sequence_num:
+            return  # Canceled, or superseded by a newer run.
+
+        with Namespace(self._namespace):
+            if job.status_code == jobs.STATUS_CODE_QUEUED:
+                state = {
+                    'time_started': time.time(),
+                    'submissions': 0, 'updated': 0, 'unscored': 0,
+                    'changes': {}, 'positions': self._build_key_ranges()}
+                if not self._start(sequence_num, state):
+                    return
+            else:
+                state = transforms.loads(job.output)
+
+            # When this task is retried, ranges may be started twice; the
+            # second task to finish a batch then finds the range moved on
+            # and drops its counts.
+            for index, position in enumerate(state['positions']):
+                if not position['after'] and not position['done']:
+                    deferred.defer(
+                        self.rescore_key_range, sequence_num, index, None)
+
+    def rescore_key_range(self, sequence_num, index, after):
+        """Rescores the next batch of a key range, then queues the one after.
+
+        Args:
+          sequence_num: int. The run of the job this task belongs to.
+          index: int. The key range to rescore.
+          after: string. The key of the last student rescored in the range,
+              or None to start at the beginning of the range.
+        """
+        job = self.load()
+        if not job or job.has_finished or job.sequence_num != sequence_num:
+            return  # Canceled, or superseded by a newer run.
+
+        with Namespace(self._namespace):
+            position = dict(transforms.loads(job.output)['positions'][index])
+            if position['after'] != after or position['done']:
+                return  # The batch was rescored by an earlier attempt.
+            counts = {
+                'submissions': 0, 'updated': 0, 'unscored': 0, 'changes': {}}
+            try:
+                students = self._fetch_next_batch(position)
+                self._rescore(self._get_unit(), students, counts)
+            except (db.Timeout, db.InternalError):
+                raise  # Retried by the task queue from the saved position.
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(traceback.format_exc())
+                logging.error('Job failed: %s\n%s', self._job_name, e)
+                self._fail(sequence_num, traceback.format_exc())
+                raise deferred.PermanentTaskFailure(e)
+
+            if students:
+                position['after'] = str(students[-1].key())
+            position['done'] = len(students) < self.BATCH_SIZE
+            self._save_batch(sequence_num, index, after, position, counts)
+
+    def _put_job(self, job, status_code, output, state):
+        job.status_code = status_code
+        job.output = output
+        job.execution_time_sec = int(time.time() - state['time_started'])
+        job.updated_on = datetime.datetime.now()
+        job.put()
+
+    def _start(self, sequence_num, state):
+        """Starts the job unless it was canceled or started meanwhile."""
+
+        def _save():
+            job = self.load()
+            if (not job or job.sequence_num != sequence_num or
+                    job.status_code != jobs.STATUS_CODE_QUEUED):
+                return False
+            self._put_job(
+                job, jobs.STATUS_CODE_STARTED, transforms.dumps(state), state)
+            return True
+
+        return db.run_in_transaction(_save)
+
+    def _save_batch(self, sequence_num, index, after, position, counts):
+        """Adds the counts of a batch to the job and moves its range on.
+
+        The task for the next batch of the range is queued in the same
+        transaction, so a range is never left without one. Nothing is saved
+        if the job was canceled or restarted, or another attempt at the same
+        batch saved it first.
+        """
+
+        def _save():
+            job = self.load()
+            if (not job or job.sequence_num != sequence_num or
+                    job.has_finished):
+                return
+            state = transforms.loads(job.output)
+            if state['positions'][index]['after'] != after:
+                return
+            state['positions'][index] = position
+            if not position['done']:
+                deferred.defer(
+                    self.rescore_key_range, sequence_num, index,
+                    position['after'], _transactional=True)
+            for name in ('submissions', 'updated', 'unscored'):
+                state[name] += counts[name]
+            changes = collections.defaultdict(int, state['changes'])
+            for change, count in counts['changes'].iteritems():
+                changes[change] += count
+            state['changes'] = dict(changes)
+            if all(each['done'] for each in state['positions']):
+                self._put_job(
+                    job, jobs.STATUS_CODE_COMPLETED,
+                    transforms.dumps(self._get_output(state)), state)
+                logging.info('Job completed: %s', self._job_name)
             else:
+                self._put_job(
+                    job, jobs.STATUS_CODE_STARTED, transforms.dumps(state),
+                    state)
+
+        db.run_in_transaction(_save)
+
+    def _fail(self, sequence_num, output):
+
+        def _save():
+            job = self.load()
+            if (not job or job.sequence_num != sequence_num or
+                    job.has_finished):
                 return
-        else:
-            return
-        enable_negative_marking = unit.enable_negative_marking
+            state = transforms.loads(job.output)
+            self._put_job(job, jobs.STATUS_CODE_FAILED, output, state)
+
+        db.run_in_transaction(_save)
 
-        submission = student_work.Submission.get_contents(
-                unit.unit_id, entity.get_key())
+    def _get_unit(self):
+        course = courses.Course(None, app_context=self._app_context)
+        unit = course.find_unit_by_id(self._unit_id)
+        if (not unit or verify.UNIT_TYPE_ASSESSMENT != unit.type or
+            unit.workflow.get_grader() != courses.AUTO_GRADER):
+            raise ValueError(
+                'Unit %s of %s is not an auto graded assessment' % (
+                    self._unit_id, self._namespace))
+        return unit
 
-        if not submission:
+    @classmethod
+    def _build_key_ranges(cls):
+        """Splits the students into at most NUM_SHARDS ranges of like size.
+
+        As in paginated_table.build_key_ranges(), the keys of a sample of
+        students ordered by __scatter__ give the bounds of the ranges.
+        Courses too small to carry any sample come back as a single range.
+        """
+        query = models.Student.all(keys_only=True).order('__scatter__')
+        keys = sorted(query.fetch(
+            cls.NUM_SHARDS * cls.KEY_RANGE_OVERSAMPLING))
+        stride = len(keys) / float(cls.NUM_SHARDS)
+        split_keys = sorted(set(
+            keys[int(stride * index)] for index in xrange(1, cls.NUM_SHARDS)
+            if keys))
+        bounds = [None] + [str(key) for key in split_keys] + [None]
+        return [{'start': start, 'end': end, 'after': None, 'done': False}
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _fetch_next_batch(self, position):
+        query = models.Student.all()
+        if position['after']:
+            query.filter('__key__ >', db.Key(position['after']))
+        elif position['start']:
+            query.filter('__key__ >=', db.Key(position['start']))
+        if position['end']:
+            query.filter('__key__ <', db.Key(position['end']))
+        query.order('__key__')
+        return query.fetch(self.BATCH_SIZE)
+
+    def _rescore(self, unit, students, counts):
+        # Submissions are keyed by Student.get_key(), which uses the user_id
+        # rather than the email that students are stored by.
+        students = [student for student in students if student.user_id]
+        submissions = entities.get([
+            student_work.Submission.get_key(unit.unit_id, student.get_key())
+            for student in students])
+        answers = []
+        rescored = []
+        for student, submission in zip(students, submissions):
+            if submission is None or not submission.contents:
+                continue
+            answers.append(transforms.loads(submission.contents))
+            rescored.append(student)
+        new_scores = scorer.score_assessments(
+            answers, unit.html_content, unit.enable_negative_marking,
+            ignore_order=self._ignore_order)
+
+        changes = collections.defaultdict(int)
+        changed = []
+        for student, new_score in zip(rescored, new_scores):
+            old_score = student.get_score(unit.unit_id)
+            if old_score is None:
+                counts['unscored'] += 1
+            else:
+                changes[str(new_score - float(old_score))] += 1
+            if old_score != new_score:
+                changed.append((student.key(), old_score, new_score))
+        counts['changes'] = dict(changes)
+        counts['submissions'] = len(rescored)
+        COUNTER_BULK_RESCORE_SUBMISSIONS.inc(len(rescored))
+
+        if self._dry_run:
+            counts['updated'] = len(changed)
             return
+        updated = []
+        for index in xrange(
+                0, len(changed), self.MAX_STUDENTS_PER_TRANSACTION):
+            updated += db.run_in_transaction_options(
+                self.xg_on, self._set_scores, unit.unit_id,
+                changed[index:index + self.MAX_STUDENTS_PER_TRANSACTION])
+        counts['updated'] = len(updated)
+        if updated:
+            # Student.put() refreshes memcache entity by entity; drop the
+            # stale copies of the whole batch instead.
+            # pylint: disable=protected-access
+            models.MemcacheManager.delete_multi([
+                models.Student._memcache_key(student.key().name())
+                for student in updated])
+            COUNTER_BULK_RESCORE_STUDENTS_UPDATED.inc(len(updated))
+
+    @classmethod
+    def _set_scores(cls, unit_id, changed):
+        """Writes new scores of students whose score is still the one read.
+
+        Args:
+          unit_id: string. The unit rescored.
+          changed: list of (student key, old score, new score).
 
-        old_score = course.get_score(entity, unit.unit_id)
-        new_score = scorer.score_assessment(submission, unit.html_content, enable_negative_marking, ignore_order=ignore_order)
-        utils.set_score(entity, unit.unit_id, new_score)
-        entity.put()
-        yield (str(old_score), new_score)
+        Returns:
+          The students that were updated.
+        """
+        students = entities.get([key for key, _, _ in changed])
+        updated = []
+        for student, (_, old_score, new_score) in zip(students, changed):
+            if student and student.get_score(unit_id) == old_score:
+                utils.set_score(student, unit_id, new_score)
+                updated.append(student)
+        if updated:
+            entities.put(updated)
+        return updated
 
-    def build_additional_mapper_params(self, app_context):
-        course = courses.Course(None, app_context=app_context)
-        unit = course.find_unit_by_id(str(self._unit_id))
+    def _get_output(self, state):
         return {
-            'course': app_context.get_namespace_name(),
             'unit_id': self._unit_id,
-            'ignore_order':self._ignore_order,
-            }
-
-    @staticmethod
-    def reduce(key, data_list):
-        pass
+            'dry_run': self._dry_run,
+            'submissions': state['submissions'],
+            'updated': state['updated'],
+            'unscored': state['unscored'],
+            'changes': sorted(
+                (float(change), count)
+                for change, count in state['changes'].iteritems())}
@@ -16,18 +16,44 @@
 
 __author__ = 'abhinavk@google.com (Abhinav Khandelwal)'
 
+import hashlib
 import logging
 import re
+import threading
 
+try:
+    import numpy
+except ImportError:
+    # numpy is provided by the App Engine runtime (see app.yaml); dev setups
+    # without it score multiple choice questions one response at a time.
+    numpy = None
+
+from common import caching
 from common import tags
+from controllers import sites
+from models import counters
 from models import models as m_models
 from modules.assessment_tags import questions as q_tags
 
+from google.appengine.api import memcache
+from google.appengine.api import namespace_manager
+
+
+COUNTER_GRADING_PLAN_CACHE_HIT = counters.PerfCounter(
+    'gcb-scoring-grading-plan-cache-hit',
+    'number of times a grading plan was found in the process cache')
+COUNTER_GRADING_PLAN_MEMCACHE_HIT = counters.PerfCounter(
+    'gcb-scoring-grading-plan-memcache-hit',
+    'number of times a grading plan was found in memcache')
+COUNTER_GRADING_PLAN_BUILT = counters.PerfCounter(
+    'gcb-scoring-grading-plan-built',
+    'number of times a grading plan was built from assessment HTML')
+
 
 def check_case_insensitive(user_response, correct_answer):
     return user_response.lower() == correct_answer.lower()
 
-def check_regex(user_response, correct_answer):
+def compile_regex(correct_answer):
     regex_group = re.match('/(.*)/([gim]*)/', correct_answer)
     if regex_group is not None:
         regexp = regex_group.groups()[0]
@@ -41,7 +67,10 @@ def check_regex(user_response, correct_answer):
     else:
         regexp = correct_answer
         flags = 0
-    res = re.match(regexp, user_response, flags=flags)
+    return re.compile(regexp, flags)
+
+def check_regex(user_response, correct_answer):
+    res = compile_regex(correct_answer).match(user_response)
     return res is not None
 
 def check_numeric(user_response, correct_answer):
@@ -96,6 +125,8 @@ def get_question_group_object(node):
     question_group_dto = m_models.QuestionGroupDAO.load(qgid)
     if not question_group_dto:
         return None
+    m_models.QuestionDAO.prefetch(
+        [item['question'] for item in question_group_dto.dict['items']])
 
     questions = dict()
     for ind, item in enumerate(question_group_dto.dict['items']):
@@ -136,6 +167,12 @@ def get_assement_objects(html_string):
            node_list[instance_id] = node
 
     root = tags.html_string_to_element_tree(html_string)
+    m_models.QuestionDAO.prefetch([
+        elt.attrib.get('quid')
+        for elt in root.iter(q_tags.QuestionTag.binding_name)])
+    m_models.QuestionGroupDAO.prefetch([
+        elt.attrib.get('qgid')
+        for elt in root.iter(q_tags.QuestionGroupTag.binding_name)])
     used_instance_ids = set([])
     for elt in root:
         _parse_html_node(elt, used_instance_ids, node_list)
@@ -189,6 +226,23 @@ def get_question_for_give_key_ignore_order(questions, key_with_order):
     return None
 
 
+def _record_individual_score(individual_scores, key, score, top_level):
+    if top_level:
+        individual_scores[key] = score
+    else:
+        key_parts = key.split('.')
+        top_level_key = key_parts[0]
+        key_index = int(key_parts[1])
+        if top_level_key not in individual_scores:
+            l = []
+        else:
+            l = individual_scores[top_level_key]
+        while len(l) <= key_index:
+            l.append(0)
+        l[key_index] = score
+        individual_scores[top_level_key] = l
+
+
 def score_question_group(responses, questions, negative_marking, individual_scores=None, ignore_order=False):
     top_level = (individual_scores is None)
     if top_level:
@@ -206,7 +260,15 @@ def score_question_group(responses, questions, negative_marking, individual_scor
         else:
                 question_container = questions[key]
 
-        if 'q' not in question_container:
+        if isinstance(question_container, CompiledQuestion):
+            if question_container.type is None:
+                logging.error("don't know the type of the question")
+                continue
+            score = question_container.score(response, negative_marking)
+            weight = float(question_container.weight)
+            score *= weight
+            _record_individual_score(individual_scores, key, score, top_level)
+        elif 'q' not in question_container:
             score, weight = score_question_group(
                 response, question_container, negative_marking, individual_scores,ignore_order=ignore_order)
         else:
@@ -223,27 +285,290 @@ def score_question_group(responses, questions, negative_marking, individual_scor
                 score = score_sa_question(response, question)
             weight = float(question_container['weight'])
             score *= weight
-            if top_level:
-                individual_scores[key] = score
-            else:
-                key_parts = key.split('.')
-                top_level_key = key_parts[0]
-                key_index = int(key_parts[1])
-                if top_level_key not in individual_scores:
-                    l = []
-                else:
-                    l = individual_scores[top_level_key]
-                while len(l) <= key_index:
-                    l.append(0)
-                l[key_index] = score
-                individual_scores[top_level_key] = l
+            _record_individual_score(individual_scores, key, score, top_level)
         full_score += score
         full_weight += weight
     if top_level:
         responses['individualScores'] = individual_scores
     return full_score, full_weight
 
+def _make_matcher(matcher, correct_answer):
+    """Returns a function telling whether a response matches an answer."""
+    if matcher == 'case_insensitive':
+        expected = correct_answer.lower()
+        return lambda user_response: user_response.lower() == expected
+    elif matcher == 'regex':
+        try:
+            pattern = compile_regex(correct_answer)
+        except re.error, e:
+            logging.error('Bad regex answer %s: %s', correct_answer, e)
+            return lambda unused_user_response: False
+        return lambda user_response: pattern.match(user_response) is not None
+    elif matcher == 'numeric':
+        return lambda user_response: check_numeric(
+            user_response, correct_answer)
+    elif matcher == 'range_match':
+        return lambda user_response: check_range(user_response, correct_answer)
+    return lambda unused_user_response: False
+
+
+def _to_float(value):
+    """Returns value as a float, or unchanged if it is not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class CompiledQuestion(object):
+    """A question of a grading plan, ready to score responses in memory."""
+
+    def __init__(self, spec):
+        self.type = spec['type']
+        self.weight = spec['weight']
+        self.choice_scores = spec['choices']
+        self.graders = [
+            (_make_matcher(matcher, correct_answer), score)
+            for matcher, correct_answer, score in spec['graders']]
+
+    @classmethod
+    def make_spec(cls, question_container):
+        """Flattens {'q': QuestionDTO, 'weight': ...} into plain data.
+
+        Weights and scores that are not numbers are kept as they are, so that
+        they only fail when a response that uses them is scored, as they
+        always did.
+        """
+        question = question_container['q'].dict
+        question_type = question.get('type')
+        weight = _to_float(question_container['weight'])
+        choices = []
+        graders = []
+        if question_type == 0:
+            choices = [
+                _to_float(choice['score']) for choice in question['choices']]
+        elif question_type == 1:
+            graders = [
+                (grader['matcher'], grader['response'].strip(),
+                 _to_float(grader['score']))
+                for grader in question['graders']]
+        return {
+            'type': question_type,
+            'weight': weight,
+            'choices': choices,
+            'graders': graders}
+
+    def score(self, response, negative_marking):
+        if self.type == 0:
+            score = 0
+            for index in range(len(response)):
+                if response[index]:
+                    choice_score = float(self.choice_scores[index])
+                    if negative_marking is not True and choice_score < 0.0:
+                        return 0.0
+                    score += choice_score
+            return score
+        elif self.type == 1:
+            score = 0
+            user_response = response['response'].strip()
+            for matches, grader_score in self.graders:
+                if matches(user_response):
+                    score += float(grader_score)
+            return max(score, 0)
+        return 0
+
+    def score_many(self, responses, negative_marking):
+        """Scores many responses to a multiple choice question at once.
+
+        The responses are turned into a boolean matrix of one row per response
+        and one column per choice; the scores are its product with the vector
+        of choice scores. Without negative marking, rows that select any
+        negatively scored choice score 0, as in score(). Questions with a
+        choice score that is not a number are scored by score().
+        """
+        num_choices = len(self.choice_scores)
+        if (numpy is None or not responses or not num_choices or
+            any(not isinstance(choice_score, float)
+                for choice_score in self.choice_scores) or
+            any(len(response) > num_choices for response in responses)):
+            return [self.score(response, negative_marking)
+                    for response in responses]
+        selected = numpy.array([
+            [bool(choice) for choice in response] +
+            [False] * (num_choices - len(response))
+            for response in responses], dtype=bool)
+        choice_scores = numpy.array(self.choice_scores, dtype=float)
+        scores = selected.dot(choice_scores)
+        if negative_marking is not True:
+            scores[selected[:, choice_scores < 0.0].any(axis=1)] = 0.0
+        return scores.tolist()
+
+
+class _BatchedChoiceQuestion(CompiledQuestion):
+    """Stands in for a multiple choice question while a batch is scored.
+
+    score_question_group() walks every submission of the batch twice: first
+    to collect the responses to each multiple choice question, then to hand
+    back the scores score_many() computed for all of them.
+    """
+
+    def __init__(self, question):  # pylint: disable=super-init-not-called
+        self.type = question.type
+        self.weight = question.weight
+        self.question = question
+        self.responses = []
+        self.scores = None
+
+    def score(self, response, unused_negative_marking):
+        if self.scores is None:
+            self.responses.append(response)
+            return 0
+        return next(self.scores)
+
+    def compute_scores(self, negative_marking):
+        self.scores = iter(
+            self.question.score_many(self.responses, negative_marking))
+
+
+def _batch_choice_questions(plan, batched):
+    batch_plan = {}
+    for instance_id, item in plan.items():
+        if not isinstance(item, CompiledQuestion):
+            item = _batch_choice_questions(item, batched)
+        elif item.type == 0:
+            item = _BatchedChoiceQuestion(item)
+            batched.append(item)
+        batch_plan[instance_id] = item
+    return batch_plan
+
+
+def make_grading_plan_spec(html_string):
+    """Flattens the questions of an assessment into plain, cacheable data.
+
+    Returns:
+      A dict of instance id: question spec for questions, and of instance
+      id: {question instance id: question spec} for question groups.
+    """
+    spec = {}
+    for instance_id, node in (get_assement_objects(html_string) or {}).items():
+        if 'q' in node:
+            spec[instance_id] = CompiledQuestion.make_spec(node)
+        else:
+            spec[instance_id] = dict(
+                (question_instance_id, CompiledQuestion.make_spec(question))
+                for question_instance_id, question in node.items())
+    return spec
+
+
+def compile_grading_plan(spec):
+    """Turns a grading plan spec into what score_question_group() expects."""
+    plan = {}
+    for instance_id, item in spec.items():
+        if 'type' in item:
+            plan[instance_id] = CompiledQuestion(item)
+        else:
+            plan[instance_id] = dict(
+                (question_instance_id, CompiledQuestion(question))
+                for question_instance_id, question in item.items())
+    return plan
+
+
+class GradingPlanCache(caching.ProcessScopedSingleton):
+    """Compiled grading plans, keyed by assessment content.
+
+    Scoring an assessment needs its HTML parsed and every question and
+    question group loaded. The result only depends on the HTML, on the
+    questions in the course and on the locale they are translated to, so it
+    is compiled once into a grading plan: plain data that is shared through
+    memcache and compiled, regexes included, once per process.
+
+    Saving or deleting a question, a question group or a translation
+    changes a per course generation stamp in memcache, which is part of
+    every plan key. Other processes notice a new stamp within
+    GENERATION_CHECK_INTERVAL_SECS.
+    """
+
+    GENERATION_MEMCACHE_KEY = 'scoring-question-bank-generation'
+    GENERATION_CHECK_INTERVAL_SECS = 5
+    MAX_PLANS = 200
+    MEMCACHE_TTL_SECS = 60 * 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans = caching.LRUCache(max_item_count=self.MAX_PLANS)
+        self._generation = caching.MemcacheGeneration(
+            self.GENERATION_MEMCACHE_KEY,
+            check_interval_secs=self.GENERATION_CHECK_INTERVAL_SECS)
+
+    @classmethod
+    def on_questions_changed(cls, unused_dtos):
+        """Post-save and post-delete hook for what grading plans read."""
+        cls.instance()._generation.incr(namespace_manager.get_namespace())
+
+    @classmethod
+    def _get_locale(cls):
+        app_context = sites.get_course_for_current_request()
+        return app_context.get_current_locale() if app_context else None
+
+    def get(self, html_string):
+        namespace = namespace_manager.get_namespace()
+        content = html_string or ''
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        content_hash = hashlib.sha1(content).hexdigest()
+        key = 'scoring-grading-plan:%s:%s:%s' % (
+            content_hash, self._get_locale(), self._generation.get(namespace))
+
+        with self._lock:
+            found, plan = self._plans.get((namespace, key))
+        if found:
+            COUNTER_GRADING_PLAN_CACHE_HIT.inc()
+            return plan
+
+        spec = memcache.get(key, namespace=namespace)
+        if spec is None:
+            COUNTER_GRADING_PLAN_BUILT.inc()
+            spec = make_grading_plan_spec(html_string)
+            memcache.set(
+                key, spec, time=self.MEMCACHE_TTL_SECS, namespace=namespace)
+        else:
+            COUNTER_GRADING_PLAN_MEMCACHE_HIT.inc()
+        plan = compile_grading_plan(spec)
+        with self._lock:
+            self._plans.put((namespace, key), plan)
+        return plan
+
+
 def score_assessment(answers, questions_html, negative_marking,ignore_order=False):
-    questions = get_assement_objects(questions_html)
+    questions = GradingPlanCache.instance().get(questions_html)
     score, weight = score_question_group(answers, questions, negative_marking, ignore_order=ignore_order)
     return round((score * 100 ) / weight) if weight else 0
+
+
+def score_assessments(submissions, questions_html, negative_marking,
+                      ignore_order=False):
+    """Scores many submissions to an assessment, as score_assessment() does.
+
+    Multiple choice questions are scored for all submissions at once. The
+    submissions are left unchanged.
+
+    Returns:
+      A list with the score of each submission.
+    """
+    batched = []
+    questions = _batch_choice_questions(
+        GradingPlanCache.instance().get(questions_html), batched)
+    for answers in submissions:
+        score_question_group(
+            dict(answers), questions, negative_marking,
+            ignore_order=ignore_order)
+    for question in batched:
+        question.compute_scores(negative_marking)
+
+    scores = []
+    for answers in submissions:
+        score, weight = score_question_group(
+            dict(answers), questions, negative_marking,
+            ignore_order=ignore_order)
+        scores.append(round((score * 100) / weight) if weight else 0)
+    return scores
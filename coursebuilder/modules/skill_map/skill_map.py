@@ -36,6 +36,7 @@ from controllers import sites
 from controllers import utils
 from mapreduce import context
 from models import analytics
+from models import counters
 from models import courses
 from models import custom_modules
 from models import data_sources
@@ -54,6 +55,7 @@ from modules.i18n_dashboard import i18n_dashboard
 from modules.skill_map import skill_map_metrics
 
 from google.appengine.ext import db
+from google.appengine.api import memcache
 from google.appengine.api import namespace_manager
 
 skill_mapping_module = None
@@ -68,6 +70,13 @@ RESOURCES_URI = '/modules/skill_map/resources'
 # Key for storing list of skill id's in the properties table of a Lesson
 LESSON_SKILL_LIST_KEY = 'modules.skill_map.skill_list'
 
+COUNTER_SKILL_GRAPH_CACHE_HIT = counters.PerfCounter(
+    'gcb-skill-map-compiled-graph-cache-hit',
+    'number of times a compiled skill graph was found in the process cache')
+COUNTER_SKILL_GRAPH_COMPILED = counters.PerfCounter(
+    'gcb-skill-map-compiled-graph-built',
+    'number of times the skills of a course were loaded and compiled')
+
 
 def _assert(condition, message, errors):
     """Assert a condition and either log exceptions or raise AssertionError."""
@@ -145,6 +154,7 @@ class Skill(object):
 
 
 def _on_skills_changed(skills):
+    CompiledSkillGraphCache.on_skills_changed()
     if not i18n_dashboard.I18nProgressDeferredUpdater.is_translatable_course():
         return
     key_list = [resource.Key(ResourceSkill.TYPE, skill.id) for skill in skills]
@@ -249,25 +259,148 @@ class TranslatableResourceSkill(
         return ret
 
 
+class CompiledSkillGraph(object):
+    """The skills of a course and their order, ready to be shared.
+
+    Skills are numbered in the order of their ids. The successors and
+    predecessors of every skill are kept as lists of these numbers, from
+    which the topological order is found with Kahn's algorithm in time
+    linear in the number of skills and prerequisites. Once built, instances
+    are never modified; SkillGraph copies the skills before handing them out.
+    """
+
+    def __init__(self, skills, generation=None):
+        self.generation = generation
+        self._skill_dicts = dict(
+            (skill_id, skill.dict) for skill_id, skill in skills.iteritems())
+        self.ids = sorted(skills)
+        index_of = dict((skill_id, i) for i, skill_id in enumerate(self.ids))
+        self.successors = [[] for _ in self.ids]
+        self.predecessors = [[] for _ in self.ids]
+        for i, skill_id in enumerate(self.ids):
+            for pid in sorted(skills[skill_id].prerequisite_ids):
+                if pid in index_of:
+                    self.successors[index_of[pid]].append(i)
+                    self.predecessors[i].append(index_of[pid])
+        self.co_sets, self.topological_order = self._sort()
+
+    def _sort(self):
+        """Returns the topologically sorted co-sets, and the order of ids.
+
+        Co-sets are lists of the ids of skills whose prerequisites are all in
+        earlier co-sets; they are None if the prerequisites have a cycle. The
+        order lists the ids of the co-sets in turn, followed by any skills on
+        or after a cycle.
+        """
+        in_degree = [len(predecessors) for predecessors in self.predecessors]
+        co_set = [i for i, degree in enumerate(in_degree) if not degree]
+        co_sets = []
+        while co_set:
+            co_sets.append([self.ids[i] for i in co_set])
+            next_co_set = []
+            for i in co_set:
+                for j in self.successors[i]:
+                    in_degree[j] -= 1
+                    if not in_degree[j]:
+                        next_co_set.append(j)
+            co_set = next_co_set
+        order = [skill_id for co_set in co_sets for skill_id in co_set]
+        if len(order) < len(self.ids):
+            ordered = set(order)
+            order.extend(
+                skill_id for skill_id in self.ids if skill_id not in ordered)
+            co_sets = None
+        return co_sets, order
+
+    def copy_skills(self):
+        """Returns a new dict mapping skill id to a new Skill."""
+        # Skill setters replace top-level values, so a shallow copy of the
+        # dict is enough to keep them from changing the shared one.
+        return dict(
+            (skill_id, Skill(skill_id, dict(data_dict)))
+            for skill_id, data_dict in self._skill_dicts.iteritems())
+
+
+class CompiledSkillGraphCache(caching.ProcessScopedSingleton):
+    """Compiled skill graphs of courses, shared by the requests of a process.
+
+    Saving or deleting a skill changes a per course generation stamp in
+    memcache. Other processes notice a new stamp within
+    GENERATION_CHECK_INTERVAL_SECS and compile the graph again.
+    """
+
+    GENERATION_MEMCACHE_KEY = 'skill-map-skill-graph-generation'
+    GENERATION_CHECK_INTERVAL_SECS = 5
+
+    def __init__(self):
+        self._graphs = {}
+        self._generation = caching.MemcacheGeneration(
+            self.GENERATION_MEMCACHE_KEY,
+            check_interval_secs=self.GENERATION_CHECK_INTERVAL_SECS)
+
+    @classmethod
+    def on_skills_changed(cls):
+        namespace = namespace_manager.get_namespace()
+        instance = cls.instance()
+        instance._generation.incr(namespace)
+        instance._graphs.pop(namespace, None)
+
+    def get(self):
+        namespace = namespace_manager.get_namespace()
+        # Read the stamp before the skills, so that skills saved meanwhile
+        # are compiled again under the next stamp.
+        generation = self._generation.get(namespace)
+        graph = self._graphs.get(namespace)
+        if graph is not None and graph.generation == generation:
+            COUNTER_SKILL_GRAPH_CACHE_HIT.inc()
+            return graph
+        COUNTER_SKILL_GRAPH_COMPILED.inc()
+        graph = CompiledSkillGraph(
+            _SkillDao.get_all_mapped_without_hooks(), generation=generation)
+        self._graphs[namespace] = graph
+        return graph
+
+
 class SkillGraph(caching.RequestScopedSingleton):
     """Facade to handle the CRUD lifecycle of the skill dependency graph."""
 
     def __init__(self):
+        self._compiled = CompiledSkillGraphCache.instance().get()
         # dict mapping skill id to skill
-        self._skills = _SkillDao.get_all_mapped()
+        self._skills = self._compiled.copy_skills()
+        # pylint: disable=protected-access
+        _SkillDao._maybe_apply_post_load_hooks(self._skills.itervalues())
         # dict mapping skill id to list of successor SkillDTO's
         self._successors = None
-        self._rebuild()
+        self.build_successors()
+        SkillMap.clear_all()
 
     def _rebuild(self):
+        self._compiled = CompiledSkillGraph(self._skills)
         self.build_successors()
         SkillMap.clear_all()
 
     def build_successors(self):
+        ids = self._compiled.ids
         self._successors = {}
-        for other in self._skills.values():
-            for pid in other.prerequisite_ids:
-                self._successors.setdefault(pid, []).append(other)
+        for i, successors in enumerate(self._compiled.successors):
+            if successors:
+                self._successors[ids[i]] = [
+                    self._skills[ids[j]] for j in successors]
+
+    def topological_co_sets(self):
+        """Returns lists of skill ids, each one's prerequisites in earlier ones.
+
+        Returns None if the prerequisites of the skills have a cycle.
+        """
+        return self._compiled.co_sets
+
+    def topological_order(self):
+        """Returns all skill ids, each after all of its prerequisites.
+
+        Skills on or after a cycle of prerequisites come last.
+        """
+        return self._compiled.topological_order
 
     @classmethod
     def load(cls):
@@ -344,6 +477,7 @@ class SkillGraph(caching.RequestScopedSingleton):
 
         _SkillDao.delete(self._skills[skill_id])
         _SkillDao.save_all(successors)
+        CompiledSkillGraphCache.on_skills_changed()
 
         del self._skills[skill_id]
         self._rebuild()
@@ -560,8 +694,10 @@ class SkillMap(caching.RequestScopedSingleton):
         self._units = dict([(u.unit_id, u) for u in self._course.get_units()])
 
         self._lessons_by_skill = {}
+        self._skill_ids_by_lesson = {}
         for lesson in self._course.get_lessons_for_all_units():
             skill_list = lesson.properties.get(LESSON_SKILL_LIST_KEY, [])
+            self._skill_ids_by_lesson[str(lesson.lesson_id)] = skill_list
             for skill_id in skill_list:
                 self._lessons_by_skill.setdefault(skill_id, []).append(lesson)
 
@@ -592,33 +728,15 @@ class SkillMap(caching.RequestScopedSingleton):
 
     def _topo_sort(self):
         """Returns topologically sorted co-sets."""
-        successors = self.build_successors()
-        ret = []
-        co_set = set(
-            successors.keys()) - reduce(
-            set.union, successors.values())  # Skills with no prerequisites.
-        while True:
-            if not co_set:
-                break
-            ret.append(co_set)
-            for x in co_set:
-                del successors[x]
-            for src, dst in successors.items():
-                successors[src] = dst - co_set
-            co_set = set(successors.keys()) - reduce(
-                set.union, successors.values(), set())
-        if successors:  # There is unvisited nodes -> there is a cycle.
+        co_sets = self._skill_graph.topological_co_sets()
+        if co_sets is None:  # There is a cycle.
             return None
-        else:
-            return ret
+        return [set(co_set) for co_set in co_sets]
 
     def _set_topological_sort_index(self):
-        chain = []
-        for x in self._topo_sort():
-            chain.extend(list(x))
-        for skill in self._skill_graph.skills:
-            self._skill_infos[skill.id].set_topo_sort_index(
-                chain.index(skill.id))
+        for index, skill_id in enumerate(
+                self._skill_graph.topological_order()):
+            self._skill_infos[skill_id].set_topo_sort_index(index)
 
     @classmethod
     def load(cls, course):
@@ -637,9 +755,7 @@ class SkillMap(caching.RequestScopedSingleton):
         Returns:
             A list of SkillInfo objects.
         """
-        # TODO(jorr): Can we stop relying on the unit and just use lesson id?
-        lesson = self._course.find_lesson_by_id(None, lesson_id)
-        skill_list = lesson.properties.get(LESSON_SKILL_LIST_KEY, [])
+        skill_list = self._skill_ids_by_lesson.get(str(lesson_id), [])
         return [self._skill_infos[skill_id] for skill_id in skill_list]
 
     def successors(self, skill_info):
@@ -681,13 +797,15 @@ class SkillMap(caching.RequestScopedSingleton):
         for loc in locations:
             unit, lesson = resource.Key.fromstring(loc['key']).get_resource(
                 self._course)
-            lesson.properties.setdefault(LESSON_SKILL_LIST_KEY, []).append(
-                skill.id)
+            skill_list = lesson.properties.setdefault(
+                LESSON_SKILL_LIST_KEY, [])
+            skill_list.append(skill.id)
+            self._skill_ids_by_lesson[str(lesson.lesson_id)] = skill_list
             assert self._course.update_lesson(lesson)
             # pylint: disable=protected-access
             skill._locations.append(LocationInfo(unit, lesson))
+            self._lessons_by_skill.setdefault(skill.id, []).append(lesson)
         self._course.save()
-        self._lessons_by_skill.setdefault(skill.id, []).extend(locations)
 
     def delete_skill_from_lessons(self, skill):
         #TODO(broussev): check, and if need be, refactor pre-save lesson hooks
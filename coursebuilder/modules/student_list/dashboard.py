@@ -200,11 +200,10 @@ class StudentListDashboardHandler(base.StudentListBase):
         template_value['units'] = units
 
         # Watch time
-        watch_time = models.StudentPropertyEntity.get(
-            student, record_watchtime.RecordWatchTime.PROPERTY_NAME)
+        watch_time_dict = record_watchtime.WatchTimeStore.load(
+            student.user_id)
 
-        if watch_time and watch_time.value:
-            watch_time_dict = transforms.loads(watch_time.value)
+        if watch_time_dict:
             for resource_id, entity in watch_time_dict.iteritems():
                 total_watched = sum(
                     [b-a for a, b in entity.get('watched', [])])
@@ -20,7 +20,17 @@ import ast
 import collections
 import json
 
+try:
+    import numpy
+except ImportError:
+    # numpy is provided by the App Engine runtime (see app.yaml); dev setups
+    # without it aggregate with plain lists instead.
+    numpy = None
+
+from mapreduce import context
+
 from common import schema_fields
+from models import config
 from models import courses
 from models import data_sources
 from models import jobs
@@ -29,6 +39,125 @@ from models import models
 
 from modules.watch_time import record_watchtime
 
+
+WATCH_TIME_BUCKET_SECONDS = config.ConfigProperty(
+    'gcb_watch_time_bucket_seconds', int,
+    'Width, in seconds, of the buckets of the video watch time histograms.', 1)
+
+WATCH_TIME_PER_SECOND_STATS = config.ConfigProperty(
+    'gcb_watch_time_per_second_stats', bool,
+    'Compute video watch time stats by expanding every watched range into '
+    'individual seconds, as older versions did, instead of by merging '
+    'intervals. Much slower for popular videos.', False)
+
+# Watched ranges past this point are ignored; they can only be bogus.
+MAX_VIDEO_SECONDS = 24 * 60 * 60
+
+
+def get_watched_buckets(timings, bucket_seconds):
+    """Returns the merged [first, last] bucket ranges a student watched.
+
+    Args:
+      timings: the value recorded by RecordWatchTime for one video.
+      bucket_seconds: width of a histogram bucket.
+    Returns:
+      A sorted list of disjoint, inclusive [first, last] bucket index pairs,
+      so that each bucket counts a student at most once.
+    """
+    if not isinstance(timings, dict):
+        return []
+    watched = timings.get(record_watchtime.RecordWatchTime.KEY_NAME_WATCHED)
+    if not watched:
+        return []
+    ranges = []
+    for start, end in watched:
+        start = max(int(start), 0)
+        end = min(int(end), MAX_VIDEO_SECONDS)
+        if start <= end:
+            ranges.append([start / bucket_seconds, end / bucket_seconds])
+    ranges.sort()
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+class WatchTimeHistogram(object):
+    """Number of viewers of each bucket of a video.
+
+    Watched ranges are added with a difference array: +1 where a range
+    starts, -1 just past its end, and a running sum. The cost is linear in
+    the number of ranges plus the number of buckets, however long the ranges
+    are. Counts are kept in a numpy array when numpy is available.
+    """
+
+    def __init__(self, counts=None):
+        self._counts = self._make_array([] if counts is None else counts)
+
+    @staticmethod
+    def _make_array(values):
+        if numpy is not None:
+            return numpy.array(values, dtype=numpy.int64)
+        return list(values)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _grow(self, size):
+        missing = size - len(self._counts)
+        if missing <= 0:
+            return
+        if numpy is not None:
+            self._counts = numpy.concatenate(
+                [self._counts, numpy.zeros(missing, dtype=numpy.int64)])
+        else:
+            self._counts.extend([0] * missing)
+
+    def add(self, counts):
+        """Adds the counts of another histogram, bucket by bucket."""
+        self._grow(len(counts))
+        if numpy is not None:
+            self._counts[:len(counts)] += self._make_array(counts)
+        else:
+            for index, count in enumerate(counts):
+                self._counts[index] += count
+
+    def add_ranges(self, ranges):
+        """Adds one viewer to every bucket of each [first, last] range."""
+        if not ranges:
+            return
+        size = max(last for _, last in ranges) + 1
+        if numpy is not None:
+            bounds = numpy.array(ranges, dtype=numpy.int64)
+            deltas = (
+                numpy.bincount(bounds[:, 0], minlength=size + 1) -
+                numpy.bincount(bounds[:, 1] + 1, minlength=size + 1))
+            self.add(numpy.cumsum(deltas)[:size])
+        else:
+            deltas = [0] * (size + 1)
+            for first, last in ranges:
+                deltas[first] += 1
+                deltas[last + 1] -= 1
+            counts = []
+            running = 0
+            for delta in deltas[:size]:
+                running += delta
+                counts.append(running)
+            self.add(counts)
+
+    def to_list(self):
+        return [int(count) for count in self._counts]
+
+    def to_stats(self, bucket_seconds):
+        """Returns {first second of bucket: viewers} for watched buckets."""
+        return dict(
+            (index * bucket_seconds, int(count))
+            for index, count in enumerate(self._counts) if count)
+
+
 class WatchTimeStats(jobs.MapReduceJob):
     """A job that computes video watch time stats."""
 
@@ -42,8 +171,7 @@ class WatchTimeStats(jobs.MapReduceJob):
 
     @staticmethod
     def map(entity):
-        data = []
-        if entity.name == record_watchtime.RecordWatchTime.PROPERTY_NAME:
+        if record_watchtime.WatchTimeStore.is_watch_time_property(entity.name):
             video_timing_details = transforms.loads(entity.value)
             for video_id, timings in video_timing_details.iteritems():
                 if not isinstance(timings, dict):
@@ -53,6 +181,7 @@ class WatchTimeStats(jobs.MapReduceJob):
                 watchtime = timings[record_watchtime.RecordWatchTime.KEY_NAME_WATCHED]
                 if not watchtime:
                     continue
+                data = []
                 for timing_range in watchtime:
                     for key in range(timing_range[0], timing_range[1]+1):
                         data.append(key)
@@ -70,10 +199,67 @@ class WatchTimeStats(jobs.MapReduceJob):
         yield({'video_id': str(key), 'stats': video_timings })
 
 
+class IntervalWatchTimeStats(jobs.MapReduceJob):
+    """A job that computes video watch time histograms from intervals.
+
+    Mappers emit the merged bucket ranges each student watched; the combiner
+    folds them into a dense WatchTimeHistogram per video, so the shuffle and
+    the reducer only see a few compact histograms instead of one value per
+    watched second.
+    """
+
+    @staticmethod
+    def get_description():
+        return 'Watch time'
+
+    @staticmethod
+    def entity_class():
+        return models.StudentPropertyEntity
+
+    def build_additional_mapper_params(self, unused_app_context):
+        return {'bucket_seconds': max(1, WATCH_TIME_BUCKET_SECONDS.value)}
+
+    @staticmethod
+    def map(entity):
+        if not record_watchtime.WatchTimeStore.is_watch_time_property(
+                entity.name):
+            return
+        params = context.get().mapreduce_spec.mapper.params
+        video_timing_details = transforms.loads(entity.value)
+        for video_id, timings in video_timing_details.iteritems():
+            ranges = get_watched_buckets(timings, params['bucket_seconds'])
+            if ranges:
+                yield (str(video_id), transforms.dumps(ranges))
+
+    @staticmethod
+    def combine(unused_key, values, previously_combined_values=None):
+        ranges = []
+        for value in values:
+            ranges.extend(transforms.loads(value))
+        histogram = WatchTimeHistogram()
+        histogram.add_ranges(ranges)
+        for value in previously_combined_values or []:
+            histogram.add(transforms.loads(value))
+        yield transforms.dumps(histogram.to_list())
+
+    @staticmethod
+    def reduce(key, data_list):
+        params = context.get().mapreduce_spec.mapper.params
+        histogram = WatchTimeHistogram()
+        for counts in data_list:
+            histogram.add(transforms.loads(counts))
+        yield {
+            'video_id': str(key),
+            'bucket_seconds': params['bucket_seconds'],
+            'stats': histogram.to_stats(params['bucket_seconds'])}
+
+
 class WatchTimeStatsDataSource(data_sources.SynchronousQuery):
     @staticmethod
     def required_generators():
-        return [WatchTimeStats]
+        if WATCH_TIME_PER_SECOND_STATS.value:
+            return [WatchTimeStats]
+        return [IntervalWatchTimeStats]
 
     @classmethod
     def get_name(cls):
@@ -16,15 +16,47 @@
 
 __author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
 
-import json
 import logging
+import time
+import zlib
 
+from common.utils import Namespace
 from controllers.utils import BaseHandler
 from controllers.utils import ReflectiveRequestHandler
+from models import config
+from models import counters
 from models import models
 from models import transforms
 
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+
+WATCH_TIME_WRITE_BEHIND = config.ConfigProperty(
+    'gcb_watch_time_write_behind', bool,
+    'Buffer video watch time heartbeats in a pull queue and write them to '
+    'the datastore in batches every minute, instead of running a datastore '
+    'transaction for every heartbeat.', True)
+
+COUNTER_HEARTBEATS_BUFFERED = counters.PerfCounter(
+    'gcb-watch-time-heartbeats-buffered',
+    'number of video watch time heartbeats queued for a later write')
+COUNTER_HEARTBEATS_WRITTEN = counters.PerfCounter(
+    'gcb-watch-time-heartbeats-written',
+    'number of video watch time heartbeats written to the datastore')
+COUNTER_ENTITIES_WRITTEN = counters.PerfCounter(
+    'gcb-watch-time-entities-written',
+    'number of video watch time entities written to the datastore')
+COUNTER_FLUSH_WORKERS_SCHEDULED = counters.PerfCounter(
+    'gcb-watch-time-flush-workers-scheduled',
+    'number of tasks scheduled to write the buffered watch time of a group '
+    'of students')
+COUNTER_FLUSH_FAILURES = counters.PerfCounter(
+    'gcb-watch-time-flush-failures',
+    'number of students whose buffered watch time could not be written; '
+    'their heartbeats are retried when the lease expires')
 
 
 class RecordWatchTime(BaseHandler, ReflectiveRequestHandler):
@@ -34,7 +66,8 @@ class RecordWatchTime(BaseHandler, ReflectiveRequestHandler):
     KEY_NAME_DURATION = 'duration'
     KEY_NAME_WATCHED = 'watched'
 
-    def merge_times(self, time_tuples):
+    @staticmethod
+    def merge_times(time_tuples):
         sorted_tuples = sorted(time_tuples, key=lambda x: x[0])
         merged_time_stamps = []
         s = None
@@ -51,36 +84,10 @@ class RecordWatchTime(BaseHandler, ReflectiveRequestHandler):
             merged_time_stamps.append((s, e))
         return merged_time_stamps
 
-    @db.transactional()
-    def update_watchtime(self, student, resource_id, merged_time_tuples, duration):
-        entity = models.StudentPropertyEntity.get(student, self.PROPERTY_NAME)
-        if entity:
-            value_dict = transforms.loads(entity.value)
-        else:
-            entity = models.StudentPropertyEntity.create(student, self.PROPERTY_NAME)
-            value_dict = dict()
-        value = []
-        if resource_id in value_dict:
-            if self.KEY_NAME_WATCHED in value_dict[resource_id]:
-                value = value_dict[resource_id][self.KEY_NAME_WATCHED]
-        final_value = self.merge_times(value + merged_time_tuples)
-        value_dict[resource_id] = dict()
-        try:
-            value_dict[resource_id][self.KEY_NAME_DURATION] = int(
-                float(duration))
-        except ValueError:
-            logging.error('Failed to save duration: %s', duration)
-            pass
-        value_dict[resource_id][self.KEY_NAME_WATCHED] = final_value
-        if merged_time_tuples:
-            entity.value = transforms.dumps(value_dict)
-            entity.put()
-
     def post_record_video_watchtime(self):
         student = self.personalize_page_and_get_enrolled()
         if not student:
             return
-        user_id = str(student.user_id)
         resource_id = self.request.get('resource_id')
         if not resource_id:
             return
@@ -93,4 +100,294 @@ class RecordWatchTime(BaseHandler, ReflectiveRequestHandler):
             if len(end) > i:
                 end_val = end[i]
                 merged_time_tuples.append((int(start_val), int(end_val)))
-        self.update_watchtime(student, resource_id, merged_time_tuples, duration)
+        if not merged_time_tuples:
+            return
+        try:
+            duration = int(float(duration))
+        except ValueError:
+            logging.error('Failed to save duration: %s', duration)
+            duration = None
+
+        if WATCH_TIME_WRITE_BEHIND.value:
+            try:
+                WatchTimeBuffer.add(
+                    student.user_id, resource_id, merged_time_tuples, duration)
+                return
+            except taskqueue.Error, e:
+                logging.warning(
+                    'Writing watch time directly, could not queue it: %s', e)
+        WatchTimeStore.update(student.user_id, {
+            resource_id: (merged_time_tuples, duration)})
+
+
+class WatchTimeStore(object):
+    """Stores the watch time of each student and video in its own entity.
+
+    Watch time used to live in a single StudentPropertyEntity per student,
+    holding every video the student ever played, which had to be rewritten
+    as a whole on every update. It is now sharded by video: the property
+    named video_watch_time:<resource_id> holds {resource_id: timings}, in the
+    same format as before. The old property is still read, and the timings
+    of a video move out of it into the video's own entity the first time
+    that video is updated.
+    """
+
+    SHARD_SEPARATOR = ':'
+
+    # Cross-group transactions are limited to 25 entity groups; one of them
+    # is the student's old, unsharded property.
+    MAX_VIDEOS_PER_TRANSACTION = 20
+
+    xg_on = db.create_transaction_options(xg=True)
+
+    @classmethod
+    def get_property_name(cls, resource_id):
+        return '%s%s%s' % (
+            RecordWatchTime.PROPERTY_NAME, cls.SHARD_SEPARATOR, resource_id)
+
+    @classmethod
+    def is_watch_time_property(cls, name):
+        return name == RecordWatchTime.PROPERTY_NAME or (
+            name is not None and name.startswith(
+                RecordWatchTime.PROPERTY_NAME + cls.SHARD_SEPARATOR))
+
+    @classmethod
+    def load(cls, user_id):
+        """Returns {resource_id: timings} for every video a student played."""
+        watch_time = {}
+        legacy = models.StudentPropertyEntity.get_for_id(
+            user_id, RecordWatchTime.PROPERTY_NAME)
+        if legacy and legacy.value:
+            watch_time.update(transforms.loads(legacy.value))
+
+        first_key = models.StudentPropertyEntity.create_key(
+            user_id, cls.get_property_name(''))
+        query = models.StudentPropertyEntity.all().filter(
+            '__key__ >=', db.Key.from_path(
+                models.StudentPropertyEntity.kind(), first_key)).filter(
+            '__key__ <', db.Key.from_path(
+                models.StudentPropertyEntity.kind(), first_key + u'\ufffd'))
+        for entity in query.run(batch_size=100):
+            if entity.value:
+                watch_time.update(transforms.loads(entity.value))
+        return watch_time
+
+    @classmethod
+    def update(cls, user_id, updates):
+        """Merges new watched ranges into the entities of a student.
+
+        Args:
+          user_id: the user_id of the student.
+          updates: a dict of resource_id: (list of (start, end) ranges,
+              duration or None).
+        """
+        resource_ids = sorted(updates.keys())
+        for index in xrange(
+                0, len(resource_ids), cls.MAX_VIDEOS_PER_TRANSACTION):
+            batch = dict(
+                (resource_id, updates[resource_id]) for resource_id in
+                resource_ids[index:index + cls.MAX_VIDEOS_PER_TRANSACTION])
+            db.run_in_transaction_options(
+                cls.xg_on, cls._update_in_txn, user_id, batch)
+
+    @classmethod
+    def _update_in_txn(cls, user_id, updates):
+        resource_ids = updates.keys()
+        legacy_key = models.StudentPropertyEntity.create_key(
+            user_id, RecordWatchTime.PROPERTY_NAME)
+        shard_keys = [
+            models.StudentPropertyEntity.create_key(
+                user_id, cls.get_property_name(resource_id))
+            for resource_id in resource_ids]
+        entities = models.StudentPropertyEntity.get_by_key_name(
+            [legacy_key] + shard_keys)
+
+        legacy = entities[0]
+        legacy_dict = {}
+        if legacy and legacy.value:
+            legacy_dict = transforms.loads(legacy.value)
+        legacy_changed = False
+
+        to_put = []
+        for resource_id, key, shard in zip(
+                resource_ids, shard_keys, entities[1:]):
+            time_tuples, duration = updates[resource_id]
+            if shard:
+                timings = transforms.loads(shard.value).get(resource_id, {})
+            else:
+                shard = models.StudentPropertyEntity(
+                    key_name=key, name=cls.get_property_name(resource_id))
+                timings = {}
+            watched = list(timings.get(RecordWatchTime.KEY_NAME_WATCHED, []))
+
+            old_timings = legacy_dict.pop(resource_id, None)
+            if old_timings is not None:
+                legacy_changed = True
+                if isinstance(old_timings, dict):
+                    watched += old_timings.get(
+                        RecordWatchTime.KEY_NAME_WATCHED, [])
+                    timings.setdefault(
+                        RecordWatchTime.KEY_NAME_DURATION,
+                        old_timings.get(RecordWatchTime.KEY_NAME_DURATION))
+
+            if duration is not None:
+                timings[RecordWatchTime.KEY_NAME_DURATION] = duration
+            timings[RecordWatchTime.KEY_NAME_WATCHED] = (
+                RecordWatchTime.merge_times(watched + list(time_tuples)))
+            shard.value = transforms.dumps({resource_id: timings})
+            to_put.append(shard)
+
+        if legacy_changed:
+            legacy.value = transforms.dumps(legacy_dict)
+            to_put.append(legacy)
+        for entity in to_put:
+            entity.put()
+        COUNTER_ENTITIES_WRITTEN.inc(len(to_put))
+
+
+class WatchTimeBuffer(object):
+    """Buffers watch time heartbeats in a pull queue until they are flushed.
+
+    A heartbeat only costs a task insertion. Each heartbeat is tagged with
+    one of NUM_FLUSH_WORKERS groups of students, and WatchTimeFlushHandler
+    schedules one push task per group. Each task leases the heartbeats of
+    its group in bulk, merges them per student and video and writes each
+    student's videos in one transaction, so groups are written in parallel
+    and no two tasks write the same student. Heartbeats stay in the queue
+    until they are written, so a failed flush is retried once their lease
+    expires.
+    """
+
+    QUEUE_NAME = 'watch-time'
+    LEASE_SECONDS = 120
+    MAX_TASKS_PER_LEASE = 1000
+    FLUSH_DEADLINE_SECONDS = 50
+    NUM_FLUSH_WORKERS = 8
+    TAG_PREFIX = 'student-group-'
+
+    @classmethod
+    def get_tag(cls, user_id):
+        """Returns the tag of the group of students a student belongs to."""
+        group = (zlib.crc32(str(user_id)) & 0xffffffff) % cls.NUM_FLUSH_WORKERS
+        return '%s%d' % (cls.TAG_PREFIX, group)
+
+    @classmethod
+    def add(cls, user_id, resource_id, time_tuples, duration):
+        payload = transforms.dumps({
+            'namespace': namespace_manager.get_namespace(),
+            'user_id': user_id,
+            'resource_id': resource_id,
+            'watched': time_tuples,
+            'duration': duration})
+        taskqueue.Queue(cls.QUEUE_NAME).add(taskqueue.Task(
+            payload=payload, method='PULL', tag=cls.get_tag(user_id)))
+        COUNTER_HEARTBEATS_BUFFERED.inc()
+
+    @classmethod
+    def _group(cls, tasks):
+        """Returns {(namespace, user_id): {resource_id: updates}, tasks}."""
+        updates = {}
+        tasks_by_student = {}
+        for task in tasks:
+            try:
+                heartbeat = transforms.loads(task.payload)
+                student = (heartbeat['namespace'], heartbeat['user_id'])
+                resource_id = heartbeat['resource_id']
+                watched = heartbeat['watched']
+                duration = heartbeat['duration']
+            except (ValueError, KeyError), e:
+                logging.error('Dropping bad watch time heartbeat: %s', e)
+                tasks_by_student.setdefault(None, []).append(task)
+                continue
+
+            student_updates = updates.setdefault(student, {})
+            old_watched, old_duration = student_updates.get(
+                resource_id, ([], None))
+            student_updates[resource_id] = (
+                old_watched + watched,
+                duration if duration is not None else old_duration)
+            tasks_by_student.setdefault(student, []).append(task)
+        return updates, tasks_by_student
+
+    @classmethod
+    def schedule_flush(cls):
+        """Schedules a task to flush each group of students.
+
+        Tasks are named after the current minute, so a cron request that is
+        run twice does not start a second task for a group.
+
+        Returns:
+          The number of tasks scheduled.
+        """
+        minute = int(time.time()) // 60
+        num_scheduled = 0
+        for group in xrange(cls.NUM_FLUSH_WORKERS):
+            tag = '%s%d' % (cls.TAG_PREFIX, group)
+            try:
+                deferred.defer(
+                    cls._flush_task, tag,
+                    _name='watch-time-flush-%d-%s' % (minute, tag))
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                continue
+            num_scheduled += 1
+        COUNTER_FLUSH_WORKERS_SCHEDULED.inc(num_scheduled)
+        return num_scheduled
+
+    @classmethod
+    def _flush_task(cls, tag):
+        num_written = cls.flush(tag)
+        logging.info(
+            'Wrote %d watch time heartbeats of %s.', num_written, tag)
+
+    @classmethod
+    def flush(cls, tag):
+        """Writes the buffered heartbeats of a group of students.
+
+        Stops when the group has no heartbeats left or time is up.
+
+        Args:
+          tag: the tag of the group of students, as returned by get_tag().
+
+        Returns:
+          The number of heartbeats written.
+        """
+        queue = taskqueue.Queue(cls.QUEUE_NAME)
+        start = time.time()
+        num_written = 0
+        while time.time() - start < cls.FLUSH_DEADLINE_SECONDS:
+            tasks = queue.lease_tasks_by_tag(
+                cls.LEASE_SECONDS, cls.MAX_TASKS_PER_LEASE, tag=tag)
+            if not tasks:
+                break
+            updates, tasks_by_student = cls._group(tasks)
+            done = tasks_by_student.pop(None, [])
+            for (namespace, user_id), student_updates in updates.iteritems():
+                try:
+                    with Namespace(namespace):
+                        WatchTimeStore.update(user_id, student_updates)
+                except db.Error, e:
+                    COUNTER_FLUSH_FAILURES.inc()
+                    logging.warning(
+                        'Failed to write watch time of %s in %s: %s',
+                        user_id, namespace, e)
+                    continue
+                done += tasks_by_student[(namespace, user_id)]
+            num_written += len(done)
+            COUNTER_HEARTBEATS_WRITTEN.inc(len(done))
+            if done:
+                queue.delete_tasks(done)
+        return num_written
+
+
+class WatchTimeFlushHandler(BaseHandler):
+    """Cron handler that schedules writing buffered watch time."""
+
+    URL = '/cron/watch_time/flush'
+
+    def get(self):
+        if 'X-AppEngine-Cron' not in self.request.headers:
+            self.error(400)
+            return
+        num_scheduled = WatchTimeBuffer.schedule_flush()
+        logging.info('Scheduled %d watch time flush tasks.', num_scheduled)
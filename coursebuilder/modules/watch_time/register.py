@@ -43,7 +43,9 @@ def register_module():
     tabs.Registry.register(
         'analytics', tab_name, MODULE_NAME, [stats])
 
-    global_routes = []
+    global_routes = [
+        (record_watchtime.WatchTimeFlushHandler.URL,
+         record_watchtime.WatchTimeFlushHandler)]
     watch_time_routes = [
         ('/modules/watch_time/video_watchtime', record_watchtime.RecordWatchTime),
         ('/modules/nptel/video_watchtime', record_watchtime.RecordWatchTime)
@@ -0,0 +1,186 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the per-second and the interval watch time aggregations.
+
+Synthetic watch time records are pushed through the map and reduce steps of
+WatchTimeStats and through the map, combine and reduce steps of
+IntervalWatchTimeStats, with the shuffle emulated in memory. The script
+reports the time each step takes and how many values cross the shuffle:
+
+$ PYTHONPATH=.:$GOOGLE_APP_ENGINE_HOME:lib/appengine-mapreduce-0.8.2.zip/\
+appengine-mapreduce-0.8.2/python/src python \
+    modules/watch_time/scripts/benchmark.py --students 5000 --length 3600
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import argparse
+import collections
+import json
+import random
+import time
+
+from models import transforms
+from modules.watch_time import analytics
+from modules.watch_time import record_watchtime
+
+
+class _FakeEntity(object):
+
+    def __init__(self, value):
+        self.name = record_watchtime.RecordWatchTime.PROPERTY_NAME
+        self.value = value
+
+
+def _merge(ranges):
+    # RecordWatchTime stores disjoint ranges only.
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def make_entities(num_students, num_videos, length, max_ranges):
+    entities = []
+    for _ in xrange(num_students):
+        videos = {}
+        for video in xrange(num_videos):
+            watched = []
+            for _ in xrange(random.randint(1, max_ranges)):
+                start = random.randint(0, length - 1)
+                end = min(length, start + random.randint(0, length / 2))
+                watched.append((start, end))
+            videos['video-%s' % video] = {
+                record_watchtime.RecordWatchTime.KEY_NAME_DURATION: length,
+                record_watchtime.RecordWatchTime.KEY_NAME_WATCHED:
+                    _merge(watched)}
+        entities.append(_FakeEntity(transforms.dumps(videos)))
+    return entities
+
+
+def _shuffle(outputs):
+    grouped = collections.defaultdict(list)
+    for key, value in outputs:
+        grouped[key].append(str(value))
+    return grouped
+
+
+def run_per_second(entities):
+    timings = {}
+    start = time.time()
+    outputs = []
+    for entity in entities:
+        outputs.extend(analytics.WatchTimeStats.map(entity))
+    timings['map'] = time.time() - start
+    num_values = sum(len(data) for _, data in outputs)
+
+    start = time.time()
+    grouped = _shuffle(outputs)
+    timings['shuffle'] = time.time() - start
+
+    start = time.time()
+    results = {}
+    for key, values in grouped.iteritems():
+        for result in analytics.WatchTimeStats.reduce(key, values):
+            results[key] = result['stats']
+    timings['reduce'] = time.time() - start
+    return results, timings, num_values
+
+
+def run_intervals(entities, bucket_seconds, combine_batch):
+    timings = {}
+    start = time.time()
+    outputs = []
+    for entity in entities:
+        for video_id, video_timings in transforms.loads(
+                entity.value).iteritems():
+            ranges = analytics.get_watched_buckets(
+                video_timings, bucket_seconds)
+            if ranges:
+                outputs.append((video_id, transforms.dumps(ranges)))
+    timings['map'] = time.time() - start
+
+    start = time.time()
+    grouped = _shuffle(outputs)
+    timings['shuffle'] = time.time() - start
+
+    # The reducer reader hands the combiner one batch of map outputs at a
+    # time, together with what it combined so far.
+    start = time.time()
+    num_values = 0
+    combined = {}
+    for key, values in grouped.iteritems():
+        current = []
+        for index in xrange(0, len(values), combine_batch):
+            current = list(analytics.IntervalWatchTimeStats.combine(
+                key, values[index:index + combine_batch], current))
+        combined[key] = current
+        num_values += sum(len(json.loads(value)) for value in current)
+    timings['combine'] = time.time() - start
+
+    start = time.time()
+    results = {}
+    for key, values in combined.iteritems():
+        histogram = analytics.WatchTimeHistogram()
+        for counts in values:
+            histogram.add(transforms.loads(counts))
+        results[key] = histogram.to_stats(bucket_seconds)
+    timings['reduce'] = time.time() - start
+    return results, timings, num_values
+
+
+def _report(name, timings, num_values):
+    print '%s:' % name
+    for step in ('map', 'shuffle', 'combine', 'reduce'):
+        if step in timings:
+            print '  %-8s %8.3fs' % (step, timings[step])
+    print '  %-8s %8.3fs' % ('total', sum(timings.values()))
+    print '  values reaching the reducer: %s' % num_values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', default=2000, type=int)
+    parser.add_argument('--videos', default=2, type=int)
+    parser.add_argument(
+        '--length', default=1800, type=int, help='video length in seconds')
+    parser.add_argument(
+        '--ranges', default=3, type=int,
+        help='maximum number of watched ranges per student and video')
+    parser.add_argument('--bucket_seconds', default=1, type=int)
+    parser.add_argument('--combine_batch', default=1000, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    entities = make_entities(
+        args.students, args.videos, args.length, args.ranges)
+    print 'numpy: %s' % (analytics.numpy is not None)
+
+    per_second, timings, num_values = run_per_second(entities)
+    _report('per second', timings, num_values)
+    intervals, timings, num_values = run_intervals(
+        entities, args.bucket_seconds, args.combine_batch)
+    _report('intervals', timings, num_values)
+
+    if args.bucket_seconds == 1:
+        print 'results match: %s' % (per_second == intervals)
+
+
+if __name__ == '__main__':
+    main()
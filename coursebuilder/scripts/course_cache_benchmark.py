@@ -0,0 +1,109 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times the serialization of courses for memcache.
+
+Units and lessons of a synthetic course are serialized the way the pickled
+course memento used to be and with the CourseElementSerializer records
+CachedCourse13 now uses. The script checks that records load back into
+equal units and lessons:
+
+$ PYTHONPATH=.:$GOOGLE_APP_ENGINE_HOME python \
+    scripts/course_cache_benchmark.py --units 50 --lessons 10
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import argparse
+import pickle
+import timeit
+
+from models import courses
+
+
+def make_course(num_units, num_lessons):
+    units = []
+    lessons = []
+    for unit_id in xrange(1, num_units + 1):
+        unit = courses.Unit13()
+        unit.unit_id = unit_id
+        unit.type = 'U'
+        unit.title = u'Unit %s \u00e9t\u00e9' % unit_id
+        unit.description = 'Description of unit %s' % unit_id
+        unit.labels = '1,2'
+        units.append(unit)
+        for index in xrange(num_lessons):
+            lesson = courses.Lesson13()
+            lesson.lesson_id = unit_id * 1000 + index
+            lesson.unit_id = unit_id
+            lesson.title = 'Lesson %s.%s' % (unit_id, index)
+            lesson.objectives = u'<p>Lesson <b>objectives</b></p>' * 20
+            lesson.video = 'dQw4w9WgXcQ'
+            lesson.properties = {'duration': index * 60}
+            lessons.append(lesson)
+    return units, lessons
+
+
+def _public(element):
+    return dict(
+        (name, value) for name, value in element.__dict__.iteritems()
+        if name != '_index')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--units', default=50, type=int)
+    parser.add_argument('--lessons', default=10, type=int,
+                        help='number of lessons per unit')
+    parser.add_argument('--number', default=20, type=int,
+                        help='number of times the course is serialized')
+    args = parser.parse_args()
+
+    units, lessons = make_course(args.units, args.lessons)
+    unit_serializer = courses.CachedCourse13.UNIT_SERIALIZER
+    lesson_serializer = courses.CachedCourse13.LESSON_SERIALIZER
+
+    def dumps_memento():
+        return pickle.dumps({'units': units, 'lessons': lessons})
+
+    def dumps_records():
+        return ([unit_serializer.dumps(unit) for unit in units] +
+                [lesson_serializer.dumps(lesson) for lesson in lessons])
+
+    memento = dumps_memento()
+    records = dumps_records()
+    unit_records = records[:len(units)]
+    lesson_records = records[len(units):]
+
+    def loads_records():
+        return ([unit_serializer.loads(data) for data in unit_records] +
+                [lesson_serializer.loads(data) for data in lesson_records])
+
+    print '%s units, %s lessons' % (len(units), len(lessons))
+    print '  %-16s %8s bytes' % ('memento', len(memento))
+    print '  %-16s %8s bytes' % ('records', sum(len(data) for data in records))
+    for label, function in (
+        ('dumps memento', dumps_memento),
+        ('loads memento', lambda: pickle.loads(memento)),
+        ('dumps records', dumps_records),
+        ('loads records', loads_records)):
+        seconds = timeit.timeit(function, number=args.number)
+        print '  %-16s %8.3f ms' % (label, seconds * 1000 / args.number)
+    print 'records match: %s' % (
+        [_public(element) for element in units + lessons] ==
+        [_public(element) for element in loads_records()])
+
+
+if __name__ == '__main__':
+    main()
@@ -44,7 +44,8 @@ ALL_TEST_CLASSES = {
     'tests.functional.common_crypto.PiiObfuscationHmac': 2,
     'tests.functional.common_crypto.GenCryptoKeyFromHmac': 2,
     'tests.functional.common_crypto.GetExternalUserIdTests': 4,
-    'tests.functional.explorer_module.CourseExplorerTest': 3,
+    'tests.functional.explorer_module.CourseExplorerTest': 4,
+    'tests.functional.explorer_module.CourseCatalogCacheTest': 5,
     'tests.functional.explorer_module.CourseExplorerDisabledTest': 3,
     'tests.functional.explorer_module.GlobalProfileTest': 1,
     'tests.functional.controllers_review.PeerReviewControllerTest': 7,
@@ -57,14 +58,16 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_analytics.MapReduceSimpleTest': 1,
     'tests.functional.model_analytics.ProgressAnalyticsTest': 8,
     'tests.functional.model_analytics.QuestionAnalyticsTest': 3,
-    'tests.functional.model_courses.CourseCachingTest': 5,
+    'tests.functional.model_courses.CourseCachingTest': 6,
+    'tests.functional.model_courses.CourseIndexTest': 4,
+    'tests.functional.model_courses.CourseListAppContextCacheTest': 4,
     'tests.functional.model_data_sources.PaginatedTableTest': 17,
     'tests.functional.model_data_sources.PiiExportTest': 4,
     'tests.functional.model_entities.BaseEntityTestCase': 3,
     'tests.functional.model_entities.ExportEntityTestCase': 2,
     'tests.functional.model_entities.EntityTransformsTest': 4,
     'tests.functional.model_jobs.JobOperationsTest': 15,
-    'tests.functional.model_models.BaseJsonDaoTestCase': 1,
+    'tests.functional.model_models.BaseJsonDaoTestCase': 2,
     'tests.functional.model_models.ContentChunkTestCase': 15,
     'tests.functional.model_models.EventEntityTestCase': 1,
     'tests.functional.model_models.MemcacheManagerTestCase': 4,
@@ -72,13 +75,14 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_models.QuestionDAOTestCase': 3,
     'tests.functional.model_models.StudentAnswersEntityTestCase': 1,
     'tests.functional.model_models.StudentProfileDAOTestCase': 6,
-    'tests.functional.model_models.StudentPropertyEntityTestCase': 1,
-    'tests.functional.model_models.StudentTestCase': 3,
+    'tests.functional.model_models.StudentPropertyEntityTestCase': 5,
+    'tests.functional.model_models.StudentTestCase': 6,
     'tests.functional.model_student_work.KeyPropertyTest': 4,
     'tests.functional.model_student_work.ReviewTest': 3,
     'tests.functional.model_student_work.SubmissionTest': 3,
     'tests.functional.model_utils.QueryMapperTest': 4,
     'tests.functional.model_vfs.VfsLargeFileSupportTest': 6,
+    'tests.functional.model_vfs.VfsTemplateEnvironmentTest': 2,
     'tests.functional.module_config_test.ManipulateAppYamlFileTest': 8,
     'tests.functional.module_config_test.ModuleIncorporationTest': 8,
     'tests.functional.module_config_test.ModuleManifestTest': 7,
@@ -104,7 +108,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_dashboard.RoleEditorTestCase': 3,
     'tests.functional.modules_data_pump.SchemaConversionTests': 1,
     'tests.functional.modules_data_pump.StudentSchemaValidationTests': 2,
-    'tests.functional.modules_data_pump.PiiTests': 7,
+    'tests.functional.modules_data_pump.PiiTests': 8,
     'tests.functional.modules_data_pump.BigQueryInteractionTests': 36,
     'tests.functional.modules_data_pump.UserInteractionTests': 4,
     'tests.functional.modules_data_source_providers.CourseElementsTest': 11,
@@ -137,27 +141,33 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_invitation.ProfileViewInvitationTests': 5,
     'tests.functional.modules_invitation.SantitationTests': 1,
     'tests.functional.modules_manual_progress.ManualProgressTest': 24,
+    'tests.functional.modules_manual_review.AssignmentPoolTest': 5,
+    'tests.functional.modules_manual_review.CourseStaffCountsTest': 3,
+    'tests.functional.modules_manual_review.EvaluatorAllocatorTest': 2,
+    'tests.functional.modules_manual_review.FindAndAddEvaluatorsTest': 4,
+    'tests.functional.modules_manual_review.ManagerAssignFromPoolTest': 2,
     'tests.functional.modules_math.MathTagTests': 3,
     'tests.functional.modules_notifications.CronTest': 9,
     'tests.functional.modules_notifications.DatetimeConversionTest': 1,
-    'tests.functional.modules_notifications.ManagerTest': 31,
+    'tests.functional.modules_notifications.ManagerTest': 33,
     'tests.functional.modules_notifications.NotificationTest': 8,
     'tests.functional.modules_notifications.PayloadTest': 6,
     'tests.functional.modules_notifications.SerializedPropertyTest': 2,
     'tests.functional.modules_notifications.StatsTest': 2,
+    'tests.functional.modules_nptel.CsvReportJobTest': 2,
     'tests.functional.modules_oeditor.ObjectEditorTest': 4,
     'tests.functional.modules_questionnaire.QuestionnaireDataSourceTests': 2,
     'tests.functional.modules_questionnaire.QuestionnaireTagTests': 3,
     'tests.functional.modules_questionnaire.QuestionnaireRESTHandlerTests': 5,
     'tests.functional.modules_rating.ExtraContentProvideTests': 4,
-    'tests.functional.modules_scorer.ScoringTest':10,
+    'tests.functional.modules_scorer.ScoringTest':17,
     'tests.functional.modules_rating.RatingHandlerTests': 15,
     'tests.functional.modules_search.SearchTest': 12,
     'tests.functional.modules_skill_map.CountSkillCompletionsTests': 3,
     'tests.functional.modules_skill_map.LocationListRestHandlerTests': 2,
     'tests.functional.modules_skill_map.SkillAggregateRestHandlerTests': 6,
     'tests.functional.modules_skill_map.SkillCompletionTrackerTests': 6,
-    'tests.functional.modules_skill_map.SkillGraphTests': 11,
+    'tests.functional.modules_skill_map.SkillGraphTests': 12,
     'tests.functional.modules_skill_map.SkillI18nTests': 5,
     'tests.functional.modules_skill_map.SkillMapAnalyticsTabTests': 2,
     'tests.functional.modules_skill_map.SkillMapHandlerTests': 4,
@@ -186,27 +196,27 @@ ALL_TEST_CLASSES = {
     'tests.functional.student_last_location.RootCourse': 3,
     'tests.functional.student_tracks.StudentTracksTest': 10,
     'tests.functional.review_stats.PeerReviewAnalyticsTest': 1,
-    'tests.functional.roles.RolesTest': 24,
+    'tests.functional.roles.RolesTest': 25,
     'tests.functional.upload_module.TextFileUploadHandlerTestCase': 8,
     'tests.functional.test_classes.ActivityTest': 2,
     'tests.functional.test_classes.AdminAspectTest': 9,
     'tests.functional.test_classes.AssessmentTest': 2,
-    'tests.functional.test_classes.CourseAuthorAspectTest': 4,
+    'tests.functional.test_classes.CourseAuthorAspectTest': 5,
     'tests.functional.test_classes.CourseAuthorCourseCreationTest': 1,
     'tests.functional.test_classes.CourseUrlRewritingTest': 44,
     'tests.functional.test_classes.DatastoreBackedCustomCourseTest': 6,
     'tests.functional.test_classes.DatastoreBackedSampleCourseTest': 44,
     'tests.functional.test_classes.EtlMainTestCase': 42,
     'tests.functional.test_classes.EtlRemoteEnvironmentTestCase': 0,
-    'tests.functional.test_classes.InfrastructureTest': 21,
+    'tests.functional.test_classes.InfrastructureTest': 24,
     'tests.functional.test_classes.I18NTest': 2,
     'tests.functional.test_classes.LessonComponentsTest': 2,
     'tests.functional.test_classes.MemcacheTest': 65,
     'tests.functional.test_classes.MultipleCoursesTest': 1,
     'tests.functional.test_classes.NamespaceTest': 2,
     'tests.functional.test_classes.StaticHandlerTest': 1,
-    'tests.functional.test_classes.StudentAspectTest': 19,
-    'tests.functional.test_classes.StudentUnifiedProfileTest': 19,
+    'tests.functional.test_classes.StudentAspectTest': 20,
+    'tests.functional.test_classes.StudentUnifiedProfileTest': 20,
     'tests.functional.test_classes.TransformsEntitySchema': 1,
     'tests.functional.test_classes.TransformsJsonFileTestCase': 3,
     'tests.functional.test_classes.VirtualFileSystemTest': 44,
@@ -240,6 +250,7 @@ ALL_TEST_CLASSES = {
     'tests.unit.models_analytics.AnalyticsTests': 5,
     'tests.unit.models_courses.WorkflowValidationTests': 13,
     'tests.unit.models_transforms.JsonToDictTests': 13,
+    'tests.unit.models_transforms.JsonEncodingTests': 4,
     'tests.unit.models_transforms.JsonParsingTests': 3,
     'tests.unit.models_transforms.StringValueConversionTests': 2,
     'tests.unit.modules_dashboard.TabTests': 6,
@@ -0,0 +1,157 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times compiled and recursive JSON schema validation of exported rows.
+
+Pages of student-like rows, as the data pump validates before sending them
+to BigQuery, are checked with a validator from get_json_schema_validator()
+and by walking the schema for each row.  Some rows are damaged so that the
+script can check both give the same complaints:
+
+$ PYTHONPATH=.:$GOOGLE_APP_ENGINE_HOME python \
+    scripts/schema_validation_benchmark.py --rows 100 --pages 50
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import argparse
+import datetime
+import random
+import time
+
+from common import schema_fields
+from models import transforms
+
+
+def make_schema():
+    reg = schema_fields.FieldRegistry('Student')
+    reg.add_property(schema_fields.SchemaField(
+        'user_id', 'User ID', 'string'))
+    reg.add_property(schema_fields.SchemaField(
+        'email', 'Email', 'string'))
+    reg.add_property(schema_fields.SchemaField(
+        'name', 'Name', 'string', optional=True))
+    reg.add_property(schema_fields.SchemaField(
+        'is_enrolled', 'Is Enrolled', 'boolean'))
+    reg.add_property(schema_fields.SchemaField(
+        'enrolled_on', 'Enrolled On', 'datetime'))
+    reg.add_property(schema_fields.SchemaField(
+        'last_seen_on', 'Last Seen On', 'date', optional=True))
+    reg.add_property(schema_fields.SchemaField(
+        'scores', 'Scores', 'string', optional=True))
+    reg.add_property(schema_fields.SchemaField(
+        'overall_score', 'Overall Score', 'number', optional=True))
+    reg.add_property(schema_fields.SchemaField(
+        'home_page', 'Home Page', 'url', optional=True))
+    reg.add_property(schema_fields.FieldArray(
+        'labels', 'Labels', item_type=schema_fields.SchemaField(
+            'label', 'Label', 'string')))
+    field = schema_fields.FieldRegistry('Field')
+    field.add_property(schema_fields.SchemaField('name', 'Name', 'string'))
+    field.add_property(schema_fields.SchemaField('value', 'Value', 'string'))
+    reg.add_property(schema_fields.FieldArray(
+        'additional_fields', 'Additional Fields', item_type=field))
+    return reg.get_json_schema_dict()['properties']
+
+
+def make_row(index):
+    enrolled_on = datetime.datetime(2020, 1, 1) + datetime.timedelta(
+        seconds=random.randint(0, 10 ** 7))
+    return {
+        'user_id': str(10 ** 20 + index),
+        'email': 'student%s@example.com' % index,
+        'name': 'Student %s' % index,
+        'is_enrolled': True,
+        'enrolled_on': enrolled_on.strftime(
+            transforms.ISO_8601_DATETIME_FORMAT),
+        'last_seen_on': enrolled_on.strftime(transforms.ISO_8601_DATE_FORMAT),
+        'scores': transforms.dumps({'1': random.randint(0, 100)}),
+        'overall_score': random.uniform(0, 100),
+        'home_page': 'https://example.com/~%s' % index,
+        'labels': [str(label) for label in xrange(random.randint(0, 3))],
+        'additional_fields': [
+            {'name': 'form%02d' % field, 'value': 'answer %s' % field}
+            for field in xrange(random.randint(1, 5))],
+    }
+
+
+def damage(row):
+    choice = random.randint(0, 3)
+    if choice == 0:
+        row['overall_score'] = int(row['overall_score'])
+    elif choice == 1:
+        row['enrolled_on'] = row['last_seen_on']
+    elif choice == 2:
+        row['labels'].append(None)
+    else:
+        del row['email']
+        row['unexpected'] = 1
+
+
+def _walk_schema(row, schema):
+    # pylint: disable=protected-access
+    complaints = []
+    transforms._validate_object_matches_json_schema(row, schema, '', complaints)
+    return complaints
+
+
+def _time_pages(pages, validate_page):
+    start = time.time()
+    complaints = [validate_page(page) for page in pages]
+    return time.time() - start, complaints
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default=100, type=int,
+                        help='number of rows per page, as for chunk_size')
+    parser.add_argument('--pages', default=50, type=int)
+    parser.add_argument('--damaged', default=0.01, type=float,
+                        help='fraction of rows not matching the schema')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    schema = make_schema()
+    pages = []
+    for page in xrange(args.pages):
+        rows = [make_row(page * args.rows + index)
+                for index in xrange(args.rows)]
+        for row in rows:
+            if random.random() < args.damaged:
+                damage(row)
+        pages.append(rows)
+
+    walking_seconds, walking_complaints = _time_pages(
+        pages, lambda page: [_walk_schema(row, schema) for row in page])
+
+    def validate_compiled(page):
+        validate = transforms.get_json_schema_validator(schema)
+        return [validate(row) for row in page]
+    compiled_seconds, compiled_complaints = _time_pages(
+        pages, validate_compiled)
+
+    num_rows = args.rows * args.pages
+    print '%s pages of %s rows; %s rows with complaints' % (
+        args.pages, args.rows,
+        sum(1 for page in walking_complaints for row in page if row))
+    for label, seconds in (('walking schema', walking_seconds),
+                           ('compiled', compiled_seconds)):
+        print '  %-16s %8.3fs %8.2f us/row' % (
+            label, seconds, seconds * 10 ** 6 / num_rows)
+    print 'complaints match: %s' % (walking_complaints == compiled_complaints)
+
+
+if __name__ == '__main__':
+    main()
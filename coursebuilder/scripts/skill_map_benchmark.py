@@ -0,0 +1,117 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times the topological ordering of a synthetic skill graph.
+
+Skills are ordered by prerequisites with CompiledSkillGraph and with the
+set difference sort and chain.index() lookups SkillMap used to do, which are
+kept here for comparison. The script checks that both find the same co-sets:
+
+$ PYTHONPATH=.:$GOOGLE_APP_ENGINE_HOME:lib/appengine-mapreduce-0.8.2.zip/\
+appengine-mapreduce-0.8.2/python/src python \
+    scripts/skill_map_benchmark.py --skills 2000 --prerequisites 3
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import argparse
+import random
+import timeit
+
+from modules.skill_map import skill_map
+
+
+def make_skills(num_skills, max_prerequisites):
+    skills = {}
+    for skill_id in xrange(1, num_skills + 1):
+        # Prerequisites have lower ids, so the graph has no cycles.
+        prerequisite_ids = random.sample(
+            xrange(1, skill_id), min(skill_id - 1,
+                                     random.randint(0, max_prerequisites)))
+        skill = skill_map.Skill(skill_id, {
+            'name': 'Skill %s' % skill_id,
+            'description': 'Description of skill %s' % skill_id})
+        # pylint: disable=protected-access
+        skill._set_prerequisite_ids(prerequisite_ids)
+        skills[skill_id] = skill
+    return skills
+
+
+def _legacy_topo_sort(skills):
+    successors = {}
+    for skill in skills.values():
+        for pid in skill.prerequisite_ids:
+            successors.setdefault(pid, set()).add(skill.id)
+        if skill.id not in successors:
+            successors[skill.id] = set()
+    ret = []
+    co_set = set(successors.keys()) - reduce(set.union, successors.values())
+    while co_set:
+        ret.append(co_set)
+        for x in co_set:
+            del successors[x]
+        for src, dst in successors.items():
+            successors[src] = dst - co_set
+        co_set = set(successors.keys()) - reduce(
+            set.union, successors.values(), set())
+    return ret
+
+
+def legacy_sort_index(skills):
+    chain = []
+    co_sets = _legacy_topo_sort(skills)
+    for x in co_sets:
+        chain.extend(list(x))
+    return co_sets, dict(
+        (skill.id, chain.index(skill.id)) for skill in skills.values())
+
+
+def compiled_sort_index(skills):
+    graph = skill_map.CompiledSkillGraph(skills)
+    return graph.co_sets, dict(
+        (skill_id, index)
+        for index, skill_id in enumerate(graph.topological_order))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--skills', default=2000, type=int)
+    parser.add_argument('--prerequisites', default=3, type=int,
+                        help='maximum number of prerequisites per skill')
+    parser.add_argument('--number', default=5, type=int,
+                        help='number of times the skills are ordered')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    skills = make_skills(args.skills, args.prerequisites)
+    legacy_co_sets, _ = legacy_sort_index(skills)
+    compiled_co_sets, _ = compiled_sort_index(skills)
+
+    print '%s skills, %s prerequisites, %s co-sets' % (
+        len(skills), sum(len(s.prerequisite_ids) for s in skills.values()),
+        len(compiled_co_sets))
+    graph = skill_map.CompiledSkillGraph(skills)
+    for label, function in (
+        ('legacy sort', lambda: legacy_sort_index(skills)),
+        ('compiled sort', lambda: compiled_sort_index(skills)),
+        ('copy skills', graph.copy_skills)):
+        seconds = timeit.timeit(function, number=args.number)
+        print '  %-16s %8.3f ms' % (label, seconds * 1000 / args.number)
+    print 'co-sets match: %s' % (
+        legacy_co_sets == [set(co_set) for co_set in compiled_co_sets])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times transforms.dumps() and dumps_internal() on typical payloads.
+
+Each payload is encoded with dumps(), with dumps_internal() and with the
+character by character escaping dumps() used to do, which is kept here for
+comparison. The script checks that dumps() still produces the same output:
+
+$ PYTHONPATH=.:$GOOGLE_APP_ENGINE_HOME python scripts/transforms_benchmark.py
+"""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import argparse
+import json
+import random
+from StringIO import StringIO
+import timeit
+
+from models import transforms
+
+
+def _legacy_dumps(*args, **kwargs):
+    # pylint: disable=protected-access
+    kwargs.setdefault('cls', transforms._CustomJSONEncoder)
+    out = StringIO()
+    for c in json.dumps(*args, **kwargs).decode('utf8'):
+        char_val = ord(c)
+        if char_val > 0x7f or c == '<' or c == '>':
+            out.write('\\u%04X' % char_val)
+        else:
+            out.write(c)
+    return out.getvalue()
+
+
+def make_scores(num_assessments):
+    return dict(
+        (str(unit_id), round(random.uniform(0, 100)))
+        for unit_id in xrange(num_assessments))
+
+
+def make_progress(num_units, num_lessons):
+    progress = {'s.0': 1}
+    for unit_id in xrange(num_units):
+        progress['u.%s' % unit_id] = random.randint(0, 2)
+        for lesson_id in xrange(num_lessons):
+            prefix = 'u.%s.l.%s' % (unit_id, lesson_id)
+            progress[prefix] = random.randint(0, 2)
+            progress['%s.h.0' % prefix] = random.randint(0, 2)
+            for component_id in xrange(3):
+                progress['%s.h.0.c.%s' % (prefix, component_id)] = 1
+    return progress
+
+
+def make_question(num_choices):
+    return {
+        'version': '1.5',
+        'type': 0,
+        'description': u'Temp\u00e9rature de l\'eau',
+        'question': (
+            u'<p>Quelle est la temp\u00e9rature <b>d\'\u00e9bullition</b> '
+            u'de l\'eau \u00e0 <i>1 atm</i>?</p>' * 4),
+        'multiple_selections': False,
+        'choices': [{
+            'text': u'<span>%s \u00b0C</span>' % (index * 25),
+            'score': 1.0 if index == 4 else 0.0,
+            'feedback': u'<p>Voir la le\u00e7on %s</p>' % index,
+        } for index in xrange(num_choices)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', default=200, type=int,
+                        help='number of times each payload is encoded')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    payloads = [
+        ('scores', make_scores(1000)),
+        ('progress', make_progress(20, 15)),
+        ('question', make_question(8)),
+    ]
+    for name, payload in payloads:
+        assert _legacy_dumps(payload) == transforms.dumps(payload)
+        print '%s (%s bytes):' % (name, len(transforms.dumps(payload)))
+        for label, function in (
+            ('legacy dumps', _legacy_dumps),
+            ('dumps', transforms.dumps),
+            ('dumps_internal', transforms.dumps_internal)):
+            seconds = timeit.timeit(
+                lambda: function(payload), number=args.number)
+            print '  %-16s %8.3f ms' % (label, seconds * 1000 / args.number)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,12 +23,17 @@ from actions import assert_does_not_contain
 from actions import assert_equals
 from controllers import sites
 from models import config
+from models import course_category
+from models import course_list
 from models import models
 from models import transforms
 from models.models import PersonalProfile
+from modules.course_explorer import catalog
 from modules.course_explorer import course_explorer
 from modules.course_explorer import student
 
+from google.appengine.api import memcache
+
 
 class BaseExplorerTest(actions.TestBase):
     """Base class for testing explorer pages."""
@@ -153,6 +158,108 @@ class CourseExplorerTest(BaseExplorerTest):
         sites.ApplicationContext.get_environ = get_environ_old
         sites.reset_courses()
 
+    def test_catalog_decorates_copies_of_shared_courses(self):
+        course = catalog.CourseCatalog.build().courses[0]
+        decorated = course.for_student(True, False)
+        self.assertTrue(decorated.is_registered)
+        self.assertFalse(course.is_registered)
+        self.assertEqual(course.title, decorated.title)
+        self.assertEqual('/course', course.course_preview_url)
+
+
+class CourseCatalogCacheTest(actions.TestBase):
+    """Tests the catalog shared by the course explorer pages."""
+
+    def setUp(self):
+        super(CourseCatalogCacheTest, self).setUp()
+        config.Registry.test_overrides[sites.USE_COURSE_LIST.name] = True
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        self._add_course('ns_first', '/first')
+        self.cache = catalog.CourseCatalogCache.instance()
+
+    def tearDown(self):
+        self.cache.clear()
+        config.Registry.test_overrides = {}
+        super(CourseCatalogCacheTest, self).tearDown()
+
+    def _add_course(self, namespace, slug):
+        errors = []
+        course_list.CourseListDAO.add_new_course(
+            namespace, slug, 'Course %s' % slug, errors)
+        self.assertEqual([], errors)
+
+    def _get_slugs(self, course_catalog):
+        return sorted(course.slug for course in course_catalog.courses)
+
+    def test_catalog_is_shared_until_course_list_changes(self):
+        course_catalog = self.cache.get()
+        self.assertEqual(['/first'], self._get_slugs(course_catalog))
+        self.assertIs(course_catalog, self.cache.get())
+
+        self._add_course('ns_second', '/second')
+        course_catalog = self.cache.get()
+        self.assertEqual(['/first', '/second'], self._get_slugs(course_catalog))
+
+    def test_catalog_is_rebuilt_when_categories_change(self):
+        self.assertEqual({}, self.cache.get().category_defs)
+
+        errors = []
+        course_category.CourseCategoryDAO.add_new_category(
+            'math', 'Mathematics', True, errors)
+        self.assertEqual([], errors)
+        course_catalog = self.cache.get()
+        self.assertEqual({'math': 'Mathematics'}, course_catalog.category_defs)
+        self.assertEqual(
+            ['math'], course_catalog.category_menu.keys())
+
+    def test_catalog_is_rebuilt_when_other_instance_bumps_version(self):
+        course_catalog = self.cache.get()
+        memcache.incr(
+            course_list.CourseListDAO.VERSION_MEMCACHE_KEY,
+            namespace=course_list.CourseListDAO.TARGET_NAMESPACE)
+        self.assertIs(course_catalog, self.cache.get())
+
+        self.swap(catalog.CourseCatalogCache, 'VERSION_CHECK_INTERVAL_SECS', 0)
+        self.assertIsNot(course_catalog, self.cache.get())
+
+    def test_catalog_round_trips_through_memcache_chunks(self):
+        self._add_course('ns_second', '/second')
+        self._add_course('ns_third', '/third')
+        self.swap(catalog.CourseCatalogCache, 'MEMCACHE_CHUNK_SIZE', 2)
+        course_catalog = self.cache.get()
+
+        # Another process finds the catalog in memcache and does not build
+        # it.
+        self.cache.clear()
+        self.cache = catalog.CourseCatalogCache.instance()
+        built = catalog.COUNTER_CATALOG_BUILT.value
+        hits = catalog.COUNTER_CATALOG_MEMCACHE_HIT.value
+        loaded = self.cache.get()
+        self.assertEqual(built, catalog.COUNTER_CATALOG_BUILT.value)
+        self.assertEqual(hits + 1, catalog.COUNTER_CATALOG_MEMCACHE_HIT.value)
+        self.assertIsNot(course_catalog, loaded)
+        self.assertEqual(
+            [course.to_dict() for course in course_catalog.courses],
+            [course.to_dict() for course in loaded.courses])
+        self.assertEqual(course_catalog.categories, loaded.categories)
+
+    def test_catalog_with_missing_chunk_is_built_again(self):
+        self._add_course('ns_second', '/second')
+        self.swap(catalog.CourseCatalogCache, 'MEMCACHE_CHUNK_SIZE', 1)
+        self.cache.get()
+        # pylint: disable=protected-access
+        versions = catalog.CourseCatalogCache._get_versions()
+        models.MemcacheManager.delete(
+            catalog.CourseCatalogCache._memcache_key(versions, 1),
+            namespace=catalog.CourseCatalogCache.MEMCACHE_NAMESPACE)
+
+        self.cache.clear()
+        self.cache = catalog.CourseCatalogCache.instance()
+        built = catalog.COUNTER_CATALOG_BUILT.value
+        self.assertEqual(
+            ['/first', '/second'], self._get_slugs(self.cache.get()))
+        self.assertEqual(built + 1, catalog.COUNTER_CATALOG_BUILT.value)
+
 
 class CourseExplorerDisabledTest(actions.TestBase):
     """Tests when course explorer is disabled."""
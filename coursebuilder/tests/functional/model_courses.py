@@ -18,13 +18,18 @@ __author__ = [
     'mgainer@google.com (Mike Gainer)',
 ]
 
+from common import caching
 from common import utils as common_utils
+from controllers import sites
 from models import config
+from models import course_list
 from models import courses
 from models import models
 from models import vfs
 from tests.functional import actions
 
+from google.appengine.api import memcache
+
 LOREM_IPSUM = """
 Lorem ipsum dolor sit amet, consectetur adipiscing elit. Pellentesque nisl
 libero, interdum vel lectus eget, lacinia vestibulum eros. Maecenas posuere
@@ -71,55 +76,50 @@ class CourseCachingTest(actions.TestBase):
         self.course.save()
         return unit
 
-    def test_large_course_is_cached_in_memcache(self):
-        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
-        unit = self._add_large_unit(num_lessons)
-
-        memcache_keys = courses.CachedCourse13._make_keys()
+    def _get_manifest(self):
+        # pylint: disable=protected-access
+        return courses.CachedCourse13._get_manifest(self.NAMESPACE)
 
-        # Verify memcache has no contents upon initial save.
-        memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
-        self.assertEquals({}, memcache_values)
-
-        # Load course.  It won't be in memcache, so Course will fetch it
-        # from VFS and save it in memcache.
-        course = courses.Course(handler=None, app_context=self.app_context)
-
-        # Check that things have gotten into memcache.
-        memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
-        self.assertEquals(
-            memcache_keys[0:2],
-            sorted(memcache_values.keys()),
-            'Only two keys should be present.')
-        self.assertEquals(
-            models.MEMCACHE_MAX,
-            len(memcache_values[memcache_keys[0]]),
-            'Shard #0 should be full of data.')
-        self.assertGreater(
-            len(memcache_values[memcache_keys[1]]), 0,
-            'Shard #1 should have data.')
+    def _get_record_keys(self):
+        # pylint: disable=protected-access
+        _, _, unit_digests, lesson_digests, _ = self._get_manifest()
+        return [courses.CachedCourse13._record_key(digest)
+                for digest in unit_digests + lesson_digests]
 
+    def _delete_course_from_vfs(self):
         # Destroy the contents of the course from VFS, so that we are
         # absolutely certain that if the next course load succeeds, it has
         # come from the memcache version, rather than VFS.
-        file_key_names = vfs.DatastoreBackedFileSystem._generate_file_key_names(
-            '/data/course.json', vfs._MAX_VFS_SHARD_SIZE + 1)
         with common_utils.Namespace(self.NAMESPACE):
-            shard_0 = vfs.FileDataEntity.get_by_key_name(file_key_names[0])
-            shard_0.delete()
-            shard_1 = vfs.FileDataEntity.get_by_key_name(file_key_names[1])
-            shard_1.delete()
+            for entity in vfs.FileDataEntity.all():
+                if entity.key().name().startswith('/data/course.json'):
+                    entity.delete()
+
+    def test_large_course_is_cached_in_memcache(self):
+        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
+        unit = self._add_large_unit(num_lessons)
 
-        # Re-load course to force load from memcache.
+        # Saving the course puts it in memcache, one record per unit and
+        # lesson.
+        record_keys = self._get_record_keys()
+        self.assertEquals(1 + num_lessons, len(record_keys))
+        memcache_values = models.MemcacheManager.get_multi(
+            record_keys, self.NAMESPACE)
+        self.assertEquals(sorted(record_keys), sorted(memcache_values.keys()))
+
+        self._delete_course_from_vfs()
+
+        # Re-load course to force load from memcache, with no records kept
+        # in-process.
+        caching.ProcessScopedSingleton.clear_all()
         course = courses.Course(handler=None, app_context=self.app_context)
 
         # Verify contents.
         lessons = course.get_lessons(unit.unit_id)
         self.assertEquals(num_lessons, len(lessons))
-        for lesson in lessons:
+        for index, lesson in enumerate(lessons):
             self.assertEquals(lesson.objectives, LOREM_IPSUM)
+            self.assertEquals(index + 1, lesson.index)
 
         # Delete items from memcache, and verify that loading fails.  This
         # re-verifies that the loaded data was, in fact, coming from memcache.
@@ -127,25 +127,16 @@ class CourseCachingTest(actions.TestBase):
         with self.assertRaises(AttributeError):
             course = courses.Course(handler=None, app_context=self.app_context)
 
-    def test_recovery_from_missing_initial_shard(self):
-        self._test_recovery_from_missing_shard(0)
-
-    def test_recovery_from_missing_trailing_shard(self):
-        self._test_recovery_from_missing_shard(1)
-
-    def _test_recovery_from_missing_shard(self, shard_index):
-        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
+    def test_recovery_from_missing_record(self):
+        num_lessons = 10
         unit = self._add_large_unit(num_lessons)
-        memcache_keys = courses.CachedCourse13._make_keys()
-
-        # Load course.  It won't be in memcache, so Course will fetch it
-        # from VFS and save it in memcache.
-        course = courses.Course(handler=None, app_context=self.app_context)
+        record_keys = self._get_record_keys()
 
-        models.MemcacheManager.delete(memcache_keys[shard_index])
+        models.MemcacheManager.delete(record_keys[3])
+        caching.ProcessScopedSingleton.clear_all()
 
         # Re-load course to force load from memcache.  This should fail back
-        # to VFS, and still load successfully.
+        # to VFS, still load successfully and put all records back.
         course = courses.Course(handler=None, app_context=self.app_context)
 
         # Verify contents.
@@ -153,34 +144,229 @@ class CourseCachingTest(actions.TestBase):
         self.assertEquals(num_lessons, len(lessons))
         for lesson in lessons:
             self.assertEquals(lesson.objectives, LOREM_IPSUM)
+        self.assertEquals(
+            len(record_keys), len(models.MemcacheManager.get_multi(
+                record_keys, self.NAMESPACE)))
 
-    def test_course_that_is_too_large_to_cache_is_not_cached(self):
-        num_lessons = courses.CachedCourse13._max_size() / len(LOREM_IPSUM)
-        # Fudge factor to get size of course as saved to under the VFS limit
-        # but over the memcache limit.
-        num_lessons -= 18
-        unit = self._add_large_unit(num_lessons)
-        memcache_keys = courses.CachedCourse13._make_keys()
+    def test_course_with_too_large_lesson_is_not_cached(self):
+        unit = self.course.add_unit()
+        lesson = self.course.add_lesson(unit)
+        lesson.objectives = LOREM_IPSUM * (
+            models.MEMCACHE_MAX / len(LOREM_IPSUM) + 1)
+        self.course.save()
 
         # Load the course, which would normally populate memcache with the
-        # loaded content, but will not have, because the course is too large.
+        # loaded content, but will not have, because a lesson is too large.
         # Verify that.
+        courses.Course(handler=None, app_context=self.app_context)
+        self.assertIsNone(
+            self._get_manifest(),
+            'Memcache for too-large course should be cleared.')
+
+    def test_lesson_edit_writes_one_record(self):
+        unit = self._add_large_unit(num_lessons=5)
+        _, _, unit_digests, lesson_digests, _ = self._get_manifest()
+
         course = courses.Course(handler=None, app_context=self.app_context)
-        memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
+        lesson = course.get_lessons(unit.unit_id)[2]
+        lesson.title = 'New Title'
+        course.update_lesson(lesson)
+        course.save()
+
+        _, _, new_unit_digests, new_lesson_digests, _ = (
+            self._get_manifest())
+        self.assertEquals(unit_digests, new_unit_digests)
         self.assertEquals(
-            {}, memcache_values,
-            'Memcache for too-large course should be cleared.')
+            [False, False, True, False, False],
+            [old != new
+             for old, new in zip(lesson_digests, new_lesson_digests)])
 
-    def test_small_course_occupies_only_one_shard(self):
-        self._add_large_unit(num_lessons=1)
-        memcache_keys = courses.CachedCourse13._make_keys()
+        self._delete_course_from_vfs()
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(
+            'New Title', course.get_lessons(unit.unit_id)[2].title)
 
-        # Load course to get shard put into memcache.
+    def test_load_from_memcache_uses_cached_indexes(self):
+        unit = self._add_large_unit(num_lessons=3)
+        assessment = self.course.add_assessment(None)
+        unit.post_assessment = assessment.unit_id
+        self.course.update_unit(unit)
+        self.course.save()
+        caching.ProcessScopedSingleton.clear_all()
+
+        def fail_index(unused_self):
+            self.fail('Course loaded from memcache was indexed again')
+        self.swap(courses.CourseModel13, '_index', fail_index)
+        self._delete_course_from_vfs()
         course = courses.Course(handler=None, app_context=self.app_context)
+
+        loaded_unit = course.find_unit_by_id(unit.unit_id)
+        self.assertEquals(unit.title, loaded_unit.title)
+        self.assertEquals(1, loaded_unit.index)
+        lessons = course.get_lessons(unit.unit_id)
+        self.assertEquals([1, 2, 3], [lesson.index for lesson in lessons])
+        self.assertIs(
+            lessons[1], course.find_lesson_by_id(None, lessons[1].lesson_id))
+        self.assertIs(
+            loaded_unit, course.get_parent_unit(assessment.unit_id))
+        self.assertEquals([loaded_unit], course.get_units_of_type('U'))
+
+    def test_small_course_occupies_one_record_per_element(self):
+        self._add_large_unit(num_lessons=1)
+        record_keys = self._get_record_keys()
+
         memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
+            record_keys, self.NAMESPACE)
+        self.assertEquals(2, len(memcache_values))
+
+
+class CourseIndexTest(actions.TestBase):
+
+    COURSE_NAME = 'test_course'
+    ADMIN_EMAIL = 'admin@foo.com'
+
+    def setUp(self):
+        super(CourseIndexTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Test Course')
+        self.course = courses.Course(handler=None, app_context=self.app_context)
+
+    def _reload(self):
+        return courses.Course(handler=None, app_context=self.app_context)
+
+    def test_find_by_id_after_add_and_delete(self):
+        unit = self.course.add_unit()
+        lesson = self.course.add_lesson(unit)
+        self.assertIs(unit, self.course.find_unit_by_id(unit.unit_id))
+        self.assertIs(unit, self.course.find_unit_by_id(str(unit.unit_id)))
+        self.assertIs(
+            lesson, self.course.find_lesson_by_id(None, lesson.lesson_id))
+
+        self.course.delete_unit(unit)
+        self.assertIsNone(self.course.find_unit_by_id(unit.unit_id))
+        self.assertIsNone(self.course.find_lesson_by_id(None, lesson.lesson_id))
+        self.assertEquals([], self.course.get_lessons(unit.unit_id))
+
+    def test_parent_unit_follows_pre_and_post_assessments(self):
+        unit = self.course.add_unit()
+        pre = self.course.add_assessment(None)
+        post = self.course.add_assessment(None)
+        unit.pre_assessment = pre.unit_id
+        unit.post_assessment = post.unit_id
+        self.course.update_unit(unit)
+        self.assertIs(unit, self.course.get_parent_unit(pre.unit_id))
+        self.assertIs(unit, self.course.get_parent_unit(post.unit_id))
+
+        self.course.delete_unit(pre)
+        self.assertIsNone(unit.pre_assessment)
+        self.assertIsNone(self.course.get_parent_unit(pre.unit_id))
+        self.assertIs(unit, self.course.get_parent_unit(post.unit_id))
+
+    def test_units_of_type_keep_course_order(self):
+        first = self.course.add_unit()
+        assessment = self.course.add_assessment(None)
+        second = self.course.add_unit()
+        self.assertEquals(
+            [first, second], self.course.get_units_of_type('U'))
+        self.assertEquals(
+            [assessment], self.course.get_units_of_type('A'))
+
+        self.course.reorder_units([
+            {'id': second.unit_id, 'lessons': []},
+            {'id': assessment.unit_id},
+            {'id': first.unit_id, 'lessons': []}])
         self.assertEquals(
-            memcache_keys[0:1],
-            memcache_values.keys(),
-            'Only shard zero should be present in memcache.')
+            [second, first], self.course.get_units_of_type('U'))
+
+    def test_indexes_survive_save_and_reload(self):
+        unit = self.course.add_unit()
+        lesson = self.course.add_lesson(unit)
+        assessment = self.course.add_assessment(None)
+        unit.post_assessment = assessment.unit_id
+        self.course.update_unit(unit)
+        self.course.save()
+
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        try:
+            for unused in range(2):  # First from the VFS, then from memcache.
+                course = self._reload()
+                self.assertEquals(
+                    unit.title, course.find_unit_by_id(unit.unit_id).title)
+                self.assertEquals(
+                    [lesson.lesson_id],
+                    [l.lesson_id for l in course.get_lessons(unit.unit_id)])
+                self.assertEquals(
+                    unit.unit_id,
+                    course.get_parent_unit(assessment.unit_id).unit_id)
+        finally:
+            del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+
+
+class CourseListAppContextCacheTest(actions.TestBase):
+
+    def setUp(self):
+        super(CourseListAppContextCacheTest, self).setUp()
+        config.Registry.test_overrides[sites.USE_COURSE_LIST.name] = True
+        errors = []
+        course_list.CourseListDAO.add_new_course(
+            'ns_listed', '/listed', 'Listed Course', errors)
+        self.assertEquals([], errors)
+        self.cache = sites.CourseListAppContextCache.instance()
+        self.cache.clear()
+        self.cache = sites.CourseListAppContextCache.instance()
+
+    def tearDown(self):
+        self.cache.clear()
+        del config.Registry.test_overrides[sites.USE_COURSE_LIST.name]
+        super(CourseListAppContextCacheTest, self).tearDown()
+
+    def test_hit_returns_same_app_context(self):
+        app_context = self.cache.get_for_slug('/listed')
+        self.assertEquals('ns_listed', app_context.get_namespace_name())
+
+        hits = sites.COURSE_LIST_APP_CONTEXT_CACHE_HIT.value
+        self.assertIs(app_context, self.cache.get_for_slug('/listed'))
+        self.assertIs(app_context, self.cache.get_for_namespace('ns_listed'))
+        self.assertEquals(
+            hits + 2, sites.COURSE_LIST_APP_CONTEXT_CACHE_HIT.value)
+
+    def test_misses_are_remembered_and_bounded(self):
+        self.swap(sites.CourseListAppContextCache, 'MAX_MISSING_SLUGS', 3)
+        self.cache.clear()
+        self.cache = sites.CourseListAppContextCache.instance()
+
+        self.assertIsNone(self.cache.get_for_slug('/unknown'))
+        hits = sites.COURSE_LIST_APP_CONTEXT_CACHE_HIT.value
+        self.assertIsNone(self.cache.get_for_slug('/unknown'))
+        self.assertEquals(
+            hits + 1, sites.COURSE_LIST_APP_CONTEXT_CACHE_HIT.value)
+
+        for index in xrange(sites.CourseListAppContextCache.MAX_MISSING_SLUGS):
+            self.assertIsNone(self.cache.get_for_slug('/unknown%s' % index))
+        # The oldest miss was evicted, so it is looked up again.
+        hits = sites.COURSE_LIST_APP_CONTEXT_CACHE_HIT.value
+        self.assertIsNone(self.cache.get_for_slug('/unknown'))
+        self.assertEquals(hits, sites.COURSE_LIST_APP_CONTEXT_CACHE_HIT.value)
+
+    def test_change_in_this_process_invalidates(self):
+        self.assertIsNone(self.cache.get_for_slug('/later'))
+        errors = []
+        course_list.CourseListDAO.add_new_course(
+            'ns_later', '/later', 'Later Course', errors)
+        self.assertEquals([], errors)
+        app_context = self.cache.get_for_slug('/later')
+        self.assertEquals('ns_later', app_context.get_namespace_name())
+
+    def test_version_bump_by_other_instance_invalidates(self):
+        app_context = self.cache.get_for_slug('/listed')
+        # Another instance changed the course list and bumped the stamp.
+        memcache.incr(
+            course_list.CourseListDAO.VERSION_MEMCACHE_KEY,
+            namespace=course_list.CourseListDAO.TARGET_NAMESPACE)
+        self.assertIs(app_context, self.cache.get_for_slug('/listed'))
+
+        self.swap(sites.CourseListAppContextCache,
+                  'VERSION_CHECK_INTERVAL_SECS', 0)
+        rebuilt = self.cache.get_for_slug('/listed')
+        self.assertIsNot(app_context, rebuilt)
+        self.assertEquals('ns_listed', rebuilt.get_namespace_name())
@@ -19,11 +19,14 @@ __author__ = [
 ]
 
 import datetime
+import pickle
 
+from controllers import sites
 from models import config
 from models import entities
 from models import models
 from models import services
+from models import transforms
 from modules.notifications import notifications
 from tests.functional import actions
 
@@ -413,6 +416,43 @@ class BaseJsonDaoTestCase(actions.TestBase):
 
         assert_bulk_load_succeeds()
 
+    def test_load_in_request_fetches_prefetched_ids_once(self):
+        for index in xrange(3):
+            TestDao.save(TestDto('dto_%s' % index, {'a': index}))
+
+        sites.set_path_info('/')
+        try:
+            batches = models.DAO_LOAD_BATCH.value
+            hits = models.DAO_IDENTITY_MAP_HIT.value
+            TestDao.prefetch(['dto_0', 'dto_1', 'dto_2', 'dto_3'])
+            self.assertEquals({'a': 0}, TestDao.load('dto_0').dict)
+            self.assertEquals(batches + 1, models.DAO_LOAD_BATCH.value)
+
+            # The other ids were fetched in the same batch and are served from
+            # the identity map, even once they are evicted from memcache.
+            models.MemcacheManager.delete('(entity:TestEntity:dto_1)')
+            self.assertEquals({'a': 1}, TestDao.load('dto_1').dict)
+            self.assertIsNone(TestDao.load('dto_3'))
+            dtos = TestDao.bulk_load(['dto_2', 'dto_0'])
+            self.assertEquals([{'a': 2}, {'a': 0}], [dto.dict for dto in dtos])
+            self.assertEquals(batches + 1, models.DAO_LOAD_BATCH.value)
+            self.assertEquals(hits + 4, models.DAO_IDENTITY_MAP_HIT.value)
+
+            # Each load builds a new DTO, and saving replaces the entity.
+            dto = TestDao.load('dto_1')
+            dto.dict['a'] = 10
+            self.assertEquals({'a': 1}, TestDao.load('dto_1').dict)
+            TestDao.save(dto)
+            self.assertEquals({'a': 10}, TestDao.load('dto_1').dict)
+            self.assertEquals(batches + 2, models.DAO_LOAD_BATCH.value)
+        finally:
+            sites.unset_path_info()
+
+        # Outside of a request prefetch() does nothing.
+        TestDao.prefetch(['dto_0'])
+        self.assertEquals({'a': 0}, TestDao.load('dto_0').dict)
+        self.assertEquals(batches + 2, models.DAO_LOAD_BATCH.value)
+
 
 class QuestionDAOTestCase(actions.TestBase):
     """Functional tests for QuestionDAO."""
@@ -504,6 +544,28 @@ class StudentTestCase(actions.ExportTestBase):
             'transformed_name',
             models.Student.safe_key(key, self.transform).name())
 
+    def test_set_scores_updates_only_given_assessments(self):
+        student = models.Student(key_name='name', scores='{"1": 10}')
+        student.set_scores({2: 20, '3': 30})
+        self.assertEqual({'1': 10, '2': 20, '3': 30}, student.get_scores())
+        self.assertEqual(
+            {'1': 10, '2': 20, '3': 30}, transforms.loads(student.scores))
+
+    def test_get_scores_follows_direct_writes_to_scores(self):
+        student = models.Student(key_name='name', scores='{"1": 10}')
+        self.assertEqual(10, student.get_score(1))
+        student.scores = '{"1": 15}'
+        self.assertEqual(15, student.get_score(1))
+        student.scores = None
+        self.assertEqual({}, student.get_scores())
+
+    def test_decoded_scores_survive_put_and_get(self):
+        student = models.Student(key_name='name')
+        student.set_scores({'1': 10})
+        student.put()
+        student = models.Student.get_by_key_name('name')
+        self.assertEqual({'1': 10}, student.get_scores())
+
 
 class StudentProfileDAOTestCase(actions.ExportTestBase):
 
@@ -637,3 +699,53 @@ class StudentPropertyEntityTestCase(actions.ExportTestBase):
             'transformed_%s-%s' % (user_id, property_name),
             models.StudentPropertyEntity.safe_key(
                 student_property_key, self.transform).name())
+
+    def test_set_value_items_is_encoded_by_put(self):
+        student = models.Student(key_name='email@example.com', user_id='1')
+        student.put()
+        student_property = models.StudentPropertyEntity.create(
+            student, 'property-name')
+        student_property.value = '{"a": 1}'
+        student_property.set_value_items({'b': 2})
+        student_property.set_value_items({'a': 3})
+        self.assertEqual({'a': 3, 'b': 2}, student_property.get_value_dict())
+        self.assertTrue(student_property.has_dirty_value())
+
+        student_property.put()
+        self.assertFalse(student_property.has_dirty_value())
+        self.assertEqual(
+            {'a': 3, 'b': 2}, transforms.loads(student_property.value))
+        student_property = models.StudentPropertyEntity.get(
+            student, 'property-name')
+        self.assertEqual({'a': 3, 'b': 2}, student_property.get_value_dict())
+
+    def test_set_value_items_is_encoded_by_batched_put(self):
+        student = models.Student(key_name='email@example.com', user_id='1')
+        student_property = models.StudentPropertyEntity.create(
+            student, 'property-name')
+        student_property.set_value_items({'a': 1})
+        entities.put([student, student_property])
+
+        self.assertFalse(student_property.has_dirty_value())
+        student_property = db.get(student_property.key())
+        self.assertEqual({'a': 1}, student_property.get_value_dict())
+
+    def test_decoded_value_is_not_pickled(self):
+        student = models.Student(key_name='email@example.com', user_id='1')
+        student_property = models.StudentPropertyEntity.create(
+            student, 'property-name')
+        student_property.set_value_items({'a': 1})
+
+        state = student_property.__getstate__()
+        self.assertNotIn('_decoded_value', state)
+        self.assertEqual({'a': 1}, transforms.loads(student_property.value))
+        unpickled = pickle.loads(pickle.dumps(student_property))
+        self.assertEqual({'a': 1}, unpickled.get_value_dict())
+
+    def test_get_value_dict_follows_direct_writes_to_value(self):
+        student = models.Student(key_name='email@example.com', user_id='1')
+        student_property = models.StudentPropertyEntity.create(
+            student, 'property-name')
+        self.assertEqual({}, student_property.get_value_dict())
+        student_property.value = '{"a": 1}'
+        self.assertEqual({'a': 1}, student_property.get_value_dict())
@@ -23,6 +23,8 @@ import random
 import StringIO
 import tempfile
 
+import jinja2
+
 from common import utils as common_utils
 from models import vfs
 from models import courses
@@ -199,3 +201,63 @@ class VfsLargeFileSupportTest(actions.TestBase):
         # from AppEngine about cross-group transaction having too many
         # entities involved.
         self.course.save()
+
+
+class VfsTemplateEnvironmentTest(actions.TestBase):
+
+    COURSE_NAME = 'test_course'
+    ADMIN_EMAIL = 'admin@foo.com'
+    TEMPLATE_DIR = '/assets/html/pooled'
+
+    def setUp(self):
+        super(VfsTemplateEnvironmentTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Test Course')
+        self.template_dir = self.app_context.fs.impl.physical_to_logical(
+            self.TEMPLATE_DIR)
+
+    def _put_template(self, content):
+        self.app_context.fs.put(
+            os.path.join(self.template_dir, 'pooled.html'),
+            StringIO.StringIO(content))
+
+    def _render(self):
+        environ = self.app_context.get_template_environ(
+            'en_US', [self.template_dir])
+        return environ, environ.get_template('pooled.html').render({})
+
+    def test_environment_is_reused_and_follows_file_changes(self):
+        self._put_template('first')
+        environ, content = self._render()
+        self.assertEquals('first', content)
+
+        other_environ, content = self._render()
+        self.assertIs(environ, other_environ)
+        self.assertEquals('first', content)
+
+        self._put_template('second')
+        other_environ, content = self._render()
+        self.assertIs(environ, other_environ)
+        self.assertEquals('second', content)
+
+    def test_unchanged_template_is_not_opened_again(self):
+        self._put_template('first')
+        self._render()
+
+        opened = []
+        open_file = vfs.DatastoreBackedFileSystem.open
+
+        def counting_open(fs, filename):
+            if filename.endswith('pooled.html'):
+                opened.append(filename)
+            return open_file(fs, filename)
+
+        self.swap(vfs.DatastoreBackedFileSystem, 'open', counting_open)
+        unused_environ, content = self._render()
+        self.assertEquals('first', content)
+        self.assertEquals([], opened)
+
+        self.app_context.fs.delete(
+            os.path.join(self.template_dir, 'pooled.html'))
+        with self.assertRaises(jinja2.TemplateNotFound):
+            self._render()
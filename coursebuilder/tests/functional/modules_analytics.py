@@ -1575,6 +1575,70 @@ class ClusteringGeneratorTests(actions.TestBase):
         ]
         self._check_hamming(cluster_vector, [], 1)
 
+    def test_cluster_distances_match_hamming_distance(self):
+        clusters = [
+            {'id': 1, 'vector': [
+                {clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+                 clustering.DIM_ID: '1',
+                 clustering.DIM_HIGH: 10,
+                 clustering.DIM_LOW: None},
+                {clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+                 clustering.DIM_ID: '2',
+                 clustering.DIM_HIGH: 80,
+                 clustering.DIM_LOW: 60}]},
+            {'id': 2, 'vector': [
+                {clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+                 clustering.DIM_ID: '2',
+                 clustering.DIM_HIGH: None,
+                 clustering.DIM_LOW: 90},
+                {clustering.DIM_TYPE: clustering.DIM_TYPE_LESSON,
+                 clustering.DIM_ID: '1',
+                 clustering.DIM_HIGH: 5,
+                 clustering.DIM_LOW: 5}]},
+            {'id': 3, 'vector': []},
+        ]
+        student_vectors = [
+            [],
+            [{clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+              clustering.DIM_ID: 1,
+              clustering.DIM_VALUE: 7},
+             {clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+              clustering.DIM_ID: '2',
+              clustering.DIM_VALUE: 100},
+             {clustering.DIM_TYPE: clustering.DIM_TYPE_LESSON,
+              clustering.DIM_ID: '1',
+              clustering.DIM_VALUE: 5}],
+            [{clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+              clustering.DIM_ID: '1',
+              clustering.DIM_VALUE: 11},
+             {clustering.DIM_TYPE: clustering.DIM_TYPE_UNIT,
+              clustering.DIM_ID: '2',
+              clustering.DIM_VALUE: 70}],
+        ]
+        distances = clustering.ClusterDistances(clusters, 1)
+        rows = distances.get_distances(
+            [distances.pack(vector) for vector in student_vectors])
+        for row, student_vector in zip(rows, student_vectors):
+            self.assertEqual(
+                [min(2, clustering.hamming_distance(
+                    cluster['vector'], student_vector))
+                 for cluster in clusters],
+                row)
+
+    def test_cluster_histogram_statistics(self):
+        histogram = clustering.ClusterHistogram(3, 2)
+        histogram.add_distances([[0, 1, 3], [1, 1, 3]])
+        other = clustering.ClusterHistogram(3, 2)
+        other.add_distances([[2, 3, 0], [0, 0, 3]])
+        histogram.add(other.to_dict())
+        self.assertEqual([
+            ('count', ('a', [2, 1, 1])),
+            ('count', ('b', [1, 2])),
+            ('count', ('c', [1])),
+            ('intersection', (('a', 'b'), [1, 3])),
+            ('intersection', (('a', 'c'), [0, 0, 1])),
+        ], list(histogram.get_statistics(['a', 'b', 'c'])))
+
 
 class TestClusterStatisticsDataSource(actions.TestBase):
 
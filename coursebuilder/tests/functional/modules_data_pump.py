@@ -429,6 +429,47 @@ class PiiTests(actions.TestBase):
               common_utils.find(lambda x: x['name'] == 'form01',
                                 student_record['additional_fields'])['value'])
 
+    def test_student_key_ranges_export_each_student_once(self):
+        user_ids = ['user%02d' % index for index in xrange(10)]
+        with common_utils.Namespace('ns_' + COURSE_NAME):
+            for user_id in user_ids:
+                models.Student(key_name=user_id, user_id=user_id,
+                               email=user_id + '@foo.com',
+                               is_enrolled=True).put()
+            split_key = str(models.Student(key_name='user04').key())
+
+        job = data_pump.DataPumpJob(self.app_context,
+                                    rest_providers.StudentsDataSource.__name__)
+        data_source_context = job._build_data_source_context()
+        data_source_context.chunk_size = 4
+        data_source_context.send_uncensored_pii_data = True
+        job_context = job._build_job_context(None, None)
+        job._start_key_ranges(self.app_context, data_source_context,
+                              job_context)
+        self.assertTrue(job_context[data_pump.KEY_RANGES_AFTER_PAGE])
+        job_context[data_pump.KEY_RANGES_AFTER_PAGE] = [
+            {'start': None, 'end': split_key, 'after': None, 'done': False},
+            {'start': split_key, 'end': None, 'after': None, 'done': False}]
+
+        exported_user_ids = []
+        next_page = 0
+        is_last_page = False
+        while not is_last_page:
+            data, is_last_page = job._fetch_key_range_page_data(
+                self.app_context, data_source_context, job_context, next_page)
+
+            # A page BigQuery did not receive reads the same items again.
+            job_context[data_pump.LAST_PAGE_SENT] = next_page
+            data_again, _ = job._fetch_key_range_page_data(
+                self.app_context, data_source_context, job_context, next_page)
+            self.assertEqual(data, data_again)
+
+            exported_user_ids.extend(item['user_id'] for item in data)
+            next_page += 1
+        self.assertEqual(3, next_page)
+        self.assertEqual(user_ids, sorted(exported_user_ids))
+
+
 class MockResponse(object):
 
     def __init__(self, the_dict):
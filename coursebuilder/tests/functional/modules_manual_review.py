@@ -0,0 +1,333 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Functional tests for modules/manual_review."""
+
+__author__ = 'Thejesh GN (tgn@google.com)'
+
+import collections
+
+from models import entities
+from models import models
+from models import student_work
+from modules.course_staff import course_staff
+from modules.manual_review import allocator
+from modules.manual_review import assign
+from modules.manual_review import manage
+from modules.manual_review import pool
+from modules.manual_review import staff
+from modules.subjective_assignments import question
+from tests.functional import actions
+
+from google.appengine.ext import db
+
+UNIT_ID = '1'
+
+Unit = collections.namedtuple('Unit', ['unit_id'])
+
+
+def _make_student(email, user_id):
+    student = models.Student(key_name=email, user_id=user_id)
+    student.put()
+    return student
+
+
+def _make_staff(user_id, can_grade=True, num_assigned=0, num_graded=0):
+    cs = course_staff.CourseStaff(
+        key_name=user_id, can_grade=can_grade, num_assigned=num_assigned,
+        num_graded=num_graded)
+    cs.put()
+    return cs
+
+
+def _make_summary(email, user_id):
+    reviewee_key = _make_student(email, user_id).get_key()
+    summary = staff.ManualEvaluationSummary(
+        reviewee_key=reviewee_key,
+        submission_key=student_work.Submission.get_key(UNIT_ID, reviewee_key),
+        unit_id=UNIT_ID)
+    summary.put()
+    return summary
+
+
+class AssignmentPoolTest(actions.TestBase):
+    """Tests the shards of pool.AssignmentPool."""
+
+    def setUp(self):
+        super(AssignmentPoolTest, self).setUp()
+        self.shard = pool.AssignmentPoolShard(key_name='shard')
+        self.keys = [db.Key.from_path('Summary', name) for name in 'abc']
+
+    def test_shard_add_and_remove(self):
+        self.assertTrue(self.shard.add(self.keys[0]))
+        self.assertTrue(self.shard.add(self.keys[1]))
+        self.assertFalse(self.shard.add(self.keys[0]))
+        self.assertEqual(self.keys[:2], self.shard.summary_keys)
+        self.assertEqual([0, 0], self.shard.leased_until)
+
+        self.assertTrue(self.shard.remove(self.keys[0]))
+        self.assertFalse(self.shard.remove(self.keys[0]))
+        self.assertEqual([self.keys[1]], self.shard.summary_keys)
+        self.assertEqual([0], self.shard.leased_until)
+
+    def test_shard_add_stops_at_max_shard_size(self):
+        self.swap(pool, 'MAX_SHARD_SIZE', 2)
+        full = pool.COUNTER_POOL_SHARD_FULL.value
+
+        self.assertTrue(self.shard.add(self.keys[0]))
+        self.assertTrue(self.shard.add(self.keys[1]))
+        self.assertFalse(self.shard.add(self.keys[2]))
+        self.assertEqual(self.keys[:2], self.shard.summary_keys)
+        self.assertEqual(full + 1, pool.COUNTER_POOL_SHARD_FULL.value)
+
+    def test_shard_lease_runs_out(self):
+        self.shard.add(self.keys[0])
+        self.shard.add(self.keys[1])
+
+        self.assertEqual(self.keys[0], self.shard.lease(100, 60))
+        self.assertEqual(self.keys[1], self.shard.lease(100, 60))
+        self.assertFalse(self.shard.is_leasable(159))
+        self.assertIsNone(self.shard.lease(159, 60))
+
+        self.assertTrue(self.shard.is_leasable(160))
+        self.assertEqual(self.keys[0], self.shard.lease(160, 60))
+        self.assertEqual([220, 160], self.shard.leased_until)
+
+    def test_update_shard_adds_then_removes_summary(self):
+        summary = _make_summary('reviewee@example.com', 'reviewee')
+        shard_key = pool.AssignmentPool._get_shard_key(
+            UNIT_ID, pool.AssignmentPool.get_shard_index(summary.key()))
+
+        pool.AssignmentPool._update_shard(UNIT_ID, summary.key())
+        self.assertEqual(
+            [summary.key()], entities.get(shard_key).summary_keys)
+
+        summary.increment_count(staff.REVIEW_STATE_ASSIGNED)
+        summary.put()
+        pool.AssignmentPool._update_shard(UNIT_ID, summary.key())
+        self.assertEqual([], entities.get(shard_key).summary_keys)
+
+    def test_summary_changed_updates_pool_in_task(self):
+        summary = _make_summary('reviewee@example.com', 'reviewee')
+        shard_index = pool.AssignmentPool.get_shard_index(summary.key())
+
+        pool.AssignmentPool.summary_changed(summary)
+        self.assertEqual([], pool.AssignmentPool.get_leasable_shards(UNIT_ID))
+
+        self.execute_all_deferred_tasks()
+        self.assertEqual(
+            [shard_index], pool.AssignmentPool.get_leasable_shards(UNIT_ID))
+        self.assertEqual(
+            summary.key(), pool.AssignmentPool.lease(UNIT_ID, shard_index))
+        self.assertIsNone(pool.AssignmentPool.lease(UNIT_ID, shard_index))
+
+
+class ManagerAssignFromPoolTest(actions.TestBase):
+    """Tests how manage.Manager assigns submissions from the pool."""
+
+    def setUp(self):
+        super(ManagerAssignFromPoolTest, self).setUp()
+        self.swap(pool, 'NUM_SHARDS', 1)
+
+    def test_skips_own_submission_in_same_shard(self):
+        own = _make_summary('evaluator@example.com', 'evaluator')
+        other = _make_summary('reviewee@example.com', 'reviewee')
+        pool.AssignmentPool._update_shard(UNIT_ID, own.key())
+        pool.AssignmentPool._update_shard(UNIT_ID, other.key())
+
+        step_key = manage.Manager._assign_from_pool(UNIT_ID, 'evaluator', 5)
+
+        step = entities.get(step_key)
+        self.assertEqual('evaluator', step.evaluator)
+        self.assertEqual(other.key(), step.manual_evaluation_summary_key)
+        self.assertEqual(1, entities.get(other.key()).assigned_count)
+        self.assertEqual(0, entities.get(own.key()).assigned_count)
+
+    def test_falls_back_to_candidates_query_on_pool_miss(self):
+        # Not added to the pool, as if its shard had been full.
+        other = _make_summary('reviewee@example.com', 'reviewee')
+        misses = manage.COUNTER_GET_NEW_REVIEW_POOL_MISS.value
+
+        step_key = manage.Manager.get_new_manual_review(UNIT_ID, 'evaluator')
+
+        self.assertEqual(
+            misses + 1, manage.COUNTER_GET_NEW_REVIEW_POOL_MISS.value)
+        step = entities.get(step_key)
+        self.assertEqual(other.key(), step.manual_evaluation_summary_key)
+
+
+class CourseStaffCountsTest(actions.TestBase):
+    """Tests the counter shards of course_staff.CourseStaff."""
+
+    def test_increment_counts_spreads_over_shards(self):
+        cs = _make_staff('staff', num_assigned=2, num_graded=1)
+        shard_indexes = iter([0, 1, 1])
+        self.swap(
+            course_staff.random, 'randrange',
+            lambda unused_stop: next(shard_indexes))
+
+        course_staff.CourseStaff.increment_counts('staff', num_assigned=1)
+        course_staff.CourseStaff.increment_counts('staff', num_assigned=1)
+        course_staff.CourseStaff.increment_counts(
+            'staff', num_assigned=-1, num_graded=1)
+
+        shards = course_staff.CourseStaffCounterShard.all().fetch(None)
+        self.assertEqual(
+            ['staff:0', 'staff:1'],
+            sorted(shard.key().name() for shard in shards))
+        self.assertEqual(
+            {'staff': (3, 2)}, course_staff.CourseStaff.get_counts([cs]))
+
+    def test_increment_counts_joins_transaction(self):
+        cs = _make_staff('staff')
+
+        def rolled_back():
+            course_staff.CourseStaff.increment_counts('staff', num_assigned=1)
+            raise db.Rollback()
+
+        db.run_in_transaction(rolled_back)
+        self.assertEqual(
+            {'staff': (0, 0)}, course_staff.CourseStaff.get_counts([cs]))
+
+    def test_get_counts_of_several_staff(self):
+        first = _make_staff('first', num_assigned=1)
+        second = _make_staff('second')
+        course_staff.CourseStaff.increment_counts('first', num_graded=1)
+        course_staff.CourseStaff.increment_counts('second', num_assigned=2)
+        course_staff.CourseStaff.increment_counts('third', num_assigned=5)
+
+        self.assertEqual(
+            {'first': (1, 1), 'second': (2, 0)},
+            course_staff.CourseStaff.get_counts([first, second]))
+
+
+class EvaluatorAllocatorTest(actions.TestBase):
+    """Tests allocator.EvaluatorAllocator."""
+
+    def setUp(self):
+        super(EvaluatorAllocatorTest, self).setUp()
+        allocator.EvaluatorAllocator.instance().clear()
+        _make_staff('busy', num_assigned=3, num_graded=1)
+        _make_staff('idle')
+        _make_staff('some', num_assigned=1)
+        _make_staff('no_grading', can_grade=False)
+
+    def tearDown(self):
+        allocator.EvaluatorAllocator.instance().clear()
+        super(EvaluatorAllocatorTest, self).tearDown()
+
+    def _find(self, count, exclude_user_ids=()):
+        return [
+            cs.user_id for cs in allocator.EvaluatorAllocator.instance(
+                ).find_evaluators(count, exclude_user_ids)]
+
+    def test_takes_least_loaded_evaluators(self):
+        self.assertEqual(['idle', 'some'], self._find(2))
+        # Both are counted as assigned, so idle is still the least loaded.
+        self.assertEqual(['idle'], self._find(1))
+        self.assertIn(self._find(1, exclude_user_ids=['idle']), [
+            ['busy'], ['some']])
+        self.assertEqual([], self._find(1, exclude_user_ids=[
+            'busy', 'idle', 'some']))
+
+    def test_reads_staff_again_when_invalidated(self):
+        loads = allocator.COUNTER_EVALUATOR_INDEX_LOAD.value
+        self.assertEqual(['idle'], self._find(1))
+        _make_staff('new')
+        self.assertEqual(['some'], self._find(1, exclude_user_ids=['idle']))
+        self.assertEqual(
+            loads + 1, allocator.COUNTER_EVALUATOR_INDEX_LOAD.value)
+
+        allocator.EvaluatorAllocator.instance().invalidate()
+        self.assertEqual(['new'], self._find(1, exclude_user_ids=['idle']))
+        self.assertEqual(
+            loads + 2, allocator.COUNTER_EVALUATOR_INDEX_LOAD.value)
+
+
+class FindAndAddEvaluatorsTest(actions.TestBase):
+    """Tests manage.Manager.find_and_add_evaluators."""
+
+    def setUp(self):
+        super(FindAndAddEvaluatorsTest, self).setUp()
+        allocator.EvaluatorAllocator.instance().clear()
+        # Restored from the class dict, as swap() would put back a method
+        # bound to the base class instead of the classmethod.
+        handler = question.SubjectiveAssignmentBaseHandler
+        self.addCleanup(
+            setattr, handler, 'get_content', handler.__dict__['get_content'])
+        handler.get_content = staticmethod(
+            lambda course, unit: {handler.OPT_NUM_REVIEWERS: 2})
+        self.unit = Unit(unit_id=UNIT_ID)
+        self.submissions = []
+        for name in ('first', 'second'):
+            student = _make_student('%s@example.com' % name, name)
+            self.submissions.append((
+                student_work.Submission.get_key(UNIT_ID, student.get_key()),
+                student))
+
+    def tearDown(self):
+        allocator.EvaluatorAllocator.instance().clear()
+        super(FindAndAddEvaluatorsTest, self).tearDown()
+
+    def _get_evaluators(self, submission_key):
+        return sorted(
+            step.evaluator for step in staff.ManualEvaluationStep.all().filter(
+                'submission_key =', submission_key)
+            if not step.removed)
+
+    def test_assigns_evaluators_to_each_submission(self):
+        staff_list = [_make_staff(user_id) for user_id in ('a', 'b', 'c')]
+
+        results = manage.Manager.find_and_add_evaluators(
+            None, self.unit, self.submissions, exclude_user_ids=['c'])
+
+        self.assertEqual([True, True], results)
+        for submission_key, _ in self.submissions:
+            self.assertEqual(['a', 'b'], self._get_evaluators(submission_key))
+        self.assertEqual(
+            {'a': (2, 0), 'b': (2, 0), 'c': (0, 0)},
+            course_staff.CourseStaff.get_counts(staff_list))
+
+    def test_only_adds_missing_evaluators(self):
+        _make_staff('a')
+        manage.Manager.find_and_add_evaluators(
+            None, self.unit, self.submissions)
+        _make_staff('b')
+        allocator.EvaluatorAllocator.instance().invalidate()
+
+        results = manage.Manager.find_and_add_evaluators(
+            None, self.unit, self.submissions)
+
+        self.assertEqual([True, True], results)
+        for submission_key, _ in self.submissions:
+            self.assertEqual(['a', 'b'], self._get_evaluators(submission_key))
+
+    def test_does_not_assign_own_submission(self):
+        _make_staff('first')
+
+        results = manage.Manager.find_and_add_evaluators(
+            None, self.unit, self.submissions[:1])
+
+        self.assertEqual([False], results)
+        submission_key = self.submissions[0][0]
+        self.assertEqual([], self._get_evaluators(submission_key))
+        self.assertIsNotNone(staff.ManualEvaluationSummary.get_by_key_name(
+            staff.ManualEvaluationSummary.key_name(submission_key)))
+
+    def test_get_students_by_user_id(self):
+        self.assertEqual(
+            ['first@example.com', None],
+            [student.key().name() if student else None
+             for student in assign.get_students_by_user_id(
+                 ['first', 'missing'])])
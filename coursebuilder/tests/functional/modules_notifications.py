@@ -38,6 +38,19 @@ class UnregisteredRetentionPolicy(notifications.RetentionPolicy):
     NAME = 'unregistered'
 
 
+class BulkRecipient(db.Model):
+    email = db.StringProperty()
+
+
+class BulkRecipients(notifications.Recipients):
+
+    def get_query(self):
+        return BulkRecipient.all()
+
+    def get_email(self, entity):
+        return entity.email
+
+
 class CronTest(actions.TestBase):
     """Tests notifications/cron.py."""
 
@@ -285,11 +298,15 @@ class ManagerTest(actions.TestBase):
         self.to = 'to@example.com'
         self.sender = 'sender@example.com'
         self.subject = 'subject'
+        self.old_fan_out_page_size = notifications._FAN_OUT_PAGE_SIZE
+        self.old_send_mail_batch_size = notifications._SEND_MAIL_BATCH_SIZE
 
     def tearDown(self):
         config.Registry.test_overrides.clear()
         counters.Registry._clear_all()
         notifications._RETENTION_POLICIES = self.old_retention_policies
+        notifications._FAN_OUT_PAGE_SIZE = self.old_fan_out_page_size
+        notifications._SEND_MAIL_BATCH_SIZE = self.old_send_mail_batch_size
         super(ManagerTest, self).tearDown()
 
     def test_get_in_process_notifications_query(self):
@@ -679,6 +696,48 @@ class ManagerTest(actions.TestBase):
                 invalid_to, self.sender, self.intent, self.body, self.subject,
                 )
 
+    def test_send_async_bulk_pages_batches_and_sends_each_recipient(self):
+        notifications._FAN_OUT_PAGE_SIZE = 2
+        notifications._SEND_MAIL_BATCH_SIZE = 2
+        to_list = ['to%s@example.com' % index for index in xrange(5)]
+        for index, to in enumerate(to_list + [None]):
+            BulkRecipient(key_name='recipient%s' % index, email=to).put()
+
+        enqueue_date = notifications.Manager.send_async_bulk(
+            BulkRecipients(), self.sender, self.intent, self.body,
+            self.subject, audit_trail=self.audit_trail)
+        self.execute_all_deferred_tasks()
+
+        messages = self.get_mail_stub().get_sent_messages()
+        self.assertEqual(
+            sorted(to_list), sorted(message.to for message in messages))
+        statuses = notifications.Manager.query(to_list, self.intent)
+        for to in to_list:
+            status = statuses[to][0]
+            self.assertEqual(enqueue_date, status.enqueue_date)
+            self.assertEqual(notifications.Status.SUCCEEDED, status.state)
+
+        self.assertEqual(
+            4, notifications.COUNTER_SEND_ASYNC_BULK_PAGE.value)
+        self.assertEqual(
+            5, notifications.COUNTER_SEND_ASYNC_BULK_SAVED.value)
+        self.assertEqual(
+            3, notifications.COUNTER_SEND_MAIL_BATCH_TASK_STARTED.value)
+        self.assertEqual(5, notifications.COUNTER_SEND_MAIL_TASK_SENT.value)
+        self.assertEqual(5, notifications.COUNTER_RETENTION_POLICY_RUN.value)
+
+        # Running a batch again does not send its notifications again.
+        notifications.Manager._send_mail_batch_task(
+            '', self.intent, enqueue_date, to_list[:2])
+        self.assertEqual(5, len(self.get_mail_stub().get_sent_messages()))
+        self.assertEqual(2, notifications.COUNTER_SEND_MAIL_TASK_SKIPPED.value)
+
+    def test_send_async_bulk_raises_value_error_if_sender_invalid(self):
+        with self.assertRaisesRegexp(ValueError, 'Malformed email address: ""'):
+            notifications.Manager.send_async_bulk(
+                BulkRecipients(), '', self.intent, self.body, self.subject)
+        self.assertFalse(self.taskq.GetTasks('default'))
+
     def test_send_mail_task_fails_permanent_and_marks_entities_if_cap_hit(self):
         over_cap = notifications._RECOVERABLE_FAILURE_CAP + 1
         notification_key, payload_key = db.put(
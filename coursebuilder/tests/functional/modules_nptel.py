@@ -0,0 +1,132 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the sharded CSV reports of modules/nptel."""
+
+__author__ = 'Abhinav Khandelwal (abhinavk@google.com)'
+
+import os
+import shutil
+import StringIO
+import tempfile
+
+from common import utils as common_utils
+from models import jobs
+from models import models
+from modules.nptel import report_writer
+from tests.functional import actions
+
+COURSE_NAME = 'nptel_report'
+ADMIN_EMAIL = 'admin@example.com'
+NAMESPACE = 'ns_%s' % COURSE_NAME
+
+
+class EnrolledStudentsReport(report_writer.CsvReportJob):
+
+    @staticmethod
+    def get_description():
+        return 'enrolled students'
+
+    @staticmethod
+    def entity_class():
+        return models.Student
+
+    def get_header_row(self):
+        return ['email', 'name']
+
+    def get_report_title(self):
+        return 'enrolled_%s.csv' % self._namespace
+
+    @staticmethod
+    def build_row(student, unused_row_params):
+        if student.is_enrolled:
+            return [student.email, student.name]
+        return None
+
+
+class CsvReportJobTest(actions.TestBase):
+
+    def setUp(self):
+        super(CsvReportJobTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            COURSE_NAME, ADMIN_EMAIL, 'NPTEL Report')
+        self.shard_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.shard_root)
+        self.uploads = []
+        self.swap(report_writer, 'insert_file', self._insert_file)
+
+    def _insert_file(
+            self, title, unused_description, content, unused_course_info,
+            folder_id=None):
+        self.uploads.append((title, content.read(), folder_id))
+        return {'id': 'file-%d' % len(self.uploads)}
+
+    def _get_part_names(self):
+        part_names = []
+        for unused_dirpath, unused_dirnames, filenames in os.walk(
+                self.shard_root):
+            part_names += filenames
+        return part_names
+
+    def test_report_concatenates_parts_after_one_header(self):
+        enrolled = []
+        with common_utils.Namespace(NAMESPACE):
+            for index in xrange(10):
+                email = 'student%d@example.com' % index
+                is_enrolled = index % 3 != 0
+                models.Student(
+                    key_name=email, user_id=str(index),
+                    name='Student, %d' % index, is_enrolled=is_enrolled).put()
+                if is_enrolled:
+                    enrolled.append('%s,"Student, %d"' % (email, index))
+
+        # Every row goes to a part file of its own.
+        self.swap(report_writer._CsvShardPool, 'MAX_PART_BYTES', 1)
+        job = EnrolledStudentsReport(
+            self.app_context,
+            storage=report_writer.LocalShardStorage(self.shard_root))
+        job.submit()
+        self.execute_all_deferred_tasks()
+
+        self.assertEquals(1, len(self.uploads))
+        title, content, folder_id = self.uploads[0]
+        self.assertEquals('enrolled_%s.csv' % NAMESPACE, title)
+        self.assertEquals(report_writer.get_folder_id(None), folder_id)
+        lines = content.splitlines()
+        self.assertEquals('email,name', lines[0])
+        self.assertEquals(sorted(enrolled), sorted(lines[1:]))
+
+        results = dict(jobs.MapReduceJob.get_results(job.load()))
+        summary = results[title]
+        self.assertTrue(summary['uploaded'])
+        self.assertEquals(len(enrolled), summary['parts'])
+        self.assertEquals(len(content), summary['bytes'])
+        self.assertEquals([], self._get_part_names())
+
+    def test_concatenated_stream_reads_and_seeks_across_parts(self):
+        contents = ['header\n', 'a,1\nb,2\n', '', 'c,3\n']
+        stream = report_writer.ConcatenatedStream([
+            (len(content), lambda content=content: StringIO.StringIO(content))
+            for content in contents])
+        self.assertEquals(len(''.join(contents)), stream.size)
+        self.assertEquals('header\na,', stream.read(9))
+        self.assertEquals(9, stream.tell())
+        self.assertEquals('1\nb,2\nc,3\n', stream.read())
+        self.assertEquals('', stream.read(1))
+
+        stream.seek(-4, os.SEEK_END)
+        self.assertEquals('c,3\n', stream.read())
+        stream.seek(4)
+        self.assertEquals('er\na,1', stream.read(6))
+        stream.close()
@@ -17,11 +17,14 @@
 __author__ = 'Rahul Telgote (rtelgote@google.com)'
 
 import collections
+from modules.scoring import rescorer
 from modules.scoring import scorer
 from common import crypto
 from common import utils as common_utils
 from models import courses
+from models import jobs
 from models import models
+from models import student_work
 from models import transforms
 from models.data_sources import utils as data_sources_utils
 from tests.functional import actions
@@ -246,4 +249,146 @@ class ScoringTest(actions.TestBase):
     def test_check_range(self):
         user_response = 3.7
         correct_answer = '3.3-3.9'
-        self.assertTrue(scorer.check_range(user_response, correct_answer))
\ No newline at end of file
+        self.assertTrue(scorer.check_range(user_response, correct_answer))
+
+    def test_grading_plan_scores_like_node_list(self):
+        answers = {u'zsgZ8dUMvJjz': [True, False, True, False]}
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            plan = scorer.GradingPlanCache.instance().get(self.HTML_STRING)
+            self.assertEquals(
+                scorer.score_question_group(dict(answers), self.NODE_LIST,
+                                            False),
+                scorer.score_question_group(dict(answers), plan, False))
+            self.assertEquals(
+                200, scorer.score_assessment(answers, self.HTML_STRING, False))
+
+    def test_grading_plan_is_cached(self):
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            plan = scorer.GradingPlanCache.instance().get(self.HTML_STRING)
+            self.assertIs(
+                plan, scorer.GradingPlanCache.instance().get(self.HTML_STRING))
+
+            # Another process finds the plan in memcache.
+            scorer.GradingPlanCache.clear_all()
+            other_plan = scorer.GradingPlanCache.instance().get(
+                self.HTML_STRING)
+            self.assertIsNot(plan, other_plan)
+            self.assertEquals(plan.keys(), other_plan.keys())
+
+    def test_grading_plan_follows_question_changes(self):
+        answers = {u'zsgZ8dUMvJjz': [True, False, False, False]}
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            self.assertEquals(
+                100, scorer.score_assessment(answers, self.HTML_STRING, False))
+
+            question = models.QuestionDAO.load(QUID2)
+            question.dict['choices'][0]['score'] = 0.5
+            models.QuestionDAO.save(question)
+            self.assertEquals(
+                50, scorer.score_assessment(answers, self.HTML_STRING, False))
+
+    def test_grading_plan_follows_question_deletion(self):
+        answers = {u'zsgZ8dUMvJjz': [True, False, False, False]}
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            self.assertEquals(
+                100, scorer.score_assessment(answers, self.HTML_STRING, False))
+
+            models.QuestionDAO.delete(models.QuestionDAO.load(QUID2))
+            self.assertEquals(
+                0, scorer.score_assessment(answers, self.HTML_STRING, False))
+
+    def test_grading_plan_only_fails_on_bad_scores_that_are_used(self):
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            question = models.QuestionDAO.load(QUID2)
+            question.dict['choices'][3]['score'] = 'bad'
+            models.QuestionDAO.save(question)
+
+            answers = {u'zsgZ8dUMvJjz': [True, False, False, False]}
+            self.assertEquals(
+                100, scorer.score_assessment(answers, self.HTML_STRING, True))
+            self.assertEquals(
+                [100], scorer.score_assessments(
+                    [answers], self.HTML_STRING, True))
+            with self.assertRaises(ValueError):
+                scorer.score_assessment(
+                    {u'zsgZ8dUMvJjz': [False, False, False, True]},
+                    self.HTML_STRING, True)
+
+    def test_score_assessments_scores_like_score_assessment(self):
+        submissions = [
+            {u'zsgZ8dUMvJjz': [True, False, True, False]},
+            {u'zsgZ8dUMvJjz': [True, True, False, False]},
+            {u'zsgZ8dUMvJjz': [False, False, False, True]},
+            {}]
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            for negative_marking in (True, False):
+                self.assertEquals(
+                    [scorer.score_assessment(
+                        dict(answers), self.HTML_STRING, negative_marking)
+                     for answers in submissions],
+                    scorer.score_assessments(
+                        submissions, self.HTML_STRING, negative_marking))
+
+    def test_bulk_rescorer_writes_changed_scores(self):
+        self.swap(rescorer.BulkRescorer, 'BATCH_SIZE', 2)
+
+        # Rescore in two key ranges, split before same@example.com.
+        def build_key_ranges(unused_cls):
+            split = str(db.Key.from_path(
+                models.Student.kind(), 'same@example.com'))
+            return [
+                {'start': None, 'end': split, 'after': None, 'done': False},
+                {'start': split, 'end': None, 'after': None, 'done': False}]
+
+        old_build_key_ranges = rescorer.BulkRescorer.__dict__[
+            '_build_key_ranges']
+        rescorer.BulkRescorer._build_key_ranges = classmethod(
+            build_key_ranges)
+        self.addCleanup(
+            setattr, rescorer.BulkRescorer, '_build_key_ranges',
+            old_build_key_ranges)
+        unit_id = str([
+            unit for unit in self.course.get_units()
+            if unit.title == 'One Question'][0].unit_id)
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            for user_id, answers, old_score in (
+                    ('changed', [True, False, False, False], 0),
+                    ('same', [True, False, False, False], 100),
+                    ('unscored', [False, False, False, False], None),
+                    ('no_submission', None, 50)):
+                student = models.Student(
+                    key_name='%s@example.com' % user_id, user_id=user_id)
+                if old_score is not None:
+                    student.set_scores({unit_id: old_score})
+                student.put()
+                if answers is not None:
+                    student_work.Submission(
+                        unit_id=unit_id, reviewee_key=student.get_key(),
+                        contents=transforms.dumps(
+                            {u'zsgZ8dUMvJjz': answers})).put()
+
+        def rescore(dry_run):
+            job = rescorer.BulkRescorer(self.context, unit_id, dry_run=dry_run)
+            job.submit()
+            self.execute_all_deferred_tasks()
+            job = job.load()
+            self.assertEquals(jobs.STATUS_CODE_COMPLETED, job.status_code)
+            self.assertEquals({
+                'unit_id': unit_id, 'dry_run': dry_run, 'submissions': 3,
+                'updated': 2, 'unscored': 1,
+                'changes': [[0.0, 1], [100.0, 1]]},
+                transforms.loads(job.output))
+            with common_utils.Namespace(self.context.get_namespace_name()):
+                return dict(
+                    (student.user_id, student.get_score(unit_id))
+                    for student in models.Student.all()
+                    if student.key().name().endswith('@example.com'))
+
+        self.assertEquals(
+            {'changed': 0, 'same': 100, 'unscored': None,
+             'no_submission': 50},
+            rescore(True))
+        self.assertEquals(
+            {'changed': 100, 'same': 100, 'unscored': 0,
+             'no_submission': 50},
+            rescore(False))
@@ -37,6 +37,7 @@ from models import models
 from models import transforms
 from models.progress import UnitLessonCompletionTracker
 from modules.i18n_dashboard import i18n_dashboard
+from modules.skill_map.skill_map import CompiledSkillGraphCache
 from modules.skill_map.skill_map import CountSkillCompletion
 from modules.skill_map.skill_map import LESSON_SKILL_LIST_KEY
 from modules.skill_map.skill_map import ResourceSkill
@@ -279,6 +280,31 @@ class SkillGraphTests(BaseSkillMapTests):
         successor_ids = {s.id for s in skill_graph.successors(skill_1.id)}
         self.assertEqual({skill_2.id, skill_3.id}, successor_ids)
 
+    def test_compiled_graph_is_shared_until_skills_change(self):
+        skill_graph = SkillGraph.load()
+        skill_1 = skill_graph.add(Skill.build(SKILL_NAME, SKILL_DESC))
+        skill_2 = skill_graph.add(Skill.build(SKILL_NAME_2, SKILL_DESC_2))
+        skill_graph.add_prerequisite(skill_1.id, skill_2.id)
+
+        cache = CompiledSkillGraphCache.instance()
+        SkillGraph.clear_all()
+        compiled = cache.get()
+        self.assertEqual([[skill_2.id], [skill_1.id]], compiled.co_sets)
+        self.assertIs(compiled, cache.get())
+
+        # Requests get their own copies of the skills.
+        skill_graph = SkillGraph.load()
+        skill_graph.get(skill_1.id).dict['name'] = 'changed'
+        SkillGraph.clear_all()
+        self.assertEqual(SKILL_NAME, SkillGraph.load().get(skill_1.id).name)
+        self.assertIs(compiled, cache.get())
+
+        SkillGraph.load().delete_prerequisite(skill_1.id, skill_2.id)
+        SkillGraph.clear_all()
+        self.assertIsNot(compiled, cache.get())
+        self.assertEqual(
+            [sorted([skill_1.id, skill_2.id])], cache.get().co_sets)
+
 
 class SkillMapTests(BaseSkillMapTests):
 
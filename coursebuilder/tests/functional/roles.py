@@ -232,6 +232,14 @@ class RolesTest(actions.TestBase):
         self.assertIn(
             PERMISSION, mem_map[STUDENT_EMAIL][PERMISSION_MODULE.name])
 
+    def test_email_list_cache_parses_each_list_once(self):
+        email_lists = roles.EmailListCache.instance()
+        text = '[Student@Example.com], other@example.com'
+        emails = email_lists.get(text)
+        self.assertEqual(
+            frozenset(['student@example.com', 'other@example.com']), emails)
+        self.assertIs(emails, email_lists.get(text))
+
     # --------------------------- Allowlisting tests:
     # See tests/functional/allowlist.py, which covers both the actual
     # role behavior as well as more-abstract can-you-see-the-resource
@@ -42,6 +42,7 @@ from controllers_review import PeerReviewDashboardAdminTest
 from review_stats import PeerReviewAnalyticsTest
 
 import appengine_config
+from common import caching
 from common import crypto
 from common.utils import Namespace
 from controllers import lessons
@@ -61,6 +62,7 @@ from models.courses import Course
 import modules.admin.admin
 from modules.announcements.announcements import AnnouncementEntity
 import modules.oeditor.oeditor
+from modules.unsubscribe import unsubscribe
 from tools import verify
 from tools.etl import etl
 from tools.etl import etl_lib
@@ -161,6 +163,86 @@ class InfrastructureTest(actions.TestBase):
         finally:
             del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
 
+    def test_memcache_l1_cache_serves_and_invalidates_hot_keys(self):
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        config.Registry.test_overrides[models.CAN_USE_L1_CACHE.name] = True
+        key = Course.ENVIRON_MEMCACHE_KEY_PREFIX + 'l1-test'
+        namespace = models.MemcacheManager.get_namespace()
+        try:
+            models.MemcacheManager.set(key, {'value': 1})
+
+            # Served from the L1 cache, as a copy, without reading memcache.
+            memcache.set(key, {'value': 2}, namespace=namespace)
+            value = models.MemcacheManager.get(key)
+            self.assertEquals({'value': 1}, value)
+            value['value'] = 3
+            self.assertEquals({'value': 1}, models.MemcacheManager.get(key))
+
+            # Another process moving the generation on drops the entry.
+            memcache.incr(
+                models.MemcacheL1Cache.GENERATION_MEMCACHE_KEY,
+                namespace=namespace)
+            models.MemcacheL1Cache.instance()._generation.forget()
+            self.assertEquals({'value': 2}, models.MemcacheManager.get(key))
+
+            models.MemcacheManager.delete(key)
+            self.assertIsNone(models.MemcacheManager.get(key))
+        finally:
+            del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+            del config.Registry.test_overrides[models.CAN_USE_L1_CACHE.name]
+
+    def test_memcache_generation(self):
+        key = 'test-memcache-generation'
+        generation = caching.MemcacheGeneration(key, check_interval_secs=60)
+        stamp = generation.get('ns_a')
+        self.assertIsNotNone(stamp)
+        self.assertEquals(stamp, memcache.get(key, namespace='ns_a'))
+        self.assertIsNone(memcache.get(key, namespace='ns_b'))
+
+        # Changes made elsewhere are only seen once the stamp is re-read.
+        memcache.incr(key, namespace='ns_a')
+        self.assertEquals(stamp, generation.get('ns_a'))
+        generation.forget('ns_a')
+        self.assertEquals(stamp + 1, generation.get('ns_a'))
+
+        self.assertEquals(stamp + 2, generation.incr('ns_a'))
+        self.assertEquals(stamp + 2, generation.get('ns_a'))
+
+        # A stamp lost to eviction is created again.
+        memcache.delete(key, namespace='ns_a')
+        generation.forget()
+        self.assertIsNotNone(generation.get('ns_a'))
+
+    def test_memcache_l1_cache_read_through_keeps_generation(self):
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        config.Registry.test_overrides[models.CAN_USE_L1_CACHE.name] = True
+        key = Course.ENVIRON_MEMCACHE_KEY_PREFIX + 'l1-read-through'
+        namespace = models.MemcacheManager.get_namespace()
+        l1_cache = models.MemcacheL1Cache.instance()
+        try:
+            generation = l1_cache._generation.get(namespace)
+            models.MemcacheManager.set(key, {'value': 1})
+            models.MemcacheManager.set_multi({key: {'value': 1}})
+            self.assertEquals(generation, memcache.get(
+                models.MemcacheL1Cache.GENERATION_MEMCACHE_KEY,
+                namespace=namespace))
+
+            # A value read from memcache is cached apart from the one given
+            # to the caller.
+            l1_cache.delete(key, namespace)
+            value = models.MemcacheManager.get_multi([key])[key]
+            value['value'] = 2
+            self.assertEquals(
+                {'value': 1}, models.MemcacheManager.get_multi([key])[key])
+
+            models.MemcacheManager.invalidate_l1([key])
+            self.assertNotEquals(generation, memcache.get(
+                models.MemcacheL1Cache.GENERATION_MEMCACHE_KEY,
+                namespace=namespace))
+        finally:
+            del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+            del config.Registry.test_overrides[models.CAN_USE_L1_CACHE.name]
+
     def test_memcache_fails_missmatched_begin_end(self):
         config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
         models.MemcacheManager.begin_readonly()
@@ -1713,6 +1795,46 @@ class CourseAuthorAspectTest(actions.TestBase):
         json_dict = transforms.loads(response.body)
         assert json_dict['status'] == 404
 
+    def test_announcement_email_is_sent_to_enrolled_students(self):
+        """Test saving an announcement with Send Email mails students."""
+        student_emails = ['student1@example.com', 'student2@example.com']
+        for email in student_emails + ['unsubscribed@example.com']:
+            actions.login(email)
+            actions.register(self, email)
+        unsubscribe.set_subscribed('unsubscribed@example.com', False)
+        list_email = 'announcements@example.com'
+        self.swap(
+            courses.Course, 'get_course_announcement_list_email',
+            lambda unused_self: list_email)
+        admin_email = 'test_announcements_email@google.com'
+        actions.login(admin_email, is_admin=True)
+
+        item = AnnouncementEntity(title='Title', html='Body', is_draft=False)
+        item.put()
+        response = self.get('rest/announcements/item?key=%s' % item.key())
+        json_dict = transforms.loads(response.body)
+        payload_dict = transforms.loads(json_dict['payload'])
+        payload_dict['send_email'] = True
+        request = {
+            'key': str(item.key()),
+            'payload': transforms.dumps(payload_dict),
+            'xsrf_token': json_dict['xsrf_token']}
+        response = self.put('rest/announcements/item?%s' % urllib.urlencode(
+            {'request': transforms.dumps(request)}), {})
+        json_dict = transforms.loads(response.body)
+        assert_equals(200, json_dict['status'])
+        assert_equals('Saved.', json_dict['message'])
+
+        self.execute_all_deferred_tasks()
+        self.execute_all_deferred_tasks(queue_name='courseannouncements')
+        messages = self.get_mail_stub().get_sent_messages()
+        assert_equals(
+            sorted(student_emails + [list_email]),
+            sorted(message.to for message in messages))
+        for message in messages:
+            assert_equals(admin_email, message.sender)
+            assert_equals('Title', message.subject)
+
 
 class CourseAuthorCourseCreationTest(actions.TestBase):
 
@@ -2213,6 +2335,50 @@ class StudentAspectTest(actions.TestBase):
         # Clean up.
         config.Registry.test_overrides = {}
 
+    def test_attempt_activity_events_in_one_batch(self):
+        """Test a batch of events is recorded with its progress."""
+
+        email = 'test_attempt_activity_batch@example.com'
+        name = 'Test Attempt Activity Batch'
+
+        actions.login(email)
+        actions.register(self, name)
+        config.Registry.test_overrides[
+            lessons.CAN_PERSIST_ACTIVITY_EVENTS.name] = True
+
+        # The blocks in Lesson 1.2 with activities are blocks 3 and 6.
+        location = 'http://localhost:8080/activity?unit=1&lesson=2'
+        request = {
+            'xsrf_token': XsrfTokenManager.create_xsrf_token('event-post'),
+            'events': [
+                {'source': 'attempt-activity', 'payload': transforms.dumps(
+                    {'index': index, 'location': location})}
+                for index in (3, 6)] + [
+                {'source': 'attempt-activity', 'payload': 'not json'}]}
+        response = self.post('rest/events?%s' % urllib.urlencode(
+            {'request': transforms.dumps(request)}), {})
+        assert_equals(response.status_int, 200)
+        assert not response.body
+
+        old_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(self.namespace)
+        try:
+            events = models.EventEntity.all().fetch(1000)
+            assert_equals(
+                [3, 6], sorted(
+                    transforms.loads(event.data)['index'] for event in events))
+
+            student = models.Student.get_enrolled_student_by_email(email)
+            course = courses.Course(
+                None, app_context=sites.get_all_courses()[0])
+            tracker = course.get_progress_tracker()
+            assert_equals(
+                2, tracker.get_lesson_progress(student, 1)[2]['activity'])
+        finally:
+            namespace_manager.set_namespace(old_namespace)
+
+        config.Registry.test_overrides = {}
+
     def test_two_students_dont_see_each_other_pages(self):
         """Test a user can't see another user pages."""
         email1 = 'user1@foo.com'
@@ -2493,6 +2659,14 @@ class ActivityTest(actions.TestBase):
             'html': 0, 'activity': 2, 'has_activity': True
         }
 
+        # The bulk query agrees with the per unit queries.
+        unit_progress, lesson_progress = (
+            tracker.get_unit_and_lesson_progress(student))
+        assert unit_progress == tracker.get_unit_progress(student)
+        for unit in course.get_units():
+            assert lesson_progress[unit.unit_id] == (
+                tracker.get_lesson_progress(student, unit.unit_id))
+
         # Test that a lesson without activities (Lesson 1.1) doesn't count.
         # Complete lessons 1.3, 1.4, 1.5 and 1.6; unit 1 should then be marked
         # as 'completed' even though we have no events associated with
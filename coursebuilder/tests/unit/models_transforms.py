@@ -235,6 +235,37 @@ class JsonParsingTests(unittest.TestCase):
         assert _json.get('foo') == 'bar'
 
 
+class JsonEncodingTests(unittest.TestCase):
+
+    def test_dumps_escapes_angle_brackets(self):
+        self.assertEqual(
+            u'{"a": "\\u003Cscript\\u003E"}',
+            transforms.dumps({'a': '<script>'}))
+
+    def test_dumps_escapes_non_ascii(self):
+        self.assertEqual(u'"caf\\u00e9"', transforms.dumps(u'caf\u00e9'))
+        self.assertEqual(
+            u'"caf\\u00E9 \\u003C"',
+            transforms.dumps(u'caf\u00e9 <', ensure_ascii=False))
+        self.assertEqual(
+            u'\U0001f600',
+            transforms.loads(
+                transforms.dumps(u'\U0001f600', ensure_ascii=False)))
+
+    def test_dumps_returns_unicode(self):
+        self.assertIsInstance(transforms.dumps({'a': 1}), unicode)
+        self.assertIsInstance(transforms.dumps({'a': '<'}), unicode)
+
+    def test_dumps_internal_reads_back_like_dumps(self):
+        value = {
+            'a': '<b>', 'c': u'caf\u00e9', 'd': set([1]),
+            'e': datetime.datetime(2020, 1, 2, 3, 4, 5)}
+        self.assertEqual(
+            transforms.loads(transforms.dumps(value)),
+            transforms.loads(transforms.dumps_internal(value)))
+        self.assertIn('<b>', transforms.dumps_internal(value))
+
+
 class SchemaValidationTests(unittest.TestCase):
 
     def test_mandatory_scalar_missing(self):
@@ -479,3 +510,35 @@ class SchemaValidationTests(unittest.TestCase):
             ['Found None at Test.struct_array[1]',
              'Missing mandatory value at Test.struct_array[2].city',
              'Missing mandatory value at Test.struct_array[3].name'])
+
+    def test_properties_member_as_schema(self):
+        reg = schema_fields.FieldRegistry('Test')
+        reg.add_property(schema_fields.SchemaField(
+            'a_date', 'A Date', 'date'))
+        reg.add_property(schema_fields.SchemaField(
+            'a_number', 'A Number', 'number', optional=True))
+        complaints = transforms.validate_object_matches_json_schema(
+            {'a_date': '2015-13-01', 'a_number': 1, 'extra': None},
+            reg.get_json_schema_dict()['properties'])
+        self.assertEqual(
+            sorted(complaints),
+            ["Expected <type 'float'> at (root).a_number, "
+             "but instead had <type 'int'>",
+             'Unexpected member "extra" in (root)',
+             'Value "2015-13-01" is not well-formed according to '
+             'is_valid_date'])
+
+    def test_validator_reused_for_equal_schemas(self):
+        def make_schema():
+            reg = schema_fields.FieldRegistry('Test')
+            reg.add_property(schema_fields.SchemaField(
+                'a_string', 'A String', 'string'))
+            return reg.get_json_schema_dict()
+
+        validate = transforms.get_json_schema_validator(make_schema())
+        self.assertIs(
+            validate, transforms.get_json_schema_validator(make_schema()))
+        self.assertEqual(
+            validate({'a_string': 1}),
+            ["Expected <type 'basestring'> at Test.a_string, "
+             "but instead had <type 'int'>"])